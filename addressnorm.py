@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Address canonicalization.
+
+Canonical addresses are only ever used as cache and deduplication keys; the
+caller's original text is what gets sent to PxPointSC. Canonicalization folds
+case, collapses whitespace and punctuation, and rewrites street suffixes,
+directionals, secondary unit designators and state names to their USPS
+Publication 28 abbreviations, so that, e.g.,
+
+    "123 Main St, Boulder CO"
+    "123  MAIN STREET BOULDER, CO"
+    "123 main st. boulder, colorado"
+
+all produce the same key: "123 MAIN ST BOULDER CO".
+
+All rewriting is table-driven, and positional: a word is only abbreviated
+where its kind of word goes (a state name at the end, a suffix at the end of
+the street line), so that street and city names that happen to be spelled
+like suffixes, directionals or states never collide with other addresses.
+"""
+
+import re
+
+# USPS Publication 28, Appendix C1: street suffix abbreviations, keyed by the
+# standard abbreviation with the common spellings that map onto it.
+_STREET_SUFFIXES = {
+    "ALY": ("ALLEY", "ALLEE", "ALLY"),
+    "ANX": ("ANNEX", "ANEX", "ANNX"),
+    "ARC": ("ARCADE",),
+    "AVE": ("AVENUE", "AV", "AVEN", "AVENU", "AVN", "AVNUE"),
+    "BYU": ("BAYOU", "BAYOO"),
+    "BCH": ("BEACH",),
+    "BND": ("BEND",),
+    "BLF": ("BLUFF", "BLUF"),
+    "BTM": ("BOTTOM", "BOT", "BOTTM"),
+    "BLVD": ("BOULEVARD", "BOUL", "BOULV"),
+    "BR": ("BRANCH", "BRNCH"),
+    "BRG": ("BRIDGE", "BRDGE"),
+    "BRK": ("BROOK",),
+    "BYP": ("BYPASS", "BYPA", "BYPAS", "BYPS"),
+    "CP": ("CAMP", "CMP"),
+    "CYN": ("CANYON", "CANYN", "CNYN"),
+    "CPE": ("CAPE",),
+    "CSWY": ("CAUSEWAY", "CAUSWA"),
+    "CTR": ("CENTER", "CEN", "CENT", "CENTR", "CENTRE", "CNTER", "CNTR"),
+    "CIR": ("CIRCLE", "CIRC", "CIRCL", "CRCL", "CRCLE"),
+    "CLF": ("CLIFF",),
+    "CLFS": ("CLIFFS",),
+    "CLB": ("CLUB",),
+    "COR": ("CORNER",),
+    "CORS": ("CORNERS",),
+    "CRSE": ("COURSE",),
+    "CT": ("COURT",),
+    "CTS": ("COURTS",),
+    "CV": ("COVE",),
+    "CRK": ("CREEK",),
+    "CRES": ("CRESCENT", "CRSENT", "CRSNT"),
+    "XING": ("CROSSING", "CRSSNG"),
+    "DL": ("DALE",),
+    "DM": ("DAM",),
+    "DV": ("DIVIDE", "DIV", "DVD"),
+    "DR": ("DRIVE", "DRIV", "DRV"),
+    "EST": ("ESTATE",),
+    "ESTS": ("ESTATES",),
+    "EXPY": ("EXPRESSWAY", "EXP", "EXPR", "EXPRESS", "EXPW"),
+    "EXT": ("EXTENSION", "EXTN", "EXTNSN"),
+    "FLS": ("FALLS",),
+    "FRY": ("FERRY", "FRRY"),
+    "FLD": ("FIELD",),
+    "FLDS": ("FIELDS",),
+    "FLT": ("FLAT",),
+    "FLTS": ("FLATS",),
+    "FRD": ("FORD",),
+    "FRST": ("FOREST", "FORESTS"),
+    "FRG": ("FORGE", "FORG"),
+    "FRK": ("FORK",),
+    "FRKS": ("FORKS",),
+    "FT": ("FORT", "FRT"),
+    "FWY": ("FREEWAY", "FREEWY", "FRWAY", "FRWY"),
+    "GDN": ("GARDEN", "GARDN", "GRDEN", "GRDN"),
+    "GDNS": ("GARDENS", "GRDNS"),
+    "GTWY": ("GATEWAY", "GATEWY", "GATWAY", "GTWAY"),
+    "GLN": ("GLEN",),
+    "GRN": ("GREEN",),
+    "GRV": ("GROVE", "GROV"),
+    "HBR": ("HARBOR", "HARB", "HARBR", "HRBOR"),
+    "HVN": ("HAVEN",),
+    "HTS": ("HEIGHTS", "HT"),
+    "HWY": ("HIGHWAY", "HIGHWY", "HIWAY", "HIWY", "HWAY"),
+    "HL": ("HILL",),
+    "HLS": ("HILLS",),
+    "HOLW": ("HOLLOW", "HLLW", "HOLLOWS", "HOLWS"),
+    "INLT": ("INLET",),
+    "IS": ("ISLAND", "ISLND"),
+    "ISS": ("ISLANDS", "ISLNDS"),
+    "JCT": ("JUNCTION", "JCTION", "JCTN", "JUNCTN", "JUNCTON"),
+    "KY": ("KEY",),
+    "KNL": ("KNOLL", "KNOL"),
+    "KNLS": ("KNOLLS",),
+    "LK": ("LAKE",),
+    "LKS": ("LAKES",),
+    "LNDG": ("LANDING", "LNDNG"),
+    "LN": ("LANE",),
+    "LGT": ("LIGHT",),
+    "LF": ("LOAF",),
+    "LCK": ("LOCK",),
+    "LCKS": ("LOCKS",),
+    "LDG": ("LODGE", "LDGE", "LODG"),
+    "LOOP": ("LOOPS",),
+    "MNR": ("MANOR",),
+    "MNRS": ("MANORS",),
+    "MDWS": ("MEADOWS", "MEADOW", "MDW", "MEDOWS"),
+    "ML": ("MILL",),
+    "MLS": ("MILLS",),
+    "MSN": ("MISSION", "MISSN", "MSSN"),
+    "MTWY": ("MOTORWAY",),
+    "MT": ("MOUNT", "MNT"),
+    "MTN": ("MOUNTAIN", "MNTAIN", "MNTN", "MOUNTIN", "MTIN"),
+    "NCK": ("NECK",),
+    "ORCH": ("ORCHARD", "ORCHRD"),
+    "OPAS": ("OVERPASS",),
+    "PARK": ("PRK", "PARKS"),
+    "PKWY": ("PARKWAY", "PARKWY", "PKWAY", "PKY", "PARKWAYS", "PKWYS"),
+    "PSGE": ("PASSAGE",),
+    "PNES": ("PINES",),
+    "PL": ("PLACE",),
+    "PLN": ("PLAIN",),
+    "PLNS": ("PLAINS",),
+    "PLZ": ("PLAZA", "PLZA"),
+    "PT": ("POINT",),
+    "PTS": ("POINTS",),
+    "PRT": ("PORT",),
+    "PR": ("PRAIRIE", "PRR"),
+    "RADL": ("RADIAL", "RAD", "RADIEL"),
+    "RNCH": ("RANCH", "RANCHES", "RNCHS"),
+    "RPD": ("RAPID",),
+    "RPDS": ("RAPIDS",),
+    "RST": ("REST",),
+    "RDG": ("RIDGE", "RDGE"),
+    "RIV": ("RIVER", "RVR", "RIVR"),
+    "RD": ("ROAD",),
+    "RDS": ("ROADS",),
+    "RTE": ("ROUTE",),
+    "SHR": ("SHORE",),
+    "SHRS": ("SHORES",),
+    "SKWY": ("SKYWAY",),
+    "SPG": ("SPRING", "SPNG", "SPRNG"),
+    "SPGS": ("SPRINGS", "SPNGS", "SPRNGS"),
+    "SQ": ("SQUARE", "SQR", "SQRE", "SQU"),
+    "STA": ("STATION", "STATN", "STN"),
+    "STRA": ("STRAVENUE", "STRAV", "STRAVEN", "STRAVN", "STRVN", "STRVNUE"),
+    "STRM": ("STREAM", "STREME"),
+    "ST": ("STREET", "STRT", "STR"),
+    "STS": ("STREETS",),
+    "SMT": ("SUMMIT", "SUMIT", "SUMITT"),
+    "TER": ("TERRACE", "TERR"),
+    "TRCE": ("TRACE", "TRACES"),
+    "TRAK": ("TRACK", "TRACKS", "TRK", "TRKS"),
+    "TRFY": ("TRAFFICWAY",),
+    "TRL": ("TRAIL", "TRAILS", "TRLS"),
+    "TUNL": ("TUNNEL", "TUNEL", "TUNLS", "TUNNELS", "TUNNL"),
+    "TPKE": ("TURNPIKE", "TRNPK", "TURNPK"),
+    "UPAS": ("UNDERPASS",),
+    "UN": ("UNION",),
+    "VLY": ("VALLEY", "VALLY", "VLLY"),
+    "VIA": ("VIADUCT", "VDCT", "VIADCT"),
+    "VW": ("VIEW",),
+    "VLG": ("VILLAGE", "VILL", "VILLAG", "VILLG", "VILLIAGE"),
+    "VL": ("VILLE",),
+    "VIS": ("VISTA", "VIST", "VST", "VSTA"),
+    "WALK": ("WALKS",),
+    "WAY": ("WY",),
+    "WL": ("WELL",),
+    "WLS": ("WELLS",),
+}
+
+# USPS Publication 28, Appendix B: directionals.
+_DIRECTIONALS = {
+    "N": ("NORTH",),
+    "S": ("SOUTH",),
+    "E": ("EAST",),
+    "W": ("WEST",),
+    "NE": ("NORTHEAST",),
+    "NW": ("NORTHWEST",),
+    "SE": ("SOUTHEAST",),
+    "SW": ("SOUTHWEST",),
+}
+
+# USPS Publication 28, Appendix C2: secondary unit designators.
+_UNIT_DESIGNATORS = {
+    "APT": ("APARTMENT",),
+    "BLDG": ("BUILDING",),
+    "DEPT": ("DEPARTMENT",),
+    "FL": ("FLOOR",),
+    "HNGR": ("HANGAR",),
+    "LOT": (),
+    "PH": ("PENTHOUSE",),
+    "RM": ("ROOM",),
+    "SPC": ("SPACE",),
+    "STE": ("SUITE",),
+    "TRLR": ("TRAILER",),
+    "UNIT": (),
+    "BSMT": ("BASEMENT",),
+    "FRNT": ("FRONT",),
+    "LBBY": ("LOBBY",),
+    "LOWR": ("LOWER",),
+    "OFC": ("OFFICE",),
+    "REAR": (),
+    "SIDE": (),
+    "UPPR": ("UPPER",),
+}
+
+# USPS state and territory abbreviations.
+_STATES = {
+    "AL": ("ALABAMA",), "AK": ("ALASKA",), "AZ": ("ARIZONA",),
+    "AR": ("ARKANSAS",), "CA": ("CALIFORNIA",), "CO": ("COLORADO",),
+    "CT": ("CONNECTICUT",), "DE": ("DELAWARE",),
+    "DC": ("DISTRICT OF COLUMBIA",), "FL": ("FLORIDA",), "GA": ("GEORGIA",),
+    "HI": ("HAWAII",), "ID": ("IDAHO",), "IL": ("ILLINOIS",),
+    "IN": ("INDIANA",), "IA": ("IOWA",), "KS": ("KANSAS",),
+    "KY": ("KENTUCKY",), "LA": ("LOUISIANA",), "ME": ("MAINE",),
+    "MD": ("MARYLAND",), "MA": ("MASSACHUSETTS",), "MI": ("MICHIGAN",),
+    "MN": ("MINNESOTA",), "MS": ("MISSISSIPPI",), "MO": ("MISSOURI",),
+    "MT": ("MONTANA",), "NE": ("NEBRASKA",), "NV": ("NEVADA",),
+    "NH": ("NEW HAMPSHIRE",), "NJ": ("NEW JERSEY",), "NM": ("NEW MEXICO",),
+    "NY": ("NEW YORK",), "NC": ("NORTH CAROLINA",), "ND": ("NORTH DAKOTA",),
+    "OH": ("OHIO",), "OK": ("OKLAHOMA",), "OR": ("OREGON",),
+    "PA": ("PENNSYLVANIA",), "PR": ("PUERTO RICO",), "RI": ("RHODE ISLAND",),
+    "SC": ("SOUTH CAROLINA",), "SD": ("SOUTH DAKOTA",), "TN": ("TENNESSEE",),
+    "TX": ("TEXAS",), "UT": ("UTAH",), "VT": ("VERMONT",),
+    "VA": ("VIRGINIA",), "WA": ("WASHINGTON",), "WV": ("WEST VIRGINIA",),
+    "WI": ("WISCONSIN",), "WY": ("WYOMING",),
+}
+
+
+def _lookup(table):
+    """Returns a map of every spelling in table, and of every abbreviation,
+    to its abbreviation."""
+    result = dict((abbreviation, abbreviation) for abbreviation in table)
+    for abbreviation, spellings in table.items():
+        for spelling in spellings:
+            result[spelling] = abbreviation
+    return result
+
+# Each kind of word is rewritten only where that kind of word goes, so that
+# street names such as "Key West" or "North Ave" are left alone.
+_SUFFIX_MAP = _lookup(_STREET_SUFFIXES)
+_DIRECTIONAL_MAP = _lookup(_DIRECTIONALS)
+_UNIT_MAP = _lookup(_UNIT_DESIGNATORS)
+# State names by their words, as in ("NEW", "YORK")
+_STATE_MAP = dict(
+    (tuple(name.split()), abbreviation)
+    for name, abbreviation in _lookup(_STATES).items())
+_MAX_STATE_WORDS = max(len(words) for words in _STATE_MAP)
+
+# Designators that stand without a unit number, as in "123 Main St Rear"
+_NUMBERLESS_UNIT_DESIGNATORS = frozenset([
+    "BSMT", "FRNT", "LBBY", "LOWR", "OFC", "PH", "REAR", "SIDE", "UPPR"])
+
+# Apostrophes and periods are dropped within words ("O'Neil", "St."); any other
+# run of characters other than letters, digits, "#", "-" and "/" separates
+# tokens. "#" always stands alone, so "#4" and "# 4" are the same.
+_DROP_RE = re.compile(r"['.]", re.UNICODE)
+_SEPARATOR_RE = re.compile(r"[^\w#/-]+|_|(#)", re.UNICODE)
+_ZIP_RE = re.compile(r"^\d{5}(-?\d{4})?$")
+
+
+def _tokenize(text):
+    """Returns the words of an address, and the index of the comma-separated
+    part each word is in."""
+    words = []
+    parts = []
+    for part, part_text in enumerate(text.split(",")):
+        for word in _SEPARATOR_RE.split(part_text):
+            if word:
+                word = word.strip("-/")
+            if word:
+                words.append(word)
+                parts.append(part)
+    return words, parts
+
+
+def _find_state(words, end):
+    """Returns the (start, abbreviation) of a state name ending at end, or
+    None. Words before it are required, so that a lone street name is never
+    taken for a state."""
+    for length in range(_MAX_STATE_WORDS, 0, -1):
+        start = end - length
+        if start < 1:
+            continue
+        abbreviation = _STATE_MAP.get(tuple(words[start:end]))
+        if abbreviation is not None:
+            return start, abbreviation
+    return None
+
+
+def _find_suffix(words, street, name_start, closed):
+    """Returns the index of the street suffix, or None.
+
+    Args:
+        words (list): The address's words.
+        street (list): The indexes of the words of the street line.
+        name_start (int): The index of the first word of the street name,
+            which is never taken for a suffix.
+        closed (bool): True if a comma ends the street line, so that its
+            last word is known to end the street.
+    """
+    candidates = [
+        i for i in street if i > name_start and words[i] in _SUFFIX_MAP]
+    if not candidates:
+        return None
+    for i in reversed(candidates):
+        if i == street[-1]:
+            if closed:
+                return i
+        elif (words[i + 1] == "#" or words[i + 1] in _DIRECTIONAL_MAP or
+                words[i + 1] in _UNIT_MAP):
+            return i
+    # the street line runs on into the city; the first suffix ends the street
+    return candidates[0]
+
+
+def canonicalize_address(address):
+    """Returns the canonical form of an address.
+
+    The canonical form serves as both the cache key and the deduplication key
+    for an address. It is not a standardized address and must not be sent to
+    PxPointSC in place of the original.
+
+    State names are abbreviated only at the end of the address, before any
+    ZIP code; a street suffix only after the first word of the street name,
+    where it ends the street line; directionals only before the street name
+    or after the suffix; and unit designators only before a unit number, or
+    at the end of a part for those that take none. Words elsewhere are kept
+    as written, so that "1 Key West, Florida" and "1 KY W, FL" differ.
+
+    Args:
+        address (str): An address (e.g., '123 main st, boulder co').
+
+    Returns:
+        The canonical address string (e.g., '123 MAIN ST BOULDER CO').
+    """
+    if not address:
+        return ""
+    words, parts = _tokenize(_DROP_RE.sub("", address.upper()))
+    result = list(words)
+    dropped = set()
+
+    end = len(words)
+    if end and _ZIP_RE.match(words[-1]):
+        end -= 1
+    state = _find_state(words, end)
+    if state is not None:
+        start, abbreviation = state
+        result[start] = abbreviation
+        dropped.update(range(start + 1, end))
+        end = start
+
+    # the house number, then the street line, up to the first comma
+    name_start = 1 if words and words[0][0].isdigit() else 0
+    street = [
+        i for i in range(name_start, end) if parts[i] == parts[name_start]]
+    if street:
+        closed = street[-1] + 1 < len(words) and (
+            parts[street[-1] + 1] != parts[street[-1]])
+        # "100 N Main St", but "100 North Ave" is named North
+        if words[name_start] in _DIRECTIONAL_MAP and (len(street) > 2 or (
+                len(street) == 2 and words[street[1]] not in _SUFFIX_MAP)):
+            result[name_start] = _DIRECTIONAL_MAP[words[name_start]]
+            name_start += 1
+        suffix = _find_suffix(words, street, name_start, closed)
+        if suffix is not None:
+            result[suffix] = _SUFFIX_MAP[words[suffix]]
+            if suffix + 1 in street and words[suffix + 1] in _DIRECTIONAL_MAP:
+                result[suffix + 1] = _DIRECTIONAL_MAP[words[suffix + 1]]
+
+    # "APT # 4" and "APT 4" are the same unit; a bare "# 4" is kept.
+    for i in range(name_start + 1, end):
+        unit = _UNIT_MAP.get(words[i])
+        if unit is None:
+            continue
+        if i + 1 < end and parts[i + 1] == parts[i]:
+            following = words[i + 1]
+            if (following == "#" or len(following) == 1 or
+                    any(c.isdigit() for c in following)):
+                result[i] = unit
+                if following == "#":
+                    dropped.add(i + 1)
+        elif unit in _NUMBERLESS_UNIT_DESIGNATORS:
+            result[i] = unit
+    return " ".join(
+        word for i, word in enumerate(result) if i not in dropped)
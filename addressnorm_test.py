@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of address canonicalization."""
+
+import unittest
+
+import addressnorm
+
+
+class CanonicalizeAddressTest(unittest.TestCase):
+    def assertSameKey(self, *addresses):
+        keys = set(
+            addressnorm.canonicalize_address(address) for address in addresses)
+        self.assertEqual(1, len(keys), keys)
+
+    def assertDifferentKeys(self, first, second):
+        self.assertNotEqual(
+            addressnorm.canonicalize_address(first),
+            addressnorm.canonicalize_address(second))
+
+    def test_spellings_of_one_address(self):
+        self.assertSameKey(
+            "123 Main St, Boulder CO",
+            "123  MAIN STREET BOULDER, CO",
+            "123 main st. boulder, colorado")
+        self.assertEqual(
+            "123 MAIN ST BOULDER CO",
+            addressnorm.canonicalize_address("123 Main St, Boulder CO"))
+
+    def test_directionals_units_and_zip(self):
+        self.assertSameKey(
+            "100 North Main Street Apartment # 4, Boulder, Colorado 80301",
+            "100 N Main St Apt 4 Boulder CO 80301",
+            "100 n. main st., apt #4, boulder, co 80301")
+
+    def test_post_directional_and_multi_word_state(self):
+        self.assertEqual(
+            "9 ELM ST W STE 3 CHARLESTON WV 25301",
+            addressnorm.canonicalize_address(
+                "9 Elm Street West, Suite 3, Charleston, West Virginia "
+                "25301"))
+
+    def test_numberless_unit(self):
+        self.assertSameKey("1 Main St Rear", "1 main street rear")
+
+    def test_street_name_spelled_like_state_and_suffix(self):
+        self.assertEqual(
+            "1 KEY WEST FL",
+            addressnorm.canonicalize_address("1 Key West, Florida"))
+        self.assertDifferentKeys("1 Key West, Florida", "1 KY W, FL")
+
+    def test_street_named_for_a_directional(self):
+        self.assertDifferentKeys("100 North Ave", "100 N Ave")
+
+    def test_state_name_in_street(self):
+        self.assertDifferentKeys(
+            "12 Kentucky St, Louisville KY", "12 KY St, Louisville KY")
+        self.assertEqual(
+            "12 KENTUCKY ST LOUISVILLE KY",
+            addressnorm.canonicalize_address(
+                "12 Kentucky St, Louisville, Kentucky"))
+
+    def test_unit_word_in_street_name(self):
+        self.assertDifferentKeys("5 Floor St, Tampa FL", "5 FL St, Tampa FL")
+        self.assertDifferentKeys("5 Suite Rd", "5 STE Rd")
+
+    def test_suffix_word_in_street_and_city_names(self):
+        self.assertEqual(
+            "5 GLEN COVE RD GLEN COVE NY",
+            addressnorm.canonicalize_address(
+                "5 Glen Cove Road, Glen Cove, New York"))
+        self.assertDifferentKeys("1 Park Ave", "1 PRK Ave")
+
+    def test_bare_number_sign_is_kept(self):
+        self.assertEqual("# 4 MAIN", addressnorm.canonicalize_address("#4 main"))
+
+    def test_empty(self):
+        self.assertEqual("", addressnorm.canonicalize_address(""))
+        self.assertEqual("", addressnorm.canonicalize_address(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
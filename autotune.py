@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Finds the batch chunk size and handle pool size that serve a request mix
+best on this host, and writes them to a configuration file.
+
+The best BATCH_CHUNK_SIZE and HANDLE_POOL_SIZE depend on the CPU count and
+on the datasets and layers a workload uses. The tuner sends a sample of the
+mix (recorded or synthetic, as for loadtest.py) in batches from a number of
+threads, once per combination of candidate values, each time through a new
+GeoSpatial instance. It reports throughput and latency at each point, and
+recommends the combination with the highest throughput whose p99 latency is
+within --max-p99-ms, preferring smaller pools, which use less memory, when
+throughputs are within --tolerance of each other.
+
+The recommendation is written in the format of spatialapi.conf, for
+geospatial.load_config(), GeoSpatial's config argument, and the --config
+option of bulkgeocode.py and loadtest.py. The other settings of the --config
+file the points started from are written with it, so that the written file
+can replace that one. Set PXPOINTSC_LIBRARY to tune against a stand-in
+native library.
+
+For example:
+    autotune.py --requests-file mix.ndjson --output tuned.conf
+"""
+
+import argparse
+import datetime
+import multiprocessing
+import socket
+import sys
+
+import geospatial
+import loadtest
+
+# Candidate values tried by default
+DEFAULT_CHUNK_SIZES = (100, 250, 500, 1000, 2000)
+
+
+def default_pool_sizes(cpu_count):
+    """Returns the pool sizes tried by default: powers of two up to the CPU
+    count, and the CPU count."""
+    sizes = []
+    size = 1
+    while size < cpu_count:
+        sizes.append(size)
+        size *= 2
+    sizes.append(max(1, cpu_count))
+    return sizes
+
+
+def measure(options, base_config, requests, chunk_size, pool_size):
+    """Runs the mix once with a chunk size and a pool size.
+
+    Returns:
+        loadtest.run()'s result dictionary.
+    """
+    config = dict(base_config)
+    config["BATCH_CHUNK_SIZE"] = chunk_size
+    config["HANDLE_POOL_SIZE"] = pool_size
+    # stored results would answer what is meant to be measured
+    config["RESULT_STORE_PATH"] = None
+    geo_spatial = geospatial.GeoSpatial(
+        options.data_catalog, options.shapefile_root, config)
+    try:
+        return loadtest.run(
+            geo_spatial, loadtest.make_units(requests, options.batch_size),
+            options.concurrency, warmup=options.warmup)
+    finally:
+        geo_spatial.close()
+
+
+def recommend(results, max_p99_ms=None, tolerance=0.05):
+    """Picks the best of a list of (chunk_size, pool_size, result) tuples.
+
+    Args:
+        results (list): Measurements, as measure() returns them.
+        max_p99_ms (float, optional): The highest acceptable p99 latency.
+            If no measurement meets it, the lowest p99 is picked.
+        tolerance (float, optional): The fraction of the best throughput
+            within which smaller pools, then smaller chunks, are preferred.
+
+    Returns:
+        The chosen (chunk_size, pool_size, result) tuple.
+    """
+    acceptable = [
+        measured for measured in results
+        if max_p99_ms is None or (measured[2]["p99_ms"] is not None and
+            measured[2]["p99_ms"] <= max_p99_ms)]
+    if not acceptable:
+        return min(results, key=lambda measured: measured[2]["p99_ms"])
+    best_throughput = max(
+        measured[2]["throughput"] for measured in acceptable)
+    return min(
+        (measured for measured in acceptable
+            if measured[2]["throughput"] >= best_throughput * (1 - tolerance)),
+        key=lambda measured: (measured[1], measured[0]))
+
+
+def write_config(path, chosen, results, options, base_config=None):
+    """Writes the recommendation, with the measurements behind it as
+    comments, in the format of spatialapi.conf.
+
+    Args:
+        path (str): The configuration file to write.
+        chosen (tuple): The (chunk_size, pool_size, result) recommend()
+            picked.
+        results (list): Every measurement, as measure() returns them.
+        options (Namespace): The command line options.
+        base_config (dict, optional): The configuration the points started
+            from, whose other keys are written too.
+    """
+    chunk_size, pool_size, _ = chosen
+    with open(path, "wb") as config_file:
+        config_file.write(
+            "# Written by autotune.py on {h} at {t}, {c} CPUs, {n} threads.\n"
+            .format(h=socket.gethostname(),
+                t=datetime.datetime.now().isoformat(),
+                c=multiprocessing.cpu_count(), n=options.concurrency))
+        config_file.write(
+            "# BATCH_CHUNK_SIZE HANDLE_POOL_SIZE: requests/s, p50, p99 ms\n")
+        for measured_chunk, measured_pool, result in results:
+            config_file.write("#   {cs} {ps}: {r}, {p50}, {p99}\n".format(
+                cs=measured_chunk, ps=measured_pool, r=result["throughput"],
+                p50=result["p50_ms"], p99=result["p99_ms"]))
+        base_keys = sorted(
+            set(base_config or ()) - 
+            set(["BATCH_CHUNK_SIZE", "HANDLE_POOL_SIZE"]))
+        if base_keys:
+            config_file.write("# From {c}\n".format(c=options.config))
+        for key in base_keys:
+            config_file.write("{k} = {v!r}\n".format(
+                k=key, v=base_config[key]))
+        config_file.write("BATCH_CHUNK_SIZE = {c}\n".format(c=chunk_size))
+        config_file.write("HANDLE_POOL_SIZE = {p}\n".format(p=pool_size))
+
+
+def _parse_sizes(text):
+    """Parses a comma-separated list of positive integers."""
+    sizes = [int(value) for value in text.split(",")]
+    if not sizes or min(sizes) < 1:
+        raise ValueError
+    return sizes
+
+
+def parse_args(argv):
+    """Parses the command line."""
+    cpu_count = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser(
+        description="Find the chunk and handle pool sizes that serve a "
+                    "request mix best, and write them to a configuration "
+                    "file.")
+    parser.add_argument("--requests-file",
+        help="recorded mix: NDJSON requests or a call log")
+    parser.add_argument("--synthetic", type=int, default=0,
+        help="number of synthetic requests to generate")
+    parser.add_argument("--layer", dest="layers", action="append",
+        default=[], help="layer synthetic points are queried against; "
+                         "may be repeated")
+    parser.add_argument("--bbox", default="37,-109,41,-102",
+        help="min_lat,min_lon,max_lat,max_lon of synthetic points "
+             "(default: Colorado)")
+    parser.add_argument("--address-fraction", type=float, default=0.5,
+        help="fraction of synthetic requests that are addresses")
+    parser.add_argument("--seed", type=int, help="synthetic mix random seed")
+    parser.add_argument("--sample", type=int,
+        help="requests of the mix to send per point (default: all)")
+    parser.add_argument("--chunk-sizes",
+        default=",".join(str(size) for size in DEFAULT_CHUNK_SIZES),
+        help="BATCH_CHUNK_SIZE values to try (default: %(default)s)")
+    parser.add_argument("--pool-sizes",
+        default=",".join(str(size) for size in default_pool_sizes(cpu_count)),
+        help="HANDLE_POOL_SIZE values to try (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=cpu_count,
+        help="sending threads (default: the CPU count, %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=5000,
+        help="requests per batch call (default: %(default)s)")
+    parser.add_argument("--warmup", type=int, default=1,
+        help="batches sent before measuring each point (default: 1)")
+    parser.add_argument("--max-p99-ms", type=float,
+        help="highest acceptable p99 latency of a batch")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+        help="fraction of the best throughput within which smaller pools "
+             "are preferred (default: %(default)s)")
+    parser.add_argument("--config",
+        help="GeoSpatial configuration file the points start from")
+    parser.add_argument("--output", default="tuned.conf",
+        help="configuration file to write (default: %(default)s)")
+    parser.add_argument("--data-catalog", default=r"f:\websites\datacatalog.xml",
+        help="data catalog path")
+    parser.add_argument("--shapefile-root", default=r"f:\pxse-data",
+        help="shapefile root directory")
+    options = parser.parse_args(argv)
+    if not options.requests_file and not options.synthetic:
+        parser.error("--requests-file or --synthetic is required")
+    try:
+        options.bbox = tuple(float(value) for value in options.bbox.split(","))
+        if len(options.bbox) != 4:
+            raise ValueError
+    except ValueError:
+        parser.error("--bbox must be four comma-separated numbers")
+    try:
+        options.chunk_sizes = _parse_sizes(options.chunk_sizes)
+        options.pool_sizes = _parse_sizes(options.pool_sizes)
+    except ValueError:
+        parser.error("sizes must be comma-separated positive integers")
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    requests = []
+    if options.requests_file:
+        requests.extend(loadtest.read_requests(options.requests_file))
+    if options.synthetic:
+        requests.extend(loadtest.synthetic_requests(
+            options.synthetic, options.layers, options.bbox,
+            options.address_fraction, options.seed))
+    if options.sample:
+        requests = requests[:options.sample]
+    base_config = {}
+    if options.config:
+        base_config = geospatial.load_config(options.config)
+
+    results = []
+    for pool_size in options.pool_sizes:
+        for chunk_size in options.chunk_sizes:
+            result = measure(
+                options, base_config, requests, chunk_size, pool_size)
+            results.append((chunk_size, pool_size, result))
+            print "BATCH_CHUNK_SIZE={c} HANDLE_POOL_SIZE={p}: {r}/s; " \
+                "p50 {p50}ms, p99 {p99}ms".format(
+                    c=chunk_size, p=pool_size, r=result["throughput"],
+                    p50=result["p50_ms"], p99=result["p99_ms"])
+            sys.stdout.flush()
+    chosen = recommend(results, options.max_p99_ms, options.tolerance)
+    write_config(options.output, chosen, results, options, base_config)
+    print "Recommended BATCH_CHUNK_SIZE={c} HANDLE_POOL_SIZE={p}, " \
+        "written to {o}".format(c=chosen[0], p=chosen[1], o=options.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the batch and pool size tuner."""
+
+import os.path
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import fakepxpointsc
+fakepxpointsc.install()
+
+import autotune
+import geospatial
+
+
+def _measured(chunk_size, pool_size, throughput, p99_ms):
+    return chunk_size, pool_size, {
+        "throughput": throughput, "p50_ms": p99_ms, "p99_ms": p99_ms}
+
+
+class DefaultPoolSizesTest(unittest.TestCase):
+    def test_powers_of_two_and_the_cpu_count(self):
+        self.assertEqual([1], autotune.default_pool_sizes(1))
+        self.assertEqual([1, 2, 4], autotune.default_pool_sizes(4))
+        self.assertEqual([1, 2, 4, 6], autotune.default_pool_sizes(6))
+        self.assertEqual([1], autotune.default_pool_sizes(0))
+
+
+class RecommendTest(unittest.TestCase):
+    def test_highest_throughput(self):
+        results = [
+            _measured(100, 1, 500, 20), _measured(100, 2, 900, 30),
+            _measured(500, 2, 1000, 60)]
+        self.assertEqual(results[2], autotune.recommend(results))
+        # within the tolerance, the smaller chunk is preferred
+        self.assertEqual(results[1], autotune.recommend(results, None, 0.2))
+
+    def test_smaller_pools_within_tolerance(self):
+        results = [
+            _measured(500, 4, 1000, 20), _measured(1000, 2, 980, 20),
+            _measured(500, 2, 970, 20), _measured(500, 1, 600, 20)]
+        self.assertEqual(results[2], autotune.recommend(results))
+        self.assertEqual(results[0], autotune.recommend(results, None, 0))
+
+    def test_max_p99(self):
+        results = [
+            _measured(100, 1, 500, 20), _measured(500, 1, 1000, 60),
+            _measured(1000, 1, 1200, None)]
+        self.assertEqual(results[0], autotune.recommend(results, 50))
+        # if none is fast enough, the fastest is picked
+        self.assertEqual(results[0], autotune.recommend(results[:2], 10))
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        fakepxpointsc.reset()
+        self.addCleanup(fakepxpointsc.reset)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_base_config_is_kept(self):
+        base_path = os.path.join(self.directory, "base.conf")
+        with open(base_path, "wb") as base_file:
+            base_file.write(
+                "DATACATALOG_PATH = 'ignored'\n"
+                "BATCH_CHUNK_SIZE = 7\n"
+                "GEOCODE_CACHE_SIZE = 0\n"
+                "GEOCODER_DATASET_PROFILES = {'parcel': ['Parcel']}\n")
+        output_path = os.path.join(self.directory, "tuned.conf")
+        output = StringIO.StringIO()
+        self.addCleanup(setattr, sys, "stdout", sys.stdout)
+        sys.stdout = output
+        self.assertEqual(0, autotune.main([
+            "--synthetic", "20", "--seed", "1", "--layer", "County",
+            "--chunk-sizes", "5,10", "--pool-sizes", "1,2",
+            "--concurrency", "2", "--batch-size", "10",
+            "--config", base_path, "--output", output_path,
+            "--data-catalog",
+            fakepxpointsc.write_data_catalog(self.directory),
+            "--shapefile-root", self.directory]))
+        self.assertEqual(5, len(output.getvalue().splitlines()))
+        tuned = geospatial.load_config(output_path)
+        self.assertIn(tuned["BATCH_CHUNK_SIZE"], (5, 10))
+        self.assertIn(tuned["HANDLE_POOL_SIZE"], (1, 2))
+        self.assertEqual(
+            {"GEOCODE_CACHE_SIZE": 0,
+             "GEOCODER_DATASET_PROFILES": {"parcel": ["Parcel"]}},
+            dict((key, value) for key, value in tuned.items()
+                 if key not in ("BATCH_CHUNK_SIZE", "HANDLE_POOL_SIZE")))
+
+
+if __name__ == "__main__":
+    unittest.main()
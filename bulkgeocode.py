@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Bulk geocoding and layer enrichment from the command line.
+
+Reads CSV or NDJSON records holding either an address or a lat/lon point
+from a file or stdin, geocodes the addresses and queries layers about the
+resulting points, and writes each input record, extended with the results,
+as CSV or NDJSON.
+
+Records are processed in chunks through GeoSpatial.get_locations() and
+GeoSpatial.query_layer_batch(), so memory use is bounded by the chunk size.
+After each chunk is written, the input offset and output size are saved to
+an optional checkpoint file; a job restarted with --resume continues after
+the last committed chunk.
+
+For example:
+    bulkgeocode.py --input addresses.csv --output enriched.csv \\
+        --layer County --layer State --checkpoint enriched.ckpt
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import geospatial
+
+# Output columns added for each record
+GEOCODE_STATUS_FIELD = "$Status"
+LAYER_STATUS_FIELD = "[{a}]$Status"
+
+
+class _StageTimer:
+    """Accumulates the time spent in each processing stage."""
+    def __init__(self):
+        self.stages = []
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        if stage not in self.seconds:
+            self.stages.append(stage)
+            self.seconds[stage] = 0.0
+        self.seconds[stage] += seconds
+
+    def timed(self, stage, function, *args):
+        """Calls function(*args), charging its time to a stage."""
+        start = time.time()
+        try:
+            return function(*args)
+        finally:
+            self.add(stage, time.time() - start)
+
+    def __str__(self):
+        return " ".join(
+            "{s}={t:.1f}s".format(s=stage, t=self.seconds[stage])
+            for stage in self.stages)
+
+
+class _LineSource:
+    """Iterates over the lines of a file, counting the bytes consumed.
+
+    Lines are read one at a time, without read-ahead, so the offset is exact
+    for both seekable files and pipes.
+    """
+    def __init__(self, stream, offset=0):
+        self.stream = stream
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.stream.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line
+
+
+def _read_records(source, input_format, field_names=None):
+    """Yields (record, end_offset) tuples from a line source.
+
+    Args:
+        source (_LineSource): The input lines.
+        input_format (str): "csv" or "ndjson".
+        field_names (list, optional): The CSV header, if already read.
+    """
+    if input_format == "ndjson":
+        for line in source:
+            if line.strip():
+                yield json.loads(line), source.offset
+        return
+    reader = csv.reader(source)
+    for row in reader:
+        if not row:
+            continue
+        yield dict(zip(field_names, row)), source.offset
+
+
+def _first_result(json_results, id_col_name):
+    """Returns the status and the first result row of a JSON result, without
+    its call id column."""
+    result = json.loads(json_results)
+    row = {}
+    if result["result"]:
+        row = dict(
+            (key, value) for key, value in result["result"][0].iteritems()
+            if key != id_col_name)
+    return result["status"], row
+
+
+def _encode(value):
+    """Encodes a value for the csv module."""
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value if isinstance(value, str) else str(value)
+
+
+class BulkJob:
+    """Geocodes and enriches a stream of records, chunk by chunk."""
+    def __init__(self, geo_spatial, options):
+        """Initializes the job.
+
+        Args:
+            geo_spatial (GeoSpatial): The instance that answers the queries.
+            options (argparse.Namespace): The parsed command line.
+        """
+        self.geo_spatial = geo_spatial
+        self.options = options
+        self.timer = _StageTimer()
+        self.records = 0
+        self.start_time = time.time()
+        self.last_report = self.start_time
+        self.input_field_names = None
+        self.output_field_names = None
+
+    def process_chunk(self, records):
+        """Geocodes and enriches a list of records, returning the output
+        records."""
+        options = self.options
+        points = []
+        if options.address_field:
+            addresses = [
+                (str(i), record.get(options.address_field) or "")
+                for i, record in enumerate(records)]
+            geocoded = self.timer.timed(
+                "geocode", list, self.geo_spatial.get_locations(
+                    addresses, options.profile))
+            for (call_id, json_results), record in zip(geocoded, records):
+                status, row = _first_result(json_results, "Id")
+                record[GEOCODE_STATUS_FIELD] = status
+                record.update(row)
+                try:
+                    points.append(
+                        (call_id, float(row["$Latitude"]),
+                         float(row["$Longitude"])))
+                except (KeyError, ValueError):
+                    pass
+        else:
+            for i, record in enumerate(records):
+                try:
+                    points.append((
+                        str(i), float(record[options.lat_field]),
+                        float(record[options.lon_field])))
+                except (KeyError, TypeError, ValueError):
+                    pass
+        for layer_name in options.layers:
+            results = self.timer.timed(
+                layer_name, list, self.geo_spatial.query_layer_batch(
+                    layer_name, points,
+                    search_dist_meters=options.search_dist_meters))
+            id_col_name = "[{a}]INPUT.Id".format(a=layer_name)
+            for call_id, json_results in results:
+                status, row = _first_result(json_results, id_col_name)
+                record = records[int(call_id)]
+                record[LAYER_STATUS_FIELD.format(a=layer_name)] = status
+                record.update(row)
+        return records
+
+    def write_chunk(self, output, records):
+        """Writes output records in the output format."""
+        if self.options.output_format == "ndjson":
+            for record in records:
+                output.write(json.dumps(record, sort_keys=True) + "\n")
+            return
+        if self.output_field_names is None:
+            # The first chunk decides the columns: the input fields, then the
+            # result fields. Fields only later chunks have (such as rarer
+            # geocoder outputs) are left out.
+            self.output_field_names = list(self.input_field_names or [])
+            self.output_field_names.extend(sorted(set(
+                key for record in records for key in record
+                if key not in self.output_field_names)))
+            csv.writer(output).writerow(
+                [_encode(name) for name in self.output_field_names])
+        writer = csv.writer(output)
+        for record in records:
+            writer.writerow([
+                _encode(record.get(name))
+                for name in self.output_field_names])
+
+    def report(self, force=False):
+        """Writes throughput and stage timing to stderr, at most once per
+        report interval."""
+        now = time.time()
+        if not force and now - self.last_report < self.options.report_interval:
+            return
+        self.last_report = now
+        elapsed = max(now - self.start_time, 1e-9)
+        print >> sys.stderr, "{n} records in {e:.1f}s ({r:.1f}/s). {t}".format(
+            n=self.records, e=elapsed, r=self.records / elapsed, t=self.timer)
+
+
+def _read_checkpoint(path):
+    """Returns the saved checkpoint, or None."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "rb") as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def _write_checkpoint(path, checkpoint):
+    """Atomically replaces the checkpoint file."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    if sys.platform.startswith("win") and os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+
+
+def _guess_format(path, default):
+    """Guesses a file format from its extension."""
+    if path and path != "-":
+        extension = os.path.splitext(path)[1].lower()
+        if extension in (".json", ".jsonl", ".ndjson"):
+            return "ndjson"
+        if extension == ".csv":
+            return "csv"
+    return default
+
+
+def parse_args(argv):
+    """Parses the command line."""
+    parser = argparse.ArgumentParser(
+        description="Geocode and enrich CSV or NDJSON records in bulk.")
+    parser.add_argument("--input", default="-",
+        help="input file, or - for stdin (default)")
+    parser.add_argument("--output", default="-",
+        help="output file, or - for stdout (default)")
+    parser.add_argument("--input-format", choices=("csv", "ndjson"),
+        help="input format; guessed from the file extension by default")
+    parser.add_argument("--output-format", choices=("csv", "ndjson"),
+        help="output format; guessed from the file extension by default")
+    parser.add_argument("--address-field", default="address",
+        help="field holding the address to geocode (default: address); "
+             "empty to read points instead")
+    parser.add_argument("--profile",
+        help="geocoder output profile, such as coords, standard or full")
+    parser.add_argument("--lat-field", default="lat",
+        help="field holding the latitude of an input point")
+    parser.add_argument("--lon-field", default="lon",
+        help="field holding the longitude of an input point")
+    parser.add_argument("--layer", dest="layers", action="append",
+        default=[], help="layer to query about each point; may be repeated")
+    parser.add_argument("--search-dist-meters", type=float, default=0,
+        help="FindNearest search distance; 0 (default) for WITHIN queries")
+    parser.add_argument("--chunk-size", type=int,
+        help="records per chunk (default: the configuration's "
+             "BATCH_CHUNK_SIZE)")
+    parser.add_argument("--config",
+        help="GeoSpatial configuration file, such as one autotune.py wrote")
+    parser.add_argument("--checkpoint",
+        help="file recording the last committed chunk")
+    parser.add_argument("--resume", action="store_true",
+        help="continue after the last committed chunk in --checkpoint")
+    parser.add_argument("--report-interval", type=float, default=10.0,
+        help="seconds between progress reports on stderr")
+    parser.add_argument("--data-catalog", default=r"f:\websites\datacatalog.xml",
+        help="data catalog path")
+    parser.add_argument("--shapefile-root", default=r"f:\pxse-data",
+        help="shapefile root directory")
+    options = parser.parse_args(argv)
+    options.input_format = options.input_format or _guess_format(
+        options.input, "csv")
+    options.output_format = options.output_format or _guess_format(
+        options.output, options.input_format)
+    if options.resume and not options.checkpoint:
+        parser.error("--resume requires --checkpoint")
+    if options.resume and options.output == "-":
+        parser.error("--resume requires an --output file")
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    checkpoint = _read_checkpoint(options.checkpoint) if options.resume else None
+
+    if options.input == "-":
+        input_stream = sys.stdin
+    else:
+        input_stream = open(options.input, "rb")
+    source = _LineSource(input_stream)
+    field_names = None
+    if options.input_format == "csv":
+        field_names = next(csv.reader(source), [])
+
+    skip_records = 0
+    if checkpoint is not None:
+        try:
+            input_stream.seek(checkpoint["input_offset"])
+            source.offset = checkpoint["input_offset"]
+        except (IOError, AttributeError):
+            # pipes cannot seek; skip the committed records instead
+            skip_records = checkpoint["records"]
+        output = open(options.output, "r+b")
+        output.truncate(checkpoint["output_offset"])
+        output.seek(checkpoint["output_offset"])
+    elif options.output == "-":
+        output = sys.stdout
+    else:
+        output = open(options.output, "wb")
+
+    config = {}
+    if options.config:
+        config = geospatial.load_config(options.config)
+    if options.chunk_size is None:
+        options.chunk_size = config.get(
+            "BATCH_CHUNK_SIZE", geospatial.DEFAULT_CONFIG["BATCH_CHUNK_SIZE"])
+    config["BATCH_CHUNK_SIZE"] = options.chunk_size
+    job = BulkJob(
+        geospatial.GeoSpatial(
+            options.data_catalog, options.shapefile_root, config),
+        options)
+    job.input_field_names = field_names
+    if checkpoint is not None:
+        job.records = checkpoint["records"]
+        job.output_field_names = checkpoint.get("output_field_names")
+
+    records = _read_records(source, options.input_format, field_names)
+    while True:
+        chunk = []
+        end_offset = source.offset
+        start = time.time()
+        for record, end_offset in records:
+            if skip_records:
+                skip_records -= 1
+                continue
+            chunk.append(record)
+            if len(chunk) >= options.chunk_size:
+                break
+        job.timer.add("read", time.time() - start)
+        if not chunk:
+            break
+        job.timer.timed(
+            "write", job.write_chunk, output, job.process_chunk(chunk))
+        job.records += len(chunk)
+        if options.checkpoint:
+            start = time.time()
+            output.flush()
+            os.fsync(output.fileno())
+            _write_checkpoint(options.checkpoint, {
+                "input_offset": end_offset,
+                "output_offset": output.tell(),
+                "records": job.records,
+                "output_field_names": job.output_field_names
+            })
+            job.timer.add("checkpoint", time.time() - start)
+        job.report()
+    output.flush()
+    job.report(True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
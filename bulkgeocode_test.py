@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the bulk geocoding command line, including checkpoint and
+resume."""
+
+import csv
+import json
+import os.path
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import fakepxpointsc
+fakepxpointsc.install()
+
+import bulkgeocode
+
+ADDRESSES = [
+    "{n} Main St, Boulder, CO".format(n=n) if n != 4 else ""
+    for n in range(1, 12)]
+
+
+class _Crash(Exception):
+    pass
+
+
+class BulkGeocodeTest(unittest.TestCase):
+    def setUp(self):
+        fakepxpointsc.reset()
+        self.addCleanup(fakepxpointsc.reset)
+        # progress reports and usage errors
+        self.addCleanup(setattr, sys, "stderr", sys.stderr)
+        sys.stderr = StringIO.StringIO()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.data_catalog = fakepxpointsc.write_data_catalog(self.directory)
+        self.input_path = os.path.join(self.directory, "addresses.csv")
+        with open(self.input_path, "wb") as input_file:
+            writer = csv.writer(input_file)
+            writer.writerow(["id", "address"])
+            for i, address in enumerate(ADDRESSES):
+                writer.writerow([str(i), address])
+
+    def run_job(self, output_name, *args):
+        output_path = os.path.join(self.directory, output_name)
+        argv = [
+            "--input", self.input_path, "--output", output_path,
+            "--data-catalog", self.data_catalog,
+            "--shapefile-root", self.directory, "--layer", "County",
+            "--chunk-size", "3", "--report-interval", "1000"]
+        self.assertEqual(0, bulkgeocode.main(argv + list(args)))
+        return output_path
+
+    @staticmethod
+    def read_rows(path):
+        with open(path, "rb") as output_file:
+            return list(csv.reader(output_file))
+
+    def test_csv(self):
+        rows = self.read_rows(self.run_job("enriched.csv"))
+        header = rows[0]
+        self.assertEqual(["id", "address"], header[:2])
+        self.assertEqual(len(ADDRESSES) + 1, len(rows))
+        records = [dict(zip(header, row)) for row in rows[1:]]
+        self.assertEqual(
+            [str(i) for i in range(len(ADDRESSES))],
+            [record["id"] for record in records])
+        self.assertEqual("OK", records[0]["$Status"])
+        self.assertEqual("40.0", records[0]["$Latitude"])
+        self.assertEqual("OK", records[0]["[County]$Status"])
+        self.assertEqual("Boulder", records[0]["[County]NAME"])
+        # the empty address is not found, and so has no layer results
+        self.assertEqual("NO_RESULTS", records[3]["$Status"])
+        self.assertEqual("", records[3]["[County]$Status"])
+
+    def test_ndjson_points(self):
+        self.input_path = os.path.join(self.directory, "points.ndjson")
+        with open(self.input_path, "wb") as input_file:
+            input_file.write(json.dumps({"lat": 40.0, "lon": -105.3}) + "\n")
+            input_file.write("\n")
+            input_file.write(json.dumps({"lat": "x", "lon": -105.3}) + "\n")
+        output_path = self.run_job("enriched.ndjson", "--address-field", "")
+        with open(output_path, "rb") as output_file:
+            records = [json.loads(line) for line in output_file]
+        self.assertEqual(2, len(records))
+        self.assertEqual("Boulder", records[0]["[County]NAME"])
+        self.assertNotIn("[County]NAME", records[1])
+        self.assertFalse([
+            call for call in fakepxpointsc.calls
+            if call[0] == "GeocoderGeocode"])
+
+    def test_resume(self):
+        expected = self.read_rows(self.run_job("expected.csv"))
+        checkpoint_path = os.path.join(self.directory, "job.ckpt")
+
+        # fail while geocoding the third chunk
+        chunks = [0]
+        def geocode(address, options):
+            if address == ADDRESSES[0]:
+                chunks[0] += 1
+            if chunks[0] == 1 and address == ADDRESSES[6]:
+                raise _Crash()
+            return fakepxpointsc.default_geocode(address, options)
+        fakepxpointsc.geocode = geocode
+        self.assertRaises(
+            _Crash, self.run_job, "enriched.csv", "--checkpoint",
+            checkpoint_path)
+        with open(checkpoint_path, "rb") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        self.assertEqual(6, checkpoint["records"])
+        output_path = os.path.join(self.directory, "enriched.csv")
+        self.assertEqual(checkpoint["output_offset"],
+                         os.path.getsize(output_path))
+
+        # a partly written chunk past the checkpoint is discarded
+        with open(output_path, "ab") as output_file:
+            output_file.write("partial,row\n")
+        fakepxpointsc.reset()
+        self.run_job(
+            "enriched.csv", "--checkpoint", checkpoint_path, "--resume")
+        self.assertEqual(expected, self.read_rows(output_path))
+        # only the records after the checkpoint were geocoded again
+        self.assertEqual(
+            len(ADDRESSES) - 6,
+            sum(call[2] for call in fakepxpointsc.calls
+                if call[0] == "GeocoderGeocode"))
+
+    def test_resume_requires_checkpoint(self):
+        self.assertRaises(
+            SystemExit, bulkgeocode.parse_args,
+            ["--resume", "--output", "out.csv"])
+
+
+if __name__ == "__main__":
+    unittest.main()
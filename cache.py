@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""In-memory result caches used by the GeoSpatial module."""
+
+import collections
+import threading
+
+
+class LRUCache:
+    """A bounded, thread-safe, least-recently-used cache.
+
+    A max_size of zero (or less) disables the cache: get always misses and put
+    is a no-op, so callers never need to special-case a disabled cache.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value cached for key, or default on a miss.
+
+        Args:
+            key (hashable): The cache key.
+            default (object, optional): The value to return on a miss.
+        """
+        with self.__lock:
+            try:
+                value = self.__entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # re-insert to mark the entry as most recently used
+            self.__entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Caches value under key, evicting the least recently used entries
+        if the cache is full.
+
+        Args:
+            key (hashable): The cache key.
+            value (object): The value to cache.
+        """
+        if self.max_size <= 0:
+            return
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = value
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def stats(self):
+        """Returns a dictionary of the cache's size and hit/miss counters."""
+        return {
+            "size": len(self.__entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the in-memory result caches."""
+
+import unittest
+
+import cache
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_hit_and_miss(self):
+        lru = cache.LRUCache(2)
+        self.assertEqual("none", lru.get("a", "none"))
+        lru.put("a", 1)
+        self.assertEqual(1, lru.get("a"))
+        self.assertEqual(
+            {"size": 1, "max_size": 2, "hits": 1, "misses": 1}, lru.stats())
+
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(2)
+        lru.put("a", 1)
+        lru.put("b", 2)
+        # a is now more recently used than b
+        lru.get("a")
+        lru.put("c", 3)
+        self.assertEqual(1, lru.get("a"))
+        self.assertEqual(None, lru.get("b"))
+        self.assertEqual(3, lru.get("c"))
+        self.assertEqual(2, len(lru))
+
+    def test_put_refreshes_existing_key(self):
+        lru = cache.LRUCache(2)
+        lru.put("a", 1)
+        lru.put("b", 2)
+        lru.put("a", 10)
+        lru.put("c", 3)
+        self.assertEqual(10, lru.get("a"))
+        self.assertEqual(None, lru.get("b"))
+
+    def test_disabled(self):
+        lru = cache.LRUCache(0)
+        lru.put("a", 1)
+        self.assertEqual(None, lru.get("a"))
+        self.assertEqual(0, len(lru))
+
+    def test_clear(self):
+        lru = cache.LRUCache(2)
+        lru.put("a", 1)
+        lru.clear()
+        self.assertEqual(None, lru.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Asynchronous, structured logging of calls.
+
+Request threads should never wait on a log file. CallLog.log() checks the
+logger's level and the operation's sample rate before doing any work, and
+hands the record's fields, still unformatted, to a QueueHandler. A
+QueueWriter thread formats them as key=value pairs and writes them to the
+real handlers in batches, flushing once per batch. When the queue is full,
+records are dropped and counted instead of blocking the caller.
+
+For example:
+    writer = calllog.configure(r".\\spatialapi.txt", logging.INFO)
+    ...
+    writer.stop()
+"""
+
+import logging
+import Queue
+import random
+import socket
+import threading
+
+# Name of the logger calls are logged to, as in spatialapi
+LOGGER_NAME = "SPATIALAPI"
+
+# Format of log lines, as in spatialapi:
+# '9999-12-01 23:59:59,999 [MACHINE/PXPOINTSC:INFO] message'
+LOG_FORMAT = "%(asctime)s [{h}/PXPOINTSC:%(levelname)s] %(message)s"
+
+
+class KeyValueMessage:
+    """A log message of an operation and its fields, formatted only when it
+    is written.
+
+    Field values that are callable are called then, so costly values (such
+    as the status in a JSON result) are only computed for records that are
+    written, and off the request thread.
+    """
+    def __init__(self, operation, fields):
+        self.operation = operation
+        self.fields = fields
+
+    def __str__(self):
+        parts = ["op={o}".format(o=self.operation)]
+        for key in sorted(self.fields):
+            value = self.fields[key]
+            if callable(value):
+                try:
+                    value = value()
+                except Exception as e:
+                    value = "<{e}>".format(e=e)
+            if isinstance(value, unicode):
+                value = value.encode("utf-8")
+            elif isinstance(value, float):
+                value = repr(value)
+            else:
+                value = str(value)
+            if not value or any(c in value for c in " \"=\t\r\n"):
+                value = '"{v}"'.format(v=value.replace("\\", "\\\\")
+                    .replace('"', '\\"').replace("\n", "\\n")
+                    .replace("\r", "\\r"))
+            parts.append("{k}={v}".format(k=key, v=value))
+        return " ".join(parts)
+
+
+class QueueHandler(logging.Handler):
+    """Puts log records on a queue without blocking, for a QueueWriter to
+    write."""
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def emit(self, record):
+        if record.exc_info:
+            # tracebacks are formatted now, while their frames are current
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+
+class QueueWriter:
+    """Writes the records a QueueHandler queues to other handlers, on a
+    background thread."""
+    def __init__(self, queue, handlers, batch_size=256):
+        """Initializes the writer.
+
+        Args:
+            queue (Queue.Queue): The queue the QueueHandler puts records on.
+            handlers (list): The handlers to write records to. Stream handlers
+                (including FileHandlers) are flushed once per batch rather
+                than once per record.
+            batch_size (int, optional): The maximum number of records written
+                between flushes.
+        """
+        self.queue = queue
+        self.handlers = list(handlers)
+        self.batch_size = max(1, batch_size)
+        self.written = 0
+        self.__thread = None
+
+    def start(self):
+        """Starts the writer thread."""
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """Writes the records already queued, then stops the writer thread
+        and closes the handlers."""
+        if self.__thread is not None:
+            self.queue.put(None)
+            self.__thread.join()
+            self.__thread = None
+        for handler in self.handlers:
+            handler.close()
+
+    def __run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            if stopping:
+                batch.pop()
+            for handler in self.handlers:
+                self.__write(handler, batch)
+            self.written += len(batch)
+            if stopping:
+                return
+
+    @staticmethod
+    def __write(handler, batch):
+        """Writes a batch of records to a handler."""
+        records = [
+            record for record in batch
+            if record.levelno >= handler.level and handler.filter(record)]
+        if not records:
+            return
+        stream = getattr(handler, "stream", None)
+        if stream is None:
+            for record in records:
+                handler.handle(record)
+            return
+        handler.acquire()
+        try:
+            for record in records:
+                try:
+                    stream.write(handler.format(record) + "\n")
+                except Exception:
+                    handler.handleError(record)
+            handler.flush()
+        finally:
+            handler.release()
+
+
+class CallLog:
+    """Logs calls as structured, sampled records."""
+    def __init__(
+            self, logger_name=LOGGER_NAME, sample_rates=None,
+            default_sample_rate=1.0):
+        """Initializes the call log.
+
+        Args:
+            logger_name (str, optional): The name of the logger to log to.
+            sample_rates (dict, optional): Maps operation names to the
+                fraction, from 0 to 1, of their calls to log.
+            default_sample_rate (float, optional): The fraction of calls to
+                log for operations not in sample_rates.
+        """
+        self.logger = logging.getLogger(logger_name)
+        self.sample_rates = dict(sample_rates or {})
+        self.default_sample_rate = default_sample_rate
+
+    def enabled(self, operation, level=logging.INFO):
+        """Returns True if a call of an operation at a level is to be logged;
+        sampled calls return True at the operation's sample rate."""
+        if not self.logger.isEnabledFor(level):
+            return False
+        rate = self.sample_rates.get(operation, self.default_sample_rate)
+        return rate >= 1.0 or random.random() < rate
+
+    def log(self, operation, level=logging.INFO, **fields):
+        """Logs a call of an operation, if enabled() says to.
+
+        Args:
+            operation (str): The operation name, such as "get_location".
+            level (int, optional): The logging level.
+            fields: The call's key/value fields. Callable values are called
+                when the record is written.
+        """
+        if self.enabled(operation, level):
+            self.logger.log(level, KeyValueMessage(operation, fields))
+
+
+def configure(
+        log_file_path, level=logging.INFO, logger_name=LOGGER_NAME,
+        queue_size=10000):
+    """Routes a logger through a queue to a file written on a background
+    thread, in spatialapi's format.
+
+    Args:
+        log_file_path (str): The log file, appended to.
+        level (int, optional): The logger's level.
+        logger_name (str, optional): The name of the logger.
+        queue_size (int, optional): The number of records that may wait to
+            be written before new ones are dropped.
+
+    Returns:
+        The started QueueWriter. Stop it at shutdown to write out the records
+        still queued.
+    """
+    queue = Queue.Queue(queue_size)
+    file_handler = logging.FileHandler(log_file_path)
+    file_handler.setFormatter(logging.Formatter(
+        LOG_FORMAT.format(h=socket.gethostname())))
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(level)
+    logger.addHandler(QueueHandler(queue))
+    # records are only written by the writer thread
+    logger.propagate = False
+    writer = QueueWriter(queue, [file_handler])
+    writer.start()
+    return writer
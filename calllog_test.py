@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the asynchronous call log."""
+
+import logging
+import os.path
+import Queue
+import shutil
+import tempfile
+import unittest
+
+import calllog
+
+
+class _ListHandler(logging.Handler):
+    """Keeps the records it handles."""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class KeyValueMessageTest(unittest.TestCase):
+    def test_format(self):
+        message = calllog.KeyValueMessage("get_location", {
+            "call_id": "1", "address": "123 Main St", "elapsed_ms": 1.5,
+            "rows": 3, "empty": "", "quoted": 'say "hi"\n',
+            "unicode": u"Espa\xf1ola"})
+        self.assertEqual(
+            'op=get_location address="123 Main St" call_id=1 '
+            'elapsed_ms=1.5 empty="" quoted="say \\"hi\\"\\n" rows=3 '
+            'unicode=Espa\xc3\xb1ola', str(message))
+
+    def test_callable_values(self):
+        calls = []
+        def status():
+            calls.append(1)
+            return "OK"
+        def broken():
+            raise KeyError("status")
+        message = calllog.KeyValueMessage(
+            "op", {"status": status, "broken": broken})
+        self.assertEqual([], calls)
+        self.assertEqual(
+            "op=op broken=<'status'> status=OK", str(message))
+        self.assertEqual([1], calls)
+
+
+class CallLogTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("calllog_test")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.handler = _ListHandler()
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_sample_rates(self):
+        call_log = calllog.CallLog(
+            "calllog_test", {"never": 0.0, "half": 0.5}, 1.0)
+        for _ in range(1000):
+            call_log.log("never")
+            call_log.log("half")
+            call_log.log("always")
+        counts = {}
+        for record in self.handler.records:
+            counts[record.msg.operation] = (
+                counts.get(record.msg.operation, 0) + 1)
+        self.assertNotIn("never", counts)
+        self.assertEqual(1000, counts["always"])
+        self.assertTrue(400 < counts["half"] < 600)
+
+    def test_level(self):
+        call_log = calllog.CallLog("calllog_test")
+        call_log.log("debug", logging.DEBUG, value=lambda: self.fail())
+        self.assertEqual([], self.handler.records)
+        self.assertFalse(call_log.enabled("debug", logging.DEBUG))
+
+
+class QueueTest(unittest.TestCase):
+    def test_full_queue_drops_records(self):
+        handler = calllog.QueueHandler(Queue.Queue(2))
+        for i in range(5):
+            handler.emit(logging.makeLogRecord({"msg": str(i)}))
+        self.assertEqual(2, handler.queue.qsize())
+        self.assertEqual(3, handler.dropped)
+
+    def test_writer(self):
+        queue = Queue.Queue()
+        target = _ListHandler()
+        target.setLevel(logging.INFO)
+        writer = calllog.QueueWriter(queue, [target], batch_size=3)
+        handler = calllog.QueueHandler(queue)
+        for i in range(10):
+            handler.emit(logging.makeLogRecord({
+                "msg": str(i),
+                "levelno": logging.DEBUG if i == 4 else logging.INFO}))
+        writer.start()
+        writer.stop()
+        self.assertEqual(10, writer.written)
+        self.assertEqual(
+            ["0", "1", "2", "3", "5", "6", "7", "8", "9"],
+            [record.msg for record in target.records])
+
+    def test_configure(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "calls.txt")
+        writer = calllog.configure(path, logger_name="calllog_test_file")
+        logger = logging.getLogger("calllog_test_file")
+        self.addCleanup(logger.handlers.pop)
+        calllog.CallLog("calllog_test_file").log(
+            "query_layer", layer="County", status=lambda: "OK")
+        writer.stop()
+        with open(path) as log_file:
+            lines = log_file.read().splitlines()
+        self.assertEqual(1, len(lines))
+        self.assertTrue(lines[0].endswith(
+            ":INFO] op=query_layer layer=County status=OK"), lines[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,15 +1,34 @@
+import hashlib
 import os.path
 import xml.etree.ElementTree as ET
 
+
+def get_vintage(paths):
+    """Returns a short string identifying the version of a set of data files.
+
+    The vintage changes whenever a path changes (e.g., PxPoint_2013_12 is
+    replaced by PxPoint_2014_03) or a file is replaced in place.
+    """
+    digest = hashlib.md5()
+    for path in paths:
+        try:
+            modified = os.path.getmtime(path)
+        except OSError:
+            modified = None
+        digest.update(u'{p}@{m};'.format(p=path, m=modified).encode('utf-8'))
+    return digest.hexdigest()
+
 class DataCatalog:
     license_path = None
     license_key = None
-    pxpoint_datasets = {}
-    spatial_layers = {}
     pxpoint_root = None
     spatial_root = None
 
     def __init__(self, path_to_data_catalog, pxse_dir):
+        # per instance, so that a reloaded catalog starts empty
+        self.pxpoint_datasets = {}
+        self.spatial_layers = {}
+
         dc = ET.parse(path_to_data_catalog)
 
         # get license path and key
@@ -39,4 +58,12 @@ class DataCatalog:
         for layer in layer_iterator:
             self.spatial_layers[layer.attrib['Name']] = layer.attrib['URI'].replace('file:///$PXSEDIR', pxse_dir)
 
+    def geocoder_vintage(self):
+        """Returns the vintage of the geocoding datasets."""
+        return get_vintage(
+            self.pxpoint_datasets[name] 
+            for name in sorted(self.pxpoint_datasets) if name != 'All')
 
+    def layer_vintage(self, layer_alias):
+        """Returns the vintage of a spatial layer."""
+        return get_vintage([self.spatial_layers[layer_alias]])
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""A stand-in for pxpointsc, for unit tests that cannot load PxPointSC.
+
+install() puts this module in sys.modules as pxpointsc, so it must be called
+before geospatial (or anything else importing pxpointsc) is imported:
+
+    import fakepxpointsc
+    fakepxpointsc.install()
+    import geospatial
+
+Geocoders find every non-empty address at GEOCODE_LATITUDE and
+GEOCODE_LONGITUDE, reverse geocoding finds REVERSE_GEOCODE_ADDRESS for every
+point, every layer query finds one feature, with LAYER_VALUES, and places
+have no parent or children, unless a test replaces the module's geocode,
+reverse_geocode, query, find_parent or find_children function. These may
+return a RowError instead of their rows to fail an input row. Every table
+operation, and every replay of one, is recorded in calls, and sleeps for
+delay seconds first.
+
+write_data_catalog() writes a data catalog naming the fake's datasets and
+layers.
+"""
+
+import os.path
+import re
+import sys
+import threading
+import time
+
+import pxcommon
+import table
+
+CHAR_SET_NAME = "UTF-8"
+GEOCODE_LATITUDE = 40.0
+GEOCODE_LONGITUDE = -105.0
+REVERSE_GEOCODE_ADDRESS = "1 MAIN ST"
+LAYER_VALUES = {
+    "NAME": "Boulder",
+    "FIPS": "08013",
+    "$Geometry":
+        "POLYGON ((-106 39, -104 39, -104 41, -106 41, -106 39))",
+}
+
+DATA_CATALOG = """<?xml version="1.0"?>
+<DataCatalog>
+  <PxPointLicense path="{root}/license.lic" key="123456789"/>
+  <PxPointDatasets>
+    <Dataset Name="All" URI="file:///$PXSEDIR/PxPoint/All"/>
+    <Dataset Name="Parcel" URI="file:///$PXSEDIR/PxPoint/Parcel"/>
+    <Dataset Name="USPS" URI="file:///$PXSEDIR/PxPoint/USPS"/>
+  </PxPointDatasets>
+  <SpatialLayers>
+    <Layer Name="County" URI="file:///$PXSEDIR/County/County.shp"/>
+    <Layer Name="State" URI="file:///$PXSEDIR/State/State.shp"/>
+  </SpatialLayers>
+</DataCatalog>
+"""
+
+_POINT_RE = re.compile(r"POINT\s*\(\s*(\S+)\s+(\S+)\s*\)")
+
+# (function name, handle, number of input rows) of every table operation,
+# and (function name, handle, number of layers) of every layer attachment
+calls = []
+# every handle opened
+handles = []
+# seconds each table operation takes
+delay = 0.0
+
+_handle_lock = threading.Lock()
+_handle_count = [0]
+_table_operation_observers = []
+
+
+class RowError:
+    """The error of an input row, as found by a replaceable function."""
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+
+class FakeHandle:
+    """A geocoder or spatial processor handle."""
+    def __init__(self, kind):
+        with _handle_lock:
+            _handle_count[0] += 1
+            self.number = _handle_count[0]
+        self.kind = kind
+        self.closed = False
+        handles.append(self)
+
+    def __repr__(self):
+        return "<{k} {n}>".format(k=self.kind, n=self.number)
+
+
+def install():
+    """Makes this module the one imported as pxpointsc."""
+    sys.modules["pxpointsc"] = sys.modules[__name__]
+
+
+def reset():
+    """Restores the default results and forgets the recorded calls."""
+    global delay, geocode, reverse_geocode, query, find_parent, find_children
+    del calls[:]
+    del handles[:]
+    delay = 0.0
+    geocode = default_geocode
+    reverse_geocode = default_reverse_geocode
+    query = default_query
+    find_parent = default_find_parent
+    find_children = default_find_children
+
+
+def write_data_catalog(directory):
+    """Writes a data catalog to a directory, returning its path."""
+    path = os.path.join(directory, "datacatalog.xml")
+    with open(path, "wb") as catalog_file:
+        catalog_file.write(DATA_CATALOG.format(root=directory))
+    return path
+
+
+def default_geocode(address, options):
+    """Returns the output rows, as dictionaries, found for an address."""
+    if not address.strip():
+        return []
+    return [{"$Latitude": GEOCODE_LATITUDE, "$Longitude": GEOCODE_LONGITUDE,
+             "$AddressLine": address.upper()}]
+
+
+def default_reverse_geocode(lat, lon, options):
+    """Returns the output rows, as dictionaries, found for a point."""
+    return [{"$AddressLine": REVERSE_GEOCODE_ADDRESS, "$Latitude": lat,
+             "$Longitude": lon}]
+
+
+def default_query(lat, lon, options):
+    """Returns the layer features, as dictionaries of field values without
+    their layer prefix, found for a point."""
+    return [dict(LAYER_VALUES)]
+
+
+def default_find_parent(place_type, place_id):
+    """Returns the parent place, as a list of at most one dictionary, of a
+    place."""
+    return []
+
+
+def default_find_children(place_type, place_id):
+    """Returns the child places, as dictionaries, of a place."""
+    return []
+
+
+geocode = default_geocode
+reverse_geocode = default_reverse_geocode
+query = default_query
+find_parent = default_find_parent
+find_children = default_find_children
+
+
+def add_table_operation_observer(observer):
+    _table_operation_observers.append(observer)
+
+
+def remove_table_operation_observer(observer):
+    _table_operation_observers.remove(observer)
+
+
+def _table_operation(
+        function_name, handle, input_table, out_col_definition,
+        err_col_definition, processing_options, observed=True):
+    """Builds the output of a table operation from the rows its finder
+    returns for each input row: a list of dictionaries of output values, or
+    a RowError.
+
+    Returns:
+        An (output_table, error_table, return_code, return_message, timings)
+        tuple.
+    """
+    find = _FINDERS[function_name]
+    calls.append((function_name, handle, input_table.nrows()))
+    start = time.time()
+    if delay:
+        time.sleep(delay)
+    col_names = out_col_definition.split(";")
+    output_table = table.Table()
+    for col_name in col_names:
+        output_table.append_col(col_name)
+    error_table = table.Table()
+    for col_name in err_col_definition.split(";"):
+        error_table.append_col(col_name)
+    for row in input_table.rows:
+        found = find(row, processing_options)
+        if isinstance(found, RowError):
+            error_table.append_row([row[0], str(found.code), found.message])
+            continue
+        for values in found:
+            output_table.append_row([row[0]] + [
+                values.get(col_name.split("]")[-1], "")
+                for col_name in col_names[1:]])
+    timings = {"native": time.time() - start}
+    observers = list(_table_operation_observers) if observed else []
+    if observers:
+        table_bytes, table_size = input_table.serialize()
+    for observer in observers:
+        observer(
+            function_name, lambda: table_bytes[:table_size],
+            out_col_definition, err_col_definition, processing_options,
+            pxcommon.PXP_SUCCESS, timings)
+    return output_table, error_table, pxcommon.PXP_SUCCESS, "", timings
+
+
+def replay_table_operation(
+        function_name, handle, table_bytes, out_col_definition,
+        err_col_definition, processing_options):
+    """Makes a table operation with an already serialized input table, as
+    pxpointsc does. Observers are not told of replays."""
+    input_table = table.Table()
+    input_table.deserialize(table_bytes, 0)
+    return _table_operation(
+        function_name, handle, input_table, out_col_definition,
+        err_col_definition, processing_options, False)
+
+
+# the rows each table operation finds for an input row, given the
+# processing options
+_FINDERS = {
+    "GeocoderGeocode": lambda row, options: geocode(row[1], options),
+    "GeocoderReverseGeocode": lambda row, options: reverse_geocode(
+        *(_point(row) + (options, ))),
+    "GeocoderFindParent": lambda row, options: find_parent(row[1], row[2]),
+    "GeocoderFindChildren":
+        lambda row, options: find_children(row[1], row[2]),
+    "GeoSpatialQuery": lambda row, options: query(
+        *(_point(row) + (options, )))
+}
+
+
+def _point(row):
+    """Returns the (lat, lon) of an input row's WKT point."""
+    match = _POINT_RE.match(row[1])
+    return float(match.group(2)), float(match.group(1))
+
+
+def geocoder_init(data_catalog, dataset_names=None):
+    if dataset_names is not None:
+        for dataset_name in dataset_names:
+            if dataset_name not in data_catalog.pxpoint_datasets:
+                raise ValueError(
+                    "Unknown dataset: {d}".format(d=dataset_name))
+    handle = FakeHandle("geocoder")
+    handle.dataset_names = dataset_names
+    return handle, pxcommon.PXP_SUCCESS, ""
+
+
+def geocoder_geocode(handle, input_table, out_col_definition,
+                     err_col_definition, processing_options):
+    return _table_operation(
+        "GeocoderGeocode", handle, input_table, out_col_definition,
+        err_col_definition, processing_options)[:4]
+
+
+def geocoder_reverse_geocode(handle, input_table, out_col_definition,
+                             err_col_definition, processing_options):
+    return _table_operation(
+        "GeocoderReverseGeocode", handle, input_table, out_col_definition,
+        err_col_definition, processing_options)[:4]
+
+
+def geocoder_find_parent(handle, input_table, out_col_definition,
+                         err_col_definition, processing_options):
+    return _table_operation(
+        "GeocoderFindParent", handle, input_table, out_col_definition,
+        err_col_definition, processing_options)[:4]
+
+
+def geocoder_find_children(handle, input_table, out_col_definition,
+                           err_col_definition, processing_options):
+    return _table_operation(
+        "GeocoderFindChildren", handle, input_table, out_col_definition,
+        err_col_definition, processing_options)[:4]
+
+
+def geocoder_close(handle):
+    handle.closed = True
+
+
+def geospatial_init(data_catalog):
+    return FakeHandle("geospatial"), pxcommon.PXP_SUCCESS, ""
+
+
+def geospatial_prepare(handle, data_catalog, layer_alias_list):
+    calls.append(("GeoSpatialPrepare", handle, len(layer_alias_list)))
+    return dict(
+        (layer_alias, ["[{a}]{f}".format(a=layer_alias, f=field)
+                       for field in sorted(LAYER_VALUES) if field[0] != "$"])
+        for layer_alias in layer_alias_list)
+
+
+def geospatial_attach_layer(handle, data_catalog, layer_alias):
+    calls.append(("GeoSpatialAttachLayer", handle, 1))
+    return pxcommon.PXP_SUCCESS, ""
+
+
+def geospatial_query(handle, input_table, out_col_definition,
+                     err_col_definition, processing_options):
+    return _table_operation(
+        "GeoSpatialQuery", handle, input_table, out_col_definition,
+        err_col_definition, processing_options)[:4]
+
+
+def geospatial_close(handle):
+    handle.closed = True
@@ -0,0 +1,840 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Serves a GeoSpatial to other processes over a Unix domain socket.
+
+A crash in PxPointSC takes down the process that loaded it, and every process
+that loads it keeps its own copy of the geocoder and layer data. The daemon
+owns one GeoSpatial, with its handles, caches and configuration, and serves
+any number of client processes on the same host; GeoSpatialClient offers them
+GeoSpatial's interface. A native crash then ends only the daemon, whose
+supervisor starts a new one, while its clients see server errors and
+reconnect on their next call.
+
+Each connection carries one request at a time, as a line of JSON naming the
+GeoSpatial method and its arguments, and gets one line back. The serialized
+tables of geocode_tables(), reverse_geocode_tables() and query_layer_tables()
+results, and any request or response larger than SEGMENT_THRESHOLD bytes, are
+not sent through the socket: they are written to a segment, a file mapped
+into memory in a shared memory directory (/dev/shm, where there is one), and
+only its name and offsets are sent. The receiver maps the segment, reads it
+in place and removes it. Segments are created readable by their owner only,
+so clients must run as the daemon's user, with the same shared memory
+directory. A receiver only opens a segment in its own shared memory
+directory, whose name starts with SEGMENT_PREFIX, and only if it is a
+regular file owned by that user.
+
+For example:
+    geodaemon.py --socket /var/run/geospatial.sock --config tuned.conf
+
+and, in a client process:
+    geo_spatial = geodaemon.GeoSpatialClient("/var/run/geospatial.sock")
+    json_results = geo_spatial.get_location("1", "123 main st, boulder co")
+"""
+
+import argparse
+import contextlib
+import errno
+import itertools
+import json
+import logging
+import mmap
+import os
+import signal
+import socket
+import stat
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import geospatial
+import hedging
+import table
+import variant
+
+# Requests and responses up to this size are sent through the socket
+SEGMENT_THRESHOLD = 64 * 1024
+# Names of segment files, in the shared memory directory
+SEGMENT_PREFIX = "geodaemon-"
+# Segments older than this are removed when the daemon starts
+STALE_SEGMENT_SECONDS = 60
+
+# GeoSpatial methods served, by what they return
+_JSON_METHODS = frozenset([
+    "get_location", "reverse_geocode", "query_layer", "find_parent",
+    "find_children", "find_ancestors"])
+_BATCH_METHODS = frozenset([
+    "get_locations", "reverse_geocode_batch", "query_layer_batch"])
+_TABLE_METHODS = frozenset([
+    "geocode_tables", "reverse_geocode_tables", "query_layer_tables"])
+_OTHER_METHODS = frozenset(["get_config", "get_stats", "reload_data_catalog"])
+# Arguments holding rows, which GeoSpatial expects as tuples
+_ROW_ARGUMENTS = ("locations", "points")
+
+# Names of the column types, by type, and those Table.serialize() can write
+_VAR_TYPE_NAMES = dict(
+    (value, name) for name, value in vars(variant.VarType).items()
+    if not name.startswith("_"))
+_SERIALIZABLE_TYPES = frozenset([
+    variant.VarType.Double, variant.VarType.Int64, variant.VarType.UInt64,
+    variant.VarType.Int32, variant.VarType.UInt32, variant.VarType.String,
+    variant.VarType.Bool])
+
+# Exceptions raised again by the client, by name; others are RuntimeErrors
+_ERRORS = {
+    "ValueError": ValueError,
+    "OverloadedError": geospatial.OverloadedError,
+    "DeadlineExceeded": hedging.DeadlineExceeded
+}
+
+
+class DaemonUnavailableError(RuntimeError):
+    """Raised when the daemon cannot be reached, or stops answering."""
+    pass
+
+
+def default_shm_dir():
+    """Returns /dev/shm if there is one, or else the temporary directory."""
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def _write_segment(shm_dir, parts):
+    """Writes strings to a new segment.
+
+    Returns:
+        The segment's path, and the [offset, length] of each part in it.
+    """
+    refs = []
+    size = 0
+    for part in parts:
+        refs.append([size, len(part)])
+        size += len(part)
+    fd, path = tempfile.mkstemp(prefix=SEGMENT_PREFIX, dir=shm_dir)
+    try:
+        os.ftruncate(fd, size)
+        segment = mmap.mmap(fd, size)
+        try:
+            for part in parts:
+                segment.write(part)
+        finally:
+            segment.close()
+    except Exception:
+        os.unlink(path)
+        raise
+    finally:
+        os.close(fd)
+    return path, refs
+
+
+def _open_segment(shm_dir, name):
+    """Maps a segment for reading, and removes its file.
+
+    Args:
+        shm_dir (str): The directory segments are created in.
+        name (str): The segment file's name, as sent by _send().
+
+    Raises:
+        OSError: if the name is not a segment's, the file is not a regular
+            file owned by this process's user, or it cannot be mapped.
+    """
+    if (os.path.basename(name) != name or
+            not name.startswith(SEGMENT_PREFIX)):
+        raise OSError(
+            errno.EINVAL, "Not a segment name: {n!r}".format(n=name))
+    path = os.path.join(shm_dir, name)
+    link_stat = os.lstat(path)
+    if (not stat.S_ISREG(link_stat.st_mode) or
+            link_stat.st_uid != os.getuid()):
+        raise OSError(errno.EPERM, "Not a segment of this user", path)
+    fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    try:
+        file_stat = os.fstat(fd)
+        if ((file_stat.st_dev, file_stat.st_ino) !=
+                (link_stat.st_dev, link_stat.st_ino)):
+            # replaced since lstat()
+            raise OSError(errno.EPERM, "Not a segment of this user", path)
+        os.unlink(path)
+        try:
+            return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError) as e:
+            raise OSError(errno.EIO, "Cannot map segment: {e}".format(e=e),
+                path)
+    finally:
+        os.close(fd)
+
+
+def _get_serialized_size(source_table):
+    """Returns at least the number of bytes Table.serialize() writes for a
+    table.
+
+    Raises:
+        ValueError: if a column's type cannot be serialized.
+    """
+    for col_name, col_var_type in zip(
+            source_table.col_names, source_table.col_var_types):
+        if col_var_type not in _SERIALIZABLE_TYPES:
+            raise ValueError(
+                "Cannot encode column {c} of type {t}".format(
+                    c=col_name,
+                    t=_VAR_TYPE_NAMES.get(col_var_type, col_var_type)))
+    ncols = len(source_table.col_names)
+    # magic number, column and row counts, and column types
+    size = 12 + ncols
+    # each value is its type and at most 8 bytes, or a string's length and
+    # UTF-8, of at most 4 bytes per character
+    size += sum(5 + 4 * len(col_name) for col_name in source_table.col_names)
+    size += ncols * len(source_table.rows) * 9
+    string_cols = [
+        index for index, col_var_type in enumerate(source_table.col_var_types)
+        if col_var_type == variant.VarType.String]
+    for row in source_table.rows:
+        for index in string_cols:
+            if row[index] is not None:
+                size += 4 * len(row[index])
+    return size
+
+
+def _remove_stale_segments(shm_dir):
+    """Removes the segments left behind by processes that died."""
+    for name in os.listdir(shm_dir):
+        path = os.path.join(shm_dir, name)
+        try:
+            if (name.startswith(SEGMENT_PREFIX) and
+                    time.time() - os.path.getmtime(path) >
+                    STALE_SEGMENT_SECONDS):
+                os.unlink(path)
+        except OSError:
+            # removed meanwhile
+            pass
+
+
+def _send(sock, message, blobs, shm_dir):
+    """Sends a message, with blobs (serialized tables) and, if it is large,
+    the message itself in a segment.
+
+    Args:
+        sock (socket): The connection.
+        message: The JSON-serializable message. It refers to blobs by their
+            index in the list.
+        blobs (list): Strings sent beside the message.
+        shm_dir (str): The directory segments are created in.
+
+    Returns:
+        The number of bytes written to a segment.
+    """
+    body = json.dumps(message)
+    if not blobs and len(body) <= SEGMENT_THRESHOLD:
+        sock.sendall(json.dumps({"message": message}) + "\n")
+        return 0
+    path, refs = _write_segment(shm_dir, list(blobs) + [body])
+    try:
+        sock.sendall(json.dumps({
+            "segment": os.path.basename(path), "blobs": refs[:-1],
+            "body": refs[-1]}) + "\n")
+    except Exception:
+        os.unlink(path)
+        raise
+    return refs[-1][0] + refs[-1][1]
+
+
+def _receive(stream, shm_dir):
+    """Reads a message sent by _send().
+
+    Args:
+        stream (file): The connection.
+        shm_dir (str): The directory segments are created in.
+
+    Returns:
+        The message, the mapped segment (None if there is none), which the
+        caller closes, and the [offset, length] of each blob in it.
+
+    Raises:
+        EOFError: if the connection was closed.
+        OSError: if the message's segment cannot be opened; see
+            _open_segment(). The connection can still be used.
+    """
+    line = stream.readline()
+    if not line.endswith("\n"):
+        raise EOFError("Connection closed")
+    header = json.loads(line)
+    if "segment" not in header:
+        return header["message"], None, []
+    segment = _open_segment(shm_dir, header["segment"])
+    try:
+        offset, length = header["body"]
+        return (json.loads(segment[offset:offset + length]), segment,
+            header["blobs"])
+    except Exception:
+        segment.close()
+        raise
+
+
+@contextlib.contextmanager
+def _optional(context, value):
+    """Enters context(value), unless value is None."""
+    if value is None:
+        yield
+    else:
+        with context(value):
+            yield
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    """Answers the requests of a connection, one at a time."""
+    def handle(self):
+        server = self.server
+        server.count("connections")
+        while True:
+            receive_error = None
+            try:
+                request, segment, _ = _receive(self.rfile, server.shm_dir)
+            except OSError as e:
+                # the request's segment was refused, but the connection is
+                # still in step, and gets the error as its answer
+                request = segment = None
+                receive_error = e
+            except (EOFError, IOError, ValueError):
+                return
+            if segment is not None:
+                segment.close()
+            try:
+                if receive_error is not None:
+                    raise receive_error
+                response, blobs = server.answer(request)
+            except Exception as e:
+                server.count("errors")
+                response = {"error": str(e), "error_type": type(e).__name__}
+                blobs = []
+            server.count("requests")
+            try:
+                server.count("segment_bytes", _send(
+                    self.connection, response, blobs, server.shm_dir))
+            except IOError:
+                return
+
+
+class GeoSpatialServer(SocketServer.ThreadingMixIn,
+        SocketServer.UnixStreamServer):
+    """Serves a GeoSpatial on a Unix domain socket, answering each
+    connection on its own thread."""
+    daemon_threads = True
+
+    def __init__(self, socket_path, geo_spatial, shm_dir=None):
+        """Listens on a socket, replacing a stale socket file.
+
+        Args:
+            socket_path (str): The socket's path.
+            geo_spatial (GeoSpatial): The instance served.
+            shm_dir (str, optional): The directory segments are created in.
+                The default is default_shm_dir().
+
+        Raises:
+            socket.error: if another daemon is listening on the socket.
+        """
+        if os.path.exists(socket_path):
+            # a socket file nobody listens on refuses connections
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except socket.error as e:
+                if e.errno != errno.ECONNREFUSED:
+                    raise
+                os.unlink(socket_path)
+            else:
+                raise socket.error(
+                    errno.EADDRINUSE,
+                    "A daemon is listening on {s}".format(s=socket_path))
+            finally:
+                probe.close()
+        SocketServer.UnixStreamServer.__init__(
+            self, socket_path, _RequestHandler)
+        self.socket_path = socket_path
+        self.geo_spatial = geo_spatial
+        self.shm_dir = shm_dir or default_shm_dir()
+        self.__stats = {
+            "connections": 0, "requests": 0, "errors": 0, "segment_bytes": 0}
+        self.__stats_lock = threading.Lock()
+
+    def count(self, name, n=1):
+        """Adds to one of the daemon's counters."""
+        with self.__stats_lock:
+            self.__stats[name] += n
+
+    def answer(self, request):
+        """Calls the GeoSpatial method a request names.
+
+        Returns:
+            The response, and the blobs its tables refer to.
+
+        Raises:
+            ValueError: if the method is not served.
+            Whatever the method raised.
+        """
+        method = request["method"]
+        if method not in (_JSON_METHODS | _BATCH_METHODS | _TABLE_METHODS |
+                _OTHER_METHODS):
+            raise ValueError("Unknown method: {m}".format(m=method))
+        kwargs = dict(
+            (str(name), value)
+            for name, value in request.get("kwargs", {}).items())
+        for name in _ROW_ARGUMENTS:
+            if name in kwargs:
+                kwargs[name] = [tuple(row) for row in kwargs[name]]
+        geo_spatial = self.geo_spatial
+        with _optional(geo_spatial.deadline, request.get("deadline_ms")), \
+                _optional(geo_spatial.priority, request.get("priority")), \
+                _optional(geo_spatial.admit, request.get("operation")):
+            result = getattr(geo_spatial, method)(**kwargs)
+            if method in _BATCH_METHODS:
+                result = [json_result for _, json_result in result]
+        if method == "get_stats":
+            with self.__stats_lock:
+                result["daemon"] = dict(self.__stats)
+        if method in _TABLE_METHODS:
+            return GeoSpatialServer.encode_tables(result)
+        return {"result": result}, []
+
+    def server_close(self):
+        """Stops listening, and removes the socket file."""
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    @staticmethod
+    def encode_tables(results):
+        """Serializes the tables of a list of (output_table, error_table,
+        return_code) tuples once each, as rows sharing tables share them.
+
+        Returns:
+            The response, whose rows refer to the tables by blob index, and
+            the blobs.
+
+        Raises:
+            ValueError: if a table has a column of a type that cannot be
+                serialized, such as a Geometry column.
+        """
+        # one buffer, grown as the tables need, serializes them all
+        buff = bytearray()
+        blobs = []
+        indexes = {}
+        rows = []
+        for output_table, error_table, return_code in results:
+            row = []
+            for source_table in (output_table, error_table):
+                if source_table is None:
+                    row.append(None)
+                    continue
+                if id(source_table) not in indexes:
+                    size = _get_serialized_size(source_table)
+                    if size > len(buff):
+                        buff = bytearray(max(size, 2 * len(buff)))
+                    _, length = source_table.serialize(buff)
+                    indexes[id(source_table)] = len(blobs)
+                    blobs.append(str(buffer(buff, 0, length)))
+                row.append(indexes[id(source_table)])
+            rows.append(row + [return_code])
+        return {"tables": rows}, blobs
+
+
+class GeoSpatialClient:
+    """GeoSpatial's interface to a GeoSpatial served by geodaemon.py.
+
+    Each thread has its own connection, opened on its first call. If the
+    daemon cannot be reached, the JSON-returning methods return server
+    errors and the others raise DaemonUnavailableError; the next call
+    connects again. A client can stand in for a GeoSpatial wherever only
+    these methods are used, as by pipeline.GeocodePipeline.
+    """
+    def __init__(self, socket_path, timeout=None, shm_dir=None):
+        """Initializes a client. No connection is made until the first call.
+
+        Args:
+            socket_path (str): The daemon's socket.
+            timeout (float, optional): Seconds to wait for each answer. None
+                waits as long as it takes.
+            shm_dir (str, optional): The directory segments are created in.
+                The default is default_shm_dir().
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.shm_dir = shm_dir or default_shm_dir()
+        self.__local = threading.local()
+        self.__connections = set()
+        self.__connections_lock = threading.Lock()
+        self.__chunk_size = None
+
+    def get_location(self, call_id, address, profile=None, datasets=None):
+        """As GeoSpatial.get_location()."""
+        return self.__json_call(
+            "get_location", call_id=call_id, address=address,
+            profile=profile, datasets=datasets)
+
+    def get_locations(self, locations, profile=None, datasets=None):
+        """As GeoSpatial.get_locations()."""
+        return self.__batch_call(
+            "get_locations", "locations", locations, profile=profile,
+            datasets=datasets)
+
+    def geocode_tables(self, locations, profile=None, datasets=None):
+        """As GeoSpatial.geocode_tables()."""
+        return self.__request("geocode_tables", {
+            "locations": list(locations), "profile": profile,
+            "datasets": datasets})
+
+    def reverse_geocode(
+            self, call_id, lat, lon, profile=None, datasets=None):
+        """As GeoSpatial.reverse_geocode()."""
+        return self.__json_call(
+            "reverse_geocode", call_id=call_id, lat=lat, lon=lon,
+            profile=profile, datasets=datasets)
+
+    def reverse_geocode_batch(self, points, profile=None, datasets=None):
+        """As GeoSpatial.reverse_geocode_batch()."""
+        return self.__batch_call(
+            "reverse_geocode_batch", "points", points, profile=profile,
+            datasets=datasets)
+
+    def reverse_geocode_tables(self, points, profile=None, datasets=None):
+        """As GeoSpatial.reverse_geocode_tables()."""
+        return self.__request("reverse_geocode_tables", {
+            "points": list(points), "profile": profile,
+            "datasets": datasets})
+
+    def query_layer(
+            self, call_id, layer_name, lat, lon, output_fields=None,
+            where_clause=None, search_dist_meters=0, max_results=1):
+        """As GeoSpatial.query_layer()."""
+        return self.__json_call(
+            "query_layer", call_id=call_id, layer_name=layer_name, lat=lat,
+            lon=lon, output_fields=output_fields, where_clause=where_clause,
+            search_dist_meters=search_dist_meters, max_results=max_results)
+
+    def query_layer_batch(
+            self, layer_name, points, output_fields=None, where_clause=None,
+            search_dist_meters=0, max_results=1):
+        """As GeoSpatial.query_layer_batch()."""
+        return self.__batch_call(
+            "query_layer_batch", "points", points, layer_name=layer_name,
+            output_fields=output_fields, where_clause=where_clause,
+            search_dist_meters=search_dist_meters, max_results=max_results)
+
+    def query_layer_tables(
+            self, layer_name, points, output_fields=None, where_clause=None,
+            search_dist_meters=0, max_results=1):
+        """As GeoSpatial.query_layer_tables()."""
+        return self.__request("query_layer_tables", {
+            "layer_name": layer_name, "points": list(points),
+            "output_fields": output_fields, "where_clause": where_clause,
+            "search_dist_meters": search_dist_meters,
+            "max_results": max_results})
+
+    def find_parent(self, call_id, place_type, place_id):
+        """As GeoSpatial.find_parent()."""
+        return self.__json_call(
+            "find_parent", call_id=call_id, place_type=place_type,
+            place_id=place_id)
+
+    def find_children(self, call_id, place_type, place_id):
+        """As GeoSpatial.find_children()."""
+        return self.__json_call(
+            "find_children", call_id=call_id, place_type=place_type,
+            place_id=place_id)
+
+    def find_ancestors(self, call_id, place_type, place_id):
+        """As GeoSpatial.find_ancestors()."""
+        return self.__json_call(
+            "find_ancestors", call_id=call_id, place_type=place_type,
+            place_id=place_id)
+
+    def create_batch_json_results(
+            self, get_results, nrows, max_results=-1, operation=None):
+        """As GeoSpatial.create_batch_json_results(). The daemon admits the
+        calls get_results makes through this client as the operation."""
+        outer = getattr(self.__local, "operation", None)
+        self.__local.operation = operation
+        try:
+            results = get_results()
+        except ValueError as e:
+            return [geospatial.GeoSpatial.create_server_error_json_result(
+                str(e), geospatial._StatusCode.INVALID_REQUEST)] * nrows
+        except geospatial.OverloadedError as e:
+            return [geospatial.GeoSpatial.create_server_error_json_result(
+                str(e), geospatial._StatusCode.OVERLOADED)] * nrows
+        except RuntimeError as e:
+            return [geospatial.GeoSpatial.create_server_error_json_result(
+                str(e))] * nrows
+        finally:
+            self.__local.operation = outer
+        return [
+            self.create_json_result_with_status(
+                output_table, error_table, return_code, max_results)
+            for output_table, error_table, return_code in results]
+
+    # the conversions are GeoSpatial's own, which use no instance state
+    create_json_result_with_status = geospatial.GeoSpatial.__dict__[
+        "create_json_result_with_status"]
+    get_error_status_from_code = geospatial.GeoSpatial.__dict__[
+        "get_error_status_from_code"]
+
+    def get_config(self):
+        """As GeoSpatial.get_config()."""
+        return self.__request("get_config", {})
+
+    def get_stats(self):
+        """As GeoSpatial.get_stats(), with the daemon's counters under
+        "daemon"."""
+        return self.__request("get_stats", {})
+
+    def reload_data_catalog(self):
+        """As GeoSpatial.reload_data_catalog(), in the daemon."""
+        return self.__request("reload_data_catalog", {})
+
+    @contextlib.contextmanager
+    def deadline(self, deadline_ms):
+        """As GeoSpatial.deadline(), for the calling thread's calls through
+        this client."""
+        outer = getattr(self.__local, "deadline", None)
+        deadline = time.time() + deadline_ms / 1000.0
+        self.__local.deadline = (
+            deadline if outer is None else min(outer, deadline))
+        try:
+            yield
+        finally:
+            self.__local.deadline = outer
+
+    @contextlib.contextmanager
+    def priority(self, priority_class):
+        """As GeoSpatial.priority(), for the calling thread's calls through
+        this client. An unknown priority class fails the calls."""
+        outer = getattr(self.__local, "priority", None)
+        self.__local.priority = priority_class
+        try:
+            yield
+        finally:
+            self.__local.priority = outer
+
+    def close(self):
+        """Closes every thread's connection. The daemon keeps running."""
+        with self.__connections_lock:
+            connections = list(self.__connections)
+            self.__connections.clear()
+        for sock, stream in connections:
+            stream.close()
+            sock.close()
+
+    def __json_call(self, method, **kwargs):
+        """Makes a call returning a JSON string, returning a server error if
+        the daemon is unavailable."""
+        try:
+            return str(self.__request(method, kwargs))
+        except DaemonUnavailableError as e:
+            return geospatial.GeoSpatial.create_server_error_json_result(
+                str(e))[1]
+
+    def __batch_call(self, method, rows_argument, rows, **kwargs):
+        """Makes a batch call per chunk of rows, yielding (call_id, JSON)
+        tuples, with server errors for the chunks the daemon did not
+        answer."""
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.__get_chunk_size()))
+            if not chunk:
+                return
+            kwargs[rows_argument] = chunk
+            try:
+                json_results = self.__request(method, kwargs)
+            except DaemonUnavailableError as e:
+                json_results = [
+                    geospatial.GeoSpatial.create_server_error_json_result(
+                        str(e))[1]] * len(chunk)
+            for row, json_result in zip(chunk, json_results):
+                yield row[0], str(json_result)
+
+    def __get_chunk_size(self):
+        """Returns the daemon's BATCH_CHUNK_SIZE, the rows sent per batch
+        request."""
+        if self.__chunk_size is None:
+            try:
+                self.__chunk_size = max(
+                    1, self.get_config()["BATCH_CHUNK_SIZE"])
+            except DaemonUnavailableError:
+                return geospatial.DEFAULT_CONFIG["BATCH_CHUNK_SIZE"]
+        return self.__chunk_size
+
+    def __request(self, method, kwargs):
+        """Sends a request on the calling thread's connection and returns
+        the result, with its tables deserialized.
+
+        Raises:
+            DaemonUnavailableError: if the daemon cannot be reached or did
+                not answer.
+            Whatever the method raised in the daemon, as ValueError,
+            OverloadedError, DeadlineExceeded or RuntimeError.
+        """
+        request = {"method": method, "kwargs": kwargs}
+        deadline = getattr(self.__local, "deadline", None)
+        if deadline is not None:
+            request["deadline_ms"] = (deadline - time.time()) * 1000
+        for name in ("priority", "operation"):
+            value = getattr(self.__local, name, None)
+            if value is not None:
+                request[name] = value
+        try:
+            sock, stream = self.__get_connection()
+            _send(sock, request, [], self.shm_dir)
+            response, segment, blobs = _receive(stream, self.shm_dir)
+        except OSError as e:
+            # the answer was read, but its segment could not be
+            raise DaemonUnavailableError(
+                "Geocoder daemon answer unreadable: {e}".format(e=e))
+        except (EOFError, IOError, ValueError) as e:
+            # the connection is out of step, or gone
+            self.__disconnect()
+            raise DaemonUnavailableError(
+                "Geocoder daemon unavailable: {e}".format(e=e))
+        try:
+            if "error" in response:
+                raise _ERRORS.get(response["error_type"], RuntimeError)(
+                    response["error"])
+            if "tables" in response:
+                tables = []
+                for offset, _ in blobs:
+                    result_table = table.Table()
+                    result_table.deserialize(segment, offset)
+                    tables.append(result_table)
+                return [
+                    (None if output_index is None else tables[output_index],
+                        None if error_index is None else tables[error_index],
+                        return_code)
+                    for output_index, error_index, return_code
+                    in response["tables"]]
+            return response["result"]
+        finally:
+            if segment is not None:
+                segment.close()
+
+    def __get_connection(self):
+        """Returns the calling thread's (socket, file) connection, opening
+        it if need be."""
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except Exception:
+                sock.close()
+                raise
+            connection = (sock, sock.makefile("rb"))
+            self.__local.connection = connection
+            with self.__connections_lock:
+                self.__connections.add(connection)
+        return connection
+
+    def __disconnect(self):
+        """Closes the calling thread's connection, if it has one."""
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            return
+        self.__local.connection = None
+        with self.__connections_lock:
+            self.__connections.discard(connection)
+        sock, stream = connection
+        stream.close()
+        sock.close()
+
+
+def serve(options):
+    """Serves a GeoSpatial until interrupted or terminated."""
+    config = {}
+    if options.config:
+        config = geospatial.load_config(options.config)
+    shm_dir = options.shm_dir or default_shm_dir()
+    _remove_stale_segments(shm_dir)
+    geo_spatial = geospatial.GeoSpatial(
+        options.data_catalog, options.shapefile_root, config)
+    try:
+        server = GeoSpatialServer(options.socket, geo_spatial, shm_dir)
+        try:
+            # SIGTERM, as sent by the supervisor, shuts down cleanly
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            logging.info("Serving on {s}".format(s=options.socket))
+            server.serve_forever()
+        finally:
+            server.server_close()
+    finally:
+        geo_spatial.close()
+
+
+def supervise(argv, restart_seconds):
+    """Runs the daemon in a child process, starting a new one whenever it
+    dies, until it exits cleanly or the supervisor is interrupted or
+    terminated."""
+    command = [sys.executable, os.path.abspath(__file__)] + argv + ["--child"]
+    while True:
+        child = subprocess.Popen(command)
+        try:
+            return_code = child.wait()
+        except (KeyboardInterrupt, SystemExit):
+            child.terminate()
+            child.wait()
+            return 0
+        if return_code == 0:
+            return 0
+        logging.error(
+            "Geocoder daemon exited with {c}; restarting in {s}s".format(
+                c=return_code, s=restart_seconds))
+        time.sleep(restart_seconds)
+
+
+def parse_args(argv):
+    """Parses the command line."""
+    parser = argparse.ArgumentParser(
+        description="Serve a GeoSpatial to other processes over a Unix "
+                    "domain socket.")
+    parser.add_argument("--socket", default="/tmp/geospatial.sock",
+        help="socket path (default: %(default)s)")
+    parser.add_argument("--config",
+        help="GeoSpatial configuration file, such as autotune.py writes")
+    parser.add_argument("--shm-dir",
+        help="directory of shared memory segments (default: /dev/shm, or "
+             "the temporary directory)")
+    parser.add_argument("--restart-seconds", type=float, default=1.0,
+        help="seconds before a crashed daemon is restarted "
+             "(default: %(default)s)")
+    parser.add_argument("--no-restart", action="store_true",
+        help="serve in this process, without restarting after a crash")
+    parser.add_argument("--child", action="store_true",
+        help=argparse.SUPPRESS)
+    parser.add_argument("--data-catalog", default=r"f:\websites\datacatalog.xml",
+        help="data catalog path")
+    parser.add_argument("--shapefile-root", default=r"f:\pxse-data",
+        help="shapefile root directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    options = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if options.no_restart or options.child:
+        try:
+            serve(options)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    return supervise(argv, options.restart_seconds)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the GeoSpatial daemon, its client and their shared memory
+segments."""
+
+import errno
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+import fakepxpointsc
+fakepxpointsc.install()
+
+import geodaemon
+import geospatial
+import table
+import variant
+
+
+class SegmentTest(unittest.TestCase):
+    def setUp(self):
+        self.shm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.shm_dir)
+
+    def test_round_trip(self):
+        path, refs = geodaemon._write_segment(self.shm_dir, ["abc", "de"])
+        segment = geodaemon._open_segment(
+            self.shm_dir, os.path.basename(path))
+        self.addCleanup(segment.close)
+        self.assertEqual([[0, 3], [3, 2]], refs)
+        self.assertEqual("abcde", segment[:])
+        # the receiver removes the file
+        self.assertFalse(os.path.exists(path))
+
+    def test_names_outside_the_directory(self):
+        path, _ = geodaemon._write_segment(self.shm_dir, ["abc"])
+        name = os.path.basename(path)
+        for bad_name in (path, os.path.join("..", name), "other-" + name):
+            self.assertRaises(
+                OSError, geodaemon._open_segment, self.shm_dir, bad_name)
+        self.assertTrue(os.path.exists(path))
+
+    def test_symlinks_and_directories(self):
+        target = os.path.join(self.shm_dir, "target")
+        with open(target, "wb") as target_file:
+            target_file.write("secret")
+        link_name = geodaemon.SEGMENT_PREFIX + "link"
+        os.symlink(target, os.path.join(self.shm_dir, link_name))
+        dir_name = geodaemon.SEGMENT_PREFIX + "dir"
+        os.mkdir(os.path.join(self.shm_dir, dir_name))
+        for name in (link_name, dir_name, geodaemon.SEGMENT_PREFIX + "none"):
+            self.assertRaises(
+                OSError, geodaemon._open_segment, self.shm_dir, name)
+        # nothing was followed or removed
+        self.assertTrue(os.path.exists(target))
+        self.assertTrue(
+            os.path.islink(os.path.join(self.shm_dir, link_name)))
+
+
+class EncodeTablesTest(unittest.TestCase):
+    @staticmethod
+    def decode(response, blobs):
+        tables = []
+        for blob in blobs:
+            decoded = table.Table()
+            decoded.deserialize(blob, 0)
+            tables.append(decoded)
+        return [
+            (None if output_index is None else tables[output_index],
+             None if error_index is None else tables[error_index],
+             return_code)
+            for output_index, error_index, return_code in response["tables"]]
+
+    def test_large_tables(self):
+        small = table.Table()
+        small.append_col("INPUT.Id")
+        small.append_row(("1", ))
+        large = table.Table()
+        large.append_col("INPUT.Id")
+        large.append_col("$Count", variant.VarType.Int32)
+        for i in range(50000):
+            large.append_row((u"\u00e9" * 50 + str(i), i))
+        response, blobs = geodaemon.GeoSpatialServer.encode_tables(
+            [(small, None, 0), (large, small, 0), (large, None, 1)])
+        # each table is serialized once
+        self.assertEqual(2, len(blobs))
+        self.assertGreater(len(blobs[1]), 4 * 1024 * 1024)
+        decoded = self.decode(response, blobs)
+        self.assertEqual([[u"1"]], decoded[0][0].rows)
+        self.assertEqual(
+            [u"\u00e9" * 50 + "49999", 49999], decoded[1][0].rows[-1])
+        self.assertIs(decoded[1][0], decoded[2][0])
+        self.assertEqual([0, 0, 1], [row[2] for row in decoded])
+
+    def test_geometry_column(self):
+        geometry_table = table.Table()
+        geometry_table.append_col("INPUT.Id")
+        geometry_table.append_col(
+            "[County]$Geometry", variant.VarType.Geometry)
+        geometry_table.append_row(("1", "POINT (0 0)"))
+        with self.assertRaises(ValueError) as context:
+            geodaemon.GeoSpatialServer.encode_tables(
+                [(geometry_table, None, 0)])
+        self.assertIn("[County]$Geometry", str(context.exception))
+        self.assertIn("Geometry", str(context.exception))
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        fakepxpointsc.reset()
+        self.addCleanup(fakepxpointsc.reset)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.shm_dir = os.path.join(self.directory, "shm")
+        os.mkdir(self.shm_dir)
+        geo_spatial = geospatial.GeoSpatial(
+            fakepxpointsc.write_data_catalog(self.directory), self.directory)
+        self.addCleanup(geo_spatial.close)
+        self.socket_path = os.path.join(self.directory, "geospatial.sock")
+        server = geodaemon.GeoSpatialServer(
+            self.socket_path, geo_spatial, self.shm_dir)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.client = geodaemon.GeoSpatialClient(
+            self.socket_path, timeout=5, shm_dir=self.shm_dir)
+        self.addCleanup(self.client.close)
+
+    def test_calls(self):
+        result = json.loads(self.client.get_location("1", "1 Main St"))
+        self.assertEqual("OK", result["status"])
+        points = [(str(i), 40.0, -105.0) for i in range(3)]
+        results = self.client.query_layer_tables("County", points)
+        self.assertEqual(3, len(results))
+        output_table, _, return_code = results[0]
+        self.assertEqual(0, return_code)
+        self.assertEqual(1, output_table.nrows())
+        # the tables came through a segment, which was removed
+        self.assertEqual([], os.listdir(self.shm_dir))
+
+    def test_live_socket_is_kept(self):
+        geo_spatial = geospatial.GeoSpatial(
+            fakepxpointsc.write_data_catalog(self.directory), self.directory)
+        self.addCleanup(geo_spatial.close)
+        with self.assertRaises(socket.error) as context:
+            geodaemon.GeoSpatialServer(
+                self.socket_path, geo_spatial, self.shm_dir)
+        self.assertEqual(errno.EADDRINUSE, context.exception.errno)
+        result = json.loads(self.client.get_location("1", "1 Main St"))
+        self.assertEqual("OK", result["status"])
+
+    def test_stale_socket_is_replaced(self):
+        socket_path = os.path.join(self.directory, "stale.sock")
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(socket_path)
+        stale.close()
+        geo_spatial = geospatial.GeoSpatial(
+            fakepxpointsc.write_data_catalog(self.directory), self.directory)
+        self.addCleanup(geo_spatial.close)
+        server = geodaemon.GeoSpatialServer(
+            socket_path, geo_spatial, self.shm_dir)
+        server.server_close()
+
+    def test_unencodable_tables(self):
+        def geocode_tables(geo_spatial, locations, profile=None,
+                           datasets=None):
+            geometry_table = table.Table()
+            geometry_table.append_col("$Geometry", variant.VarType.Geometry)
+            return [(geometry_table, None, 0)]
+        self.addCleanup(
+            setattr, geospatial.GeoSpatial, "geocode_tables",
+            geospatial.GeoSpatial.__dict__["geocode_tables"])
+        geospatial.GeoSpatial.geocode_tables = geocode_tables
+        with self.assertRaises(ValueError) as context:
+            self.client.geocode_tables([("1", "1 Main St")])
+        self.assertIn("$Geometry", str(context.exception))
+
+    def test_forged_segment(self):
+        target = os.path.join(self.directory, "target")
+        with open(target, "wb") as target_file:
+            target_file.write("{}")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.settimeout(5)
+        sock.connect(self.socket_path)
+        stream = sock.makefile("rb")
+        self.addCleanup(stream.close)
+        for name in (target, "../target"):
+            sock.sendall(json.dumps(
+                {"segment": name, "blobs": [], "body": [0, 2]}) + "\n")
+            response, _, _ = geodaemon._receive(stream, self.shm_dir)
+            self.assertEqual("OSError", response["error_type"])
+        # the connection is still in step, and the file was left alone
+        geodaemon._send(
+            sock, {"method": "get_config"}, [], self.shm_dir)
+        response, _, _ = geodaemon._receive(stream, self.shm_dir)
+        self.assertIn("BATCH_CHUNK_SIZE", response["result"])
+        self.assertTrue(os.path.exists(target))
+
+    def test_unreadable_answer(self):
+        # the daemon's segments are written where the client does not look
+        client = geodaemon.GeoSpatialClient(
+            self.socket_path, timeout=5, shm_dir=self.directory)
+        self.addCleanup(client.close)
+        self.assertRaises(
+            geodaemon.DaemonUnavailableError, client.query_layer_tables,
+            "County", [("1", 40.0, -105.0)])
+        result = json.loads(client.get_location("1", "1 Main St"))
+        self.assertEqual("OK", result["status"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Minimal planar geometry support for layer geometries.
+
+PxPointSC returns feature geometries as well-known binary (WKB) or well-known
+text (WKT). This module parses points and (multi)polygons from either form and
+answers the few planar predicates the caching and local query code needs.
+
+Polygons are represented as lists of rings, the first ring being the shell and
+any others holes; a ring is a list of (x, y) tuples. Multipolygons are lists of
+polygons. Coordinates are x = longitude, y = latitude.
+"""
+
+import re
+import struct
+
+# WKB geometry type codes (see http://en.wikipedia.org/wiki/Well-known_binary)
+WKB_POINT = 1
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTIPOLYGON = 6
+
+# EWKB flags that may be OR-ed into the geometry type
+_EWKB_Z = 0x80000000
+_EWKB_M = 0x40000000
+_EWKB_SRID = 0x20000000
+
+_WKT_TOKEN_RE = re.compile(r"\(|\)|,|[-+0-9.eE]+|[A-Za-z]+")
+
+
+def _read_wkb(data, offset):
+    """Reads one WKB geometry from data[offset], returning the geometry type,
+    its coordinates and the new offset."""
+    (byte_order, ) = struct.unpack_from("B", data, offset)
+    offset += 1
+    endian = "<" if byte_order == 1 else ">"
+    (geom_type, ) = struct.unpack_from(endian + "I", data, offset)
+    offset += 4
+    if geom_type & _EWKB_SRID:
+        offset += 4
+    ndims = 2
+    if geom_type & _EWKB_Z:
+        ndims += 1
+    if geom_type & _EWKB_M:
+        ndims += 1
+    geom_type &= 0xffff
+    # ISO WKB encodes Z, M and ZM as +1000, +2000 and +3000
+    ndims += (geom_type // 1000 + 1) // 2 if geom_type >= 1000 else 0
+    geom_type %= 1000
+    point_fmt = endian + "d" * ndims
+    point_size = 8 * ndims
+
+    def read_points(offset):
+        (npoints, ) = struct.unpack_from(endian + "I", data, offset)
+        offset += 4
+        points = []
+        for _ in range(npoints):
+            coords = struct.unpack_from(point_fmt, data, offset)
+            offset += point_size
+            points.append((coords[0], coords[1]))
+        return points, offset
+
+    if geom_type == WKB_POINT:
+        coords = struct.unpack_from(point_fmt, data, offset)
+        return geom_type, (coords[0], coords[1]), offset + point_size
+    if geom_type == WKB_POLYGON:
+        (nrings, ) = struct.unpack_from(endian + "I", data, offset)
+        offset += 4
+        rings = []
+        for _ in range(nrings):
+            ring, offset = read_points(offset)
+            rings.append(ring)
+        return geom_type, rings, offset
+    if geom_type in (WKB_MULTIPOINT, WKB_MULTIPOLYGON):
+        (nparts, ) = struct.unpack_from(endian + "I", data, offset)
+        offset += 4
+        parts = []
+        for _ in range(nparts):
+            _, part, offset = _read_wkb(data, offset)
+            parts.append(part)
+        return geom_type, parts, offset
+    raise NotImplementedError("WKB geometry type {t}".format(t=geom_type))
+
+
+def _parse_wkt(text):
+    """Parses WKT into its geometry type name and nested coordinate lists."""
+    tokens = _WKT_TOKEN_RE.findall(text)
+    if not tokens:
+        raise ValueError("Empty WKT")
+    geom_name = tokens[0].upper()
+    position = [1]
+    # skip Z/M/ZM dimension qualifiers
+    while (position[0] < len(tokens) and
+            tokens[position[0]].upper() in ("Z", "M", "ZM")):
+        position[0] += 1
+
+    def parse_list():
+        # a list is either "( x y, x y ... )" or "( list, list ... )"
+        if tokens[position[0]] != "(":
+            raise ValueError("Invalid WKT: {t}".format(t=text))
+        position[0] += 1
+        items = []
+        while True:
+            if tokens[position[0]] == "(":
+                items.append(parse_list())
+            else:
+                coords = []
+                while tokens[position[0]] not in (",", ")"):
+                    coords.append(float(tokens[position[0]]))
+                    position[0] += 1
+                items.append((coords[0], coords[1]))
+            if tokens[position[0]] == ",":
+                position[0] += 1
+                continue
+            position[0] += 1
+            return items
+
+    return geom_name, parse_list()
+
+
+def parse_polygons(value):
+    """Parses a polygonal geometry from WKB bytes or WKT text.
+
+    Args:
+        value (str): A WKB byte string, or a WKT string.
+
+    Returns:
+        A list of polygons (a multipolygon), or None if the value is not a
+        polygon or multipolygon.
+    """
+    if value is None:
+        return None
+    if isinstance(value, unicode) or value[:1].isalpha():
+        geom_name, coords = _parse_wkt(value)
+        if geom_name == "POLYGON":
+            return [coords]
+        if geom_name == "MULTIPOLYGON":
+            return coords
+        return None
+    geom_type, coords, _ = _read_wkb(value, 0)
+    if geom_type == WKB_POLYGON:
+        return [coords]
+    if geom_type == WKB_MULTIPOLYGON:
+        return coords
+    return None
+
+
+def parse_point(value):
+    """Parses a point from WKB bytes or WKT text.
+
+    Args:
+        value (str): A WKB byte string, or a WKT string.
+
+    Returns:
+        An (x, y) tuple, or None if the value is not a point.
+    """
+    if value is None:
+        return None
+    if isinstance(value, unicode) or value[:1].isalpha():
+        geom_name, coords = _parse_wkt(value)
+        return coords[0] if geom_name == "POINT" else None
+    geom_type, coords, _ = _read_wkb(value, 0)
+    return coords if geom_type == WKB_POINT else None
+
+
+def bounding_box(polygons):
+    """Returns the (min_x, min_y, max_x, max_y) extent of a multipolygon."""
+    xs = [x for polygon in polygons for x, _ in polygon[0]]
+    ys = [y for polygon in polygons for _, y in polygon[0]]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def point_in_ring(x, y, ring):
+    """Returns True if (x, y) is inside ring, by the even-odd rule."""
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y1 > y) != (y2 > y):
+            if x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def point_in_flat_rings(x, y, rings):
+    """Returns True if (x, y) is inside a set of rings, by the even-odd rule
+    over all of them.
+
+    This is how shapefile polygons are interpreted: the rings of a shape are
+    not grouped into polygons, and holes are simply rings inside shells. Each
+    ring is a flat sequence of interleaved x and y values.
+    """
+    inside = False
+    for ring in rings:
+        x1 = ring[-2]
+        y1 = ring[-1]
+        for i in range(0, len(ring), 2):
+            x2 = ring[i]
+            y2 = ring[i + 1]
+            if (y1 > y) != (y2 > y):
+                if x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                    inside = not inside
+            x1 = x2
+            y1 = y2
+    return inside
+
+
+def point_in_polygons(x, y, polygons):
+    """Returns True if (x, y) is inside a multipolygon, honoring holes."""
+    for polygon in polygons:
+        if point_in_ring(x, y, polygon[0]):
+            for hole in polygon[1:]:
+                if point_in_ring(x, y, hole):
+                    break
+            else:
+                return True
+    return False
+
+
+def _segment_meets_box(x1, y1, x2, y2, min_x, min_y, max_x, max_y):
+    """Returns True if a segment touches the closed box (Liang-Barsky)."""
+    if ((x1 < min_x and x2 < min_x) or (x1 > max_x and x2 > max_x) or
+            (y1 < min_y and y2 < min_y) or (y1 > max_y and y2 > max_y)):
+        return False
+    t0, t1 = 0.0, 1.0
+    dx = x2 - x1
+    dy = y2 - y1
+    for p, q in ((-dx, x1 - min_x), (dx, max_x - x1),
+                 (-dy, y1 - min_y), (dy, max_y - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = float(q) / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+def polygons_contain_box(polygons, min_x, min_y, max_x, max_y):
+    """Returns True if a multipolygon fully contains a box.
+
+    The box is contained when its corners are inside the multipolygon and no
+    ring boundary touches it. A box that merely touches a boundary is not
+    considered contained.
+    """
+    for x, y in ((min_x, min_y), (min_x, max_y), (max_x, min_y),
+                 (max_x, max_y)):
+        if not point_in_polygons(x, y, polygons):
+            return False
+    for polygon in polygons:
+        for ring in polygon:
+            x1, y1 = ring[-1]
+            for x2, y2 in ring:
+                if _segment_meets_box(
+                        x1, y1, x2, y2, min_x, min_y, max_x, max_y):
+                    return False
+                x1, y1 = x2, y2
+    return True
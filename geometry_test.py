@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the planar geometry support."""
+
+import struct
+import unittest
+
+import geometry
+
+SQUARE_WITH_HOLE = (
+    "POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0), (4 4, 6 4, 6 6, 4 6, 4 4))")
+
+
+def wkb_polygon(rings, byte_order=1):
+    """Returns the WKB of a polygon."""
+    endian = "<" if byte_order == 1 else ">"
+    data = struct.pack("B", byte_order) + struct.pack(
+        endian + "II", geometry.WKB_POLYGON, len(rings))
+    for ring in rings:
+        data += struct.pack(endian + "I", len(ring))
+        for x, y in ring:
+            data += struct.pack(endian + "dd", x, y)
+    return data
+
+
+class ParseTest(unittest.TestCase):
+    def test_wkt_polygon_with_hole(self):
+        polygons = geometry.parse_polygons(SQUARE_WITH_HOLE)
+        self.assertEqual(1, len(polygons))
+        self.assertEqual(2, len(polygons[0]))
+        self.assertEqual((10.0, 0.0), polygons[0][0][1])
+
+    def test_wkt_multipolygon(self):
+        polygons = geometry.parse_polygons(
+            "MULTIPOLYGON (((0 0, 1 0, 1 1, 0 0)), ((5 5, 6 5, 6 6, 5 5)))")
+        self.assertEqual(2, len(polygons))
+
+    def test_wkb_polygon_either_byte_order(self):
+        ring = [(0, 0), (2, 0), (2, 2), (0, 2), (0, 0)]
+        for byte_order in (0, 1):
+            self.assertEqual(
+                [[[(float(x), float(y)) for x, y in ring]]],
+                geometry.parse_polygons(wkb_polygon([ring], byte_order)))
+
+    def test_points(self):
+        self.assertEqual((1.5, -2.0), geometry.parse_point("POINT (1.5 -2)"))
+        self.assertEqual(
+            (1.5, -2.0),
+            geometry.parse_point(struct.pack("<BIdd", 1, 1, 1.5, -2.0)))
+        self.assertEqual(None, geometry.parse_point(SQUARE_WITH_HOLE))
+        self.assertEqual(None, geometry.parse_polygons("POINT (1 2)"))
+
+
+class PredicateTest(unittest.TestCase):
+    def setUp(self):
+        self.polygons = geometry.parse_polygons(SQUARE_WITH_HOLE)
+
+    def test_point_in_polygons_honors_holes(self):
+        self.assertTrue(geometry.point_in_polygons(1, 1, self.polygons))
+        self.assertFalse(geometry.point_in_polygons(5, 5, self.polygons))
+        self.assertFalse(geometry.point_in_polygons(11, 5, self.polygons))
+
+    def test_point_in_flat_rings_matches_polygons(self):
+        rings = [
+            [value for point in ring for value in point]
+            for ring in self.polygons[0]]
+        for x, y in ((1, 1), (5, 5), (11, 5), (4.5, 9.5)):
+            self.assertEqual(
+                geometry.point_in_polygons(x, y, self.polygons),
+                geometry.point_in_flat_rings(x, y, rings))
+
+    def test_box_containment(self):
+        self.assertTrue(
+            geometry.polygons_contain_box(self.polygons, 1, 1, 2, 2))
+        # holds the hole
+        self.assertFalse(
+            geometry.polygons_contain_box(self.polygons, 1, 1, 9, 9))
+        # crosses the shell
+        self.assertFalse(
+            geometry.polygons_contain_box(self.polygons, 9, 9, 11, 11))
+        # touches the shell
+        self.assertFalse(
+            geometry.polygons_contain_box(self.polygons, 0, 1, 1, 2))
+
+    def test_bounding_box(self):
+        self.assertEqual(
+            (0.0, 0.0, 10.0, 10.0), geometry.bounding_box(self.polygons))
+
+
+if __name__ == "__main__":
+    unittest.main()
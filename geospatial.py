@@ -5,10 +5,11 @@
 
 """CoreLogic GeoSpatial API module.
 
-Two classes are exposed by this module:
+Three classes are exposed by this module:
 
     GeoSpatial
     StatusCode
+    OverloadedError
 
 GeoSpatial is a thin client to the PxPointSC wrapper (pxpointsc.py).
 
@@ -16,7 +17,16 @@ GeoSpatial is a thin client to the PxPointSC wrapper (pxpointsc.py).
 # for logging information about calls
 import logging
 import socket
+import collections
+import contextlib
 import datetime
+import hashlib
+import itertools
+import os
+import random
+import sys
+import threading
+import time
 # geocoder and spatial analyzer
 import pxpointsc
 # supporting libs for pxpointsc
@@ -25,6 +35,221 @@ import table
 # supporting lib for spatialapi
 import json
 import datacatalog
+# result caching
+import addressnorm
+import cache
+import gridcache
+import resultstore
+# local layer queries
+import locallayer
+# place hierarchy
+import placehierarchy
+# call logging
+import calllog
+import slowcalls
+# handle pools and hedged calls
+import hedging
+import scheduler
+
+# Geocoder output columns, after INPUT.Id, of the built-in output profiles
+GEOCODING_OUTPUT_PROFILES = {
+    "coords": ["$Latitude", "$Longitude", "$MatchCode"],
+    "standard": [
+        "$AddressLine",
+        "$CityLine",
+        "$Latitude",
+        "$Longitude",
+        "$MatchCode",
+        "$MatchDescription",
+        "$Postcode",
+        "$State"
+    ],
+    "full": [
+        "$AddressLine",
+        "$City",
+        "$CityLine",
+        "$County",
+        "$Dataset",
+        "$ExtraFound",
+        "$IsIntersection",
+        "$Latitude",
+        "$Longitude",
+        "$MatchCode",
+        "$MatchDescription",
+        "$Number",
+        "$Postcode",
+        "$State",
+        "$StreetAddress",
+        "$StreetName",
+        "$StreetSide",
+        "$UnitNumber"
+    ]
+}
+
+# Default configuration. Keys mirror those of spatialapi.conf; any subset may be
+# overridden through the config argument to GeoSpatial.
+DEFAULT_CONFIG = {
+    # Maximum number of geocode results cached in memory, keyed by canonical
+    # address (see addressnorm.py). Zero disables the cache.
+    "GEOCODE_CACHE_SIZE": 100000,
+    # Layers whose WITHIN query results are cached per lat/lon grid cell,
+    # mapped to their cell size in decimal degrees (see gridcache.py). Only
+    # layers of non-overlapping polygons, such as State or County, qualify.
+    "GRID_CACHE_LAYERS": {},
+    # Maximum number of grid cells remembered across all grid-cached layers.
+    "GRID_CACHE_SIZE": 100000,
+    # Path of the SQLite database holding results shared by all processes and
+    # kept across restarts (see resultstore.py). None disables the store.
+    "RESULT_STORE_PATH": None,
+    # Maximum total size, in bytes, of the results in the store.
+    "RESULT_STORE_MAX_BYTES": 1024 * 1024 * 1024,
+    # Number of the hottest stored results loaded into the in-memory caches
+    # when an instance is created.
+    "RESULT_STORE_WARM_ENTRIES": 10000,
+    # Layers answered in-process from their shapefiles (see locallayer.py)
+    # instead of by PxPointSC: WITHIN queries on polygon layers, and nearest
+    # queries on point layers.
+    "LOCAL_LAYERS": [],
+    # Fraction of local layer queries that are also sent to PxPointSC, to
+    # verify that both agree. Where they differ, PxPointSC's answer is
+    # returned and the disagreement logged.
+    "LOCAL_CROSS_CHECK_RATE": 0.0,
+    # Maximum number of rows in each input table the batch methods,
+    # get_locations() and query_layer_batch(), send to PxPointSC.
+    "BATCH_CHUNK_SIZE": 1000,
+    # Points of a batch layer query whose coordinates round to the same
+    # multiple of this many decimal degrees are sent to PxPointSC once, as
+    # the first of them, and share its result. Zero merges identical points
+    # only. Addresses of a batch are merged when their canonical forms match.
+    "BATCH_POINT_TOLERANCE_DEGREES": 0.0,
+    # Geocoder output profile of calls that name none.
+    "GEOCODE_OUTPUT_PROFILE": "full",
+    # Custom geocoder output profiles, mapping names to lists of output
+    # columns, in addition to GEOCODING_OUTPUT_PROFILES.
+    "GEOCODE_OUTPUT_PROFILES": {},
+    # Geocoder dataset profiles, mapping names to lists of the data catalog's
+    # geocoding datasets, such as {"parcel": ["Parcel"]}. Calls naming a
+    # dataset profile are geocoded by a geocoder searching only its datasets,
+    # which is faster, and whose memory is only that of its datasets. Each
+    # profile's geocoder is initialized on first use, so only the profiles
+    # in use take memory. GEOCODER_DATASET_PROFILE is the profile of calls
+    # that name none; None searches every dataset.
+    "GEOCODER_DATASET_PROFILES": {},
+    "GEOCODER_DATASET_PROFILE": None,
+    # Maximum number of successful reverse geocode results remembered in
+    # memory, keyed by coordinates rounded to REVERSE_GEOCODE_PRECISION
+    # decimal places (5 places is about a meter). Points of a batch that
+    # round alike are also reverse geocoded once. Zero disables the memo.
+    "REVERSE_GEOCODE_CACHE_SIZE": 100000,
+    "REVERSE_GEOCODE_PRECISION": 5,
+    # (place_type, place_id) places, such as ("State", "CO"), whose
+    # descendants are loaded into the place hierarchy when the instance is
+    # created. Other places are loaded on first use.
+    "PLACE_HIERARCHY_PRELOAD": [],
+    # FindNearest queries sent to PxPointSC with max_results > 0 first search
+    # a small radius, multiplying it by ADAPTIVE_NEAREST_GROWTH for the
+    # points short of max_results features, up to the caller's search
+    # distance. The first radius is a layer's typical radius: the
+    # ADAPTIVE_NEAREST_PERCENTILE of the radii its last
+    # ADAPTIVE_NEAREST_HISTORY points were answered at, but no less than
+    # ADAPTIVE_NEAREST_MIN_METERS. Results are the same as for a single
+    # search at the caller's distance. Zero disables adaptive searches.
+    "ADAPTIVE_NEAREST_MIN_METERS": 0,
+    "ADAPTIVE_NEAREST_GROWTH": 4.0,
+    "ADAPTIVE_NEAREST_HISTORY": 1000,
+    "ADAPTIVE_NEAREST_PERCENTILE": 75,
+    # Fraction, from 0 to 1, of the calls of each operation (get_location,
+    # query_layer_batch and so on) logged as key=value records to the
+    # calllog.LOGGER_NAME logger at INFO level, by operation name; and of
+    # the calls of operations not named. Batch operations log one record
+    # per chunk. calllog.configure() writes the records on a background
+    # thread.
+    "CALL_LOG_SAMPLE_RATES": {},
+    "CALL_LOG_SAMPLE_RATE": 1.0,
+    # Directory PxPointSC calls slower than SLOW_CALL_THRESHOLD_MS are
+    # captured to, for replaycalls.py; None disables capture. Only the
+    # newest SLOW_CALL_MAX_CAPTURES captures are kept. Capture observes
+    # every pxpointsc call in the process, not just this instance's, until
+    # the instance is closed.
+    "SLOW_CALL_CAPTURE_DIR": None,
+    "SLOW_CALL_THRESHOLD_MS": 1000,
+    "SLOW_CALL_MAX_CAPTURES": 100,
+    # Sharded layers, mapping names not in the data catalog to lists of
+    # [layer_name, [min_lat, min_lon, max_lat, max_lon]] shards, such as
+    # {"Parcel": [["ParcelCO", [36.9, -109.1, 41.1, -102.0]], ...]}. Each
+    # shard layer is attached to a spatial processor of its own. The points
+    # of a query on a sharded layer are routed to the first shard whose
+    # bounding box holds them, the shards are queried in parallel, and their
+    # results are returned, in input order, as the sharded layer's. Points
+    # in no shard have no results. FindNearest queries only search the
+    # point's shard, so bounding boxes should overlap by the search distance.
+    "LAYER_SHARDS": {},
+    # Number of geocoders opened for each dataset profile, and of spatial
+    # processors for each shard (and for the other layers). Each handle runs
+    # one call at a time, and calls wait for an idle one; more than one lets
+    # slow calls be hedged.
+    "HANDLE_POOL_SIZE": 1,
+    # PxPointSC calls still running after the HEDGE_PERCENTILE of the
+    # latencies of the last LATENCY_HISTORY calls of their kind (geocodes,
+    # or queries of a layer), but no sooner than HEDGE_MIN_MS, are also
+    # made on an idle handle of the pool, and the first answer is used.
+    # Zero disables hedging.
+    "HEDGE_PERCENTILE": 0,
+    "HEDGE_MIN_MS": 10,
+    "LATENCY_HISTORY": 1000,
+    # Milliseconds each call (or batch chunk) may take, unless deadline()
+    # sets another; calls still waiting on PxPointSC then fail with a server
+    # error, and their native calls finish in the background. Zero waits as
+    # long as it takes.
+    "CALL_DEADLINE_MS": 0,
+    # Native calls on each pool run at most SCHEDULER_CALLS_PER_HANDLE per
+    # handle at once, hedges included, and those waiting are admitted by
+    # weighted fair queuing across the priority classes of
+    # SCHEDULER_WEIGHTS; a call is only hedged if a slot is free. Calls are
+    # "bulk" from the batch methods or with more than one row, otherwise
+    # "interactive", unless priority() says otherwise. Zero runs calls as
+    # they come. While interactive calls are running or waiting, or have
+    # been in the last CONTENDED_SECONDS, the batch methods send chunks of
+    # at most CONTENDED_CHUNK_SIZE rows (zero leaves them at
+    # BATCH_CHUNK_SIZE), so that interactive calls wait less behind them.
+    "SCHEDULER_CALLS_PER_HANDLE": 0,
+    "SCHEDULER_WEIGHTS": {"interactive": 10, "bulk": 1},
+    "CONTENDED_CHUNK_SIZE": 100,
+    "CONTENDED_SECONDS": 1.0,
+    # Maximum number of calls of each operation (get_location,
+    # query_layer_batch and so on) in progress at once, by operation name,
+    # and of the operations not named; zero is unbounded. Batch operations
+    # count by chunk. Calls beyond it, or made while MAX_QUEUED_CALLS
+    # native calls are waiting for a scheduler (see
+    # SCHEDULER_CALLS_PER_HANDLE) or for a handle, are rejected at once with
+    # the OVERLOADED status, rather than queued.
+    "MAX_IN_FLIGHT": {},
+    "MAX_IN_FLIGHT_DEFAULT": 0,
+    "MAX_QUEUED_CALLS": 0,
+    # Seconds between checks of the data catalog file for changes; zero
+    # disables watching. When it changes, reload_data_catalog() opens new
+    # handles in the background and switches to them.
+    "DATA_CATALOG_WATCH_SECONDS": 0
+}
+
+def load_config(path):
+    """Loads configuration from a file in the format of spatialapi.conf: a
+    Python file assigning KEY = value.
+
+    Args:
+        path (str): The configuration file, such as one written by
+            autotune.py.
+
+    Returns:
+        A dictionary of the file's DEFAULT_CONFIG keys, for the config
+        argument to GeoSpatial. Other keys, such as spatialapi.conf's
+        DATACATALOG_PATH, are left out.
+    """
+    values = {}
+    execfile(path, values)
+    return dict(
+        (key, value) for key, value in values.items() 
+        if key in DEFAULT_CONFIG)
 
 # Standard status codes
 class _StatusCode:
@@ -32,6 +257,101 @@ class _StatusCode:
     NO_RESULTS = "NO_RESULTS"
     INVALID_REQUEST = "INVALID_REQUEST"
     SERVER_ERROR = "SERVER_ERROR"
+    OVERLOADED = "OVERLOADED"
+
+class OverloadedError(RuntimeError):
+    """Raised when a call is rejected because too much work is in progress.
+    """
+    pass
+
+class _Counters:
+    """Named counters that many threads add to at once."""
+    def __init__(self, *names):
+        self.__counts = dict((name, 0) for name in names)
+        self.__lock = threading.Lock()
+
+    def add(self, name, count=1):
+        with self.__lock:
+            self.__counts[name] += count
+
+    def snapshot(self):
+        """Returns a dictionary of the current counts."""
+        with self.__lock:
+            return dict(self.__counts)
+
+class _OutputProfile:
+    """A set of geocoder output columns, with its column definition and cache
+    key prefix prepared once."""
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = tuple(columns)
+        self.col_spec = ";".join(("INPUT.Id", ) + self.columns)
+        # Results for different columns must not share cache entries, even
+        # if a custom profile is redefined under the same name.
+        self.cache_key_prefix = "{d}|".format(
+            d=hashlib.md5(self.col_spec).hexdigest()[:8])
+
+class _CatalogGeneration:
+    """A data catalog, and the PxPointSC handles and layers opened with it.
+
+    Calls pin the generation they use, so that when the data catalog is
+    reloaded, its handles are only closed once those calls have finished.
+    """
+    def __init__(self, data_catalog, number):
+        self.data_catalog = data_catalog
+        self.number = number
+        # pools of geocoders and spatial processors, lazily initialized;
+        # geocoders are keyed by dataset profile name, None searching every
+        # dataset, and spatial processors by shard layer, None holding the
+        # other layers
+        self.geocoder_handles = {}
+        self.geospatial_handles = {}
+        # output field specs of each attached layer, keyed by layer alias
+        self.layer_fields = {}
+        # in-process layer engines, loaded on first use
+        self.local_layers = {}
+        self.geocoder_vintage = None
+        self.layer_vintages = {}
+        # serializes lazy initialization
+        self.lock = threading.RLock()
+        self.__in_flight = 0
+        self.__idle = threading.Condition()
+
+    def pin(self):
+        """Records a call using this generation."""
+        with self.__idle:
+            self.__in_flight += 1
+
+    def unpin(self):
+        """Records the end of a call using this generation."""
+        with self.__idle:
+            self.__in_flight -= 1
+            if self.__in_flight == 0:
+                self.__idle.notify_all()
+
+    def wait_idle(self):
+        """Waits until no call, including native calls left running past a
+        deadline, is using this generation."""
+        with self.__idle:
+            while self.__in_flight > 0:
+                self.__idle.wait()
+        for pool in (self.geocoder_handles.values() + 
+                self.geospatial_handles.values()):
+            pool.wait_idle()
+
+    def close(self):
+        """Closes the handles and local layers of this generation."""
+        for pool in self.geocoder_handles.values():
+            for geocoder_handle in pool.handles:
+                pxpointsc.geocoder_close(geocoder_handle)
+        self.geocoder_handles.clear()
+        for pool in self.geospatial_handles.values():
+            for geospatial_handle in pool.handles:
+                pxpointsc.geospatial_close(geospatial_handle)
+        self.geospatial_handles.clear()
+        for local_layer in self.local_layers.values():
+            local_layer.close()
+        self.local_layers.clear()
 
 class GeoSpatial:
     """Conducts geocoding and spatial operations on addresses and points.
@@ -42,6 +362,12 @@ class GeoSpatial:
 
     For example:
         geo_spatial = GeoSpatial(r"f:\websites\datacatalog.xml", "f:\pxse-data")
+
+    An optional config dictionary overrides entries of DEFAULT_CONFIG; it may
+    also be the path of a configuration file, read by load_config().
+
+    The data catalog can be reloaded while the instance is in use; see
+    reload_data_catalog(). Call close() when done with the instance.
     """
 
     # Static member fields
@@ -54,54 +380,379 @@ class GeoSpatial:
 
     __ERROR_TABLE_COLS = "$ErrorCode;$ErrorMessage"
 
-    __GEOCODING_OUTPUT_COLS = ";".join(
-        [
-            "INPUT.{col_id}".format(col_id=__INPUT_ID_COL_NAME),
-            "$AddressLine",
-            "$City",
-            "$CityLine",
-            "$County",
-            "$Dataset",
-            "$ExtraFound",
-            "$IsIntersection",
-            "$Latitude",
-            "$Longitude",
-            "$MatchCode",
-            "$MatchDescription",
-            "$Number",
-            "$Postcode",
-            "$State",
-            "$StreetAddress",
-            "$StreetName",
-            "$StreetSide",
-            "$UnitNumber"
-        ])
+    __LAYER_GEOMETRY_COL_NAME = "$Geometry"
+
+    __PLACE_TYPE_COL_NAME = "$PlaceType"
+
+    __PLACE_ID_COL_NAME = "$PlaceId"
+
+    __PLACE_TABLE_COLS = "$PlaceType;$PlaceId;$PlaceName"
+
+    # result store key prefixes
+    __GEOCODE_KEY_PREFIX = "geocode|"
+
+    __CELL_KEY_PREFIX = "cell|"
+
+    __POINT_KEY_PREFIX = "point|"
+
 
 
     def __init__(
             self, data_catalog_path=r"f:\websites\datacatalog.xml", 
-            shapefile_root_dir=r"f:\pxse-data"):
-        self.__data_catalog = datacatalog.DataCatalog(data_catalog_path, 
-            shapefile_root_dir)
-        # geocoder and spatial processors are lazily initialized
-        self.__geocoder_handle = None
-        self.__geospatial_handle = None
+            shapefile_root_dir=r"f:\pxse-data", config=None):
+        self.__config = dict(DEFAULT_CONFIG)
+        if isinstance(config, basestring):
+            config = load_config(config)
+        if config is not None:
+            self.__config.update(config)
+        self.__data_catalog_path = data_catalog_path
+        self.__shapefile_root_dir = shapefile_root_dir
+        # the data catalog and the handles opened with it, replaced as a
+        # whole when the catalog is reloaded
+        self.__generation = _CatalogGeneration(
+            datacatalog.DataCatalog(data_catalog_path, shapefile_root_dir), 1)
+        self.__generation_lock = threading.Lock()
+        self.__reload_lock = threading.Lock()
+        self.__reload_stats = _Counters("reloads", "failures")
+        # the generation each thread's current call has pinned, and its
+        # deadline and priority class
+        self.__pinned = threading.local()
+        # successful geocode results, keyed by canonical address
+        self.__geocode_cache = cache.LRUCache(
+            self.__config["GEOCODE_CACHE_SIZE"])
+        # successful reverse geocode results, keyed by rounded coordinates
+        self.__reverse_geocode_cache = cache.LRUCache(
+            self.__config["REVERSE_GEOCODE_CACHE_SIZE"])
+        # geocoder output profiles, keyed by name
+        self.__output_profiles = dict(
+            (name, _OutputProfile(name, columns))
+            for name, columns in GEOCODING_OUTPUT_PROFILES.items() + 
+                self.__config["GEOCODE_OUTPUT_PROFILES"].items())
+        # WITHIN query results, keyed by layer and grid cell
+        self.__grid_cache = gridcache.GridCache(
+            self.__config["GRID_CACHE_LAYERS"],
+            self.__config["GRID_CACHE_SIZE"])
+        self.__local_stats = _Counters("queries", "cross_checks", "mismatches")
+        # layers that are shards of a sharded layer
+        self.__shard_layers = set(
+            shard_name for shards in self.__config["LAYER_SHARDS"].values()
+            for shard_name, _ in shards)
+        self.__shard_stats = _Counters("points", "unrouted", "parallel_calls")
+        # latencies of recent native calls, by kind, for hedging
+        self.__latencies = hedging.LatencyHistory(
+            self.__config["LATENCY_HISTORY"])
+        self.__hedge_stats = _Counters(
+            "hedged", "hedge_wins", "deadlines_exceeded")
+        # priority schedulers of the handle pools, by pool name
+        self.__schedulers = {}
+        self.__schedulers_lock = threading.Lock()
+        # calls in progress, admitted and shed, by operation
+        self.__admission_stats = collections.defaultdict(
+            lambda: {"in_flight": 0, "admitted": 0, "shed": 0})
+        self.__admission_lock = threading.Lock()
+        # parents and children of places, remembered for the life of the
+        # instance
+        self.__place_hierarchy = placehierarchy.PlaceHierarchy(
+            lambda keys: [
+                places if places is placehierarchy.UNKNOWN
+                else places[0] if places else None for places in
+                self.__find_places(pxpointsc.geocoder_find_parent, keys)],
+            lambda keys: self.__find_places(
+                pxpointsc.geocoder_find_children, keys))
+        # radii recent adaptive FindNearest points were answered at, by layer
+        self.__nearest_radii = {}
+        self.__nearest_lock = threading.Lock()
+        self.__nearest_stats = _Counters("points", "searches", "expansions")
+        self.__call_log = calllog.CallLog(
+            sample_rates=self.__config["CALL_LOG_SAMPLE_RATES"],
+            default_sample_rate=self.__config["CALL_LOG_SAMPLE_RATE"])
+        self.__slow_call_recorder = None
+        if self.__config["SLOW_CALL_CAPTURE_DIR"]:
+            self.__slow_call_recorder = slowcalls.SlowCallRecorder(
+                self.__config["SLOW_CALL_CAPTURE_DIR"],
+                self.__config["SLOW_CALL_THRESHOLD_MS"] / 1000.0,
+                self.__config["SLOW_CALL_MAX_CAPTURES"],
+                lambda: {
+                    "geocoder_vintage": self.__get_geocoder_vintage(),
+                    "layer_vintages": dict(
+                        self.__get_generation().layer_vintages),
+                    # the geocoder of a dataset profile searches only its
+                    # datasets, and is replayed with them
+                    "dataset_profile": getattr(
+                        self.__pinned, "datasets", None),
+                    "geocoder_datasets": self.__get_profile_datasets(
+                        getattr(self.__pinned, "datasets", None))
+                })
+            self.__slow_call_recorder.install()
+        # batch rows answered by another row of the same batch
+        self.__batch_stats = _Counters(
+            "geocode_duplicates", "point_duplicates")
+        # results shared with other processes, tagged with the data vintage
+        self.__result_store = None
+        if self.__config["RESULT_STORE_PATH"]:
+            self.__result_store = resultstore.ResultStore(
+                self.__config["RESULT_STORE_PATH"],
+                self.__config["RESULT_STORE_MAX_BYTES"])
+            self.__warm_caches(self.__config["RESULT_STORE_WARM_ENTRIES"])
+        if self.__config["PLACE_HIERARCHY_PRELOAD"]:
+            self.__place_hierarchy.preload([
+                tuple(key) for key in self.__config["PLACE_HIERARCHY_PRELOAD"]])
+        self.__watcher = None
+        self.__closed = threading.Event()
+        if self.__config["DATA_CATALOG_WATCH_SECONDS"] > 0:
+            self.__watcher = threading.Thread(target=self.__watch_data_catalog)
+            self.__watcher.daemon = True
+            self.__watcher.start()
 
 
     @staticmethod
-    def create_address_input_table(self, call_id, address):
+    def create_address_input_table(call_id, address):
         """Creates an input table with a single row containing an address."""
+        return GeoSpatial.create_addresses_input_table([(call_id, address)])
+
+
+    @staticmethod
+    def create_addresses_input_table(addresses):
+        """Creates an input table with a row for each (call_id, address)."""
+        input_table = table.Table()
+        input_table.append_col(GeoSpatial.__INPUT_ID_COL_NAME)
+        input_table.append_col(GeoSpatial.__INPUT_ADDRESS_COL_NAME)
+        for call_id, address in addresses:
+            input_table.append_row((call_id, address))
+        return input_table
+
+
+    @staticmethod
+    def create_lat_lon_input_table(call_id, lat, lon):
+        """Creates an input table with a single row containing a point."""
+        return GeoSpatial.create_lat_lons_input_table([(call_id, lat, lon)])
+
+
+    @staticmethod
+    def create_lat_lons_input_table(points):
+        """Creates an input table with a row for each (call_id, lat, lon)."""
         input_table = table.Table()
-        input_table.append_col(Spatial.__INPUT_ID_COL_NAME)
-        input_table.append_col(Spatial.__INPUT_ADDRESS_COL_NAME)
-        input_table.append_row((call_id, address))
+        input_table.append_col(GeoSpatial.__INPUT_ID_COL_NAME)
+        input_table.append_col(GeoSpatial.__INPUT_GEOMETRY_COL_NAME)
+        wkt_point = pxcommon.WKT_POINT_FORMAT.format
+        input_table.rows = [
+            (call_id, wkt_point(x=lon, y=lat)) for call_id, lat, lon in points]
         return input_table
 
 
     @staticmethod
-    def create_server_error_json_result(message):
+    def create_error_table(error_code, message, col_prefix=""):
+        """Creates an error table with a single row, shaped like those
+        PxPointSC returns."""
+        error_table = table.Table()
+        for col_name in GeoSpatial.__ERROR_TABLE_COLS.split(";"):
+            error_table.append_col(col_prefix + col_name)
+        error_table.append_row((str(error_code), message))
+        return error_table
+
+
+    @staticmethod
+    def create_query_options(
+            layer_name, search_dist_meters=0, where_clause=None, 
+            max_results=0):
+        """Creates the processing options for a layer query.
+
+        Args:
+            layer_name (str): The layer alias.
+            search_dist_meters (int, optional): The FindNearest search
+                distance, or 0 for a WITHIN query.
+            where_clause (str, optional): A where-clause filtering the
+                layer's features.
+            max_results (int, optional): The maximum number of features to
+                return per input row, or 0 or less for all of them.
+        """
+        proc_opts = "InputGeoColumn={c}".format(
+            c=GeoSpatial.__INPUT_GEOMETRY_COL_NAME)
+        if search_dist_meters <= 0:
+            option = pxcommon.get_spatial_relation_spec(
+                pxcommon.SpatialRelation.WITHIN)
+        else:
+            option = "FindNearest=T;[{a}]Distance={m}".format(
+                a=layer_name, m=search_dist_meters)
+        options = [proc_opts, "[{a}]{o}".format(a=layer_name, o=option)]
+        if where_clause:
+            options.append("[{a}]WhereClause={w}".format(
+                a=layer_name, w=where_clause))
+        if max_results > 0:
+            options.append("[{a}]MaxResults={n}".format(
+                a=layer_name, n=max_results))
+        return ";".join(options)
+
+
+    @staticmethod
+    def parse_output_fields(layer_name, output_fields):
+        """Parses the output fields requested of a layer query.
+
+        Args:
+            layer_name (str): The layer alias.
+            output_fields (str or list): Field names, separated by commas or
+                semicolons if a string, with or without the [layer] prefix.
+                None means all fields.
+
+        Returns:
+            A tuple of bare field names, or None for all fields.
+        """
+        if output_fields is None:
+            return None
+        if isinstance(output_fields, basestring):
+            output_fields = output_fields.replace(";", ",").split(",")
+        layer_prefix = "[{a}]".format(a=layer_name)
+        field_names = []
+        for field_name in output_fields:
+            field_name = field_name.strip()
+            if field_name.startswith(layer_prefix):
+                field_name = field_name[len(layer_prefix):]
+            if field_name:
+                field_names.append(field_name)
+        if not field_names:
+            raise ValueError("No output fields requested")
+        return tuple(field_names)
+
+
+    @staticmethod
+    def select_fields(field_names, requested):
+        """Returns the indexes in field_names of the requested fields,
+        matched without regard to case.
+
+        Raises:
+            ValueError: if a requested field is not in field_names.
+        """
+        indexes = dict(
+            (name.upper(), i) for i, name in enumerate(field_names))
+        result = []
+        for name in requested:
+            if name.upper() not in indexes:
+                raise ValueError("Unknown output field: {f}".format(f=name))
+            result.append(indexes[name.upper()])
+        return result
+
+
+    @staticmethod
+    def remove_col(output_table, col_idx):
+        """Removes a column from a table, returning the removed values."""
+        del output_table.col_names[col_idx]
+        del output_table.col_var_types[col_idx]
+        values = [row[col_idx] for row in output_table.rows]
+        output_table.rows = [
+            list(row[:col_idx]) + list(row[col_idx + 1:])
+            for row in output_table.rows]
+        return values
+
+
+    @staticmethod
+    def replace_call_ids(output_table, call_id):
+        """Returns a copy of an output table with every row's call id replaced.
+
+        Cached results carry the call id of the request that produced them.
+        The call id is always the first output column, since every output
+        column definition starts with INPUT.Id.
+        """
+        result_table = table.Table()
+        result_table.col_names = list(output_table.col_names)
+        result_table.col_var_types = list(output_table.col_var_types)
+        for row in output_table.rows:
+            result_table.append_row([call_id] + list(row[1:]))
+        return result_table
+
+
+    @staticmethod
+    def rename_layer_cols(source_table, old_prefix, new_prefix):
+        """Returns a copy of a table whose columns prefixed with one layer
+        prefix (such as "[ParcelCO]") have another instead, or None if
+        source_table is None."""
+        if source_table is None:
+            return None
+        result_table = table.Table()
+        result_table.col_names = [
+            new_prefix + col_name[len(old_prefix):] 
+            if col_name.startswith(old_prefix) else col_name
+            for col_name in source_table.col_names]
+        result_table.col_var_types = list(source_table.col_var_types)
+        result_table.rows = list(source_table.rows)
+        return result_table
+
+
+    @staticmethod
+    def split_table_by_row_id(source_table, nrows, keep_id_col=True):
+        """Splits a table by the input row each of its rows belongs to.
+
+        Batch input tables number their rows 0 to nrows - 1 in the Id column,
+        so that the call ids of a batch need not be unique. Output and error
+        tables that start with INPUT.Id can then be split back up by row.
+
+        Args:
+            source_table (Table): The table to split, or None.
+            nrows (int): The number of input rows.
+            keep_id_col (bool, optional): False to drop the Id column.
+
+        Returns:
+            A list of nrows tables, or of nrows Nones if source_table is None.
+        """
+        if source_table is None:
+            return [None] * nrows
+        first_col = 0 if keep_id_col else 1
+        parts = []
+        for _ in range(nrows):
+            part = table.Table()
+            part.col_names = list(source_table.col_names[first_col:])
+            part.col_var_types = list(source_table.col_var_types[first_col:])
+            parts.append(part)
+        for row in source_table.rows:
+            parts[int(row[0])].append_row(list(row[first_col:]))
+        return parts
+
+
+    @staticmethod
+    def split_batch_result(
+            output_table, error_table, return_code, return_message, nrows, 
+            col_prefix=""):
+        """Splits the result of a batch call into one result per input row.
+
+        Args:
+            output_table (Table): The output table, starting with INPUT.Id.
+            error_table (Table): The error table, starting with INPUT.Id.
+            return_code (int): The return code of the call.
+            return_message (str): The return message of the call.
+            nrows (int): The number of input rows.
+            col_prefix (str, optional): The layer prefix of error columns.
+
+        Returns:
+            A list of nrows (output_table, error_table, return_code) tuples,
+            shaped like the results of single row calls.
+        """
+        if return_code != pxcommon.PXP_SUCCESS:
+            error_table = GeoSpatial.create_error_table(
+                return_code, return_message, col_prefix)
+            return [(None, error_table, return_code)] * nrows
+        results = []
+        for output_part, error_part in zip(
+                GeoSpatial.split_table_by_row_id(output_table, nrows),
+                GeoSpatial.split_table_by_row_id(error_table, nrows, False)):
+            if output_part is not None and not output_part.is_empty():
+                results.append((output_part, error_part, pxcommon.PXP_SUCCESS))
+            elif error_part is not None and not error_part.is_empty():
+                error_code = error_part.rows[0][0]
+                try:
+                    error_code = int(error_code)
+                except ValueError:
+                    error_code = pxcommon.error_str_to_code(error_code)
+                results.append((None, error_part, error_code))
+            else:
+                error_code = pxcommon.error_str_to_code("NOTFOUND")
+                results.append((None, GeoSpatial.create_error_table(
+                    error_code, "No features found", col_prefix), error_code))
+        return results
+
+
+    @staticmethod
+    def create_server_error_json_result(
+            message, status=_StatusCode.SERVER_ERROR):
         """Creates a JSON string from a server error message."""
-        status = _StatusCode.SERVER_ERROR
         return_obj = {}
         return_obj["result"] = []
         return_obj["status"] = status
@@ -109,6 +760,24 @@ class GeoSpatial:
         return (status, json.dumps(return_obj, sort_keys=True))
 
     @staticmethod
+    def get_error_status_from_code(error_code):
+        """Maps a PxPointSC error code to a status code and a message."""
+        try:
+            error_code = int(error_code)
+        except ValueError:
+            error_code = pxcommon.error_str_to_code(error_code)
+        if error_code in (
+                pxcommon.error_str_to_code("GEOMETRY"),
+                pxcommon.error_str_to_code("NULLGEOMETRY"),
+                pxcommon.error_str_to_code("INVALIDGEOMETRY")):
+            return _StatusCode.SERVER_ERROR, "Input geometry is invalid"
+        if error_code == pxcommon.error_str_to_code("NOTFOUND"):
+            return _StatusCode.NO_RESULTS, "No features found"
+        if error_code == pxcommon.error_str_to_code("INVALIDQUERY"):
+            return (_StatusCode.INVALID_REQUEST, 
+                pxcommon.error_code_to_str(error_code))
+        return _StatusCode.SERVER_ERROR, pxcommon.error_code_to_str(error_code)
+
     def create_json_result_with_status(
             self, output_table, error_table, return_code, max_results=-1):
         """Creates a JSON string from a PxPointSC result."""
@@ -116,20 +785,18 @@ class GeoSpatial:
         status = _StatusCode.OK
         message = ""
         if return_code == pxcommon.PXP_SUCCESS:
-            if (output_table is None or output_table.nrows == 0):
+            if (output_table is None or output_table.is_empty()):
                 status  = _StatusCode.SERVER_ERROR
                 message = "Output table is empty, despite successful geocode"
             else:
-                for i in range(output_table.nrows()):
-                    current = {}
-                    row = output_table.rows[i]
-                    for j in range(output_table.ncols()):
-                        current[output_table.col_names[j]] = str(row[j]).encode(
-                            "unicode_escape")
-                    result.append(current)
-                    if i == max_results:
-                        break
-        elif error_table is None or error_table.nrows == 0:
+                col_names = output_table.col_names
+                rows = output_table.rows
+                if max_results > 0:
+                    rows = rows[:max_results]
+                for row in rows:
+                    result.append(dict(zip(col_names, [
+                        str(value).encode("unicode_escape") for value in row])))
+        elif error_table is None or error_table.is_empty():
             status  = _StatusCode.SERVER_ERROR
             message = "Error table is empty, despite apparent error"
         else:
@@ -147,41 +814,1109 @@ class GeoSpatial:
         return_obj["message"] = message
         return status, json.dumps(return_obj, sort_keys=True) 
 
-    def get_location(self, call_id, address):
+    def get_location(self, call_id, address, profile=None, datasets=None):
         """Geocodes an address, by matching it to a location record.
 
         Args:
             call_id (str): A geocode call identifier, for logging purposes.
             address (str): An address (e.g., '123 main st, boulder co').
+            profile (str or list, optional): The name of the output profile
+                selecting the geocoder output columns, or a list of columns.
+                The default is the GEOCODE_OUTPUT_PROFILE configuration.
+            datasets (str, optional): The name of the dataset profile
+                selecting the geocoding datasets searched; see
+                GEOCODER_DATASET_PROFILES. The default is the
+                GEOCODER_DATASET_PROFILE configuration.
 
         Returns:
             A JSON-formatted string containing results and a status code.
         """
+        start = time.time()
+        status, json_results = self.create_batch_json_results(
+            lambda: self.geocode_tables(
+                [(call_id, address)], profile, datasets), 1, 
+            operation="get_location")[0]
+        self.__call_log.log(
+            "get_location", call_id=call_id, address=address, 
+            datasets=datasets or "",
+            elapsed_ms=round((time.time() - start) * 1000, 3), status=status)
+        return json_results
+
+
+    def get_locations(self, locations, profile=None, datasets=None):
+        """Geocodes many addresses, making one PxPointSC call per chunk of
+        BATCH_CHUNK_SIZE addresses not already cached.
+
+        Args:
+            locations (iterable): (call_id, address) tuples. Call ids need
+                not be unique.
+            profile (str or list, optional): As for get_location().
+            datasets (str, optional): As for get_location().
+
+        Yields:
+            A (call_id, JSON-formatted string) tuple for each address, in
+            input order. The JSON is what get_location() would return.
+        """
+        for chunk in self.__chunks(locations):
+            start = time.time()
+            with self.__bulk_priority():
+                chunk_results = self.create_batch_json_results(
+                    lambda: self.geocode_tables(chunk, profile, datasets), 
+                    len(chunk), operation="get_locations")
+            self.__call_log.log(
+                "get_locations", rows=len(chunk), datasets=datasets or "",
+                elapsed_ms=round((time.time() - start) * 1000, 3))
+            for (call_id, _), (_, json_results) in zip(chunk, chunk_results):
+                yield call_id, json_results
 
 
-        # Lazily initialize the geocoder handle.
-        if self.__geocoder_handle is None:
-            self.__geocoder_handle = pxpointsc.geocoder_init(
-                self.__data_catalog)
+    def geocode_tables(self, locations, profile=None, datasets=None):
+        """Geocodes a list of (call_id, address) tuples, with one PxPointSC
+        call for the addresses not already cached.
 
-        # Create an input table from the call id and the address
-        input_table = self.create_address_input_table(call_id, address)
+        Args:
+            locations (list): (call_id, address) tuples.
+            profile (str or list, optional): As for get_location().
+            datasets (str, optional): As for get_location().
 
-        # Call the geocoder and get the results
-        output_table, error_table, return_code, _ = pxpointsc.geocoder_geocode(
-            self.__geocoder_handle,
-            input_table,
-            GeoSpatial.__GEOCODING_OUTPUT_COLS,
-            GeoSpatial.__ERROR_TABLE_COLS,
-            "" # we don't use any processing options right now
-        )
+        Returns:
+            A list of (output_table, error_table, return_code) tuples, one per
+            address, each carrying its call id.
 
-        # Build and return the JSON encoding of the results
-        status, json_results = self.create_json_results_with_status(
-            output_table, error_table, return_code)
+        Raises:
+            ValueError: if the output or dataset profile is unknown.
+            RuntimeError: if the geocoder cannot be initialized.
+        """
+        with self.__pin_generation():
+            profile = self.get_output_profile(profile)
+            datasets = self.__get_dataset_profile(datasets)
+            key_prefix = GeoSpatial.__dataset_key_prefix(datasets)
+            results = [None] * len(locations)
+            # Addresses with the same canonical form are geocoded once. Those
+            # without one are never merged.
+            cache_keys = []
+            for _, address in locations:
+                cache_key = addressnorm.canonicalize_address(address)
+                cache_keys.append(
+                    key_prefix + profile.cache_key_prefix + cache_key 
+                    if cache_key else None)
+            groups = GeoSpatial.__group_rows(cache_keys)
+            self.__batch_stats.add(
+                "geocode_duplicates", len(locations) - len(groups))
+            # (cache key, positions in locations) of each address to geocode
+            misses = []
+            for cache_key, positions in groups:
+                cached = self.__get_cached_geocode(cache_key)
+                if cached is not None:
+                    GeoSpatial.__fan_out(results, cached, locations, positions)
+                else:
+                    misses.append((cache_key, positions))
+            if not misses:
+                return results
+
+            geocoder_pool = self.__get_geocoder_pool(datasets=datasets)
+
+            # Rows are identified by their position in the batch.
+            input_table = GeoSpatial.create_addresses_input_table(
+                (str(row_id), locations[positions[0]][1]) 
+                for row_id, (_, positions) in enumerate(misses))
+            output_table, error_table, return_code, return_message = (
+                self.__call_native(
+                    "geocode" + key_prefix, geocoder_pool, len(misses),
+                    lambda geocoder_handle: pxpointsc.geocoder_geocode(
+                        geocoder_handle,
+                        input_table,
+                        profile.col_spec,
+                        "INPUT.{c};{e}".format(
+                            c=GeoSpatial.__INPUT_ID_COL_NAME, 
+                            e=GeoSpatial.__ERROR_TABLE_COLS),
+                        ""
+                    ), datasets))
+            # stored in one transaction for the batch
+            stored = []
+            for (cache_key, positions), result in zip(
+                    misses, GeoSpatial.split_batch_result(
+                        output_table, error_table, return_code, 
+                        return_message, len(misses))):
+                self.__remember_geocode(cache_key, result, stored)
+                GeoSpatial.__fan_out(results, result, locations, positions)
+            self.__save_results(stored)
+            return results
+
+
+    def reverse_geocode(
+            self, call_id, lat, lon, profile=None, datasets=None):
+        """Finds the address nearest to a location.
+
+        Args:
+            call_id (str): A call identifier, for logging purposes.
+            lat (float): The location's latitude, in decimal degrees.
+            lon (float): The location's longitude, in decimal degrees.
+            profile (str or list, optional): As for get_location().
+            datasets (str, optional): As for get_location().
+
+        Returns:
+            A JSON-formatted string containing results and a status code.
+        """
+        start = time.time()
+        status, json_results = self.create_batch_json_results(
+            lambda: self.reverse_geocode_tables(
+                [(call_id, lat, lon)], profile, datasets), 1, 
+            operation="reverse_geocode")[0]
+        self.__call_log.log(
+            "reverse_geocode", call_id=call_id, lat=lat, lon=lon, 
+            datasets=datasets or "",
+            elapsed_ms=round((time.time() - start) * 1000, 3), status=status)
         return json_results
 
 
+    def reverse_geocode_batch(self, points, profile=None, datasets=None):
+        """Reverse geocodes many locations, making one PxPointSC call per
+        chunk of BATCH_CHUNK_SIZE locations not already remembered.
+
+        Args:
+            points (iterable): (call_id, lat, lon) tuples. Call ids need not
+                be unique.
+            profile (str or list, optional): As for get_location().
+            datasets (str, optional): As for get_location().
+
+        Yields:
+            A (call_id, JSON-formatted string) tuple for each location, in
+            input order. The JSON is what reverse_geocode() would return.
+        """
+        for chunk in self.__chunks(points):
+            start = time.time()
+            with self.__bulk_priority():
+                chunk_results = self.create_batch_json_results(
+                    lambda: self.reverse_geocode_tables(
+                        chunk, profile, datasets), len(chunk), 
+                    operation="reverse_geocode_batch")
+            self.__call_log.log(
+                "reverse_geocode_batch", rows=len(chunk), 
+                datasets=datasets or "",
+                elapsed_ms=round((time.time() - start) * 1000, 3))
+            for (call_id, _, _), (_, json_results) in zip(
+                    chunk, chunk_results):
+                yield call_id, json_results
+
+
+    def reverse_geocode_tables(self, points, profile=None, datasets=None):
+        """Reverse geocodes a list of (call_id, lat, lon) tuples, with one
+        PxPointSC call for the locations not already remembered.
+
+        Returns:
+            A list of (output_table, error_table, return_code) tuples, one per
+            location, each carrying its call id.
+
+        Raises:
+            ValueError: if the output or dataset profile is unknown.
+            RuntimeError: if the geocoder cannot be initialized.
+        """
+        with self.__pin_generation():
+            profile = self.get_output_profile(profile)
+            datasets = self.__get_dataset_profile(datasets)
+            results = [None] * len(points)
+            memo_keys = []
+            precision = self.__config["REVERSE_GEOCODE_PRECISION"]
+            for _, lat, lon in points:
+                memo_keys.append("{d}{p}{lat:.{n}f},{lon:.{n}f}".format(
+                    d=GeoSpatial.__dataset_key_prefix(datasets),
+                    p=profile.cache_key_prefix, lat=lat, lon=lon, n=precision))
+            # (memo key, positions in points) of each location to geocode
+            misses = []
+            for memo_key, positions in GeoSpatial.__group_rows(memo_keys):
+                cached = self.__reverse_geocode_cache.get(memo_key)
+                if cached is not None:
+                    GeoSpatial.__fan_out(results, cached, points, positions)
+                else:
+                    misses.append((memo_key, positions))
+            if not misses:
+                return results
+
+            geocoder_pool = self.__get_geocoder_pool(datasets=datasets)
+
+            # Rows are identified by their position in the batch.
+            input_table = GeoSpatial.create_lat_lons_input_table(
+                (str(row_id), points[positions[0]][1], 
+                    points[positions[0]][2])
+                for row_id, (_, positions) in enumerate(misses))
+            output_table, error_table, return_code, return_message = (
+                self.__call_native(
+                    "reverse_geocode" + GeoSpatial.__dataset_key_prefix(
+                        datasets), geocoder_pool, len(misses),
+                    lambda geocoder_handle: pxpointsc.geocoder_reverse_geocode(
+                        geocoder_handle,
+                        input_table,
+                        profile.col_spec,
+                        "INPUT.{c};{e}".format(
+                            c=GeoSpatial.__INPUT_ID_COL_NAME, 
+                            e=GeoSpatial.__ERROR_TABLE_COLS),
+                        "InputGeoColumn={c}".format(
+                            c=GeoSpatial.__INPUT_GEOMETRY_COL_NAME)
+                    ), datasets))
+            for (memo_key, positions), result in zip(
+                    misses, GeoSpatial.split_batch_result(
+                        output_table, error_table, return_code, 
+                        return_message, len(misses))):
+                if result[2] == pxcommon.PXP_SUCCESS:
+                    self.__reverse_geocode_cache.put(memo_key, result)
+                GeoSpatial.__fan_out(results, result, points, positions)
+            return results
+
+
+    def find_parent(self, call_id, place_type, place_id):
+        """Finds the place a place belongs to, such as the county of a city.
+
+        Args:
+            call_id (str): A call identifier, for logging purposes.
+            place_type (str): The type of the place; one of
+                placehierarchy.PLACE_TYPES.
+            place_id (str): The identifier of the place, such as a state
+                abbreviation, county FIPS code or ZIP code.
+
+        Returns:
+            A JSON-formatted string containing results and a status code.
+        """
+        return self.__create_places_json_result(call_id, lambda key: [
+            place for place in [self.__place_hierarchy.parent(key)]
+            if place is not None], place_type, place_id)
+
+
+    def find_children(self, call_id, place_type, place_id):
+        """Finds the places one level below a place, such as the counties of a
+        state. Arguments and results are as for find_parent()."""
+        return self.__create_places_json_result(
+            call_id, self.__place_hierarchy.children, place_type, place_id)
+
+
+    def find_ancestors(self, call_id, place_type, place_id):
+        """Finds every place above a place, nearest first, such as the city,
+        county and state of a ZIP code. Arguments and results are as for
+        find_parent()."""
+        return self.__create_places_json_result(
+            call_id, self.__place_hierarchy.ancestors, place_type, place_id)
+
+
+    def get_place_hierarchy(self):
+        """Returns this instance's placehierarchy.PlaceHierarchy, for rollups
+        over many places without a JSON round trip."""
+        return self.__place_hierarchy
+
+
+    def __create_places_json_result(
+            self, call_id, get_places, place_type, place_id):
+        """Creates the JSON string for the places get_places() returns for a
+        place key."""
+        def get_results():
+            if place_type not in placehierarchy.PLACE_TYPES:
+                raise ValueError(
+                    "Unknown place type: {t}".format(t=place_type))
+            places = get_places((place_type, place_id))
+            if not places:
+                error_code = pxcommon.error_str_to_code("NOTFOUND")
+                return [(None, GeoSpatial.create_error_table(
+                    error_code, "No places found"), error_code)]
+            output_table = table.Table()
+            output_table.append_col(GeoSpatial.__INPUT_ID_COL_NAME)
+            for col_name in GeoSpatial.__PLACE_TABLE_COLS.split(";"):
+                output_table.append_col(col_name)
+            for place in places:
+                output_table.append_row([call_id] + list(place))
+            return [(output_table, None, pxcommon.PXP_SUCCESS)]
+        return self.create_batch_json_results(
+            get_results, 1, operation="find_places")[0][1]
+
+
+    def __find_places(self, function, keys):
+        """Calls a geocoder hierarchy operation for a list of place keys.
+
+        Args:
+            function (callable): pxpointsc.geocoder_find_parent or
+                pxpointsc.geocoder_find_children.
+            keys (list): (place_type, place_id) tuples.
+
+        Returns:
+            A list of (place_type, place_id, place_name) tuples for each key,
+            in order. Places PxPointSC finds nothing for have none, and those
+            it reports another error for have placehierarchy.UNKNOWN, so
+            that they are not remembered.
+
+        Raises:
+            RuntimeError: if the geocoder cannot be initialized, or the call
+                fails.
+        """
+        with self.__pin_generation():
+            input_table = table.Table()
+            input_table.append_col(GeoSpatial.__INPUT_ID_COL_NAME)
+            input_table.append_col(GeoSpatial.__PLACE_TYPE_COL_NAME)
+            input_table.append_col(GeoSpatial.__PLACE_ID_COL_NAME)
+            # Rows are identified by their position in the batch.
+            for row_id, (place_type, place_id) in enumerate(keys):
+                input_table.append_row((str(row_id), place_type, place_id))
+            output_table, error_table, return_code, return_message = (
+                self.__call_native(
+                    function.__name__, self.__get_geocoder_pool(), len(keys),
+                    lambda geocoder_handle: function(
+                        geocoder_handle,
+                        input_table,
+                        "INPUT.{c};{p}".format(
+                            c=GeoSpatial.__INPUT_ID_COL_NAME,
+                            p=GeoSpatial.__PLACE_TABLE_COLS),
+                        "INPUT.{c};{e}".format(
+                            c=GeoSpatial.__INPUT_ID_COL_NAME, 
+                            e=GeoSpatial.__ERROR_TABLE_COLS),
+                        ""
+                    )))
+            if return_code != pxcommon.PXP_SUCCESS:
+                raise RuntimeError(
+                    "Error finding places. Code: {c}. Message: {m}".format(
+                        c=return_code, m=return_message))
+            results = []
+            for output_part, _, row_code in GeoSpatial.split_batch_result(
+                    output_table, error_table, return_code, return_message,
+                    len(keys)):
+                if output_part is not None:
+                    # without the Id column
+                    results.append(
+                        [tuple(row[1:]) for row in output_part.rows])
+                elif row_code == pxcommon.error_str_to_code("NOTFOUND"):
+                    results.append([])
+                else:
+                    results.append(placehierarchy.UNKNOWN)
+            return results
+
+
+    @staticmethod
+    def __group_rows(keys):
+        """Groups the rows of a batch by key.
+
+        Args:
+            keys (list): The key of each row. Rows whose key is None are
+                never grouped.
+
+        Returns:
+            A list of (key, positions) tuples, in order of first appearance.
+        """
+        groups = []
+        group_positions = {}
+        for i, key in enumerate(keys):
+            group_key = key if key is not None else (None, i)
+            if group_key not in group_positions:
+                group_positions[group_key] = []
+                groups.append((key, group_positions[group_key]))
+            group_positions[group_key].append(i)
+        return groups
+
+
+    @staticmethod
+    def __fan_out(results, result, rows, positions):
+        """Stores a result at each of several positions of a batch, with the
+        call id of the row at that position."""
+        output_table, error_table, return_code = result
+        for i in positions:
+            if output_table is not None:
+                results[i] = (
+                    GeoSpatial.replace_call_ids(output_table, rows[i][0]),
+                    error_table, return_code)
+            else:
+                results[i] = result
+
+
+    def get_output_profile(self, profile=None):
+        """Returns a geocoder output profile.
+
+        Args:
+            profile (str or list, optional): A profile name, a list of output
+                columns, or None for the GEOCODE_OUTPUT_PROFILE configuration.
+
+        Raises:
+            ValueError: if there is no profile of that name.
+        """
+        if profile is None:
+            profile = self.__config["GEOCODE_OUTPUT_PROFILE"]
+        if not isinstance(profile, basestring):
+            return _OutputProfile(None, profile)
+        if profile not in self.__output_profiles:
+            raise ValueError("Unknown output profile: {p}".format(p=profile))
+        return self.__output_profiles[profile]
+
+
+    def create_batch_json_results(
+            self, get_results, nrows, max_results=-1, operation=None):
+        """Creates the JSON strings for a batch of results.
+
+        Args:
+            get_results (callable): Returns a list of (output_table,
+                error_table, return_code) tuples. A ValueError it raises is
+                reported for every row as an invalid request, an
+                OverloadedError as overloaded, and another RuntimeError as a
+                server error.
+            nrows (int): The number of rows in the batch.
+            max_results (int, optional): As for query_layer().
+            operation (str, optional): The operation the batch is admitted
+                as; see MAX_IN_FLIGHT. None admits it unconditionally.
+
+        Returns:
+            A list of nrows (status, JSON-formatted string) tuples, as
+            create_json_result_with_status() returns.
+        """
+        try:
+            if operation is None:
+                results = get_results()
+            else:
+                with self.__admit(operation):
+                    results = get_results()
+        except ValueError as e:
+            return [GeoSpatial.create_server_error_json_result(
+                str(e), _StatusCode.INVALID_REQUEST)] * nrows
+        except OverloadedError as e:
+            return [GeoSpatial.create_server_error_json_result(
+                str(e), _StatusCode.OVERLOADED)] * nrows
+        except RuntimeError as e:
+            return [GeoSpatial.create_server_error_json_result(str(e))] * nrows
+        return [
+            self.create_json_result_with_status(
+                output_table, error_table, return_code, max_results)
+            for output_table, error_table, return_code in results]
+
+
+    def __get_cached_geocode(self, cache_key):
+        """Returns the cached geocode result for a canonical address, or None.
+        """
+        if not cache_key:
+            return None
+        cached = self.__geocode_cache.get(cache_key)
+        if cached is None:
+            cached = self.__load_result(
+                GeoSpatial.__GEOCODE_KEY_PREFIX + cache_key,
+                self.__get_geocoder_vintage())
+            if cached is not None:
+                self.__geocode_cache.put(cache_key, cached)
+        return cached
+
+
+    def __remember_geocode(self, cache_key, result, stored):
+        """Caches a geocode result for a canonical address, if successful,
+        and adds its result store entry to the stored list."""
+        output_table, error_table, return_code = result
+        # Only successful matches are worth remembering
+        if (cache_key and return_code == pxcommon.PXP_SUCCESS and 
+                output_table is not None and not output_table.is_empty()):
+            self.__geocode_cache.put(cache_key, result)
+            stored.append((
+                GeoSpatial.__GEOCODE_KEY_PREFIX + cache_key,
+                self.__get_geocoder_vintage(), output_table))
+
+
+    def get_config(self):
+        """Returns a copy of this instance's configuration."""
+        return dict(self.__config)
+
+
+    def __chunks(self, rows):
+        """Yields lists of up to BATCH_CHUNK_SIZE items from an iterable, or
+        of up to CONTENDED_CHUNK_SIZE while interactive calls are about."""
+        rows = iter(rows)
+        chunk_size = max(1, self.__config["BATCH_CHUNK_SIZE"])
+        contended_chunk_size = self.__config["CONTENDED_CHUNK_SIZE"]
+        while True:
+            size = chunk_size
+            if contended_chunk_size > 0 and self.__is_contended():
+                size = min(size, contended_chunk_size)
+            chunk = list(itertools.islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+
+    def get_stats(self):
+        """Returns a dictionary of counters describing this instance's caches.
+        """
+        return {
+            "geocode_cache": self.__geocode_cache.stats(),
+            "reverse_geocode_cache": self.__reverse_geocode_cache.stats(),
+            "grid_cache": self.__grid_cache.stats(),
+            "local_layers": self.__local_stats.snapshot(),
+            "place_hierarchy": self.__place_hierarchy.stats(),
+            "adaptive_nearest": dict(
+                self.__nearest_stats.snapshot(), radii=dict(
+                    (layer_name, self.__get_nearest_radius(
+                        layer_name, float("inf")))
+                    for layer_name in self.__get_nearest_layers())),
+            "batch": self.__batch_stats.snapshot(),
+            "sharded_layers": self.__shard_stats.snapshot(),
+            "hedging": self.__hedge_stats.snapshot(),
+            "scheduler": dict(
+                (name, scheduler_.stats()) 
+                for name, scheduler_ in self.__schedulers.items()),
+            "admission": self.__get_admission_stats(),
+            "data_catalog": dict(
+                self.__reload_stats.snapshot(), 
+                generation=self.__generation.number),
+            "slow_calls": (
+                self.__slow_call_recorder.stats()
+                if self.__slow_call_recorder is not None else None)
+        }
+
+
+    def __get_geocoder_vintage(self):
+        """Returns the vintage of the geocoding datasets."""
+        generation = self.__get_generation()
+        if generation.geocoder_vintage is None:
+            generation.geocoder_vintage = (
+                generation.data_catalog.geocoder_vintage())
+        return generation.geocoder_vintage
+
+
+    def __get_layer_vintage(self, layer_name):
+        """Returns the vintage of a layer."""
+        generation = self.__get_generation()
+        if layer_name not in generation.layer_vintages:
+            generation.layer_vintages[layer_name] = (
+                generation.data_catalog.layer_vintage(layer_name))
+        return generation.layer_vintages[layer_name]
+
+
+    def __load_result(self, store_key, vintage):
+        """Returns a result from the result store, or None."""
+        if self.__result_store is None:
+            return None
+        output_table = self.__result_store.get(store_key, vintage)
+        if output_table is None:
+            return None
+        return output_table, None, pxcommon.PXP_SUCCESS
+
+
+    def __save_results(self, entries):
+        """Saves a batch's successful results, (store key, vintage,
+        output_table) tuples, to the result store in one transaction, if
+        there is a store."""
+        if self.__result_store is not None and entries:
+            self.__result_store.put_many(entries)
+
+
+    def __warm_caches(self, max_entries):
+        """Loads the hottest stored results into the in-memory caches."""
+        for store_key, vintage, output_table in self.__result_store.warm(
+                max_entries):
+            result = (output_table, None, pxcommon.PXP_SUCCESS)
+            if store_key.startswith(GeoSpatial.__GEOCODE_KEY_PREFIX):
+                if vintage == self.__get_geocoder_vintage():
+                    self.__geocode_cache.put(
+                        store_key[len(GeoSpatial.__GEOCODE_KEY_PREFIX):],
+                        result)
+            elif store_key.startswith(GeoSpatial.__CELL_KEY_PREFIX):
+                layer_name, signature, row, col = json.loads(
+                    store_key[len(GeoSpatial.__CELL_KEY_PREFIX):])
+                if (layer_name in self.__get_data_catalog().spatial_layers
+                        and vintage == self.__get_layer_vintage(layer_name)):
+                    output_fields, where_clause = signature
+                    if output_fields is not None:
+                        output_fields = tuple(output_fields)
+                    self.__grid_cache.put(
+                        (layer_name, (output_fields, where_clause), row, col), 
+                        result)
+
+
+    def __get_generation(self):
+        """Returns the generation the calling thread has pinned, or else the
+        current one."""
+        generation = getattr(self.__pinned, "generation", None)
+        if generation is None:
+            generation = self.__generation
+        return generation
+
+
+    def __get_data_catalog(self):
+        """Returns the data catalog of the generation in use."""
+        return self.__get_generation().data_catalog
+
+
+    @contextlib.contextmanager
+    def __pin_generation(self):
+        """Pins the current generation for the calling thread until the end
+        of the with block, so that a reload waits for it. Nested pins use
+        the outer generation. Outside of a deadline() block, the block is
+        given the CALL_DEADLINE_MS deadline, if any."""
+        generation = getattr(self.__pinned, "generation", None)
+        if generation is not None:
+            yield generation
+            return
+        with self.__generation_lock:
+            generation = self.__generation
+            generation.pin()
+        self.__pinned.generation = generation
+        outer_deadline = getattr(self.__pinned, "deadline", None)
+        if outer_deadline is None and self.__config["CALL_DEADLINE_MS"] > 0:
+            self.__pinned.deadline = (
+                time.time() + self.__config["CALL_DEADLINE_MS"] / 1000.0)
+        try:
+            yield generation
+        finally:
+            self.__pinned.generation = None
+            self.__pinned.deadline = outer_deadline
+            generation.unpin()
+
+
+    def __get_dataset_profile(self, datasets=None):
+        """Returns the name of a dataset profile, or None for every dataset.
+
+        Args:
+            datasets (str, optional): A profile name, or None for the
+                GEOCODER_DATASET_PROFILE configuration.
+
+        Raises:
+            ValueError: if there is no profile of that name.
+        """
+        if datasets is None:
+            datasets = self.__config["GEOCODER_DATASET_PROFILE"]
+        if (datasets is not None and 
+                datasets not in self.__config["GEOCODER_DATASET_PROFILES"]):
+            raise ValueError(
+                "Unknown dataset profile: {d}".format(d=datasets))
+        return datasets
+
+
+    def __get_profile_datasets(self, datasets):
+        """Returns the names of a dataset profile's datasets, or None for
+        every dataset."""
+        if datasets is None:
+            return None
+        return list(self.__config["GEOCODER_DATASET_PROFILES"][datasets])
+
+
+    @staticmethod
+    def __dataset_key_prefix(datasets):
+        """Returns the cache key prefix of a dataset profile's results, which
+        must not be shared with other profiles'. Results searching every
+        dataset have none."""
+        if datasets is None:
+            return ""
+        return "{d}|".format(d=datasets)
+
+
+    @contextlib.contextmanager
+    def deadline(self, deadline_ms):
+        """Gives the calling thread's calls in the with block a deadline,
+        instead of CALL_DEADLINE_MS. Calls still waiting on PxPointSC when
+        it passes fail with a server error.
+
+        For example:
+            with geo_spatial.deadline(250):
+                json_results = geo_spatial.get_location("1", address)
+
+        Args:
+            deadline_ms (float): Milliseconds from now, for the whole block.
+                A deadline set by an enclosing block still applies if sooner.
+        """
+        outer = getattr(self.__pinned, "deadline", None)
+        deadline = time.time() + deadline_ms / 1000.0
+        self.__pinned.deadline = (
+            deadline if outer is None else min(outer, deadline))
+        try:
+            yield
+        finally:
+            self.__pinned.deadline = outer
+
+
+    @contextlib.contextmanager
+    def priority(self, priority_class):
+        """Gives the calling thread's calls in the with block a priority
+        class of SCHEDULER_WEIGHTS, such as "interactive" or "bulk".
+
+        Raises:
+            ValueError: if the priority class is unknown.
+        """
+        if priority_class not in self.__config["SCHEDULER_WEIGHTS"]:
+            raise ValueError(
+                "Unknown priority class: {p}".format(p=priority_class))
+        outer = getattr(self.__pinned, "priority", None)
+        self.__pinned.priority = priority_class
+        try:
+            yield
+        finally:
+            self.__pinned.priority = outer
+
+
+    def admit(self, operation):
+        """Counts a call of an operation made on another's behalf, such as
+        a geodaemon.py client's, in progress until the end of the with
+        block, against MAX_IN_FLIGHT as for this instance's own operations.
+
+        Raises:
+            OverloadedError: if the call is shed.
+        """
+        return self.__admit(operation)
+
+
+    @contextlib.contextmanager
+    def __bulk_priority(self):
+        """Makes the calling thread's calls in the with block bulk calls,
+        unless priority() says otherwise."""
+        if getattr(self.__pinned, "priority", None) is not None:
+            yield
+            return
+        self.__pinned.priority = "bulk"
+        try:
+            yield
+        finally:
+            self.__pinned.priority = None
+
+
+    @contextlib.contextmanager
+    def __admit(self, operation):
+        """Counts a call of an operation in progress until the end of the
+        with block, if it is admitted.
+
+        Raises:
+            OverloadedError: if the operation has MAX_IN_FLIGHT calls in
+                progress, or MAX_QUEUED_CALLS native calls are waiting.
+        """
+        max_in_flight = self.__config["MAX_IN_FLIGHT"].get(
+            operation, self.__config["MAX_IN_FLIGHT_DEFAULT"])
+        max_queued = self.__config["MAX_QUEUED_CALLS"]
+        queued = self.__get_queued_calls() if max_queued > 0 else 0
+        with self.__admission_lock:
+            stats = self.__admission_stats[operation]
+            if max_queued > 0 and queued >= max_queued:
+                stats["shed"] += 1
+                raise OverloadedError(
+                    "Overloaded: {n} calls queued".format(n=queued))
+            if max_in_flight > 0 and stats["in_flight"] >= max_in_flight:
+                stats["shed"] += 1
+                raise OverloadedError(
+                    "Overloaded: {n} {o} calls in progress".format(
+                        n=stats["in_flight"], o=operation))
+            stats["in_flight"] += 1
+            stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            with self.__admission_lock:
+                stats["in_flight"] -= 1
+
+
+    def __get_queued_calls(self):
+        """Returns the number of native calls waiting for a scheduler, or
+        for a handle of an unscheduled pool."""
+        with self.__schedulers_lock:
+            schedulers = self.__schedulers.values()
+        # not under the generation's lock, held while handles are opened
+        generation = self.__get_generation()
+        pools = (generation.geocoder_handles.values() + 
+            generation.geospatial_handles.values())
+        return (sum(scheduler_.waiting() for scheduler_ in schedulers) +
+            sum(pool.waiting() for pool in pools))
+
+
+    def __get_admission_stats(self):
+        """Returns the calls in progress, admitted and shed by operation, and
+        the native calls queued."""
+        with self.__admission_lock:
+            operations = dict(
+                (operation, dict(stats)) 
+                for operation, stats in self.__admission_stats.items())
+        return {"operations": operations, "queued": self.__get_queued_calls()}
+
+
+    def __get_scheduler(self, pool):
+        """Returns the scheduler of a pool, or None if calls are not
+        scheduled. Pools reopened under the same name share a scheduler."""
+        calls_per_handle = self.__config["SCHEDULER_CALLS_PER_HANDLE"]
+        if calls_per_handle <= 0:
+            return None
+        with self.__schedulers_lock:
+            if pool.name not in self.__schedulers:
+                self.__schedulers[pool.name] = scheduler.PriorityScheduler(
+                    len(pool.handles) * calls_per_handle, 
+                    self.__config["SCHEDULER_WEIGHTS"])
+            return self.__schedulers[pool.name]
+
+
+    def __is_contended(self):
+        """Returns True if interactive calls are running or waiting, or have
+        been in the last CONTENDED_SECONDS."""
+        with self.__schedulers_lock:
+            schedulers = self.__schedulers.values()
+        return any(
+            "interactive" in scheduler_.weights and 
+            scheduler_.is_active(
+                "interactive", self.__config["CONTENDED_SECONDS"])
+            for scheduler_ in schedulers)
+
+
+    def __call_native(self, kind, pool, rows, function, datasets=None):
+        """Makes a PxPointSC call on a handle of a pool, scheduled, hedged and
+        with the calling thread's deadline, as configured.
+
+        Args:
+            kind (str): The kind of call, whose latencies set its hedge delay.
+            pool (hedging.HandlePool): The handles to make the call on.
+            rows (int): The number of input rows, which sets the call's
+                priority class if the calling thread has none.
+            function (callable): Takes a handle and makes the call.
+            datasets (str, optional): The dataset profile of the pool's
+                geocoders, recorded in slow call captures.
+
+        Returns:
+            What function returns.
+
+        Raises:
+            hedging.DeadlineExceeded: if the deadline passes first.
+        """
+        deadline = getattr(self.__pinned, "deadline", None)
+        if datasets is not None:
+            function = self.__in_dataset_profile(function, datasets)
+        scheduler_ = self.__get_scheduler(pool)
+        if scheduler_ is not None:
+            priority_class = getattr(self.__pinned, "priority", None) or (
+                "interactive" if rows <= 1 else "bulk")
+            if not scheduler_.acquire(priority_class, deadline):
+                self.__hedge_stats.add("deadlines_exceeded")
+                raise hedging.DeadlineExceeded("Deadline exceeded")
+            def admit_hedge():
+                # a hedge takes a slot of its own, if one is free at once
+                if not scheduler_.try_acquire(priority_class):
+                    return None
+                return lambda: scheduler_.release(priority_class)
+            try:
+                return self.__call_hedged(
+                    kind, pool, function, deadline, admit_hedge)
+            finally:
+                scheduler_.release(priority_class)
+        return self.__call_hedged(kind, pool, function, deadline)
+
+
+    def __in_dataset_profile(self, function, datasets):
+        """Returns function, recording a dataset profile for the thread that
+        makes the call, which may not be the calling thread."""
+        def call(handle):
+            outer = getattr(self.__pinned, "datasets", None)
+            self.__pinned.datasets = datasets
+            try:
+                return function(handle)
+            finally:
+                self.__pinned.datasets = outer
+        return call
+
+
+    def __call_hedged(self, kind, pool, function, deadline, admit_hedge=None):
+        """Makes a PxPointSC call on a handle of a pool, hedged as
+        configured; see __call_native(). admit_hedge, if given, admits the
+        hedge through the call's scheduler; see hedging.call()."""
+        hedge_delay = None
+        if self.__config["HEDGE_PERCENTILE"] > 0 and len(pool.handles) > 1:
+            hedge_delay = self.__latencies.percentile(
+                kind, self.__config["HEDGE_PERCENTILE"])
+            if hedge_delay is not None:
+                hedge_delay = max(
+                    hedge_delay, self.__config["HEDGE_MIN_MS"] / 1000.0)
+        try:
+            result, _, hedge_won = hedging.call(
+                pool, function, hedge_delay, deadline, 
+                lambda seconds: self.__latencies.add(kind, seconds),
+                lambda: self.__hedge_stats.add("hedged"), admit_hedge)
+        except hedging.DeadlineExceeded:
+            self.__hedge_stats.add("deadlines_exceeded")
+            raise
+        if hedge_won:
+            self.__hedge_stats.add("hedge_wins")
+        return result
+
+
+    def __get_geocoder_pool(self, generation=None, datasets=None):
+        """Returns the pool of geocoders of a dataset profile, initializing it
+        on first use.
+
+        Raises:
+            ValueError: if a dataset of the profile is not in the catalog.
+            RuntimeError: if a geocoder cannot be initialized.
+        """
+        generation = generation or self.__get_generation()
+        with generation.lock:
+            if datasets not in generation.geocoder_handles:
+                geocoder_handles = []
+                try:
+                    for _ in range(self.__get_pool_size()):
+                        geocoder_handle, return_code, return_message = (
+                            pxpointsc.geocoder_init(
+                                generation.data_catalog,
+                                None if datasets is None else 
+                                    self.__config[
+                                        "GEOCODER_DATASET_PROFILES"][datasets]))
+                        if return_code != pxcommon.PXP_SUCCESS:
+                            raise RuntimeError(
+                                "Error initializing geocoder. Code: {c}. "
+                                "Message: {m}".format(
+                                    c=return_code, m=return_message))
+                        geocoder_handles.append(geocoder_handle)
+                except Exception:
+                    for geocoder_handle in geocoder_handles:
+                        pxpointsc.geocoder_close(geocoder_handle)
+                    raise
+                generation.geocoder_handles[datasets] = hedging.HandlePool(
+                    geocoder_handles, 
+                    "geocoder" + GeoSpatial.__dataset_key_prefix(datasets))
+            return generation.geocoder_handles[datasets]
+
+
+    def __get_geospatial_pool(self, layer_name, generation=None):
+        """Returns the pool of spatial processors a layer is attached to,
+        initializing it on first use. Shard layers have a pool each."""
+        generation = generation or self.__get_generation()
+        handle_key = layer_name if layer_name in self.__shard_layers else None
+        with generation.lock:
+            if handle_key not in generation.geospatial_handles:
+                geospatial_handles = []
+                try:
+                    for _ in range(self.__get_pool_size()):
+                        geospatial_handle, return_code, return_message = (
+                            pxpointsc.geospatial_init(generation.data_catalog))
+                        if return_code != pxcommon.PXP_SUCCESS:
+                            raise RuntimeError(
+                                "Error initializing spatial processor. "
+                                "Code: {c}. Message: {m}".format(
+                                    c=return_code, m=return_message))
+                        geospatial_handles.append(geospatial_handle)
+                except Exception:
+                    for geospatial_handle in geospatial_handles:
+                        pxpointsc.geospatial_close(geospatial_handle)
+                    raise
+                generation.geospatial_handles[handle_key] = (
+                    hedging.HandlePool(geospatial_handles, "geospatial{k}"
+                        .format(k="" if handle_key is None else 
+                            "[{a}]".format(a=handle_key))))
+            return generation.geospatial_handles[handle_key]
+
+
+    def __get_pool_size(self):
+        """Returns the number of handles in each pool."""
+        return max(1, self.__config["HANDLE_POOL_SIZE"])
+
+
+    def __get_layer_fields(self, layer_name, generation=None):
+        """Returns the output field specs of a layer, attaching it to every
+        spatial processor of its pool on first use. Only the first is asked
+        for the layer's fields; they are the same for all."""
+        generation = generation or self.__get_generation()
+        with generation.lock:
+            if layer_name not in generation.layer_fields:
+                handles = self.__get_geospatial_pool(
+                    layer_name, generation).handles
+                layer_fields = pxpointsc.geospatial_prepare(
+                    handles[0], generation.data_catalog, [layer_name])
+                for geospatial_handle in handles[1:]:
+                    return_code, return_message = (
+                        pxpointsc.geospatial_attach_layer(
+                            geospatial_handle, generation.data_catalog, 
+                            layer_name))
+                    if return_code != pxcommon.PXP_SUCCESS:
+                        raise RuntimeError(
+                            "Error attaching layer {l}. Code: {c}. "
+                            "Message: {m}".format(
+                                l=layer_name, c=return_code, 
+                                m=return_message))
+                generation.layer_fields.update(layer_fields)
+            return generation.layer_fields[layer_name]
+
+
+    def reload_data_catalog(self):
+        """Reloads the data catalog and switches to it without downtime.
+
+        New handles are opened, and the layers open now attached, while
+        calls go on with the old ones. New calls then switch to the new
+        handles, and the old ones are closed once the calls using them have
+        finished. In-memory caches are cleared, since they may hold results
+        from the old data.
+
+        Returns:
+            True if the new catalog is in use, or False if it could not be
+            loaded (the error is logged, and the old catalog stays in use).
+        """
+        with self.__reload_lock:
+            old = self.__generation
+            new = None
+            try:
+                new = _CatalogGeneration(datacatalog.DataCatalog(
+                    self.__data_catalog_path, self.__shapefile_root_dir), 
+                    old.number + 1)
+                # open what is open now, so that no call pays for it
+                for datasets in sorted(old.geocoder_handles):
+                    self.__get_geocoder_pool(new, datasets)
+                for layer_name in sorted(old.layer_fields):
+                    if layer_name in new.data_catalog.spatial_layers:
+                        self.__get_layer_fields(layer_name, new)
+                for layer_name in sorted(old.local_layers):
+                    if layer_name in new.data_catalog.spatial_layers:
+                        self.__get_local_layer(layer_name, new)
+            except Exception as e:
+                self.__reload_stats.add("failures")
+                logging.error(
+                    "Error reloading data catalog {p}: {e}".format(
+                        p=self.__data_catalog_path, e=e))
+                if new is not None:
+                    new.close()
+                return False
+            with self.__generation_lock:
+                self.__generation = new
+            self.__clear_caches()
+            old.wait_idle()
+            old.close()
+            # calls on the old generation may have cached results meanwhile
+            self.__clear_caches()
+            self.__reload_stats.add("reloads")
+            logging.info("Reloaded data catalog {p}".format(
+                p=self.__data_catalog_path))
+            return True
+
+
+    def close(self):
+        """Stops watching the data catalog, and closes the handles once the
+        calls using them have finished."""
+        self.__closed.set()
+        if self.__watcher is not None:
+            self.__watcher.join()
+            self.__watcher = None
+        if self.__slow_call_recorder is not None:
+            self.__slow_call_recorder.uninstall()
+            self.__slow_call_recorder = None
+        with self.__reload_lock:
+            self.__generation.wait_idle()
+            self.__generation.close()
+
+
+    def __clear_caches(self):
+        """Empties the in-memory caches of data-dependent results."""
+        self.__geocode_cache.clear()
+        self.__reverse_geocode_cache.clear()
+        self.__grid_cache.clear()
+        self.__place_hierarchy.clear()
+
+
+    def __get_data_catalog_signature(self):
+        """Returns the modification time and size of the data catalog file,
+        or None if it cannot be read."""
+        try:
+            stat = os.stat(self.__data_catalog_path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+
+    def __watch_data_catalog(self):
+        """Reloads the data catalog whenever its file changes, until the
+        instance is closed."""
+        signature = self.__get_data_catalog_signature()
+        while not self.__closed.wait(
+                self.__config["DATA_CATALOG_WATCH_SECONDS"]):
+            new_signature = self.__get_data_catalog_signature()
+            if new_signature is None or new_signature == signature:
+                continue
+            # a catalog that fails to load is retried when it changes again
+            signature = new_signature
+            self.reload_data_catalog()
+
+
     def query_layer(
             self, call_id, layer_name, lat, lon, output_fields=None, 
             where_clause=None, search_dist_meters=0, max_results=1):
@@ -191,7 +1926,8 @@ class GeoSpatial:
             call_id (str): A layer query identifier, for logging purposes.
             layer_name (str): The name of the layer to be queried. This name
                 must be a key to the spatial_layers dictionary of the data 
-                catalog supplied to this instance's constructor.
+                catalog supplied to this instance's constructor, or to the
+                LAYER_SHARDS configuration.
             lat (float): The location's latitude, a double in decimal degrees.
             lon (float): The location's longitude, a double in decimal degrees.
             output_fields (str, optional): The desired metadata fields from the 
@@ -202,9 +1938,596 @@ class GeoSpatial:
                 where-clause.
             search_dist_meters (int, optional): the maximum distance from the 
                 location, in meters, to search for features in the layer.
+            max_results (int, optional): The maximum number of features to
+                return. Zero or less means all of them.
+
+        Output fields, the where-clause and max_results are passed on to
+        PxPointSC, so that it only returns the requested fields of at most
+        max_results matching features.
+
         Returns:
             A JSON-formatted string containing results and a status code.
         """
-        pass
+        start = time.time()
+        if not self.__is_known_layer(layer_name):
+            status, json_results = GeoSpatial.create_server_error_json_result(
+                "Unknown layer: {l}".format(l=layer_name),
+                _StatusCode.INVALID_REQUEST)
+        else:
+            try:
+                with self.__admit("query_layer"):
+                    output_table, error_table, return_code = (
+                        self.__query_layer_results(
+                            layer_name, [(call_id, lat, lon)], output_fields, 
+                            where_clause, search_dist_meters, max_results)[0])
+                status, json_results = self.create_json_result_with_status(
+                    output_table, error_table, return_code, max_results)
+            except ValueError as e:
+                status, json_results = (
+                    GeoSpatial.create_server_error_json_result(
+                        str(e), _StatusCode.INVALID_REQUEST))
+            except OverloadedError as e:
+                status, json_results = (
+                    GeoSpatial.create_server_error_json_result(
+                        str(e), _StatusCode.OVERLOADED))
+            except RuntimeError as e:
+                status, json_results = (
+                    GeoSpatial.create_server_error_json_result(str(e)))
+        self.__call_log.log(
+            "query_layer", call_id=call_id, layer=layer_name, lat=lat, 
+            lon=lon, search_dist_meters=search_dist_meters, 
+            elapsed_ms=round((time.time() - start) * 1000, 3), status=status)
+        return json_results
+
+
+    def query_layer_batch(
+            self, layer_name, points, output_fields=None, where_clause=None, 
+            search_dist_meters=0, max_results=1):
+        """Queries a layer about many locations, making one PxPointSC call
+        per chunk of BATCH_CHUNK_SIZE locations not already cached.
+
+        Args:
+            layer_name (str): The name of the layer to be queried.
+            points (iterable): (call_id, lat, lon) tuples. Call ids need not
+                be unique.
+            output_fields, where_clause, search_dist_meters, max_results: As
+                for query_layer(), applied to every location.
+
+        Yields:
+            A (call_id, JSON-formatted string) tuple for each location, in
+            input order. The JSON is what query_layer() would return.
+        """
+        for chunk in self.__chunks(points):
+            start = time.time()
+            with self.__bulk_priority():
+                chunk_results = self.create_batch_json_results(
+                    lambda: self.query_layer_tables(
+                        layer_name, chunk, output_fields, where_clause, 
+                        search_dist_meters, max_results), 
+                    len(chunk), max_results, "query_layer_batch")
+            self.__call_log.log(
+                "query_layer_batch", layer=layer_name, rows=len(chunk), 
+                search_dist_meters=search_dist_meters, 
+                elapsed_ms=round((time.time() - start) * 1000, 3))
+            for (call_id, _, _), (_, json_result) in zip(
+                    chunk, chunk_results):
+                yield call_id, json_result
+
+
+    def query_layer_tables(
+            self, layer_name, points, output_fields=None, where_clause=None, 
+            search_dist_meters=0, max_results=1):
+        """Queries a layer about a list of (call_id, lat, lon) tuples, with
+        one PxPointSC call for the points not answered locally or cached.
+
+        Returns:
+            A list of (output_table, error_table, return_code) tuples, one per
+            point, each carrying its call id.
+
+        Raises:
+            ValueError: if the layer, or an output field, is unknown, or the
+                where-clause is invalid.
+            RuntimeError: if the spatial processor or layer cannot be 
+                initialized.
+        """
+        if not self.__is_known_layer(layer_name):
+            raise ValueError("Unknown layer: {l}".format(l=layer_name))
+        return self.__query_layer_results(
+            layer_name, points, output_fields, where_clause, 
+            search_dist_meters, max_results)
+
+
+    def __query_layer_results(
+            self, layer_name, points, output_fields, where_clause, 
+            search_dist_meters, max_results):
+        """Queries a layer about a list of (call_id, lat, lon) tuples, with the
+        local layer engine where it can answer, otherwise through the caches
+        and PxPointSC.
+
+        Returns:
+            A list of (output_table, error_table, return_code) tuples, one per
+            point.
+
+        Raises:
+            ValueError: if an output field is unknown, or the where-clause
+                is invalid.
+            RuntimeError: if the spatial processor or layer cannot be 
+                initialized.
+        """
+        with self.__pin_generation():
+            output_fields = GeoSpatial.parse_output_fields(
+                layer_name, output_fields)
+            if where_clause is not None and ";" in where_clause:
+                # it would end the processing option
+                raise ValueError("Where-clause may not contain ';'")
+            if layer_name in self.__config["LAYER_SHARDS"]:
+                return self.__query_sharded_layer(
+                    layer_name, points, output_fields, where_clause, 
+                    search_dist_meters, max_results)
+            local_layer = None
+            if (where_clause is None and 
+                    layer_name in self.__config["LOCAL_LAYERS"]):
+                local_layer = self.__get_local_layer(layer_name)
+                if not local_layer.supports(search_dist_meters):
+                    local_layer = None
+            if local_layer is None:
+                return self.__query_layer_tables(
+                    layer_name, points, output_fields, where_clause, 
+                    search_dist_meters, max_results)
+            field_indexes = None
+            if output_fields is not None:
+                field_indexes = GeoSpatial.select_fields(
+                    local_layer.field_names, output_fields)
+            results = []
+            for call_id, lat, lon in points:
+                result = self.__query_local_layer(
+                    local_layer, call_id, lat, lon, search_dist_meters, 
+                    max_results, field_indexes)
+                self.__local_stats.add("queries")
+                if random.random() < self.__config["LOCAL_CROSS_CHECK_RATE"]:
+                    result = self.__cross_check(
+                        result, self.__query_layer_tables(
+                            layer_name, [(call_id, lat, lon)], output_fields, 
+                            where_clause, search_dist_meters, max_results)[0])
+                results.append(result)
+            return results
+
+
+    def __is_known_layer(self, layer_name):
+        """Returns True if a layer is in the data catalog, or is sharded."""
+        return (layer_name in self.__get_data_catalog().spatial_layers or 
+            layer_name in self.__config["LAYER_SHARDS"])
+
+
+    def __query_sharded_layer(
+            self, layer_name, points, output_fields, where_clause, 
+            search_dist_meters, max_results):
+        """Queries a sharded layer about a list of (call_id, lat, lon) tuples,
+        querying the shards the points are routed to in parallel.
+
+        Returns:
+            A list of (output_table, error_table, return_code) tuples, one per
+            point, in input order, whose columns are the sharded layer's.
+
+        Raises:
+            ValueError: if a shard is not in the data catalog, an output
+                field is unknown, or the where-clause is invalid.
+            RuntimeError: if a spatial processor or shard cannot be 
+                initialized.
+        """
+        layer_prefix = "[{a}]".format(a=layer_name)
+        results = [None] * len(points)
+        # positions in points of the points routed to each shard
+        routes = collections.OrderedDict()
+        shards = self.__config["LAYER_SHARDS"][layer_name]
+        unrouted = 0
+        for position, (_, lat, lon) in enumerate(points):
+            for shard_name, (min_lat, min_lon, max_lat, max_lon) in shards:
+                if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                    routes.setdefault(shard_name, []).append(position)
+                    break
+            else:
+                unrouted += 1
+                return_code = pxcommon.error_str_to_code("NOTFOUND")
+                results[position] = (None, GeoSpatial.create_error_table(
+                    return_code, "No features found", layer_prefix), 
+                    return_code)
+        self.__shard_stats.add("points", len(points))
+        self.__shard_stats.add("unrouted", unrouted)
+        data_catalog = self.__get_data_catalog()
+        for shard_name in routes:
+            if shard_name not in data_catalog.spatial_layers:
+                raise ValueError("Unknown layer: {l}".format(l=shard_name))
+        shard_results = self.__call_parallel([
+            lambda shard_name=shard_name, positions=positions: 
+                self.__query_layer_results(
+                    shard_name, [points[i] for i in positions], 
+                    output_fields, where_clause, search_dist_meters, 
+                    max_results)
+            for shard_name, positions in routes.items()])
+        for (shard_name, positions), shard_result in zip(
+                routes.items(), shard_results):
+            shard_prefix = "[{a}]".format(a=shard_name)
+            for position, (output_table, error_table, return_code) in zip(
+                    positions, shard_result):
+                results[position] = (
+                    GeoSpatial.rename_layer_cols(
+                        output_table, shard_prefix, layer_prefix),
+                    GeoSpatial.rename_layer_cols(
+                        error_table, shard_prefix, layer_prefix),
+                    return_code)
+        return results
+
+
+    def __call_parallel(self, calls):
+        """Makes calls in parallel, on threads that share the calling thread's
+        generation, and returns their results in order. The last call is
+        made on the calling thread. An exception a call raises is raised
+        again once all have finished."""
+        generation = self.__get_generation()
+        results = [None] * len(calls)
+        errors = []
+        deadline = getattr(self.__pinned, "deadline", None)
+        priority_class = getattr(self.__pinned, "priority", None)
+        def call(i):
+            self.__pinned.generation = generation
+            self.__pinned.deadline = deadline
+            self.__pinned.priority = priority_class
+            try:
+                results[i] = calls[i]()
+            except Exception:
+                errors.append(sys.exc_info())
+            finally:
+                self.__pinned.generation = None
+                self.__pinned.deadline = None
+                self.__pinned.priority = None
+        threads = [
+            threading.Thread(target=call, args=(i, )) 
+            for i in range(len(calls) - 1)]
+        self.__shard_stats.add("parallel_calls", len(threads))
+        for thread in threads:
+            thread.start()
+        try:
+            if calls:
+                results[-1] = calls[-1]()
+        finally:
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return results
+
+
+    def __get_local_layer(self, layer_name, generation=None):
+        """Returns the local engine for a layer, reading its shapefile on
+        first use."""
+        generation = generation or self.__get_generation()
+        with generation.lock:
+            if layer_name not in generation.local_layers:
+                generation.local_layers[layer_name] = locallayer.LocalLayer(
+                    layer_name, 
+                    generation.data_catalog.spatial_layers[layer_name])
+            return generation.local_layers[layer_name]
 
 
+    def __query_local_layer(
+            self, local_layer, call_id, lat, lon, search_dist_meters, 
+            max_results, field_indexes=None):
+        """Answers a query from a local layer engine.
+
+        Args:
+            field_indexes (list, optional): The indexes of the output fields
+                among the layer's fields. None means all fields.
+
+        Returns:
+            The same (output_table, error_table, return_code) tuple that a
+            native query would.
+        """
+        layer_name = local_layer.layer_alias
+        output_table = table.Table()
+        output_table.append_col("[{a}]INPUT.{c}".format(
+            a=layer_name, c=GeoSpatial.__INPUT_ID_COL_NAME))
+        if field_indexes is None:
+            field_indexes = range(len(local_layer.field_names))
+        for i in field_indexes:
+            output_table.append_col(
+                "[{a}]{f}".format(a=layer_name, f=local_layer.field_names[i]), 
+                local_layer.field_var_types[i])
+        if search_dist_meters <= 0:
+            indexes = local_layer.find_within(lat, lon)
+            if max_results > 0:
+                indexes = indexes[:max_results]
+        else:
+            indexes = [index for _, index in local_layer.find_nearest(
+                lat, lon, search_dist_meters, max_results)]
+        for record in local_layer.records(indexes):
+            output_table.append_row(
+                [call_id] + [record[i] for i in field_indexes])
+        if output_table.is_empty():
+            # mirror PxPointSC, which reports finding no features as an error
+            return_code = pxcommon.error_str_to_code("NOTFOUND")
+            return None, GeoSpatial.create_error_table(
+                return_code, "No features found", 
+                "[{a}]".format(a=layer_name)), return_code
+        error_table = table.Table()
+        for col_name in GeoSpatial.__ERROR_TABLE_COLS.split(";"):
+            error_table.append_col("[{a}]{c}".format(a=layer_name, c=col_name))
+        return output_table, error_table, pxcommon.PXP_SUCCESS
+
+
+    def __cross_check(self, local_result, native_result):
+        """Compares a local layer result with PxPointSC's, returning the one
+        to trust."""
+        self.__local_stats.add("cross_checks")
+        def features(result):
+            output_table, _, return_code = result
+            if return_code != pxcommon.PXP_SUCCESS or output_table is None:
+                return []
+            # compare attribute values only; column names and types may be
+            # reported differently
+            return sorted(
+                [unicode(value) for value in row[1:]]
+                for row in output_table.rows)
+        local_features = features(local_result)
+        native_features = features(native_result)
+        if local_features == native_features:
+            return local_result
+        self.__local_stats.add("mismatches")
+        logging.warning(
+            "Local layer result differs from PxPointSC. Local: {l}. "
+            "PxPointSC: {n}".format(l=local_features, n=native_features))
+        return native_result
+
+
+    def __query_layer_tables(
+            self, layer_name, points, output_fields, where_clause, 
+            search_dist_meters, max_results):
+        """Queries a layer about a list of (call_id, lat, lon) tuples through
+        the caches and, for the points not cached, one PxPointSC call.
+
+        Returns:
+            A list of (output_table, error_table, return_code) tuples, one per
+            point.
+
+        Raises:
+            RuntimeError: if the spatial processor or layer cannot be 
+                initialized.
+        """
+        vintage = self.__get_layer_vintage(layer_name)
+        results = [None] * len(points)
+        # Coincident points are queried once, as the first of them.
+        tolerance = self.__config["BATCH_POINT_TOLERANCE_DEGREES"]
+        if tolerance > 0:
+            groups = GeoSpatial.__group_rows([
+                (round(lat / tolerance), round(lon / tolerance))
+                for _, lat, lon in points])
+        else:
+            groups = GeoSpatial.__group_rows(
+                [(lat, lon) for _, lat, lon in points])
+        self.__batch_stats.add("point_duplicates", len(points) - len(groups))
+        # (positions in points, cell key, point store key) of each point to
+        # query
+        misses = []
+        for _, positions in groups:
+            _, lat, lon = points[positions[0]]
+            cell_key, point_store_key, cached = self.__get_cached_layer_result(
+                layer_name, lat, lon, output_fields, where_clause, 
+                search_dist_meters, max_results, vintage)
+            if cached is not None:
+                GeoSpatial.__fan_out(results, cached, points, positions)
+            else:
+                misses.append((positions, cell_key, point_store_key))
+        if not misses:
+            return results
+        # Geometry is only worth fetching for cells that may be cacheable.
+        fetch_geometry = any(
+            cell_key is not None and 
+            not self.__grid_cache.is_straddling(cell_key)
+            for _, cell_key, _ in misses)
+
+        geospatial_pool = self.__get_geospatial_pool(layer_name)
+        layer_fields = self.__get_layer_fields(layer_name)
+        layer_prefix = "[{a}]".format(a=layer_name)
+        id_col = "{p}INPUT.{c}".format(
+            p=layer_prefix, c=GeoSpatial.__INPUT_ID_COL_NAME)
+        output_cols = [id_col]
+        if output_fields is None:
+            output_cols.extend(layer_fields)
+        else:
+            # layer_fields are "[layer]field" specs
+            output_cols.extend(
+                layer_fields[i] for i in GeoSpatial.select_fields(
+                    [spec[len(layer_prefix):] for spec in layer_fields], 
+                    output_fields))
+        if fetch_geometry:
+            output_cols.append(
+                layer_prefix + GeoSpatial.__LAYER_GEOMETRY_COL_NAME)
+
+        query = lambda query_points, dist_meters: self.__call_geospatial_query(
+            geospatial_pool, layer_name, query_points, output_cols, 
+            where_clause, dist_meters, max_results)
+        query_points = [points[positions[0]] for positions, _, _ in misses]
+        if (search_dist_meters > 0 and max_results > 0 and 
+                self.__config["ADAPTIVE_NEAREST_MIN_METERS"] > 0):
+            miss_results = self.__query_nearest_adaptive(
+                layer_name, query, query_points, search_dist_meters, 
+                max_results)
+        else:
+            miss_results = query(query_points, search_dist_meters)
+
+        # stored in one transaction for the batch
+        stored = []
+        for (positions, cell_key, point_store_key), result in zip(
+                misses, miss_results):
+            output_table, error_table, return_code = result
+            if fetch_geometry and output_table is not None:
+                # The geometry column is always last, whatever its returned
+                # name.
+                geometries = GeoSpatial.remove_col(
+                    output_table, output_table.ncols() - 1)
+                if (cell_key is not None and 
+                        not self.__grid_cache.is_straddling(cell_key) and 
+                        self.__grid_cache.offer(cell_key, geometries, result)):
+                    stored.append((
+                        GeoSpatial.__CELL_KEY_PREFIX + json.dumps(cell_key),
+                        vintage, output_table))
+                    point_store_key = None
+            if (point_store_key is not None and 
+                    return_code == pxcommon.PXP_SUCCESS and 
+                    output_table is not None):
+                stored.append((point_store_key, vintage, output_table))
+            GeoSpatial.__fan_out(results, result, points, positions)
+        self.__save_results(stored)
+        return results
+
+
+    def __call_geospatial_query(
+            self, geospatial_pool, layer_name, points, output_cols, 
+            where_clause, search_dist_meters, max_results):
+        """Makes one PxPointSC query about a list of (call_id, lat, lon)
+        tuples.
+
+        Returns:
+            A list of (output_table, error_table, return_code) tuples, one per
+            point.
+
+        Raises:
+            hedging.DeadlineExceeded: if the call's deadline passes first.
+        """
+        layer_prefix = "[{a}]".format(a=layer_name)
+        # Rows are identified by their position in the batch.
+        input_table = GeoSpatial.create_lat_lons_input_table(
+            (str(row_id), lat, lon)
+            for row_id, (_, lat, lon) in enumerate(points))
+        output_table, error_table, return_code, return_message = (
+            self.__call_native(
+                "query" + layer_prefix, geospatial_pool, len(points),
+                lambda geospatial_handle: pxpointsc.geospatial_query(
+                    geospatial_handle,
+                    input_table,
+                    ";".join(output_cols),
+                    ";".join([output_cols[0], 
+                        GeoSpatial.__ERROR_TABLE_COLS.replace(
+                            "$", layer_prefix + "$")]),
+                    GeoSpatial.create_query_options(
+                        layer_name, search_dist_meters, where_clause, 
+                        max_results)
+                )))
+        return GeoSpatial.split_batch_result(
+            output_table, error_table, return_code, return_message, 
+            len(points), layer_prefix)
+
+
+    def __query_nearest_adaptive(
+            self, layer_name, query, points, search_dist_meters, max_results):
+        """Answers FindNearest queries with searches of growing radius.
+
+        A point is answered by the first search that finds max_results
+        features within the radius: no feature beyond it can be nearer. The
+        others are searched again at a larger radius, and the last search is
+        at search_dist_meters.
+
+        Args:
+            layer_name (str): The layer alias.
+            query (callable): Takes a list of points and a search distance
+                and returns their results, as __call_geospatial_query() does.
+            points (list): (call_id, lat, lon) tuples.
+            search_dist_meters (float): The caller's search distance.
+            max_results (int): The number of features wanted per point.
+
+        Returns:
+            A list of (output_table, error_table, return_code) tuples, one per
+            point.
+        """
+        not_found = pxcommon.error_str_to_code("NOTFOUND")
+        growth = max(1.5, self.__config["ADAPTIVE_NEAREST_GROWTH"])
+        radius = self.__get_nearest_radius(layer_name, search_dist_meters)
+        results = [None] * len(points)
+        remaining = range(len(points))
+        with self.__nearest_lock:
+            radii = self.__nearest_radii.setdefault(
+                layer_name, collections.deque(
+                    maxlen=max(1, self.__config["ADAPTIVE_NEAREST_HISTORY"])))
+        self.__nearest_stats.add("points", len(points))
+        while remaining:
+            self.__nearest_stats.add("searches")
+            last = radius >= search_dist_meters
+            next_remaining = []
+            for i, result in zip(remaining, query(
+                    [points[i] for i in remaining], 
+                    search_dist_meters if last else radius)):
+                output_table, _, return_code = result
+                complete = (return_code == pxcommon.PXP_SUCCESS and 
+                    output_table is not None and 
+                    output_table.nrows() >= max_results)
+                if complete:
+                    # Points short of features even at the caller's distance
+                    # say little about the typical radius, and are left out.
+                    with self.__nearest_lock:
+                        radii.append(min(radius, search_dist_meters))
+                # errors other than finding too few features are final
+                if (complete or last or (return_code != pxcommon.PXP_SUCCESS
+                        and return_code != not_found)):
+                    results[i] = result
+                else:
+                    next_remaining.append(i)
+            if next_remaining:
+                self.__nearest_stats.add("expansions")
+            remaining = next_remaining
+            radius *= growth
+        return results
+
+
+    def __get_nearest_radius(self, layer_name, search_dist_meters):
+        """Returns the radius adaptive FindNearest searches of a layer start
+        at."""
+        radius = self.__config["ADAPTIVE_NEAREST_MIN_METERS"]
+        with self.__nearest_lock:
+            radii = sorted(self.__nearest_radii.get(layer_name, ()))
+        if radii:
+            percentile = self.__config["ADAPTIVE_NEAREST_PERCENTILE"]
+            radius = max(radius, radii[min(
+                len(radii) - 1, len(radii) * percentile // 100)])
+        return min(radius, search_dist_meters)
+
+
+    def __get_nearest_layers(self):
+        """Returns the layers adaptive FindNearest searches have radii for."""
+        with self.__nearest_lock:
+            return list(self.__nearest_radii)
+
+
+    def __get_cached_layer_result(
+            self, layer_name, lat, lon, output_fields, where_clause, 
+            search_dist_meters, max_results, vintage):
+        """Looks up a layer query result in the caches.
+
+        Returns:
+            A (cell_key, point_store_key, cached_result) tuple. The cell key is
+            None if the query cannot be grid cached, and the cached result
+            None if there is none.
+        """
+        cached = None
+        # Points in a grid cell known to lie within a single polygon share
+        # that polygon's result.
+        cell_key = None
+        # Grid cached layers do not overlap, so WITHIN results have at most
+        # one feature whatever max_results is.
+        if search_dist_meters <= 0:
+            cell_key = self.__grid_cache.cell_key(
+                layer_name, lat, lon, (output_fields, where_clause))
+        if cell_key is not None:
+            cached = self.__grid_cache.get(cell_key)
+            if cached is None:
+                cached = self.__load_result(
+                    GeoSpatial.__CELL_KEY_PREFIX + json.dumps(cell_key),
+                    vintage)
+                if cached is not None:
+                    self.__grid_cache.put(cell_key, cached)
+        # Otherwise only an identical query can share a result.
+        point_store_key = GeoSpatial.__POINT_KEY_PREFIX + json.dumps([
+            layer_name, output_fields, where_clause, search_dist_meters,
+            max_results, round(lat, 6), round(lon, 6)])
+        if cached is None:
+            cached = self.__load_result(point_store_key, vintage)
+        return cell_key, point_store_key, cached
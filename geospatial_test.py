@@ -0,0 +1,872 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of GeoSpatial, with PxPointSC replaced by fakepxpointsc."""
+
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import fakepxpointsc
+fakepxpointsc.install()
+
+import calllog
+import geospatial
+import locallayer
+import pointindex
+import shapereader_test
+
+
+class GeoSpatialTestCase(unittest.TestCase):
+    """Creates a GeoSpatial instance, with config, for each test."""
+    config = {}
+
+    def setUp(self):
+        fakepxpointsc.reset()
+        self.addCleanup(fakepxpointsc.reset)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.data_catalog = fakepxpointsc.write_data_catalog(self.directory)
+        self.geo_spatial = self.create()
+
+    def create(self, **config):
+        """Creates another instance, with config added to the class's."""
+        geo_spatial = geospatial.GeoSpatial(
+            self.data_catalog, self.directory, dict(self.config, **config))
+        self.addCleanup(geo_spatial.close)
+        return geo_spatial
+
+    @staticmethod
+    def native_rows(function_name):
+        """Returns the number of rows sent to a PxPointSC function."""
+        return sum(
+            nrows for name, _, nrows in fakepxpointsc.calls
+            if name == function_name)
+
+    @staticmethod
+    def native_calls(function_name):
+        """Returns the number of calls to a PxPointSC function."""
+        return len([
+            call for call in fakepxpointsc.calls if call[0] == function_name])
+
+
+class BatchTest(GeoSpatialTestCase):
+    config = {"BATCH_CHUNK_SIZE": 3}
+
+    def test_get_locations(self):
+        locations = [
+            (str(i), "{n} Main St".format(n=i) if i != 4 else "")
+            for i in range(7)]
+        results = list(self.geo_spatial.get_locations(iter(locations)))
+        self.assertEqual(
+            [call_id for call_id, _ in locations],
+            [call_id for call_id, _ in results])
+        statuses = [
+            json.loads(json_result)["status"] for _, json_result in results]
+        self.assertEqual(["OK"] * 4 + ["NO_RESULTS"] + ["OK"] * 2, statuses)
+        self.assertEqual(
+            "6 MAIN ST",
+            json.loads(results[6][1])["result"][0]["$AddressLine"])
+        # one native call per chunk
+        self.assertEqual(3, self.native_calls("GeocoderGeocode"))
+        self.assertEqual(7, self.native_rows("GeocoderGeocode"))
+        # the results were cached
+        list(self.geo_spatial.get_locations(locations[:3]))
+        self.assertEqual(3, self.native_calls("GeocoderGeocode"))
+
+    def test_query_layer_batch(self):
+        points = [(str(i), 40.0 + i, -105.0) for i in range(5)]
+        results = list(self.geo_spatial.query_layer_batch("County", points))
+        self.assertEqual(
+            [call_id for call_id, _, _ in points],
+            [call_id for call_id, _ in results])
+        for call_id, json_result in results:
+            result = json.loads(json_result)
+            self.assertEqual("OK", result["status"])
+            self.assertEqual(
+                call_id, result["result"][0]["[County]INPUT.Id"])
+        self.assertEqual(2, self.native_calls("GeoSpatialQuery"))
+
+    def test_query_layer_batch_errors(self):
+        points = [("a", 40.0, -105.0), ("b", 41.0, -105.0)]
+        for results in (
+                self.geo_spatial.query_layer_batch("Nonesuch", points),
+                self.geo_spatial.query_layer_batch(
+                    "County", points, output_fields=["NOPE"])):
+            self.assertEqual(
+                ["INVALID_REQUEST"] * 2,
+                [json.loads(json_result)["status"]
+                 for _, json_result in results])
+        self.assertEqual(0, self.native_calls("GeoSpatialQuery"))
+        self.assertEqual([], list(
+            self.geo_spatial.query_layer_batch("County", [])))
+
+
+class BatchDedupTest(GeoSpatialTestCase):
+    config = {"GEOCODE_CACHE_SIZE": 0}
+
+    def test_equivalent_addresses_are_geocoded_once(self):
+        locations = [
+            ("a", "123 Main Street, Boulder, CO"),
+            ("b", "123 MAIN ST BOULDER CO"),
+            ("c", ""),
+            ("d", ""),
+            ("e", "9 Elm St, Boulder, CO"),
+            ("a", "123  main st., boulder, colorado")]
+        results = list(self.geo_spatial.get_locations(locations))
+        # empty addresses are never merged
+        self.assertEqual(4, self.native_rows("GeocoderGeocode"))
+        self.assertEqual(1, self.native_calls("GeocoderGeocode"))
+        self.assertEqual(
+            [call_id for call_id, _ in locations],
+            [call_id for call_id, _ in results])
+        for (call_id, _), (_, json_result) in zip(locations, results):
+            result = json.loads(json_result)
+            if call_id in ("c", "d"):
+                self.assertEqual("NO_RESULTS", result["status"])
+            else:
+                self.assertEqual(call_id, result["result"][0]["INPUT.Id"])
+        self.assertEqual(
+            2, self.geo_spatial.get_stats()["batch"]["geocode_duplicates"])
+
+    def test_coincident_points_are_queried_once(self):
+        points = [("a", 40.0, -105.0), ("b", 40.0, -105.0),
+                  ("c", 40.00001, -105.0), ("a", 40.0, -105.0)]
+        results = list(self.geo_spatial.query_layer_batch("County", points))
+        self.assertEqual(2, self.native_rows("GeoSpatialQuery"))
+        for (call_id, _, _), (result_id, json_result) in zip(points, results):
+            self.assertEqual(call_id, result_id)
+            result = json.loads(json_result)
+            self.assertEqual("OK", result["status"])
+            self.assertEqual(call_id, result["result"][0]["[County]INPUT.Id"])
+        self.assertEqual(
+            2, self.geo_spatial.get_stats()["batch"]["point_duplicates"])
+
+    def test_point_tolerance(self):
+        geo_spatial = self.create(BATCH_POINT_TOLERANCE_DEGREES=0.001)
+        points = [("a", 40.0, -105.0), ("b", 40.0001, -105.0001),
+                  ("c", 40.01, -105.0)]
+        results = list(geo_spatial.query_layer_batch("County", points))
+        self.assertEqual(2, self.native_rows("GeoSpatialQuery"))
+        self.assertEqual(
+            ["a", "b", "c"],
+            [json.loads(json_result)["result"][0]["[County]INPUT.Id"]
+             for _, json_result in results])
+
+    def test_stats_from_many_threads(self):
+        points = [("a", 40.0, -105.0)] * 10
+        def query():
+            for _ in range(20):
+                list(self.geo_spatial.query_layer_batch("County", points))
+        threads = [threading.Thread(target=query) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            4 * 20 * 9,
+            self.geo_spatial.get_stats()["batch"]["point_duplicates"])
+
+
+class GridCacheTest(GeoSpatialTestCase):
+    config = {"GRID_CACHE_LAYERS": {"County": 0.1}}
+
+    def query(self, lat, lon, layer_name="County"):
+        result = json.loads(
+            self.geo_spatial.query_layer("1", layer_name, lat, lon))
+        self.assertEqual("OK", result["status"])
+        return result["result"][0]
+
+    def test_cells_inside_a_polygon_are_cached(self):
+        first = self.query(40.01, -105.01)
+        # the same cell
+        self.assertEqual(first, self.query(40.09, -105.09))
+        self.assertEqual(1, self.native_calls("GeoSpatialQuery"))
+        # another cell
+        self.query(40.11, -105.01)
+        self.assertEqual(2, self.native_calls("GeoSpatialQuery"))
+        # the caller's fields, not the geometry asked for, are returned
+        self.assertNotIn("[County]$Geometry", first)
+
+    def test_straddling_cells_go_native(self):
+        # the fake's polygon ends at latitude 41
+        self.query(41.01, -105.01)
+        self.query(41.02, -105.02)
+        self.assertEqual(2, self.native_calls("GeoSpatialQuery"))
+        self.assertEqual(1, self.geo_spatial.get_stats()["grid_cache"][
+            "straddling"])
+
+    def test_other_layers_are_not_cached(self):
+        self.query(40.01, -105.01, "State")
+        self.query(40.01, -105.01, "State")
+        self.assertEqual(2, self.native_calls("GeoSpatialQuery"))
+
+
+class LocalLayerTest(GeoSpatialTestCase):
+    config = {"LOCAL_LAYERS": ["County"]}
+
+    def setUp(self):
+        GeoSpatialTestCase.setUp(self)
+        county_dir = os.path.join(self.directory, "County")
+        os.mkdir(county_dir)
+        # the fake finds FIPS 08013 and NAME Boulder everywhere
+        shapereader_test.write_shapefile(
+            os.path.join(county_dir, "County"),
+            [shapereader_test.square(-106, 39, 2),
+             shapereader_test.square(-100, 39, 2)],
+            [("FIPS", "C", 5, 0), ("NAME", "C", 12, 0)],
+            [["08013", "Boulder"], ["20001", "Allen"]])
+
+    def query(self, geo_spatial, lat, lon):
+        result = json.loads(geo_spatial.query_layer("1", "County", lat, lon))
+        self.assertEqual("OK", result["status"])
+        return result["result"][0]["[County]NAME"]
+
+    def test_answered_without_native_calls(self):
+        self.assertEqual("Boulder", self.query(self.geo_spatial, 40, -105))
+        self.assertEqual("Allen", self.query(self.geo_spatial, 40, -99))
+        result = json.loads(
+            self.geo_spatial.query_layer("2", "County", 10, 10))
+        self.assertEqual("NO_RESULTS", result["status"])
+        self.assertEqual(0, self.native_calls("GeoSpatialQuery"))
+        self.assertEqual(
+            3, self.geo_spatial.get_stats()["local_layers"]["queries"])
+        # where-clauses, and other layers, go native
+        self.geo_spatial.query_layer(
+            "3", "County", 40, -105, where_clause="NAME='Boulder'")
+        self.geo_spatial.query_layer("4", "State", 40, -105)
+        self.assertEqual(2, self.native_calls("GeoSpatialQuery"))
+
+    def test_output_fields(self):
+        result = json.loads(self.geo_spatial.query_layer(
+            "1", "County", 40, -105, output_fields=["[County]name"]))
+        self.assertEqual(
+            [{"[County]INPUT.Id": "1", "[County]NAME": "Boulder"}],
+            result["result"])
+        result = json.loads(self.geo_spatial.query_layer(
+            "1", "County", 40, -105, output_fields=["POP"]))
+        self.assertEqual("INVALID_REQUEST", result["status"])
+        self.assertEqual(0, self.native_calls("GeoSpatialQuery"))
+
+    def test_cross_check(self):
+        geo_spatial = self.create(LOCAL_CROSS_CHECK_RATE=1.0)
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.assertEqual("Boulder", self.query(geo_spatial, 40, -105))
+        # PxPointSC disagrees, and its answer is returned
+        self.assertEqual("Boulder", self.query(geo_spatial, 40, -99))
+        self.assertEqual(2, self.native_calls("GeoSpatialQuery"))
+        self.assertEqual(
+            {"queries": 2, "cross_checks": 2, "mismatches": 1},
+            geo_spatial.get_stats()["local_layers"])
+
+    def test_closed_with_their_generation(self):
+        closed = []
+        original_close = locallayer.LocalLayer.__dict__["close"]
+        self.addCleanup(
+            setattr, locallayer.LocalLayer, "close", original_close)
+        def close(local_layer):
+            closed.append(local_layer.layer_alias)
+            original_close(local_layer)
+        locallayer.LocalLayer.close = close
+        self.query(self.geo_spatial, 40, -105)
+        self.assertTrue(self.geo_spatial.reload_data_catalog())
+        # the reloaded layer is opened anew, and the old one closed
+        self.assertEqual(["County"], closed)
+        self.assertEqual("Boulder", self.query(self.geo_spatial, 40, -105))
+        self.geo_spatial.close()
+        self.assertEqual(["County", "County"], closed)
+
+
+class QueryPushdownTest(GeoSpatialTestCase):
+    def setUp(self):
+        GeoSpatialTestCase.setUp(self)
+        self.options = []
+        def query(lat, lon, options):
+            self.options.append(options)
+            return [dict(fakepxpointsc.LAYER_VALUES, NAME=name)
+                    for name in ("Boulder", "Broomfield", "Jefferson")]
+        fakepxpointsc.query = query
+
+    def query(self, **kwargs):
+        return json.loads(self.geo_spatial.query_layer(
+            "1", "County", 40.0, -105.0, **kwargs))
+
+    def test_output_fields(self):
+        for output_fields in (["name"], "[County]Name", "[County]NAME; "):
+            result = self.query(output_fields=output_fields)
+            self.assertEqual("OK", result["status"])
+            self.assertEqual(
+                ["[County]INPUT.Id", "[County]NAME"],
+                sorted(result["result"][0]))
+
+    def test_unknown_output_field(self):
+        result = self.query(output_fields=["NAME", "POPULATION"])
+        self.assertEqual("INVALID_REQUEST", result["status"])
+        self.assertIn("POPULATION", result["message"])
+        self.assertEqual(0, self.native_calls("GeoSpatialQuery"))
+
+    def test_where_clause(self):
+        result = self.query(where_clause="NAME LIKE 'B%'")
+        self.assertEqual("OK", result["status"])
+        self.assertIn("[County]WhereClause=NAME LIKE 'B%'", self.options[0])
+        result = self.query(where_clause="1=1;[County]Distance=1000")
+        self.assertEqual("INVALID_REQUEST", result["status"])
+        self.assertEqual(1, self.native_calls("GeoSpatialQuery"))
+
+    def test_max_results(self):
+        result = self.query(max_results=2)
+        self.assertEqual(
+            ["Boulder", "Broomfield"],
+            [row["[County]NAME"] for row in result["result"]])
+        self.assertIn("[County]MaxResults=2", self.options[0])
+        self.assertEqual(1, len(self.query(max_results=1)["result"]))
+        result = self.query(max_results=0)
+        self.assertEqual(3, len(result["result"]))
+        self.assertNotIn("MaxResults", self.options[-1])
+
+
+class OutputProfileTest(GeoSpatialTestCase):
+    config = {"GEOCODE_OUTPUT_PROFILES": {"lines": ["$AddressLine"]}}
+
+    def get_columns(self, profile=None, geo_spatial=None):
+        """Geocodes an address, returning the result's columns."""
+        geo_spatial = geo_spatial or self.geo_spatial
+        result = json.loads(
+            geo_spatial.get_location("1", "1 Main St", profile))
+        self.assertEqual("OK", result["status"])
+        return sorted(result["result"][0])
+
+    def test_profiles(self):
+        self.assertEqual(
+            ["$Latitude", "$Longitude", "$MatchCode", "INPUT.Id"],
+            self.get_columns("coords"))
+        self.assertEqual(
+            sorted(geospatial.GEOCODING_OUTPUT_PROFILES["full"] +
+                   ["INPUT.Id"]),
+            self.get_columns())
+        self.assertEqual(["$AddressLine", "INPUT.Id"],
+                         self.get_columns("lines"))
+        self.assertEqual(["$Postcode", "INPUT.Id"],
+                         self.get_columns(["$Postcode"]))
+
+    def test_default_profile(self):
+        geo_spatial = self.create(GEOCODE_OUTPUT_PROFILE="coords")
+        self.assertEqual(
+            ["$Latitude", "$Longitude", "$MatchCode", "INPUT.Id"],
+            self.get_columns(geo_spatial=geo_spatial))
+
+    def test_unknown_profile(self):
+        result = json.loads(
+            self.geo_spatial.get_location("1", "1 Main St", "nonesuch"))
+        self.assertEqual("INVALID_REQUEST", result["status"])
+        self.assertEqual(0, self.native_calls("GeocoderGeocode"))
+
+    def test_profiles_do_not_share_cache_entries(self):
+        self.get_columns("coords")
+        self.get_columns("standard")
+        self.get_columns("coords")
+        # the same columns as coords, so the same cache entry
+        self.get_columns(["$Latitude", "$Longitude", "$MatchCode"])
+        self.assertEqual(2, self.native_calls("GeocoderGeocode"))
+
+
+class ReverseGeocodeTest(GeoSpatialTestCase):
+    def reverse_geocode(self, lat, lon, profile=None, geo_spatial=None):
+        geo_spatial = geo_spatial or self.geo_spatial
+        return json.loads(
+            geo_spatial.reverse_geocode("1", lat, lon, profile))
+
+    def test_nearby_points_are_remembered(self):
+        result = self.reverse_geocode(40.0, -105.0)
+        self.assertEqual("OK", result["status"])
+        self.assertEqual(
+            fakepxpointsc.REVERSE_GEOCODE_ADDRESS,
+            result["result"][0]["$AddressLine"])
+        # rounds to the same five decimal places
+        self.assertEqual(result, self.reverse_geocode(40.000001, -105.000001))
+        self.assertEqual(1, self.native_calls("GeocoderReverseGeocode"))
+        self.reverse_geocode(40.0001, -105.0)
+        self.assertEqual(2, self.native_calls("GeocoderReverseGeocode"))
+        self.reverse_geocode(40.0, -105.0, "coords")
+        self.assertEqual(3, self.native_calls("GeocoderReverseGeocode"))
+
+    def test_batch(self):
+        points = [("a", 40.0, -105.0), ("b", 40.000001, -105.0),
+                  ("c", 39.0, -104.0), ("a", 40.0, -105.0)]
+        results = list(self.geo_spatial.reverse_geocode_batch(points))
+        self.assertEqual(2, self.native_rows("GeocoderReverseGeocode"))
+        for (call_id, _, _), (result_id, json_result) in zip(points, results):
+            self.assertEqual(call_id, result_id)
+            result = json.loads(json_result)
+            self.assertEqual(call_id, result["result"][0]["INPUT.Id"])
+        list(self.geo_spatial.reverse_geocode_batch(points))
+        self.assertEqual(1, self.native_calls("GeocoderReverseGeocode"))
+
+    def test_failures_are_not_remembered(self):
+        fakepxpointsc.reverse_geocode = lambda lat, lon, options: []
+        self.assertEqual(
+            "NO_RESULTS", self.reverse_geocode(40.0, -105.0)["status"])
+        fakepxpointsc.reverse_geocode = fakepxpointsc.default_reverse_geocode
+        self.assertEqual("OK", self.reverse_geocode(40.0, -105.0)["status"])
+        self.assertEqual(2, self.native_calls("GeocoderReverseGeocode"))
+
+    def test_memo_disabled(self):
+        geo_spatial = self.create(REVERSE_GEOCODE_CACHE_SIZE=0)
+        self.reverse_geocode(40.0, -105.0, geo_spatial=geo_spatial)
+        self.reverse_geocode(40.0, -105.0, geo_spatial=geo_spatial)
+        self.assertEqual(2, self.native_calls("GeocoderReverseGeocode"))
+
+    def test_precision(self):
+        geo_spatial = self.create(REVERSE_GEOCODE_PRECISION=2)
+        self.reverse_geocode(40.001, -105.001, geo_spatial=geo_spatial)
+        self.reverse_geocode(40.004, -104.999, geo_spatial=geo_spatial)
+        self.assertEqual(1, self.native_calls("GeocoderReverseGeocode"))
+
+
+class AdaptiveNearestTest(GeoSpatialTestCase):
+    config = {"ADAPTIVE_NEAREST_MIN_METERS": 100,
+              "ADAPTIVE_NEAREST_GROWTH": 4.0}
+
+    def setUp(self):
+        GeoSpatialTestCase.setUp(self)
+        rng = random.Random(39)
+        # county seats, denser near the middle
+        self.features = [
+            (rng.gauss(40.0, 0.3), rng.gauss(-105.0, 0.3), str(i))
+            for i in range(300)]
+        self.searches = []
+        fakepxpointsc.query = self.find_nearest
+
+    def find_nearest(self, lat, lon, options):
+        """Finds the features within the options' distance, nearest first."""
+        distance = float(re.search(r"Distance=([\d.]+)", options).group(1))
+        max_results = re.search(r"MaxResults=(\d+)", options)
+        self.searches.append(distance)
+        found = sorted(
+            (pointindex.haversine_meters(lat, lon, f_lat, f_lon), name)
+            for f_lat, f_lon, name in self.features)
+        found = [entry for entry in found if entry[0] <= distance]
+        if max_results:
+            found = found[:int(max_results.group(1))]
+        return [{"NAME": name, "FIPS": ""} for _, name in found]
+
+    def query(self, geo_spatial, points, max_results):
+        return [
+            json.loads(json_result)
+            for _, json_result in geo_spatial.query_layer_batch(
+                "County", points, search_dist_meters=50000,
+                max_results=max_results)]
+
+    def test_same_results_as_one_search(self):
+        rng = random.Random(390)
+        points = [
+            (str(i), rng.gauss(40.0, 0.5), rng.gauss(-105.0, 0.5))
+            for i in range(200)]
+        # one far from every feature
+        points.append(("far", 45.0, -95.0))
+        plain = self.create(ADAPTIVE_NEAREST_MIN_METERS=0)
+        for max_results in (1, 3):
+            self.assertEqual(
+                self.query(plain, points, max_results),
+                self.query(self.geo_spatial, points, max_results))
+        stats = self.geo_spatial.get_stats()["adaptive_nearest"]
+        self.assertEqual(2 * len(points), stats["points"])
+        self.assertTrue(stats["expansions"] > 0)
+        self.assertTrue(100 <= stats["radii"]["County"] < 50000)
+
+    def test_learns_the_typical_radius(self):
+        points = [(str(i), 40.0 + i * 0.001, -105.0) for i in range(50)]
+        self.query(self.geo_spatial, points[:25], 1)
+        radius = self.geo_spatial.get_stats()["adaptive_nearest"][
+            "radii"]["County"]
+        del self.searches[:]
+        self.query(self.geo_spatial, points[25:], 1)
+        self.assertEqual(radius, self.searches[0])
+
+    def test_disabled_without_max_results(self):
+        points = [("a", 40.0, -105.0)]
+        self.query(self.geo_spatial, points, 0)
+        self.assertEqual([50000], self.searches)
+        self.assertEqual(
+            0, self.geo_spatial.get_stats()["adaptive_nearest"]["points"])
+
+
+class CallLogTest(GeoSpatialTestCase):
+    def setUp(self):
+        GeoSpatialTestCase.setUp(self)
+        self.messages = []
+        logger = logging.getLogger(calllog.LOGGER_NAME)
+        handler = logging.Handler()
+        handler.emit = lambda record: self.messages.append(record.msg)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.INFO)
+
+    def test_single_calls_log_their_status(self):
+        self.geo_spatial.get_location("1", "1 Main St")
+        self.geo_spatial.get_location("2", "")
+        self.geo_spatial.reverse_geocode("3", 40.0, -105.0)
+        self.geo_spatial.query_layer("4", "Nonesuch", 40.0, -105.0)
+        self.assertEqual(
+            [("get_location", "OK"), ("get_location", "NO_RESULTS"),
+             ("reverse_geocode", "OK"), ("query_layer", "INVALID_REQUEST")],
+            [(message.operation, message.fields["status"])
+             for message in self.messages])
+
+    def test_batches_log_one_record_per_chunk(self):
+        geo_spatial = self.create(BATCH_CHUNK_SIZE=2)
+        list(geo_spatial.get_locations(
+            [(str(i), "{n} Main St".format(n=i)) for i in range(5)]))
+        self.assertEqual(
+            [("get_locations", 2), ("get_locations", 2),
+             ("get_locations", 1)],
+            [(message.operation, message.fields["rows"])
+             for message in self.messages])
+
+
+class ReloadTest(GeoSpatialTestCase):
+    config = {"HANDLE_POOL_SIZE": 3}
+
+    def test_layer_fields_are_asked_of_one_handle(self):
+        self.geo_spatial.query_layer("1", "County", 40.0, -105.0)
+        self.assertEqual(1, self.native_calls("GeoSpatialPrepare"))
+        self.assertEqual(2, self.native_calls("GeoSpatialAttachLayer"))
+
+    def test_reload(self):
+        self.geo_spatial.get_location("1", "1 Main St")
+        self.geo_spatial.query_layer("1", "County", 40.0, -105.0)
+        old_handles = list(fakepxpointsc.handles)
+        self.assertEqual(6, len(old_handles))
+        self.assertTrue(self.geo_spatial.reload_data_catalog())
+        # the new handles were opened, and the layer attached, at once
+        self.assertEqual(12, len(fakepxpointsc.handles))
+        self.assertEqual(2, self.native_calls("GeoSpatialPrepare"))
+        self.assertTrue(all(handle.closed for handle in old_handles))
+        self.assertFalse(any(
+            handle.closed for handle in fakepxpointsc.handles[6:]))
+        stats = self.geo_spatial.get_stats()["data_catalog"]
+        self.assertEqual(
+            {"reloads": 1, "failures": 0, "generation": 2}, stats)
+        # the geocode cache was cleared
+        self.geo_spatial.get_location("1", "1 Main St")
+        self.assertEqual(2, self.native_calls("GeocoderGeocode"))
+
+    def test_failed_reload_keeps_the_old_catalog(self):
+        self.geo_spatial.get_location("1", "1 Main St")
+        self.geo_spatial.query_layer("1", "County", 40.0, -105.0)
+        def fail(handle, data_catalog, layer_alias_list):
+            raise RuntimeError("Layer is missing")
+        self.addCleanup(
+            setattr, fakepxpointsc, "geospatial_prepare",
+            fakepxpointsc.geospatial_prepare)
+        fakepxpointsc.geospatial_prepare = fail
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.assertFalse(self.geo_spatial.reload_data_catalog())
+        # what the failed reload opened was closed, and nothing else
+        self.assertEqual(
+            [False] * 6 + [True] * 6,
+            [handle.closed for handle in fakepxpointsc.handles])
+        self.assertEqual(
+            {"reloads": 0, "failures": 1, "generation": 1},
+            self.geo_spatial.get_stats()["data_catalog"])
+        result = json.loads(
+            self.geo_spatial.query_layer("2", "County", 40.0, -105.0))
+        self.assertEqual("OK", result["status"])
+
+    def test_calls_during_reload(self):
+        fakepxpointsc.delay = 0.005
+        statuses = []
+        def geocode():
+            for i in range(20):
+                statuses.append(json.loads(self.geo_spatial.get_location(
+                    str(i), "{n} Main St".format(n=i)))["status"])
+        thread = threading.Thread(target=geocode)
+        thread.start()
+        for _ in range(3):
+            self.assertTrue(self.geo_spatial.reload_data_catalog())
+        thread.join()
+        self.assertEqual(["OK"] * 20, statuses)
+
+
+class HedgingTest(GeoSpatialTestCase):
+    config = {"HANDLE_POOL_SIZE": 2, "HEDGE_PERCENTILE": 50,
+              "HEDGE_MIN_MS": 10, "CALL_DEADLINE_MS": 100}
+
+    def test_hedge_counted_when_deadline_exceeded(self):
+        self.geo_spatial.get_location("1", "1 Main St")
+        fakepxpointsc.delay = 0.3
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        result = json.loads(self.geo_spatial.get_location("2", "2 Main St"))
+        self.assertNotEqual("OK", result["status"])
+        self.assertEqual(
+            {"hedged": 1, "hedge_wins": 0, "deadlines_exceeded": 1},
+            self.geo_spatial.get_stats()["hedging"])
+        # each attempt ran on its own handle
+        geocoders = [
+            handle for name, handle, _ in fakepxpointsc.calls
+            if name == "GeocoderGeocode"]
+        self.assertEqual(3, len(geocoders))
+        self.assertNotEqual(geocoders[1], geocoders[2])
+
+    def test_hedges_are_scheduled(self):
+        geo_spatial = self.create(SCHEDULER_CALLS_PER_HANDLE=1)
+        geo_spatial.get_location("1", "1 Main St")
+        fakepxpointsc.delay = 0.3
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        geo_spatial.get_location("2", "2 Main St")
+        self.assertEqual(1, geo_spatial.get_stats()["hedging"]["hedged"])
+        # the first call, the slow one and its hedge were each admitted
+        stats, = geo_spatial.get_stats()["scheduler"].values()
+        self.assertEqual(3, stats["interactive"]["admitted"])
+
+
+class OverloadTest(GeoSpatialTestCase):
+    config = {"MAX_IN_FLIGHT": {"query_layer": 1}, "MAX_IN_FLIGHT_DEFAULT": 2}
+
+    def status(self, json_result):
+        return json.loads(json_result)["status"]
+
+    def test_max_in_flight(self):
+        with self.geo_spatial.admit("query_layer"):
+            self.assertEqual("OVERLOADED", self.status(
+                self.geo_spatial.query_layer("1", "County", 40.0, -105.0)))
+            # other operations have their own limit
+            self.assertEqual("OK", self.status(
+                self.geo_spatial.get_location("1", "1 Main St")))
+        self.assertEqual("OK", self.status(
+            self.geo_spatial.query_layer("2", "County", 40.0, -105.0)))
+        stats = self.geo_spatial.get_stats()["admission"]["operations"]
+        self.assertEqual(
+            {"in_flight": 0, "admitted": 2, "shed": 1}, stats["query_layer"])
+
+    def test_max_in_flight_default(self):
+        with self.geo_spatial.admit("get_location"):
+            self.assertEqual("OK", self.status(
+                self.geo_spatial.get_location("1", "1 Main St")))
+            with self.geo_spatial.admit("get_location"):
+                self.assertEqual("OVERLOADED", self.status(
+                    self.geo_spatial.get_location("2", "2 Main St")))
+        unlimited = self.create(MAX_IN_FLIGHT_DEFAULT=0)
+        with unlimited.admit("get_location"):
+            with unlimited.admit("get_location"):
+                self.assertEqual("OK", self.status(
+                    unlimited.get_location("2", "2 Main St")))
+
+    def test_max_queued_calls(self):
+        geo_spatial = self.create(
+            MAX_IN_FLIGHT={}, MAX_IN_FLIGHT_DEFAULT=0, MAX_QUEUED_CALLS=1,
+            SCHEDULER_CALLS_PER_HANDLE=1)
+        geo_spatial.get_location("0", "0 Main St")
+        fakepxpointsc.delay = 0.2
+        statuses = []
+        def geocode(i):
+            statuses.append(self.status(geo_spatial.get_location(
+                str(i), "{n} Main St".format(n=i))))
+        threads = [
+            threading.Thread(target=geocode, args=(i, )) for i in (1, 2)]
+        for thread in threads:
+            thread.start()
+        # one call runs, and the other waits for the scheduler
+        while geo_spatial.get_stats()["admission"]["queued"] < 1:
+            time.sleep(0.001)
+        self.assertEqual("OVERLOADED", self.status(
+            geo_spatial.get_location("3", "3 Main St")))
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["OK", "OK"], statuses)
+        self.assertEqual("OK", self.status(
+            geo_spatial.get_location("3", "3 Main St")))
+
+    def test_max_queued_calls_without_scheduler(self):
+        geo_spatial = self.create(
+            MAX_IN_FLIGHT={}, MAX_IN_FLIGHT_DEFAULT=0, MAX_QUEUED_CALLS=1)
+        geo_spatial.get_location("0", "0 Main St")
+        fakepxpointsc.delay = 0.2
+        statuses = []
+        def geocode(i):
+            statuses.append(self.status(geo_spatial.get_location(
+                str(i), "{n} Main St".format(n=i))))
+        threads = [
+            threading.Thread(target=geocode, args=(i, )) for i in (1, 2)]
+        for thread in threads:
+            thread.start()
+        # one call runs, and the other waits for the only geocoder
+        while geo_spatial.get_stats()["admission"]["queued"] < 1:
+            time.sleep(0.001)
+        self.assertEqual("OVERLOADED", self.status(
+            geo_spatial.get_location("3", "3 Main St")))
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["OK", "OK"], statuses)
+
+
+class ShardedLayerTest(GeoSpatialTestCase):
+    config = {"LAYER_SHARDS": {"Regions": [
+        ["County", [39.0, -106.0, 41.0, -104.0]],
+        ["State", [30.0, -120.0, 45.0, -80.0]]]}}
+
+    def test_points_are_routed_to_their_shard(self):
+        points = [("a", 40.0, -105.0), ("b", 35.0, -100.0),
+                  ("c", 10.0, 10.0), ("d", 40.5, -104.5)]
+        results = [
+            json.loads(json_result) for _, json_result in
+            self.geo_spatial.query_layer_batch("Regions", points)]
+        self.assertEqual(
+            ["OK", "OK", "NO_RESULTS", "OK"],
+            [result["status"] for result in results])
+        self.assertEqual(
+            {"[Regions]INPUT.Id": "a", "[Regions]NAME": "Boulder",
+             "[Regions]FIPS": "08013"}, results[0]["result"][0])
+        self.assertEqual("b", results[1]["result"][0]["[Regions]INPUT.Id"])
+        queries = [
+            (handle, nrows) for name, handle, nrows in fakepxpointsc.calls
+            if name == "GeoSpatialQuery"]
+        # each shard has a spatial processor of its own
+        self.assertEqual(2, len(queries))
+        self.assertNotEqual(queries[0][0], queries[1][0])
+        self.assertEqual([1, 2], sorted(nrows for _, nrows in queries))
+        self.assertEqual(
+            {"points": 4, "unrouted": 1, "parallel_calls": 1},
+            self.geo_spatial.get_stats()["sharded_layers"])
+
+    def test_unknown_shard(self):
+        geo_spatial = self.create(LAYER_SHARDS={"Regions": [
+            ["Nonesuch", [-90.0, -180.0, 90.0, 180.0]]]})
+        result = json.loads(
+            geo_spatial.query_layer("a", "Regions", 40.0, -105.0))
+        self.assertEqual("INVALID_REQUEST", result["status"])
+
+
+class DatasetProfileTest(GeoSpatialTestCase):
+    config = {"GEOCODER_DATASET_PROFILES": {"parcel": ["Parcel"]}}
+
+    def geocoders(self):
+        """Returns the dataset names of the geocoders opened."""
+        return [
+            handle.dataset_names for handle in fakepxpointsc.handles
+            if handle.kind == "geocoder"]
+
+    def test_unknown_profile(self):
+        result = json.loads(self.geo_spatial.get_location(
+            "1", "1 Main St", datasets="rooftop"))
+        self.assertEqual("INVALID_REQUEST", result["status"])
+        self.assertEqual([], self.geocoders())
+
+    def test_geocoder_opened_on_first_use(self):
+        self.geo_spatial.get_location("1", "1 Main St")
+        self.assertEqual([None], self.geocoders())
+        self.geo_spatial.get_location("2", "2 Main St", datasets="parcel")
+        self.geo_spatial.get_location("3", "3 Main St", datasets="parcel")
+        self.assertEqual([None, ["Parcel"]], self.geocoders())
+        # a reload reopens the geocoders open now
+        self.assertTrue(self.geo_spatial.reload_data_catalog())
+        self.assertEqual(
+            sorted([None, ["Parcel"]] * 2), sorted(self.geocoders()))
+        self.assertEqual(
+            2, len([handle for handle in fakepxpointsc.handles
+                    if handle.closed]))
+
+    def test_cache_keys_are_not_shared(self):
+        for datasets in (None, "parcel", None, "parcel"):
+            result = json.loads(self.geo_spatial.get_location(
+                "1", "1 Main St", datasets=datasets))
+            self.assertEqual("OK", result["status"])
+        self.assertEqual(2, self.native_calls("GeocoderGeocode"))
+        geocode_handles = [
+            handle for name, handle, _ in fakepxpointsc.calls
+            if name == "GeocoderGeocode"]
+        self.assertEqual(
+            [None, ["Parcel"]],
+            [handle.dataset_names for handle in geocode_handles])
+
+
+class PlaceHierarchyTest(GeoSpatialTestCase):
+    PARENTS = {
+        ("City", "0807850"): {"$PlaceType": "County", "$PlaceId": "08013",
+                              "$PlaceName": "Boulder"},
+        ("County", "08013"): {"$PlaceType": "State", "$PlaceId": "CO",
+                              "$PlaceName": "Colorado"}}
+
+    def setUp(self):
+        super(PlaceHierarchyTest, self).setUp()
+        # place types whose lookups fail
+        self.failing = set()
+        fakepxpointsc.find_parent = self.find_parent
+
+    def find_parent(self, place_type, place_id):
+        if place_type in self.failing:
+            return fakepxpointsc.RowError(-1, "Dataset unavailable")
+        parent = self.PARENTS.get((place_type, place_id))
+        return [parent] if parent else []
+
+    def places(self, json_result):
+        result = json.loads(json_result)
+        return result["status"], [
+            place["$PlaceId"] for place in result.get("result", [])]
+
+    def test_find_ancestors(self):
+        self.assertEqual(
+            ("OK", ["08013", "CO"]),
+            self.places(self.geo_spatial.find_ancestors(
+                "1", "City", "0807850")))
+        self.assertEqual(
+            ("OK", ["CO"]),
+            self.places(self.geo_spatial.find_parent("2", "County", "08013")))
+        # the state has no parent, which is remembered too
+        for _ in range(2):
+            self.assertEqual(
+                ("NO_RESULTS", []),
+                self.places(self.geo_spatial.find_parent("3", "State", "CO")))
+        self.assertEqual(3, self.native_calls("GeocoderFindParent"))
+        self.assertEqual(
+            "INVALID_REQUEST",
+            self.places(self.geo_spatial.find_parent("4", "Town", "1"))[0])
+
+    def test_errors_are_not_remembered(self):
+        self.failing.add("County")
+        self.assertEqual(
+            ("OK", ["08013"]),
+            self.places(self.geo_spatial.find_ancestors(
+                "1", "City", "0807850")))
+        self.assertEqual(
+            1, self.geo_spatial.get_stats()["place_hierarchy"]["failures"])
+        self.failing.clear()
+        self.assertEqual(
+            ("OK", ["08013", "CO"]),
+            self.places(self.geo_spatial.find_ancestors(
+                "2", "City", "0807850")))
+        # the city's parent was remembered, the county's is asked again
+        self.assertEqual(4, self.native_calls("GeocoderFindParent"))
+
+    def test_find_children(self):
+        fakepxpointsc.find_children = lambda place_type, place_id: [
+            {"$PlaceType": "County", "$PlaceId": fips, "$PlaceName": name}
+            for fips, name in (("08013", "Boulder"), ("08031", "Denver"))]
+        # the state, with its name, is known as the parent of a county
+        self.geo_spatial.find_parent("1", "County", "08013")
+        self.assertEqual(
+            ("OK", ["08013", "08031"]),
+            self.places(self.geo_spatial.find_children("2", "State", "CO")))
+        # so the counties' parent came with them
+        self.assertEqual(
+            ("OK", ["CO"]),
+            self.places(self.geo_spatial.find_parent("3", "County", "08031")))
+        self.assertEqual(1, self.native_calls("GeocoderFindParent"))
+
+
+if __name__ == "__main__":
+    unittest.main()
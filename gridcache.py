@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Grid-cell cache for point-in-polygon (WITHIN) layer queries.
+
+Points are quantized to lat/lon cells of a per-layer size. The result of a
+WITHIN query is reused for every point in a cell, but only once the polygon
+geometry PxPointSC returned for that result has been shown to fully contain
+the cell. Cells that straddle a polygon boundary are remembered so that later
+queries in them skip asking PxPointSC for geometry, and always go native.
+
+Grid caching is only correct for layers whose polygons do not overlap (State,
+County, ZIP and the like), which is why it is enabled layer by layer.
+"""
+
+import math
+
+import cache
+import geometry
+
+
+class GridCache:
+    """Caches WITHIN query results by layer and quantized lat/lon cell."""
+    def __init__(self, layer_cell_degrees, max_cells):
+        """Initializes the cache.
+
+        Args:
+            layer_cell_degrees (dict): Maps the alias of each layer to cache
+                to the size, in decimal degrees, of its cells.
+            max_cells (int): The maximum number of cells to remember, for
+                cached results and straddling cells each.
+        """
+        self.layer_cell_degrees = dict(layer_cell_degrees or {})
+        self.__results = cache.LRUCache(max_cells)
+        self.__straddling = cache.LRUCache(max_cells)
+
+    def cell_key(self, layer_name, lat, lon, signature=None):
+        """Returns the key of the cell containing a point, or None if the
+        layer is not grid cached.
+
+        Args:
+            layer_name (str): The layer alias.
+            lat (float): The point's latitude.
+            lon (float): The point's longitude.
+            signature (hashable, optional): Any other query parameters that
+                affect the result, such as the requested output fields.
+        """
+        cell_degrees = self.layer_cell_degrees.get(layer_name)
+        if not cell_degrees:
+            return None
+        return (
+            layer_name,
+            signature,
+            int(math.floor(lat / cell_degrees)),
+            int(math.floor(lon / cell_degrees))
+        )
+
+    def get(self, key):
+        """Returns the result cached for a cell, or None."""
+        return self.__results.get(key)
+
+    def put(self, key, result):
+        """Caches a result for a cell already known to be fully contained in
+        the result's polygon, such as one loaded from a result store."""
+        self.__results.put(key, result)
+
+    def is_straddling(self, key):
+        """Returns True if the cell is known to straddle a polygon boundary."""
+        return self.__straddling.get(key) is not None
+
+    def offer(self, key, geometries, result):
+        """Caches a result for a cell if its geometries fully contain the cell.
+
+        Args:
+            key (tuple): The cell key, from cell_key().
+            geometries (list): The WKB or WKT geometry of each feature in the
+                result.
+            result (object): The result to cache.
+
+        Returns:
+            True if the result was cached, False if the cell straddles a
+            boundary (or lies outside every polygon) and was marked as such.
+        """
+        layer_name, _, row, col = key
+        cell_degrees = self.layer_cell_degrees[layer_name]
+        min_lat = row * cell_degrees
+        min_lon = col * cell_degrees
+        contained = len(geometries) > 0
+        for value in geometries:
+            polygons = geometry.parse_polygons(value)
+            if polygons is None or not geometry.polygons_contain_box(
+                    polygons, min_lon, min_lat, min_lon + cell_degrees,
+                    min_lat + cell_degrees):
+                contained = False
+                break
+        if contained:
+            self.__results.put(key, result)
+        else:
+            self.__straddling.put(key, True)
+        return contained
+
+    def clear(self):
+        """Forgets every cell, as when the layers' data changes."""
+        self.__results.clear()
+        self.__straddling.clear()
+
+    def stats(self):
+        """Returns a dictionary of the cache's size and hit/miss counters."""
+        result = self.__results.stats()
+        result["straddling"] = len(self.__straddling)
+        return result
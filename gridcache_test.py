@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the grid-cell cache for WITHIN layer queries."""
+
+import unittest
+
+import gridcache
+
+# Colorado, roughly, with borders off the cell edges
+COLORADO = (
+    "POLYGON ((-109.1 37.2, -102.1 37.2, -102.1 41.2, -109.1 41.2, "
+    "-109.1 37.2))")
+
+
+class GridCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = gridcache.GridCache({"State": 0.5}, 100)
+
+    def test_uncached_layer_has_no_cells(self):
+        self.assertEqual(None, self.cache.cell_key("County", 40.1, -105.1))
+
+    def test_points_in_one_cell_share_a_key(self):
+        self.assertEqual(
+            self.cache.cell_key("State", 40.1, -105.1),
+            self.cache.cell_key("State", 40.4, -105.4))
+        self.assertNotEqual(
+            self.cache.cell_key("State", 40.1, -105.1),
+            self.cache.cell_key("State", 40.6, -105.1))
+        self.assertNotEqual(
+            self.cache.cell_key("State", 40.1, -105.1, "NAME"),
+            self.cache.cell_key("State", 40.1, -105.1, "FIPS"))
+
+    def test_contained_cell_hits(self):
+        key = self.cache.cell_key("State", 40.1, -105.1)
+        self.assertEqual(None, self.cache.get(key))
+        self.assertTrue(self.cache.offer(key, [COLORADO], "Colorado"))
+        self.assertEqual(
+            "Colorado",
+            self.cache.get(self.cache.cell_key("State", 40.4, -105.4)))
+        self.assertFalse(self.cache.is_straddling(key))
+
+    def test_straddling_cell_misses(self):
+        # the cell from 37.0 to 37.5 crosses the southern border
+        key = self.cache.cell_key("State", 37.1, -105.1)
+        self.assertFalse(self.cache.offer(key, [COLORADO], "Colorado"))
+        self.assertEqual(None, self.cache.get(key))
+        self.assertTrue(self.cache.is_straddling(key))
+
+    def test_no_geometry_is_not_cached(self):
+        key = self.cache.cell_key("State", 40.1, -105.1)
+        self.assertFalse(self.cache.offer(key, [], "nothing"))
+        self.assertEqual(None, self.cache.get(key))
+
+    def test_clear_and_stats(self):
+        key = self.cache.cell_key("State", 40.1, -105.1)
+        self.cache.offer(key, [COLORADO], "Colorado")
+        self.cache.offer(
+            self.cache.cell_key("State", 37.1, -105.1), [COLORADO], "x")
+        stats = self.cache.stats()
+        self.assertEqual(1, stats["size"])
+        self.assertEqual(1, stats["straddling"])
+        self.cache.clear()
+        self.assertEqual(None, self.cache.get(key))
+        self.assertEqual(0, self.cache.stats()["straddling"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Pools of PxPointSC handles, and hedged calls with deadlines.
+
+A few native calls take many times the median, on pathological addresses or
+cold layer pages, and block their caller throughout. A HandlePool holds
+several handles initialized alike, such as geocoders of the same datasets,
+and hands each out to one call at a time. call() makes a call on one of
+them. If it has not returned after a hedge delay, typically a high
+percentile of the recent latencies of such calls (see LatencyHistory), the
+same call is also made on another, idle handle, and the first answer wins.
+If no answer has come by the deadline, DeadlineExceeded is raised; calls
+still running finish in the background, and their handles stay busy until
+then.
+
+For example:
+    pool = hedging.HandlePool([handle1, handle2])
+    result, hedged, hedge_won = hedging.call(
+        pool, lambda handle: query(handle), hedge_delay=0.05,
+        deadline=time.time() + 0.5)
+"""
+
+import collections
+import Queue
+import sys
+import threading
+import time
+
+
+class DeadlineExceeded(RuntimeError):
+    """Raised when a call has not answered by its deadline."""
+    pass
+
+
+class LatencyHistory:
+    """Remembers the latest latencies of calls, by kind of call."""
+    def __init__(self, max_samples=1000):
+        """Initializes an empty history.
+
+        Args:
+            max_samples (int, optional): The number of latencies remembered
+                for each kind of call.
+        """
+        self.max_samples = max(1, max_samples)
+        self.__samples = {}
+        self.__lock = threading.Lock()
+
+    def add(self, key, seconds):
+        """Records the latency of a call of a kind."""
+        with self.__lock:
+            samples = self.__samples.get(key)
+            if samples is None:
+                samples = self.__samples[key] = collections.deque(
+                    maxlen=self.max_samples)
+            samples.append(seconds)
+
+    def percentile(self, key, percentile):
+        """Returns a percentile, from 0 to 100, of the latencies of a kind of
+        call, in seconds, or None if there are none."""
+        with self.__lock:
+            samples = sorted(self.__samples.get(key, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, len(samples) * percentile // 100)]
+
+    def clear(self):
+        """Forgets every latency."""
+        with self.__lock:
+            self.__samples.clear()
+
+
+class HandlePool:
+    """Handles initialized alike, each used by one call at a time."""
+    def __init__(self, handles, name=None):
+        """Initializes the pool.
+
+        Args:
+            handles (list): The handles.
+            name (str, optional): Names the pool, and the pools that replace
+                it when the handles are reopened.
+        """
+        self.handles = list(handles)
+        self.name = name
+        # ids of the handles in use
+        self.__busy = set()
+        # calls waiting in acquire() for a handle to be released
+        self.__waiting = 0
+        self.__released = threading.Condition()
+
+    def acquire(self, idle_only=False, exclude=None, deadline=None):
+        """Returns an idle handle, which is busy until release() is called.
+        When every handle is busy, waits for one to be released.
+
+        Args:
+            idle_only (bool, optional): True to return None at once, rather
+                than wait, if every handle is busy.
+            exclude (optional): A handle not to return, such as the one the
+                call being hedged is running on.
+            deadline (float, optional): The time.time() after which to stop
+                waiting. None waits as long as it takes.
+
+        Returns:
+            The handle, or None if none was idle in time.
+        """
+        with self.__released:
+            while True:
+                for handle in self.handles:
+                    if id(handle) not in self.__busy and handle is not exclude:
+                        self.__busy.add(id(handle))
+                        return handle
+                if idle_only:
+                    return None
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        return None
+                self.__waiting += 1
+                try:
+                    self.__released.wait(timeout)
+                finally:
+                    self.__waiting -= 1
+
+    def release(self, handle):
+        """Records the end of a call on a handle."""
+        with self.__released:
+            self.__busy.discard(id(handle))
+            self.__released.notify_all()
+
+    def waiting(self):
+        """Returns the number of calls waiting for a handle."""
+        with self.__released:
+            return self.__waiting
+
+    def wait_idle(self):
+        """Waits until no call is using the pool's handles."""
+        with self.__released:
+            while self.__busy:
+                self.__released.wait()
+
+
+def call(pool, function, hedge_delay=None, deadline=None, record=None,
+         on_hedge=None, admit_hedge=None):
+    """Makes a call on an idle handle of a pool, hedged and with a deadline.
+
+    Args:
+        pool (HandlePool): The handles the call may be made on.
+        function (callable): Takes a handle and makes the call on it.
+        hedge_delay (float, optional): Seconds after which, if the call has
+            not returned, it is also made on an idle handle of the pool, if
+            there is one. None never hedges.
+        deadline (float, optional): The time.time() by which an answer is
+            needed. None waits as long as it takes.
+        record (callable, optional): Called with the seconds each call took,
+            whether its answer was used or not.
+        on_hedge (callable, optional): Called when the call is hedged, as the
+            hedge starts, whether or not an answer then comes in time.
+        admit_hedge (callable, optional): Called before hedging, to admit the
+            hedge as the call was admitted. Returns a function to call once
+            the hedge has finished, or None to not hedge.
+
+    Returns:
+        A (result, hedged, hedge_won) tuple: the first answer, whether the
+        call was hedged, and whether the hedge answered first.
+
+    Raises:
+        DeadlineExceeded: if no handle was idle, or no answer came, by the
+            deadline.
+        Whatever function raised, if that was the first answer.
+    """
+    if deadline is not None and time.time() >= deadline:
+        raise DeadlineExceeded("Deadline exceeded")
+    handle = pool.acquire(deadline=deadline)
+    if handle is None:
+        raise DeadlineExceeded("Deadline exceeded")
+    if hedge_delay is None and deadline is None:
+        # nothing to wait for on another thread
+        start = time.time()
+        try:
+            return function(handle), False, False
+        finally:
+            pool.release(handle)
+            if record is not None:
+                record(time.time() - start)
+    answers = Queue.Queue()
+    def run(index, handle, finished=None):
+        start = time.time()
+        try:
+            answers.put((index, function(handle), None))
+        except Exception:
+            answers.put((index, None, sys.exc_info()))
+        finally:
+            pool.release(handle)
+            if finished is not None:
+                finished()
+            if record is not None:
+                record(time.time() - start)
+    _start(run, 0, handle)
+    hedged = False
+    wait = hedge_delay
+    if deadline is not None:
+        remaining = deadline - time.time()
+        wait = remaining if wait is None else min(wait, remaining)
+    answer = _get(answers, wait)
+    if answer is None and hedge_delay is not None and (
+            deadline is None or time.time() < deadline):
+        finished = None
+        if admit_hedge is not None:
+            finished = admit_hedge()
+        if admit_hedge is None or finished is not None:
+            hedge_handle = pool.acquire(idle_only=True, exclude=handle)
+            if hedge_handle is not None:
+                hedged = True
+                if on_hedge is not None:
+                    on_hedge()
+                _start(run, 1, hedge_handle, finished)
+            elif finished is not None:
+                finished()
+        answer = _get(
+            answers, None if deadline is None else deadline - time.time())
+    if answer is None:
+        raise DeadlineExceeded("Deadline exceeded")
+    index, result, exc_info = answer
+    if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return result, hedged, index == 1
+
+
+def _start(function, *args):
+    """Runs a function on a daemon thread."""
+    thread = threading.Thread(target=function, args=args)
+    thread.daemon = True
+    thread.start()
+
+
+def _get(queue, timeout):
+    """Returns the next item of a queue, waiting up to timeout seconds (or
+    forever, if timeout is None), or None if there is none by then."""
+    try:
+        if timeout is None:
+            return queue.get()
+        if timeout <= 0:
+            return queue.get_nowait()
+        return queue.get(timeout=timeout)
+    except Queue.Empty:
+        return None
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the handle pools and hedged calls."""
+
+import threading
+import time
+import unittest
+
+import hedging
+
+
+class LatencyHistoryTest(unittest.TestCase):
+    def test_percentile(self):
+        history = hedging.LatencyHistory(max_samples=10)
+        self.assertIsNone(history.percentile("geocode", 90))
+        for seconds in range(20):
+            history.add("geocode", seconds)
+        self.assertEqual(10, history.percentile("geocode", 0))
+        self.assertEqual(19, history.percentile("geocode", 100))
+        self.assertIsNone(history.percentile("query", 50))
+        history.clear()
+        self.assertIsNone(history.percentile("geocode", 50))
+
+
+class HandlePoolTest(unittest.TestCase):
+    def test_handles_are_exclusive(self):
+        pool = hedging.HandlePool(["a", "b"])
+        self.assertEqual("a", pool.acquire())
+        self.assertEqual("b", pool.acquire())
+        self.assertIsNone(pool.acquire(idle_only=True))
+        self.assertIsNone(pool.acquire(deadline=time.time() + 0.05))
+        pool.release("a")
+        self.assertEqual("a", pool.acquire())
+
+    def test_acquire_waits_for_release(self):
+        pool = hedging.HandlePool(["a"])
+        pool.acquire()
+        waiting = []
+        def release():
+            waiting.append(pool.waiting())
+            pool.release("a")
+        timer = threading.Timer(0.05, release)
+        timer.start()
+        self.addCleanup(timer.join)
+        self.assertEqual("a", pool.acquire(deadline=time.time() + 5))
+        self.assertEqual([1], waiting)
+        self.assertEqual(0, pool.waiting())
+
+    def test_exclude(self):
+        pool = hedging.HandlePool(["a", "b"])
+        self.assertEqual("b", pool.acquire(exclude="a"))
+        self.assertIsNone(pool.acquire(idle_only=True, exclude="a"))
+
+    def test_wait_idle(self):
+        pool = hedging.HandlePool(["a", "b"])
+        pool.acquire()
+        pool.acquire()
+        released = []
+        def release():
+            released.append("a")
+            pool.release("a")
+            released.append("b")
+            pool.release("b")
+        timer = threading.Timer(0.05, release)
+        timer.start()
+        self.addCleanup(timer.join)
+        pool.wait_idle()
+        self.assertEqual(["a", "b"], released)
+
+
+class CallTest(unittest.TestCase):
+    def setUp(self):
+        self.latencies = []
+        self.hedges = []
+        self.lock = threading.Lock()
+        self.running = []
+        self.shared = []
+
+    def call(self, pool, function, hedge_delay=None, deadline=None):
+        return hedging.call(
+            pool, function, hedge_delay, deadline, self.latencies.append,
+            lambda: self.hedges.append(True))
+
+    def slow_on(self, slow_handle, seconds):
+        """Returns a function answering with its handle, after seconds on
+        slow_handle, and recording any handle used by two calls at once."""
+        def function(handle):
+            with self.lock:
+                if handle in self.running:
+                    self.shared.append(handle)
+                self.running.append(handle)
+            try:
+                if handle == slow_handle:
+                    time.sleep(seconds)
+                return handle
+            finally:
+                with self.lock:
+                    self.running.remove(handle)
+        return function
+
+    def test_unhedged(self):
+        pool = hedging.HandlePool(["a", "b"])
+        self.assertEqual(
+            ("a", False, False), self.call(pool, lambda handle: handle))
+        self.assertEqual(1, len(self.latencies))
+        self.assertEqual([], self.hedges)
+
+    def test_hedge_wins(self):
+        pool = hedging.HandlePool(["a", "b"])
+        self.assertEqual(
+            ("b", True, True),
+            self.call(pool, self.slow_on("a", 0.5), hedge_delay=0.02))
+        self.assertEqual([True], self.hedges)
+        pool.wait_idle()
+        self.assertEqual(2, len(self.latencies))
+
+    def test_hedge_admission(self):
+        pool = hedging.HandlePool(["a", "b"])
+        admissions = []
+        def admit_hedge(admitted):
+            admissions.append(admitted)
+            if admitted:
+                return lambda: admissions.append("finished")
+        self.assertEqual(
+            ("a", False, False),
+            hedging.call(
+                pool, self.slow_on("a", 0.1), 0.02,
+                admit_hedge=lambda: admit_hedge(False)))
+        self.assertEqual(
+            ("b", True, True),
+            hedging.call(
+                pool, self.slow_on("a", 0.3), 0.02,
+                admit_hedge=lambda: admit_hedge(True)))
+        pool.wait_idle()
+        self.assertEqual([False, True, "finished"], admissions)
+
+    def test_no_idle_handle_to_hedge_on(self):
+        pool = hedging.HandlePool(["a", "b"])
+        pool.acquire(exclude="a")
+        self.assertEqual(
+            ("a", False, False),
+            self.call(pool, self.slow_on("a", 0.1), hedge_delay=0.02))
+        self.assertEqual([], self.hedges)
+
+    def test_deadline_exceeded_counts_hedge(self):
+        pool = hedging.HandlePool(["a", "b"])
+        def slow(handle):
+            time.sleep(0.3)
+        self.assertRaises(
+            hedging.DeadlineExceeded, self.call, pool, slow,
+            hedge_delay=0.02, deadline=time.time() + 0.1)
+        self.assertEqual([True], self.hedges)
+        pool.wait_idle()
+
+    def test_deadline_waiting_for_handle(self):
+        pool = hedging.HandlePool(["a"])
+        pool.acquire()
+        self.assertRaises(
+            hedging.DeadlineExceeded, self.call, pool, lambda handle: handle,
+            deadline=time.time() + 0.05)
+
+    def test_error(self):
+        pool = hedging.HandlePool(["a"])
+        def fail(handle):
+            raise ValueError(handle)
+        self.assertRaises(
+            ValueError, self.call, pool, fail, deadline=time.time() + 5)
+        pool.wait_idle()
+
+    def test_concurrent_calls_never_share_a_handle(self):
+        pool = hedging.HandlePool(["a", "b", "c"])
+        function = self.slow_on("a", 0.05)
+        errors = []
+        def run():
+            try:
+                for _ in range(5):
+                    self.call(pool, function, hedge_delay=0.01)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pool.wait_idle()
+        self.assertEqual([], errors)
+        self.assertEqual([], self.shared)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Load generator and latency benchmark for GeoSpatial.
+
+Replays a request mix against a GeoSpatial instance. The mix is get_location
+addresses and query_layer points, read from a recorded file or generated.
+Requests are sent from a number of threads, either as fast as those threads
+allow (closed loop) or at a target rate (open loop). The run reports
+throughput, p50/p95/p99/p999 latency and the count of each status.
+
+A recorded mix is NDJSON, one request per line:
+    {"op": "get_location", "address": "123 main st, boulder co"}
+    {"op": "get_location", "address": "9 elm st", "datasets": "parcel"}
+    {"op": "query_layer", "layer": "County", "lat": 40.0, "lon": -105.2}
+or a call log written through calllog, whose get_location and query_layer
+records carry the same fields. A get_location's optional "datasets" names
+the geocoder dataset profile it is routed to.
+
+--sweep runs the benchmark once per combination of settings. Settings are
+GeoSpatial configuration keys, such as BATCH_CHUNK_SIZE or
+GEOCODE_CACHE_SIZE, or the benchmark's own "concurrency", "rate" and
+"batch_size". With --batch-size above 1, consecutive requests of the same
+kind go out together through get_locations() or query_layer_batch(). Each
+request's latency is then that of its whole batch.
+
+Set PXPOINTSC_LIBRARY to run against a stand-in native library.
+
+For example:
+    loadtest.py --synthetic 10000 --layer County --concurrency 8 \\
+        --sweep BATCH_CHUNK_SIZE=100,1000 --sweep GEOCODE_CACHE_SIZE=0,100000
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+import geospatial
+
+# Synthetic addresses are built from these
+_STREET_NAMES = (
+    "MAIN", "OAK", "PINE", "MAPLE", "CEDAR", "ELM", "WASHINGTON", "LAKE",
+    "HILL", "PARK", "BROADWAY", "PEARL", "WALNUT", "SPRUCE", "ARAPAHOE")
+_STREET_TYPES = ("ST", "AVE", "RD", "DR", "LN", "BLVD", "CT", "WAY")
+_CITIES = (
+    "BOULDER CO", "DENVER CO", "AUSTIN TX", "SEATTLE WA", "MADISON WI",
+    "PORTLAND OR", "RALEIGH NC", "TUCSON AZ")
+
+# Call log fields, as calllog.KeyValueMessage writes them
+_LOG_FIELD_PATTERN = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|\S*)')
+
+# Settings of the benchmark itself, rather than of GeoSpatial
+_RUN_SETTINGS = ("concurrency", "rate", "batch_size")
+
+# Latency percentiles reported, by result key
+PERCENTILES = (
+    ("p50_ms", 50), ("p95_ms", 95), ("p99_ms", 99), ("p999_ms", 99.9))
+
+
+def percentile(sorted_values, percent):
+    """Returns the nearest-rank percentile of a sorted list, or None if it is
+    empty."""
+    if not sorted_values:
+        return None
+    rank = int(-(-len(sorted_values) * percent // 100))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+def read_requests(path):
+    """Reads a recorded request mix from an NDJSON file or a call log."""
+    requests = []
+    with open(path, "rb") as mix_file:
+        for line in mix_file:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                request = json.loads(line)
+            else:
+                request = dict(
+                    (key, value[1:-1].decode("string_escape")
+                        if value.startswith('"') else value)
+                    for key, value in _LOG_FIELD_PATTERN.findall(line))
+            if request.get("op") == "get_location" and "address" in request:
+                requests.append({
+                    "op": "get_location", "address": request["address"],
+                    "datasets": request.get("datasets") or None})
+            elif request.get("op") == "query_layer" and "layer" in request:
+                requests.append({
+                    "op": "query_layer", "layer": request["layer"],
+                    "lat": float(request["lat"]),
+                    "lon": float(request["lon"]),
+                    "search_dist_meters": float(
+                        request.get("search_dist_meters") or 0)})
+    return requests
+
+
+def synthetic_requests(count, layers, bbox, address_fraction, seed=None):
+    """Generates a request mix.
+
+    Args:
+        count (int): The number of requests.
+        layers (list): The layers points are queried against, in turn.
+        bbox (tuple): The (min_lat, min_lon, max_lat, max_lon) points are
+            drawn from.
+        address_fraction (float): The fraction of requests that are
+            addresses to geocode rather than points to query.
+        seed (int, optional): The random seed, for repeatable mixes.
+    """
+    rng = random.Random(seed)
+    layers = itertools.cycle(layers or [None])
+    requests = []
+    for _ in range(count):
+        layer = next(layers)
+        if layer is None or rng.random() < address_fraction:
+            address = "{n} {s} {t}, {c}".format(
+                n=rng.randint(1, 9999), s=rng.choice(_STREET_NAMES),
+                t=rng.choice(_STREET_TYPES), c=rng.choice(_CITIES))
+            requests.append({"op": "get_location", "address": address})
+        else:
+            requests.append({
+                "op": "query_layer", "layer": layer,
+                "lat": rng.uniform(bbox[0], bbox[2]),
+                "lon": rng.uniform(bbox[1], bbox[3]),
+                "search_dist_meters": 0})
+    return requests
+
+
+def make_units(requests, batch_size):
+    """Groups consecutive requests of the same kind into batches of up to
+    batch_size. Returns a list of request lists."""
+    units = []
+    for request in requests:
+        if (batch_size > 1 and units and len(units[-1]) < batch_size and
+                _batch_key(units[-1][0]) == _batch_key(request)):
+            units[-1].append(request)
+        else:
+            units.append([request])
+    return units
+
+
+def _batch_key(request):
+    """Returns what requests must share to be sent in one batch."""
+    return (request["op"], request.get("layer"),
+        request.get("search_dist_meters"), request.get("datasets"))
+
+
+def send(geo_spatial, unit):
+    """Sends a request, or a batch of them. Returns the JSON results."""
+    first = unit[0]
+    if first["op"] == "get_location":
+        if len(unit) == 1:
+            return [geo_spatial.get_location(
+                "0", first["address"], datasets=first.get("datasets"))]
+        return [json_result for _, json_result in geo_spatial.get_locations(
+            [(str(i), request["address"]) for i, request in enumerate(unit)],
+            datasets=first.get("datasets"))]
+    if len(unit) == 1:
+        return [geo_spatial.query_layer(
+            "0", first["layer"], first["lat"], first["lon"],
+            search_dist_meters=first["search_dist_meters"])]
+    return [json_result for _, json_result in geo_spatial.query_layer_batch(
+        first["layer"],
+        [(str(i), request["lat"], request["lon"])
+            for i, request in enumerate(unit)],
+        search_dist_meters=first["search_dist_meters"])]
+
+
+def run(geo_spatial, units, concurrency, rate=None, warmup=0):
+    """Sends units of requests from concurrency threads.
+
+    Args:
+        geo_spatial (GeoSpatial): The instance under test.
+        units (list): Request lists, from make_units().
+        concurrency (int): The number of sending threads.
+        rate (float, optional): The target rate, in units per second. A unit
+            that starts late is timed from when it was due, so a backlog
+            shows up in its latency. None sends as fast as the threads
+            allow.
+        warmup (int, optional): The number of units sent, and not measured,
+            first.
+
+    Returns:
+        A dictionary of results: requests, seconds, throughput, latency
+        percentiles in milliseconds, and the count of each status.
+    """
+    for unit in units[:warmup]:
+        send(geo_spatial, unit)
+    units = units[warmup:]
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    next_unit = itertools.count()
+    start = time.time()
+
+    def worker():
+        while True:
+            i = next(next_unit)
+            if i >= len(units):
+                return
+            due = start + i / rate if rate else time.time()
+            if rate:
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            json_results = send(geo_spatial, units[i])
+            latency = time.time() - due
+            unit_statuses = [
+                json.loads(json_result)["status"]
+                for json_result in json_results]
+            with lock:
+                latencies.extend([latency] * len(json_results))
+                for status in unit_statuses:
+                    statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [
+        threading.Thread(target=worker) for _ in range(max(1, concurrency))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = max(time.time() - start, 1e-9)
+    latencies.sort()
+    result = {
+        "requests": len(latencies),
+        "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 1),
+        "statuses": statuses
+    }
+    for key, percent in PERCENTILES:
+        value = percentile(latencies, percent)
+        result[key] = round(value * 1000, 3) if value is not None else None
+    result["max_ms"] = (
+        round(latencies[-1] * 1000, 3) if latencies else None)
+    return result
+
+
+def _parse_value(text):
+    """Parses a sweep value as JSON, falling back to a string."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_sweeps(sweeps):
+    """Parses --sweep KEY=V1,V2 options into a list of settings dicts, one
+    per combination."""
+    keys = []
+    values = []
+    for sweep in sweeps:
+        key, _, text = sweep.partition("=")
+        if not key or not text:
+            raise ValueError("Sweep must look like KEY=V1,V2: {s}".format(
+                s=sweep))
+        keys.append(key)
+        values.append([_parse_value(value) for value in text.split(",")])
+    return [dict(zip(keys, combination))
+        for combination in itertools.product(*values)]
+
+
+def parse_args(argv):
+    """Parses the command line."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark GeoSpatial with a recorded or synthetic "
+                    "request mix.")
+    parser.add_argument("--requests-file",
+        help="recorded mix: NDJSON requests or a call log")
+    parser.add_argument("--synthetic", type=int, default=0,
+        help="number of synthetic requests to generate")
+    parser.add_argument("--layer", dest="layers", action="append",
+        default=[], help="layer synthetic points are queried against; "
+                         "may be repeated")
+    parser.add_argument("--bbox", default="37,-109,41,-102",
+        help="min_lat,min_lon,max_lat,max_lon of synthetic points "
+             "(default: Colorado)")
+    parser.add_argument("--address-fraction", type=float, default=0.5,
+        help="fraction of synthetic requests that are addresses")
+    parser.add_argument("--seed", type=int, help="synthetic mix random seed")
+    parser.add_argument("--repeat", type=int, default=1,
+        help="times to send the mix per run")
+    parser.add_argument("--concurrency", type=int, default=1,
+        help="sending threads")
+    parser.add_argument("--rate", type=float,
+        help="target requests (or batches) per second; default: closed loop")
+    parser.add_argument("--batch-size", type=int, default=1,
+        help="requests per batch call (default: 1, single calls)")
+    parser.add_argument("--warmup", type=int, default=0,
+        help="requests (or batches) sent before measuring")
+    parser.add_argument("--sweep", dest="sweeps", action="append",
+        default=[], help="KEY=V1,V2 to run once per value; may be repeated")
+    parser.add_argument("--output-format", choices=("text", "json"),
+        default="text", help="report format")
+    parser.add_argument("--config",
+        help="GeoSpatial configuration file the sweeps start from")
+    parser.add_argument("--data-catalog", default=r"f:\websites\datacatalog.xml",
+        help="data catalog path")
+    parser.add_argument("--shapefile-root", default=r"f:\pxse-data",
+        help="shapefile root directory")
+    options = parser.parse_args(argv)
+    if not options.requests_file and not options.synthetic:
+        parser.error("--requests-file or --synthetic is required")
+    try:
+        options.bbox = tuple(float(value) for value in options.bbox.split(","))
+        if len(options.bbox) != 4:
+            raise ValueError
+    except ValueError:
+        parser.error("--bbox must be four comma-separated numbers")
+    try:
+        options.sweeps = parse_sweeps(options.sweeps)
+    except ValueError as e:
+        parser.error(str(e))
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    requests = []
+    if options.requests_file:
+        requests.extend(read_requests(options.requests_file))
+    if options.synthetic:
+        requests.extend(synthetic_requests(
+            options.synthetic, options.layers, options.bbox,
+            options.address_fraction, options.seed))
+    requests = requests * max(1, options.repeat)
+
+    for settings in options.sweeps:
+        run_settings = {
+            "concurrency": options.concurrency, "rate": options.rate,
+            "batch_size": options.batch_size}
+        config = {}
+        if options.config:
+            config = geospatial.load_config(options.config)
+        for key, value in settings.items():
+            if key in _RUN_SETTINGS:
+                run_settings[key] = value
+            else:
+                config[key] = value
+        geo_spatial = geospatial.GeoSpatial(
+            options.data_catalog, options.shapefile_root, config)
+        try:
+            result = run(
+                geo_spatial, make_units(requests, run_settings["batch_size"]),
+                run_settings["concurrency"], run_settings["rate"],
+                options.warmup)
+        finally:
+            geo_spatial.close()
+        result["settings"] = settings
+        if options.output_format == "json":
+            print json.dumps(result, sort_keys=True)
+        else:
+            print "{s}: {n} requests in {t}s, {r}/s; p50 {p50}ms, " \
+                "p95 {p95}ms, p99 {p99}ms, p999 {p999}ms, max {m}ms; " \
+                "{st}".format(
+                    s=" ".join("{k}={v}".format(k=key, v=settings[key])
+                        for key in sorted(settings)) or "default",
+                    n=result["requests"], t=result["seconds"],
+                    r=result["throughput"], p50=result["p50_ms"],
+                    p95=result["p95_ms"], p99=result["p99_ms"],
+                    p999=result["p999_ms"], m=result["max_ms"],
+                    st=" ".join("{k}={v}".format(k=key, v=value)
+                        for key, value in sorted(result["statuses"].items())))
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
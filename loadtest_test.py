@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the load generator."""
+
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import fakepxpointsc
+fakepxpointsc.install()
+
+import calllog
+import geospatial
+import loadtest
+
+
+def _location(address, datasets=None):
+    return {"op": "get_location", "address": address, "datasets": datasets}
+
+
+def _point(layer, lat=40.0, lon=-105.0):
+    return {"op": "query_layer", "layer": layer, "lat": lat, "lon": lon,
+            "search_dist_meters": 0.0}
+
+
+class PercentileTest(unittest.TestCase):
+    def test_nearest_rank(self):
+        values = range(1, 101)
+        self.assertEqual(
+            [50, 95, 99, 100],
+            [loadtest.percentile(values, percent)
+             for _, percent in loadtest.PERCENTILES])
+        self.assertEqual(1, loadtest.percentile(values, 0))
+        self.assertEqual(100, loadtest.percentile(values, 100))
+        self.assertEqual(7, loadtest.percentile([7], 99.9))
+        self.assertEqual(2, loadtest.percentile([1, 2, 3], 50))
+        self.assertIsNone(loadtest.percentile([], 50))
+
+
+class MakeUnitsTest(unittest.TestCase):
+    def test_batches_of_the_same_kind(self):
+        requests = [
+            _location("1"), _location("2"), _location("3"),
+            _location("4", "Parcel"), _point("County"), _point("County"),
+            _point("State"), _location("5")]
+        self.assertEqual(
+            [[requests[0], requests[1]], [requests[2]], [requests[3]],
+             [requests[4], requests[5]], [requests[6]], [requests[7]]],
+            loadtest.make_units(requests, 2))
+        self.assertEqual(
+            [[request] for request in requests],
+            loadtest.make_units(requests, 1))
+
+
+class ReadRequestsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def read(self, lines):
+        path = os.path.join(self.directory, "requests")
+        with open(path, "wb") as requests_file:
+            requests_file.write("\n".join(lines) + "\n")
+        return loadtest.read_requests(path)
+
+    def test_ndjson(self):
+        self.assertEqual(
+            [_location("123 main st"), _location("9 elm st", "parcel"),
+             _point("County", 40.0, -105.2)],
+            self.read([
+                json.dumps({"op": "get_location", "address": "123 main st"}),
+                "",
+                json.dumps({"op": "get_location", "address": "9 elm st",
+                            "datasets": "parcel"}),
+                json.dumps({"op": "get_location"}),
+                json.dumps({"op": "get_stats"}),
+                json.dumps({"op": "query_layer", "layer": "County",
+                            "lat": 40.0, "lon": -105.2})]))
+
+    def test_call_log(self):
+        def record(operation, **fields):
+            return "2026-10-19 12:00:00,000 INFO {m}".format(
+                m=calllog.KeyValueMessage(operation, fields))
+        self.assertEqual(
+            [_location('1 "A" St, Boulder'),
+             dict(_point("State", 39.5, -104.25), search_dist_meters=500.0)],
+            self.read([
+                record("get_location", call_id="1",
+                       address='1 "A" St, Boulder', status="OK",
+                       elapsed_ms=1.5),
+                record("get_locations", rows=3, status="OK"),
+                record("query_layer", call_id="2", layer="State", lat=39.5,
+                       lon=-104.25, search_dist_meters=500)]))
+
+
+class RunTest(unittest.TestCase):
+    def setUp(self):
+        fakepxpointsc.reset()
+        self.addCleanup(fakepxpointsc.reset)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.geo_spatial = geospatial.GeoSpatial(
+            fakepxpointsc.write_data_catalog(directory), directory)
+        self.addCleanup(self.geo_spatial.close)
+        # distinct addresses, so that every request goes native
+        self.requests = [
+            _location("{n} Main St".format(n=n)) for n in range(8)]
+
+    def test_closed_loop(self):
+        fakepxpointsc.delay = 0.01
+        result = loadtest.run(
+            self.geo_spatial, loadtest.make_units(self.requests, 1), 2,
+            warmup=2)
+        self.assertEqual(6, result["requests"])
+        self.assertEqual({"OK": 6}, result["statuses"])
+        self.assertGreaterEqual(result["p50_ms"], 10)
+        self.assertLessEqual(result["p50_ms"], result["p999_ms"])
+        self.assertLessEqual(result["p999_ms"], result["max_ms"])
+
+    def test_open_loop_latency_is_measured_from_when_due(self):
+        # units are due every 25ms but take 50ms, so each starts later than
+        # the last, and the wait counts in its latency
+        fakepxpointsc.delay = 0.05
+        result = loadtest.run(
+            self.geo_spatial, loadtest.make_units(self.requests, 1), 1,
+            rate=40)
+        self.assertEqual(8, result["requests"])
+        self.assertGreaterEqual(result["max_ms"], 200)
+        self.assertGreaterEqual(result["seconds"], 0.4)
+
+    def test_batches(self):
+        result = loadtest.run(
+            self.geo_spatial, loadtest.make_units(
+                self.requests + [_point("County")], 3), 1)
+        self.assertEqual(9, result["requests"])
+        self.assertEqual({"OK": 9}, result["statuses"])
+        self.assertEqual(
+            3, len([call for call in fakepxpointsc.calls
+                    if call[0] == "GeocoderGeocode"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
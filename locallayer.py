@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""In-process query engine for hot, rarely changing layers.
+
+A LocalLayer reads a layer's shapefile directly, so its queries never cross
+into PxPointSC. Polygon layers answer WITHIN queries with an STR-tree of shape
+bounding boxes and a point-in-polygon test; point layers answer nearest
+queries with a KD-tree (see pointindex.py). Results carry the same attribute
+columns, in .dbf field order, that a native query for all of the layer's
+fields would.
+"""
+
+import cache
+import geometry
+import pointindex
+import shapereader
+import strtree
+
+
+class LocalLayer:
+    """Answers WITHIN queries against one polygon layer, or nearest queries
+    against one point layer."""
+    def __init__(self, layer_alias, shapefile_path, shape_cache_size=4096):
+        """Reads a layer's shapefile and indexes its shapes.
+
+        Args:
+            layer_alias (str): The layer alias, as in the data catalog.
+            shapefile_path (str): The path of the layer's .shp file.
+            shape_cache_size (int, optional): The number of decoded shapes to
+                keep in memory.
+        """
+        self.layer_alias = layer_alias
+        self.shapefile = shapereader.Shapefile(shapefile_path)
+        self.field_names = self.shapefile.field_names
+        self.field_var_types = self.shapefile.field_var_types
+        self.is_polygon_layer = (
+            self.shapefile.shape_type in shapereader.POLYGON_SHAPE_TYPES)
+        self.is_point_layer = (
+            self.shapefile.shape_type in shapereader.POINT_SHAPE_TYPES)
+        # features whose records are deleted are left out, like null shapes
+        boxes = [
+            None if self.shapefile.is_deleted(index) else box
+            for index, box in enumerate(self.shapefile.boxes)]
+        if self.is_polygon_layer:
+            # null shapes get an empty box that no point falls in
+            self.__index = strtree.STRtree([
+                box if box is not None else (1.0, 1.0, -1.0, -1.0)
+                for box in boxes])
+            self.__shapes = cache.LRUCache(shape_cache_size)
+        elif self.is_point_layer:
+            self.__index = pointindex.PointIndex([
+                (box[1], box[0]) if box is not None else None
+                for box in boxes])
+        else:
+            raise ValueError(
+                "Layer {a} is neither a point nor a polygon layer".format(
+                    a=layer_alias))
+
+    def supports(self, search_dist_meters):
+        """Returns True if this layer can answer a query locally: a WITHIN
+        query (no search distance) on a polygon layer, or a nearest query on
+        a point layer."""
+        if search_dist_meters <= 0:
+            return self.is_polygon_layer
+        return self.is_point_layer
+
+    def find_within(self, lat, lon):
+        """Returns the indexes of the features containing a point, in
+        shapefile order.
+
+        Args:
+            lat (float): The point's latitude.
+            lon (float): The point's longitude.
+        """
+        result = []
+        for index in sorted(self.__index.query_point(lon, lat)):
+            rings = self.__shapes.get(index)
+            if rings is None:
+                rings = self.shapefile.shape(index)
+                self.__shapes.put(index, rings)
+            if rings and geometry.point_in_flat_rings(lon, lat, rings):
+                result.append(index)
+        return result
+
+    def find_nearest(self, lat, lon, max_dist_meters, max_results=1):
+        """Returns the features of a point layer nearest to a location.
+
+        Args:
+            lat (float): The location's latitude.
+            lon (float): The location's longitude.
+            max_dist_meters (float): The search radius, in meters.
+            max_results (int, optional): The maximum number of features to
+                return. Zero or less means every feature within the radius.
+
+        Returns:
+            A list of (distance_meters, feature_index) tuples, nearest first.
+        """
+        return self.__index.nearest(
+            lat, lon, max_results if max_results > 0 else None,
+            max_dist_meters)
+
+    def find_nearest_batch(
+            self, locations, max_dist_meters, max_results=1):
+        """Yields find_nearest() results for many (lat, lon) locations, in
+        input order."""
+        return self.__index.nearest_batch(
+            locations, max_results if max_results > 0 else None,
+            max_dist_meters)
+
+    def records(self, indexes):
+        """Returns the attribute values of features, in field order."""
+        return [self.shapefile.record(index) for index in indexes]
+
+    def close(self):
+        """Closes the layer's shapefile."""
+        self.shapefile.close()
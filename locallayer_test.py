@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of local layer queries on shapefiles."""
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import locallayer
+from shapereader_test import FIELDS, square, write_shapefile
+
+
+class LocalLayerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "layer")
+
+    def open(self, *args, **kwargs):
+        write_shapefile(self.path, *args, **kwargs)
+        layer = locallayer.LocalLayer("Layer", self.path + ".shp")
+        self.addCleanup(layer.close)
+        return layer
+
+    def test_polygon_layer(self):
+        layer = self.open(
+            [square(0, 0), square(0.5, 0.5), None, square(5, 5)], FIELDS,
+            [["A", 1, 1, "T"], ["B", 2, 2, "F"], ["C", 3, 3, "T"],
+             ["D", 4, 4, "F"]])
+        self.assertTrue(layer.supports(0))
+        self.assertFalse(layer.supports(100))
+        self.assertEqual([0, 1], layer.find_within(0.75, 0.75))
+        self.assertEqual([0], layer.find_within(0.25, 0.25))
+        self.assertEqual([3], layer.find_within(5.5, 5.5))
+        self.assertEqual([], layer.find_within(3, 3))
+        self.assertEqual(
+            [[u"B", 2, 2.0, False]], layer.records(layer.find_within(1.2, 1.2)))
+
+    def test_deleted_polygons_are_not_found(self):
+        layer = self.open(
+            [square(0, 0), square(0.5, 0.5)], FIELDS,
+            [["A", 1, 1, "T"], ["B", 2, 2, "F"]], deleted=(0, ))
+        self.assertEqual([1], layer.find_within(0.75, 0.75))
+        self.assertEqual([], layer.find_within(0.25, 0.25))
+
+    def test_point_layer(self):
+        layer = self.open(
+            [(-105.0, 40.0), (-105.1, 40.0), None, (-104.0, 40.0)], FIELDS,
+            [["A", 1, 1, "T"]] * 4, shape_type=1)
+        self.assertTrue(layer.supports(100))
+        self.assertFalse(layer.supports(0))
+        nearest = layer.find_nearest(40.0, -105.01, 50000, 2)
+        self.assertEqual([0, 1], [index for _, index in nearest])
+        self.assertAlmostEqual(852, nearest[0][0], delta=1)
+        nearest = layer.find_nearest(40.0, -105.01, 50000, 0)
+        self.assertEqual([0, 1], [index for _, index in nearest])
+
+    def test_deleted_points_are_not_found(self):
+        layer = self.open(
+            [(-105.0, 40.0), (-105.1, 40.0)], FIELDS,
+            [["A", 1, 1, "T"]] * 2, deleted=(0, ), shape_type=1)
+        nearest = layer.find_nearest(40.0, -105.01, 50000, 1)
+        self.assertEqual([1], [index for _, index in nearest])
+
+
+if __name__ == "__main__":
+    unittest.main()
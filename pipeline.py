@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Pipelined geocoding and layer enrichment.
+
+A GeocodePipeline geocodes addresses chunk by chunk on one thread and
+queries layers about the geocoded points on another, with bounded queues
+between the stages. While chunk N is being enriched by the spatial processor,
+chunk N + 1 is being geocoded by the geocoder; the two use separate PxPointSC
+handles, and ctypes releases the GIL for the duration of each native call.
+
+Geocoder output tables are turned straight into layer query points from
+their $Latitude and $Longitude columns, with no JSON round trip.
+"""
+
+import Queue
+import sys
+import threading
+
+# How often, in seconds, blocked stages check whether the pipeline was closed
+_POLL_SECONDS = 0.1
+
+
+class _Failure:
+    """Carries an exception from a stage thread to the consumer."""
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class GeocodePipeline:
+    """Geocodes addresses and queries layers about the results, in stages
+    that overlap."""
+    def __init__(
+            self, geo_spatial, layer_names, search_dist_meters=0,
+            max_results=1, queue_size=2, chunk_size=None, profile=None,
+            datasets=None):
+        """Initializes the pipeline.
+
+        Args:
+            geo_spatial (GeoSpatial): The instance that answers the queries.
+            layer_names (list): The layers to query about each geocoded point.
+            search_dist_meters (int, optional): As for
+                GeoSpatial.query_layer().
+            max_results (int, optional): As for GeoSpatial.query_layer().
+            queue_size (int, optional): The maximum number of chunks waiting
+                between stages.
+            chunk_size (int, optional): The number of addresses per chunk.
+                Defaults to the instance's BATCH_CHUNK_SIZE.
+            profile (str or list, optional): The geocoder output profile, as
+                for GeoSpatial.get_location(). It must include $Latitude and
+                $Longitude for addresses to be enriched.
+            datasets (str, optional): The geocoder dataset profile, as for
+                GeoSpatial.get_location().
+        """
+        self.geo_spatial = geo_spatial
+        self.layer_names = list(layer_names)
+        self.search_dist_meters = search_dist_meters
+        self.max_results = max_results
+        self.queue_size = queue_size
+        self.profile = profile
+        self.datasets = datasets
+        self.chunk_size = max(1, chunk_size or
+            geo_spatial.get_config()["BATCH_CHUNK_SIZE"])
+
+    @staticmethod
+    def get_points(locations, results):
+        """Extracts layer query points from geocoder results.
+
+        Args:
+            locations (list): The (call_id, address) tuples geocoded.
+            results (list): The geocoder's (output_table, error_table,
+                return_code) tuple for each location.
+
+        Returns:
+            The (call_id, lat, lon) tuple of each successful geocode, and the
+            position in locations of each.
+        """
+        # positions and first rows of the successful geocodes
+        found = [
+            (i, output_table.rows[0])
+            for i, (output_table, _, _) in enumerate(results)
+            if output_table is not None and output_table.rows]
+        if not found:
+            return [], []
+        # every result of a chunk has the profile's columns
+        col_names = results[found[0][0]][0].col_names
+        try:
+            lat_idx = col_names.index("$Latitude")
+            lon_idx = col_names.index("$Longitude")
+        except ValueError:
+            return [], []
+        positions = [i for i, _ in found]
+        call_ids = [locations[i][0] for i in positions]
+        try:
+            lats = map(float, [row[lat_idx] for _, row in found])
+            lons = map(float, [row[lon_idx] for _, row in found])
+        except (ValueError, TypeError):
+            # some rows have no coordinates; keep those that do
+            return GeocodePipeline.__get_valid_points(
+                call_ids, positions, found, lat_idx, lon_idx)
+        return zip(call_ids, lats, lons), positions
+
+    @staticmethod
+    def __get_valid_points(call_ids, positions, found, lat_idx, lon_idx):
+        """Converts the coordinates of found rows one by one, skipping those
+        that are not numbers."""
+        points = []
+        valid_positions = []
+        for call_id, position, (_, row) in zip(call_ids, positions, found):
+            try:
+                points.append(
+                    (call_id, float(row[lat_idx]), float(row[lon_idx])))
+            except (ValueError, TypeError):
+                continue
+            valid_positions.append(position)
+        return points, valid_positions
+
+    def run(self, locations):
+        """Geocodes and enriches (call_id, address) tuples.
+
+        Args:
+            locations (iterable): (call_id, address) tuples. It is consumed
+                on the geocoding thread.
+
+        Yields:
+            A (call_id, geocode_json, layer_jsons) tuple for each address, in
+            input order. geocode_json is what GeoSpatial.get_location() would
+            return; layer_jsons maps each layer name to what
+            GeoSpatial.query_layer() would return for the geocoded point, or
+            None if the address was not geocoded.
+        """
+        geocoded = Queue.Queue(self.queue_size)
+        enriched = Queue.Queue(self.queue_size)
+        closed = threading.Event()
+        threads = [
+            threading.Thread(
+                target=self.__run_stage,
+                args=(self.__geocode_stage, locations, geocoded, closed)),
+            threading.Thread(
+                target=self.__run_stage,
+                args=(self.__enrich_stage, geocoded, enriched, closed))
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while True:
+                item = enriched.get()
+                if item is None:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+                for row in item:
+                    yield row
+        finally:
+            # also stops the stages when the consumer gives up early
+            closed.set()
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def __put(output, item, closed):
+        """Puts an item on a bounded queue, unless the pipeline is closed.
+        Returns False if it is."""
+        while not closed.is_set():
+            try:
+                output.put(item, True, _POLL_SECONDS)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def __run_stage(self, stage, source, output, closed):
+        """Runs a stage, passing its items and then None, or a failure, to
+        the next stage."""
+        try:
+            for item in stage(source, closed):
+                if not GeocodePipeline.__put(output, item, closed):
+                    return
+            GeocodePipeline.__put(output, None, closed)
+        except Exception:
+            GeocodePipeline.__put(output, _Failure(sys.exc_info()), closed)
+
+    def __geocode_stage(self, locations, closed):
+        """Yields (chunk, geocode JSON strings, points, positions) tuples."""
+        geo_spatial = self.geo_spatial
+        locations = iter(locations)
+        while not closed.is_set():
+            chunk = []
+            for location in locations:
+                chunk.append(location)
+                if len(chunk) >= self.chunk_size:
+                    break
+            if not chunk:
+                return
+            # results stays empty if the geocoder fails
+            results = []
+            def geocode():
+                results.extend(
+                    geo_spatial.geocode_tables(
+                        chunk, self.profile, self.datasets))
+                return results
+            json_results = [
+                json_result for _, json_result in
+                geo_spatial.create_batch_json_results(
+                    geocode, len(chunk), operation="get_locations")]
+            points, positions = GeocodePipeline.get_points(chunk, results)
+            yield chunk, json_results, points, positions
+
+    def __enrich_stage(self, geocoded, closed):
+        """Yields lists of output rows, one list per chunk."""
+        geo_spatial = self.geo_spatial
+        while not closed.is_set():
+            try:
+                item = geocoded.get(True, _POLL_SECONDS)
+            except Queue.Empty:
+                continue
+            if item is None:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+            chunk, json_results, points, positions = item
+            layer_jsons = [{} for _ in chunk]
+            for layer_name in self.layer_names:
+                for layer_json in layer_jsons:
+                    layer_json[layer_name] = None
+                if not points:
+                    continue
+                for i, (_, json_result) in zip(
+                        positions, geo_spatial.create_batch_json_results(
+                            lambda: geo_spatial.query_layer_tables(
+                                layer_name, points,
+                                search_dist_meters=self.search_dist_meters,
+                                max_results=self.max_results),
+                            len(points), self.max_results,
+                            operation="query_layer_batch")):
+                    layer_jsons[i][layer_name] = json_result
+            yield [
+                (call_id, json_result, layer_json)
+                for (call_id, _), json_result, layer_json in zip(
+                    chunk, json_results, layer_jsons)]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the pipelined geocoding and layer enrichment."""
+
+import json
+import shutil
+import tempfile
+import unittest
+
+import fakepxpointsc
+fakepxpointsc.install()
+
+import geospatial
+import pipeline
+import table
+
+
+def geocoder_result(lat, lon):
+    output_table = table.Table()
+    for col_name in ("INPUT.Id", "$Latitude", "$Longitude"):
+        output_table.append_col(col_name)
+    output_table.append_row(("0", lat, lon))
+    return output_table, None, 0
+
+
+class GetPointsTest(unittest.TestCase):
+    def test_points(self):
+        locations = [("a", ""), ("b", ""), ("c", ""), ("d", "")]
+        results = [
+            geocoder_result("40.5", "-105.5"),
+            (None, table.Table(), 1),
+            geocoder_result(39.0, -104.0),
+            (table.Table(), None, 0)]
+        self.assertEqual(
+            ([("a", 40.5, -105.5), ("c", 39.0, -104.0)], [0, 2]),
+            pipeline.GeocodePipeline.get_points(locations, results))
+
+    def test_rows_without_coordinates(self):
+        locations = [("a", ""), ("b", ""), ("c", "")]
+        results = [
+            geocoder_result("", ""), geocoder_result(1, 2),
+            geocoder_result(None, 3)]
+        self.assertEqual(
+            ([("b", 1.0, 2.0)], [1]),
+            pipeline.GeocodePipeline.get_points(locations, results))
+
+    def test_profile_without_coordinates(self):
+        output_table = table.Table()
+        output_table.append_col("INPUT.Id")
+        output_table.append_row(("0", ))
+        self.assertEqual(
+            ([], []),
+            pipeline.GeocodePipeline.get_points(
+                [("a", "")], [(output_table, None, 0)]))
+        self.assertEqual(
+            ([], []), pipeline.GeocodePipeline.get_points([], []))
+
+
+class GeocodePipelineTest(unittest.TestCase):
+    def setUp(self):
+        fakepxpointsc.reset()
+        self.addCleanup(fakepxpointsc.reset)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.geo_spatial = geospatial.GeoSpatial(
+            fakepxpointsc.write_data_catalog(directory), directory)
+        self.addCleanup(self.geo_spatial.close)
+
+    def test_run(self):
+        locations = [
+            (str(i), "{n} Main St".format(n=i) if i % 3 else "")
+            for i in range(10)]
+        rows = list(pipeline.GeocodePipeline(
+            self.geo_spatial, ["County", "State"], chunk_size=4).run(
+                iter(locations)))
+        self.assertEqual(
+            [call_id for call_id, _ in locations],
+            [call_id for call_id, _, _ in rows])
+        for (_, address), (_, geocode_json, layer_jsons) in zip(
+                locations, rows):
+            if address:
+                self.assertEqual("OK", json.loads(geocode_json)["status"])
+                self.assertEqual(
+                    "Boulder",
+                    json.loads(layer_jsons["County"])["result"][0][
+                        "[County]NAME"])
+            else:
+                self.assertEqual(
+                    "NO_RESULTS", json.loads(geocode_json)["status"])
+                self.assertEqual({"County": None, "State": None}, layer_jsons)
+        # chunks are admitted as batch calls
+        operations = self.geo_spatial.get_stats()["admission"]["operations"]
+        self.assertEqual(3, operations["get_locations"]["admitted"])
+        self.assertEqual(6, operations["query_layer_batch"]["admitted"])
+
+    def test_failure_reaches_the_consumer(self):
+        def geocode(address, options):
+            raise RuntimeError("geocoder crashed")
+        fakepxpointsc.geocode = geocode
+        rows = pipeline.GeocodePipeline(self.geo_spatial, ["County"]).run(
+            [("1", "1 Main St")])
+        status = json.loads(next(rows)[1])["status"]
+        self.assertEqual("SERVER_ERROR", status)
+
+
+if __name__ == "__main__":
+    unittest.main()
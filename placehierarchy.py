@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""In-memory cache of the place hierarchy: state, county, city and ZIP.
+
+The hierarchy changes only with the geocoding datasets, and is small enough
+(a few tens of thousands of places for the US) to keep in memory whole. A
+PlaceHierarchy remembers every parent and child list it has been told about,
+so rollups (which county, and which state, is this ZIP in?) and drill-downs
+(which ZIPs are in this county?) only go native the first time a place is
+seen. It is filled lazily, or ahead of time with preload().
+
+Places are identified by (place_type, place_id) keys, such as
+("County", "08013"). Parents and children are (place_type, place_id,
+place_name) tuples, whose first two items are again a key.
+"""
+
+import threading
+
+# Place types, from the top of the hierarchy down
+PLACE_TYPES = ("State", "County", "City", "Postcode")
+# Found for a place whose lookup failed, and which is therefore not
+# remembered
+UNKNOWN = object()
+
+
+class PlaceHierarchy:
+    """Remembers the parent and the children of places."""
+    def __init__(self, find_parents, find_children):
+        """Initializes an empty hierarchy.
+
+        Args:
+            find_parents (callable): Takes a list of place keys and returns,
+                for each, its parent place, None, or UNKNOWN if the lookup
+                failed. Called for places whose parent is not yet known.
+            find_children (callable): Takes a list of place keys and returns,
+                for each, a list of its child places, or UNKNOWN if the
+                lookup failed. Called for places whose children are not yet
+                known.
+        """
+        self.__find_parents = find_parents
+        self.__find_children = find_children
+        # parent place (or None) of each place key
+        self.__parents = {}
+        # tuple of child places of each place key
+        self.__children = {}
+        # every place seen, as a parent or a child, by place key
+        self.__places = {}
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def parents(self, keys):
+        """Returns the parent place (or None) of each of a list of place keys,
+        in order, with one native lookup for those not yet known. Places
+        whose lookup failed have None, until a later lookup succeeds."""
+        return self.__lookup(
+            keys, self.__parents, self.__find_parents, self.__add_parents,
+            None)
+
+    def parent(self, key):
+        """Returns the parent place of a place key, or None."""
+        return self.parents([key])[0]
+
+    def children_batch(self, keys):
+        """Returns the child places of each of a list of place keys, in order,
+        with one native lookup for those not yet known. Places whose lookup
+        failed have none, until a later lookup succeeds."""
+        return self.__lookup(
+            keys, self.__children, self.__find_children, self.__add_children,
+            ())
+
+    def children(self, key):
+        """Returns the child places of a place key, as a tuple."""
+        return self.children_batch([key])[0]
+
+    def ancestors(self, key):
+        """Returns the places a place key rolls up to, nearest first; for a
+        ZIP, its city, county and state."""
+        result = []
+        seen = set([key])
+        parent = self.parent(key)
+        while parent is not None and parent[:2] not in seen:
+            result.append(parent)
+            seen.add(parent[:2])
+            parent = self.parent(parent[:2])
+        return result
+
+    def descendants(self, key, place_type=None):
+        """Returns the places below a place key, level by level, with one
+        native lookup per level for those not yet known.
+
+        Args:
+            key (tuple): The place key.
+            place_type (str, optional): Only return places of this type.
+                Levels below it are not visited.
+        """
+        result = []
+        seen = set([key])
+        level = [key]
+        while level:
+            next_level = []
+            for places in self.children_batch(level):
+                for place in places:
+                    if place[:2] in seen:
+                        continue
+                    seen.add(place[:2])
+                    if place_type is None or place[0] == place_type:
+                        result.append(place)
+                    if place[0] != place_type:
+                        next_level.append(place[:2])
+            level = next_level
+        return result
+
+    def preload(self, keys):
+        """Loads the children of places, and everything below them, ahead of
+        time. Returns the number of places loaded."""
+        loaded = 0
+        for key in keys:
+            loaded += len(self.descendants(key))
+        return loaded
+
+    def clear(self):
+        """Forgets every place, as when the geocoding datasets change."""
+        with self.__lock:
+            self.__parents.clear()
+            self.__children.clear()
+            self.__places.clear()
+
+    def stats(self):
+        """Returns a dictionary of counters describing this hierarchy."""
+        with self.__lock:
+            return {
+                "places": len(self.__places),
+                "hits": self.hits,
+                "misses": self.misses,
+                "failures": self.failures
+            }
+
+    def __lookup(self, keys, known, find, add, default):
+        """Looks places up in one of the maps, finding the unknown ones once.
+        Places not found, or whose lookup failed, have default."""
+        missing = []
+        with self.__lock:
+            for key in keys:
+                if key in known:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    missing.append(key)
+        # keys asked for twice are looked up once, in order of first appearance
+        seen = set()
+        missing = [
+            key for key in missing if not (key in seen or seen.add(key))]
+        if missing:
+            # not under the lock: the native lookup may be slow
+            found = find(missing)
+            with self.__lock:
+                for key, value in zip(missing, found):
+                    if value is UNKNOWN:
+                        # not remembered, so that it is looked up again
+                        self.failures += 1
+                    else:
+                        add(key, value)
+        with self.__lock:
+            return [known.get(key, default) for key in keys]
+
+    def __add_parents(self, key, parent):
+        """Records a parent. Called with the lock held."""
+        if parent is not None:
+            parent = tuple(parent)
+            self.__places[parent[:2]] = parent
+        self.__parents[key] = parent
+
+    def __add_children(self, key, children):
+        """Records children, which also tells their parent. Called with the
+        lock held."""
+        children = tuple(tuple(child) for child in children)
+        self.__children[key] = children
+        # the children's parent is only recorded if it has been seen, with
+        # its name, before; otherwise their parent lookups go native
+        parent = self.__places.get(key)
+        for child in children:
+            self.__places[child[:2]] = child
+            if parent is not None:
+                self.__parents.setdefault(child[:2], parent)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the in-memory place hierarchy."""
+
+import unittest
+
+import placehierarchy
+
+STATE = ("State", "CO", "Colorado")
+COUNTY = ("County", "08013", "Boulder")
+CITY = ("City", "0807850", "Boulder")
+POSTCODE = ("Postcode", "80301", "80301")
+
+
+class PlaceHierarchyTest(unittest.TestCase):
+    def setUp(self):
+        self.parents = {
+            COUNTY[:2]: STATE, CITY[:2]: COUNTY, POSTCODE[:2]: CITY}
+        self.children = {
+            STATE[:2]: [COUNTY], COUNTY[:2]: [CITY], CITY[:2]: [POSTCODE]}
+        # place keys whose lookups fail
+        self.failing = set()
+        self.lookups = []
+        self.hierarchy = placehierarchy.PlaceHierarchy(
+            self.find_parents, self.find_children)
+
+    def find_parents(self, keys):
+        self.lookups.append(("parents", list(keys)))
+        return [
+            placehierarchy.UNKNOWN if key in self.failing
+            else self.parents.get(key) for key in keys]
+
+    def find_children(self, keys):
+        self.lookups.append(("children", list(keys)))
+        return [
+            placehierarchy.UNKNOWN if key in self.failing
+            else self.children.get(key, []) for key in keys]
+
+    def test_hits_and_misses(self):
+        self.assertEqual(COUNTY, self.hierarchy.parent(CITY[:2]))
+        self.assertEqual(COUNTY, self.hierarchy.parent(CITY[:2]))
+        self.assertIsNone(self.hierarchy.parent(STATE[:2]))
+        self.assertIsNone(self.hierarchy.parent(STATE[:2]))
+        self.assertEqual(
+            [("parents", [CITY[:2]]), ("parents", [STATE[:2]])],
+            self.lookups)
+        stats = self.hierarchy.stats()
+        self.assertEqual(2, stats["hits"])
+        self.assertEqual(2, stats["misses"])
+        self.assertEqual(0, stats["failures"])
+
+    def test_keys_are_looked_up_once(self):
+        self.assertEqual(
+            [COUNTY, STATE, COUNTY],
+            self.hierarchy.parents([CITY[:2], COUNTY[:2], CITY[:2]]))
+        self.assertEqual(
+            [("parents", [CITY[:2], COUNTY[:2]])], self.lookups)
+        self.assertEqual(
+            [(COUNTY, ), (COUNTY, )],
+            self.hierarchy.children_batch([STATE[:2], STATE[:2]]))
+        self.assertEqual(("children", [STATE[:2]]), self.lookups[-1])
+
+    def test_children_tell_their_parent(self):
+        # the county is known, with its name, as a child of the state
+        self.hierarchy.children(STATE[:2])
+        self.assertEqual((CITY, ), self.hierarchy.children(COUNTY[:2]))
+        del self.lookups[:]
+        self.assertEqual(COUNTY, self.hierarchy.parent(CITY[:2]))
+        self.assertEqual([], self.lookups)
+
+    def test_ancestors(self):
+        self.assertEqual(
+            [CITY, COUNTY, STATE], self.hierarchy.ancestors(POSTCODE[:2]))
+        self.assertEqual([], self.hierarchy.ancestors(STATE[:2]))
+
+    def test_ancestors_cycle(self):
+        self.parents[STATE[:2]] = CITY
+        self.assertEqual(
+            [CITY, COUNTY, STATE], self.hierarchy.ancestors(POSTCODE[:2]))
+        self.assertEqual([COUNTY, STATE], self.hierarchy.ancestors(CITY[:2]))
+
+    def test_descendants(self):
+        self.assertEqual(
+            [COUNTY, CITY, POSTCODE], self.hierarchy.descendants(STATE[:2]))
+        self.assertEqual(
+            [CITY], self.hierarchy.descendants(STATE[:2], "City"))
+        self.hierarchy.clear()
+        del self.lookups[:]
+        self.assertEqual(3, self.hierarchy.preload([STATE[:2]]))
+        self.assertEqual(3, self.hierarchy.stats()["places"])
+        self.assertEqual(
+            [COUNTY, CITY, POSTCODE], self.hierarchy.descendants(STATE[:2]))
+        self.assertEqual(4, len(self.lookups))
+
+    def test_failed_lookups_are_not_remembered(self):
+        self.failing.add(CITY[:2])
+        self.assertEqual(
+            [None, STATE], self.hierarchy.parents([CITY[:2], COUNTY[:2]]))
+        self.assertEqual((), self.hierarchy.children(CITY[:2]))
+        self.assertEqual(2, self.hierarchy.stats()["failures"])
+        # the next lookups, once PxPointSC answers, go native again
+        self.failing.clear()
+        self.assertEqual(COUNTY, self.hierarchy.parent(CITY[:2]))
+        self.assertEqual((POSTCODE, ), self.hierarchy.children(CITY[:2]))
+        self.assertEqual(
+            [("parents", [CITY[:2], COUNTY[:2]]), ("children", [CITY[:2]]),
+             ("parents", [CITY[:2]]), ("children", [CITY[:2]])],
+            self.lookups)
+
+
+if __name__ == "__main__":
+    unittest.main()
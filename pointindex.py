@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Nearest-neighbour index over lat/lon points.
+
+Points are indexed in a KD-tree over their unit-sphere (x, y, z) coordinates.
+Straight-line (chord) distance between points on the sphere grows with their
+great-circle distance, so a Euclidean nearest-neighbour search in three
+dimensions is also an exact great-circle search, with no special cases at the
+poles or the antimeridian. Distances are reported in meters along the
+great circle (the haversine distance on a sphere of the mean Earth radius).
+"""
+
+import heapq
+import math
+
+EARTH_RADIUS_METERS = 6371008.8
+
+
+def _to_xyz(lat, lon):
+    """Returns the unit-sphere coordinates of a lat/lon point."""
+    lat = math.radians(lat)
+    lon = math.radians(lon)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+
+def chord_to_meters(chord):
+    """Converts a unit-sphere chord length to a great-circle distance."""
+    return 2.0 * EARTH_RADIUS_METERS * math.asin(min(1.0, chord / 2.0))
+
+
+def meters_to_chord(meters):
+    """Converts a great-circle distance to a unit-sphere chord length."""
+    angle = min(math.pi, meters / EARTH_RADIUS_METERS)
+    return 2.0 * math.sin(angle / 2.0)
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """Returns the great-circle distance between two points, in meters."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2.0) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2.0) ** 2)
+    return 2.0 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+class PointIndex:
+    """A static KD-tree of lat/lon points.
+
+    The tree is implicit: the points are permuted so that each subrange's
+    median element splits it, on the axis recorded for that element.
+    """
+    def __init__(self, points):
+        """Builds the index.
+
+        Args:
+            points (list): One (lat, lon) tuple per point. Points are
+                identified by their index in this list; None entries are
+                skipped.
+        """
+        self.__points = [
+            _to_xyz(point[0], point[1]) + (i, )
+            for i, point in enumerate(points) if point is not None]
+        self.__axes = [0] * len(self.__points)
+        self.__build(0, len(self.__points))
+
+    def __len__(self):
+        return len(self.__points)
+
+    def __build(self, lo, hi):
+        """Arranges points[lo:hi] into a subtree, splitting on the axis of
+        widest spread."""
+        stack = [(lo, hi)]
+        points = self.__points
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= 1:
+                continue
+            spreads = [
+                max(p[axis] for p in points[lo:hi]) -
+                min(p[axis] for p in points[lo:hi])
+                for axis in range(3)]
+            axis = spreads.index(max(spreads))
+            points[lo:hi] = sorted(points[lo:hi], key=lambda p: p[axis])
+            mid = (lo + hi) // 2
+            self.__axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    def nearest(self, lat, lon, k=1, max_dist_meters=None):
+        """Finds the points nearest to a location.
+
+        Args:
+            lat (float): The location's latitude.
+            lon (float): The location's longitude.
+            k (int, optional): The maximum number of points to return. None
+                means every point within max_dist_meters.
+            max_dist_meters (float, optional): The search radius. None means
+                unbounded.
+
+        Returns:
+            A list of (distance_meters, point_index) tuples, nearest first.
+        """
+        if k is None and max_dist_meters is None:
+            raise ValueError("Either k or max_dist_meters is required")
+        if k is not None and k <= 0:
+            return []
+        target = _to_xyz(lat, lon)
+        bound = float("inf")
+        if max_dist_meters is not None:
+            bound = meters_to_chord(max_dist_meters) ** 2
+        points = self.__points
+        axes = self.__axes
+        # max-heap, by negated squared chord, of the best points so far
+        best = []
+        # subranges still to search, with a lower bound on their distance
+        stack = [(0, len(points), 0.0)]
+        while stack:
+            lo, hi, min_dist = stack.pop()
+            if lo >= hi or min_dist > bound:
+                continue
+            mid = (lo + hi) // 2
+            point = points[mid]
+            dist = ((point[0] - target[0]) ** 2 +
+                    (point[1] - target[1]) ** 2 +
+                    (point[2] - target[2]) ** 2)
+            if dist <= bound:
+                heapq.heappush(best, (-dist, point[3]))
+                if k is not None and len(best) > k:
+                    heapq.heappop(best)
+                if k is not None and len(best) == k:
+                    bound = -best[0][0]
+            axis = axes[mid]
+            delta = target[axis] - point[axis]
+            if delta < 0:
+                near, far = (lo, mid, min_dist), (mid + 1, hi, delta * delta)
+            else:
+                near, far = (mid + 1, hi, min_dist), (lo, mid, delta * delta)
+            # the far side is pushed first so the near side is searched first
+            stack.append(far)
+            stack.append(near)
+        return sorted(
+            (chord_to_meters(math.sqrt(-neg_dist)), index)
+            for neg_dist, index in best)
+
+    def nearest_batch(self, locations, k=1, max_dist_meters=None):
+        """Finds the points nearest to each of many locations.
+
+        Args:
+            locations (iterable): (lat, lon) tuples.
+            k (int, optional): As for nearest().
+            max_dist_meters (float, optional): As for nearest().
+
+        Yields:
+            One nearest() result list per location, in input order.
+        """
+        for lat, lon in locations:
+            yield self.nearest(lat, lon, k, max_dist_meters)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the nearest-neighbour point index, against a brute force search."""
+
+import random
+import unittest
+
+import pointindex
+
+
+def brute_force(points, lat, lon, k, max_dist_meters):
+    """Returns the (distance_meters, index) tuples nearest to a location."""
+    found = sorted(
+        (pointindex.haversine_meters(lat, lon, point[0], point[1]), i)
+        for i, point in enumerate(points) if point is not None)
+    if max_dist_meters is not None:
+        found = [entry for entry in found if entry[0] <= max_dist_meters]
+    return found if k is None else found[:k]
+
+
+class PointIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(2015)
+
+    def random_points(self, count, lat_range, lon_range):
+        return [(self.rng.uniform(*lat_range), self.rng.uniform(*lon_range))
+                for _ in range(count)]
+
+    def assert_matches(self, expected, actual):
+        self.assertEqual([index for _, index in expected],
+                         [index for _, index in actual])
+        for (expected_dist, _), (actual_dist, _) in zip(expected, actual):
+            self.assertAlmostEqual(expected_dist, actual_dist, delta=0.01)
+
+    def test_haversine(self):
+        self.assertAlmostEqual(
+            111195, pointindex.haversine_meters(0, 0, 1, 0), delta=1)
+        self.assertAlmostEqual(
+            0, pointindex.haversine_meters(40, -105, 40, -105))
+
+    def test_k_nearest(self):
+        points = self.random_points(2000, (37, 41), (-109, -102))
+        index = pointindex.PointIndex(points)
+        self.assertEqual(2000, len(index))
+        for k in (1, 5, 25):
+            for _ in range(50):
+                lat = self.rng.uniform(36, 42)
+                lon = self.rng.uniform(-110, -101)
+                self.assert_matches(
+                    brute_force(points, lat, lon, k, None),
+                    index.nearest(lat, lon, k))
+
+    def test_radius(self):
+        points = self.random_points(2000, (37, 41), (-109, -102))
+        index = pointindex.PointIndex(points)
+        for radius in (1000.0, 20000.0):
+            for k in (None, 3):
+                for _ in range(50):
+                    lat = self.rng.uniform(37, 41)
+                    lon = self.rng.uniform(-109, -102)
+                    self.assert_matches(
+                        brute_force(points, lat, lon, k, radius),
+                        index.nearest(lat, lon, k, radius))
+
+    def test_antimeridian_and_poles(self):
+        points = (self.random_points(300, (-89.9, 89.9), (-180, 180)) +
+                  [(89.99, 0), (-89.99, 90), (10, 179.99), (10, -179.99)])
+        index = pointindex.PointIndex(points)
+        for lat, lon in ((90, 45), (-90, 0), (10, 180), (10, -180),
+                         (0, 179.5)):
+            self.assert_matches(
+                brute_force(points, lat, lon, 4, None),
+                index.nearest(lat, lon, 4))
+
+    def test_skipped_points(self):
+        points = [(40.0, -105.0), None, (40.1, -105.0)]
+        index = pointindex.PointIndex(points)
+        self.assertEqual(2, len(index))
+        self.assertEqual(
+            [0, 2], [i for _, i in index.nearest(40.0, -105.0, None, 20000)])
+
+    def test_batch(self):
+        points = self.random_points(200, (37, 41), (-109, -102))
+        index = pointindex.PointIndex(points)
+        locations = self.random_points(20, (37, 41), (-109, -102))
+        self.assertEqual(
+            [index.nearest(lat, lon, 3) for lat, lon in locations],
+            list(index.nearest_batch(locations, 3)))
+
+    def test_arguments(self):
+        index = pointindex.PointIndex([(40.0, -105.0)])
+        self.assertEqual([], index.nearest(40.0, -105.0, 0))
+        self.assertRaises(ValueError, index.nearest, 40.0, -105.0, None)
+        self.assertEqual([], pointindex.PointIndex([]).nearest(0, 0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
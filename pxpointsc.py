@@ -7,7 +7,10 @@
 """PxPointSC API wrapper."""
 
 import ctypes
+import os
 import sys
+import threading
+import time
 
 import pxcommon
 import tableset
@@ -18,9 +21,20 @@ import table
 CHAR_SET_NAME = "UTF-8"
 
 def load_library():
-    """Loads PxPointSC library."""
+    """Loads PxPointSC library.
 
-    if sys.platform.startswith("cygwin"):
+    The PXPOINTSC_LIBRARY environment variable, if set, names the library
+    to load instead of the platform's default, such as a stand-in library
+    for benchmarks.
+    """
+
+    if os.environ.get("PXPOINTSC_LIBRARY"):
+        library_path = os.environ["PXPOINTSC_LIBRARY"]
+        if sys.platform.startswith("win"):
+            pxpointsc = ctypes.windll.LoadLibrary(library_path)
+        else:
+            pxpointsc = ctypes.cdll.LoadLibrary(library_path)
+    elif sys.platform.startswith("cygwin"):
         print >> sys.stderr, "ERROR: Not supported on cygwin.\n"\
             "       See %s." % __file__
         sys.exit(1)
@@ -85,6 +99,22 @@ def load_library():
         pxcommon.PxpInt32          # messageSize
     ]
 
+    # not exported by every PxPointSC release; see geocoder_find_aggregate()
+    try:
+        pxpointsc.GeocoderFindAggregate.restype = pxcommon.PxpHandle
+        pxpointsc.GeocoderFindAggregate.argtypes = [
+            pxcommon.PxpHandle,        # geocoder
+            pxcommon.PxpBytePtr,       # inputTableStream
+            pxcommon.PxpConstUTF8Ptr,  # outColDefinition
+            pxcommon.PxpConstUTF8Ptr,  # errColDefinition
+            pxcommon.PxpConstUTF8Ptr,  # processingOptions
+            pxcommon.PxpInt32Ptr,      # returnCode
+            pxcommon.PxpUTF8Ptr,       # returnMessage
+            pxcommon.PxpInt32          # messageSize
+        ]
+    except AttributeError:
+        pass
+
     pxpointsc.GeocoderFindPlace.restype = pxcommon.PxpHandle
     pxpointsc.GeocoderFindPlace.argtypes = [
         pxcommon.PxpHandle,        # geocoder
@@ -143,7 +173,7 @@ def load_library():
         pxcommon.PxpInt32          # messageSize
     ]
 
-    pxpointsc.GeoSpatialLayerInfo.restype = pxcommon.PxpInt32
+    pxpointsc.GeoSpatialLayerInfo.restype = pxcommon.PxpHandle
     pxpointsc.GeoSpatialLayerInfo.argtypes = [
         pxcommon.PxpHandle,        # geoProcessor
         pxcommon.PxpConstUTF8Ptr,  # layerAlias
@@ -251,21 +281,219 @@ def deserialize_tableset(tableset_handle):
     return return_tableset
 
 
-def geocoder_init(data_catalog):
+# Called after every table operation; see add_table_operation_observer().
+# The list is replaced, never changed, so calls can iterate it unlocked.
+_table_operation_observers = []
+_table_operation_observers_lock = threading.Lock()
+
+
+def add_table_operation_observer(observer):
+    """Adds a function to be called after every table operation.
+
+    The observer is called on the calling thread, with the name of the
+    PxPointSC function, a function returning a copy of the serialized input
+    table (a bytearray), the output and error column definitions, the
+    processing options, the return code, and a dictionary of the seconds
+    spent serializing the input ("serialize"), in PxPointSC ("native") and
+    deserializing the results ("deserialize"). The input table is only
+    copied if the observer asks for it.
+
+    An observer added more than once is called once for each time, until it
+    is removed as many times.
+    """
+    global _table_operation_observers
+    with _table_operation_observers_lock:
+        _table_operation_observers = _table_operation_observers + [observer]
+
+
+def remove_table_operation_observer(observer):
+    """Removes an observer added by add_table_operation_observer(), once.
+
+    Raises:
+        ValueError: if the observer was not added.
+    """
+    global _table_operation_observers
+    with _table_operation_observers_lock:
+        observers = list(_table_operation_observers)
+        observers.remove(observer)
+        _table_operation_observers = observers
+
+
+def _table_operation(
+    function,
+    handle,
+    input_table,
+    out_col_definition,
+    err_col_definition,
+    processing_options
+):
+    """Calls a PxPointSC table operation and deserializes its results.
+
+    GeocoderGeocode, GeoSpatialQuery and the other table operations share a
+    signature: a handle, a serialized input table, the output and error
+    column definitions and the processing options in; a tableset with
+    "Output" and "Error" tables out.
+
+    Args:
+        function: The bound PxPointSC function.
+        handle (PxpHandleWrapper): A handle to the geocoder or spatial
+            processor.
+        input_table (Table): A table containing rows of input data.
+        out_col_definition (str): A semicolon-delimited list of desired output 
+            columns.
+        err_col_definition (str): A semicolon-delimited list of desired error
+            columns.
+        processing_options (str): A semicolon-delimited list of processing 
+            options.
+
+    Returns:
+        An (output_table, error_table, return_code, return_message) tuple. The
+        tables are None unless the return code is 0 (success).
+    """
+    start = time.time()
+    table_bytes, table_size = input_table.serialize()
+    serialize_seconds = time.time() - start
+    output_table, error_table, return_code, return_message, timings = (
+        _call_table_operation(
+            function,
+            handle,
+            table_bytes,
+            out_col_definition,
+            err_col_definition,
+            processing_options
+        ))
+    observers = _table_operation_observers
+    if observers:
+        timings["serialize"] = serialize_seconds
+        get_table_bytes = lambda: table_bytes[:table_size]
+        for observer in observers:
+            observer(
+                function.__name__,
+                get_table_bytes,
+                out_col_definition,
+                err_col_definition,
+                processing_options,
+                return_code,
+                timings
+            )
+    return output_table, error_table, return_code, return_message
+
+
+def replay_table_operation(
+    function_name,
+    handle,
+    table_bytes,
+    out_col_definition,
+    err_col_definition,
+    processing_options
+):
+    """Calls a PxPointSC table operation with an already serialized input
+    table, as saved by a table operation observer.
+
+    Args:
+        function_name (str): The name of the PxPointSC function, such as
+            "GeocoderGeocode".
+        handle (PxpHandleWrapper): A handle to the geocoder or spatial
+            processor.
+        table_bytes (bytearray): The serialized input table.
+        out_col_definition, err_col_definition, processing_options: As for
+            geocoder_geocode().
+
+    Returns:
+        An (output_table, error_table, return_code, return_message, timings)
+        tuple. timings maps "native" and "deserialize" to seconds.
+    """
+    return _call_table_operation(
+        getattr(PXPOINTSC, function_name),
+        handle,
+        bytearray(table_bytes),
+        out_col_definition,
+        err_col_definition,
+        processing_options
+    )
+
+
+def _call_table_operation(
+    function,
+    handle,
+    table_bytes,
+    out_col_definition,
+    err_col_definition,
+    processing_options
+):
+    """Calls a PxPointSC table operation with a serialized input table.
+
+    Returns:
+        An (output_table, error_table, return_code, return_message, timings)
+        tuple. timings maps "native" and "deserialize" to seconds.
+    """
+    # ctypes cannot pass a bytearray directly; see pxcommon.serialize_table()
+    table_pointer = ctypes.cast(
+        (ctypes.c_byte * len(table_bytes)).from_buffer(table_bytes),
+        pxcommon.PxpBytePtr)
+    return_code = pxcommon.PxpInt32()
+    message_buffer = ctypes.create_string_buffer(1024)
+
+    start = time.time()
+    output_tableset_handle = pxcommon.PxpHandle(
+        function(
+            handle.handle,
+            table_pointer,
+            out_col_definition,
+            err_col_definition,
+            processing_options,
+            ctypes.byref(return_code),
+            message_buffer,
+            ctypes.sizeof(message_buffer)
+        )
+    )
+    native_seconds = time.time() - start
+    return_code = return_code.value
+    return_message = message_buffer.value.decode(CHAR_SET_NAME).strip()
+    if return_code == pxcommon.PXP_SUCCESS:
+        output_tableset = deserialize_tableset(output_tableset_handle)
+        output_table = output_tableset.tables["Output"]
+        error_table = output_tableset.tables["Error"]
+    else:
+        output_table = None
+        error_table = None
+    timings = {
+        "native": native_seconds,
+        "deserialize": time.time() - start - native_seconds
+    }
+
+    return output_table, error_table, return_code, return_message, timings
+
+
+def geocoder_init(data_catalog, dataset_names=None):
     """Initializes a Geocoder.
     
     Args:
         data_catalog (DataCatalog): The DataCatalog containing license
             and geocoding dataset paths for use in initializing a PxPointSC 
             geocoder.
+        dataset_names (list, optional): The names of the catalog's geocoding
+            datasets to search, such as ["Parcel"]. A geocoder initialized
+            with fewer datasets searches, and holds in memory, only those.
+            The default is every dataset but "All".
 
     Returns:
         A handle to the PxPointSC geocoder, a return code (0 = success),
         and a return message (empty = success).
+
+    Raises:
+        ValueError: if a dataset is not in the data catalog.
     """
-    dataset_list = data_catalog.pxpoint_datasets.keys()
-    # remove the all_us dataset
-    dataset_list.remove("All")
+    if dataset_names is None:
+        dataset_list = data_catalog.pxpoint_datasets.keys()
+        # remove the all_us dataset
+        dataset_list.remove("All")
+    else:
+        dataset_list = list(dataset_names)
+        for dataset_name in dataset_list:
+            if dataset_name not in data_catalog.pxpoint_datasets:
+                raise ValueError(
+                    "Unknown dataset: {d}".format(d=dataset_name))
     datasets = ",".join(dataset_list)
 
     return_code = pxcommon.PxpInt32()
@@ -318,32 +546,14 @@ def geocoder_geocode(
         return_message (str): The return message from PxPointSC's 
             GeocoderGeocode operation (empty = success).
     """
-    return_code = pxcommon.PxpInt32()
-    message_buffer = ctypes.create_string_buffer(1024)
-
-    output_tableset_handle = pxcommon.PxpHandle(
-        PXPOINTSC.GeocoderGeocode(
-            geocoder_handle.handle,
-            pxcommon.serialize_table(input_table),
-            out_col_definition,
-            err_col_definition,
-            processing_options,
-            ctypes.byref(return_code),
-            message_buffer,
-            ctypes.sizeof(message_buffer)
-        )
+    return _table_operation(
+        PXPOINTSC.GeocoderGeocode,
+        geocoder_handle,
+        input_table,
+        out_col_definition,
+        err_col_definition,
+        processing_options
     )
-    return_code = return_code.value
-    return_message = message_buffer.value.decode(CHAR_SET_NAME).strip()
-    if return_code == 0:
-        output_tableset = deserialize_tableset(output_tableset_handle)
-        output_table = output_tableset.tables["Output"]
-        error_table = output_tableset.tables["Error"]
-    else:
-        output_table = None
-        error_table = None
-
-    return output_table, error_table, return_code, return_message
 
 
 def geocoder_find_aggregate(
@@ -376,33 +586,104 @@ def geocoder_find_aggregate(
             GeocoderFindAggregate operation (0 = success).
         return_message (str): The return message from PxPointSC's 
             GeocoderFindAggregate operation (empty = success).
+
+    Raises:
+        RuntimeError: If the loaded PxPointSC library does not export
+            GeocoderFindAggregate.
     """
-    return_code = pxcommon.PxpInt32()
-    message_buffer = ctypes.create_string_buffer(1024)
+    if not hasattr(PXPOINTSC, "GeocoderFindAggregate"):
+        raise RuntimeError(
+            "GeocoderFindAggregate is not available in this PxPointSC library")
+    return _table_operation(
+        PXPOINTSC.GeocoderFindAggregate,
+        geocoder_handle,
+        input_table,
+        out_col_definition,
+        err_col_definition,
+        processing_options
+    )
 
-    output_tableset_handle = pxcommon.PxpHandle(
-        PXPOINTSC.GeocoderFindAggregate(
-            geocoder_handle.handle,
-            pxcommon.serialize_table(input_table),
-            out_col_definition,
-            err_col_definition,
-            processing_options,
-            ctypes.byref(return_code),
-            message_buffer,
-            ctypes.sizeof(message_buffer)
-        )
+
+def geocoder_find_parent(
+    geocoder_handle,
+    input_table,
+    out_col_definition,
+    err_col_definition,
+    processing_options
+):
+    """Performs a find parent operation.
+
+    Args:
+        geocoder_handle (int): A handle to the PxPointSC geocoder.
+        input_table (Table): A table containing rows of input place data.
+        out_col_definition (str): A semicolon-delimited list of desired output 
+            columns.
+        err_col_definition (str): A semicolon-delimited list of desired error
+            columns.
+        processing_options (str): A semicolon-delimited list of processing 
+            options.
+
+    Returns:
+        A tuple with the following items, in order:
+
+        output_table (Table): The table of output rows, with columns defined 
+            by the out_col_definition.
+        error_table (Table): The table of error rows, with columns defined by
+            the err_col_definition.
+        return_code (int): The return code from PxPointSC's 
+            GeocoderFindParent operation (0 = success).
+        return_message (str): The return message from PxPointSC's 
+            GeocoderFindParent operation (empty = success).
+    """
+    return _table_operation(
+        PXPOINTSC.GeocoderFindParent,
+        geocoder_handle,
+        input_table,
+        out_col_definition,
+        err_col_definition,
+        processing_options
     )
-    return_code = return_code.value
-    return_message = message_buffer.value.decode(CHAR_SET_NAME).strip()
-    if return_code == 0:
-        output_tableset = deserialize_tableset(output_tableset_handle)
-        output_table = output_tableset.tables["Output"]
-        error_table = output_tableset.tables["Error"]
-    else:
-        output_table = None
-        error_table = None
 
-    return output_table, error_table, return_code, return_message
+
+def geocoder_find_children(
+    geocoder_handle,
+    input_table,
+    out_col_definition,
+    err_col_definition,
+    processing_options
+):
+    """Performs a find children operation.
+
+    Args:
+        geocoder_handle (int): A handle to the PxPointSC geocoder.
+        input_table (Table): A table containing rows of input place data.
+        out_col_definition (str): A semicolon-delimited list of desired output 
+            columns.
+        err_col_definition (str): A semicolon-delimited list of desired error
+            columns.
+        processing_options (str): A semicolon-delimited list of processing 
+            options.
+
+    Returns:
+        A tuple with the following items, in order:
+
+        output_table (Table): The table of output rows, with columns defined 
+            by the out_col_definition.
+        error_table (Table): The table of error rows, with columns defined by
+            the err_col_definition.
+        return_code (int): The return code from PxPointSC's 
+            GeocoderFindChildren operation (0 = success).
+        return_message (str): The return message from PxPointSC's 
+            GeocoderFindChildren operation (empty = success).
+    """
+    return _table_operation(
+        PXPOINTSC.GeocoderFindChildren,
+        geocoder_handle,
+        input_table,
+        out_col_definition,
+        err_col_definition,
+        processing_options
+    )
 
 
 def geocoder_find_place(
@@ -436,32 +717,14 @@ def geocoder_find_place(
         return_message (str): The return message from PxPointSC's 
             GeocoderFindPlace operation (empty = success).
     """
-    return_code = pxcommon.PxpInt32()
-    message_buffer = ctypes.create_string_buffer(1024)
-
-    output_tableset_handle = pxcommon.PxpHandle(
-        PXPOINTSC.GeocoderFindPlace(
-            geocoder_handle.handle,
-            pxcommon.serialize_table(input_table),
-            out_col_definition,
-            err_col_definition,
-            processing_options,
-            ctypes.byref(return_code),
-            message_buffer,
-            ctypes.sizeof(message_buffer)
-        )
+    return _table_operation(
+        PXPOINTSC.GeocoderFindPlace,
+        geocoder_handle,
+        input_table,
+        out_col_definition,
+        err_col_definition,
+        processing_options
     )
-    return_code = return_code.value
-    return_message = message_buffer.value.decode(CHAR_SET_NAME).strip()
-    if return_code == 0:
-        output_tableset = deserialize_tableset(output_tableset_handle)
-        output_table = output_tableset.tables["Output"]
-        error_table = output_tableset.tables["Error"]
-    else:
-        output_table = None
-        error_table = None
-
-    return output_table, error_table, return_code, return_message
 
 
 def geocoder_reverse_geocode(
@@ -495,32 +758,14 @@ def geocoder_reverse_geocode(
         return_message (str): The return message from PxPointSC's 
             GeocoderReverseGeocode operation (empty = success).
     """
-    return_code = pxcommon.PxpInt32()
-    message_buffer = ctypes.create_string_buffer(1024)
-
-    output_tableset_handle = pxcommon.PxpHandle(
-        PXPOINTSC.GeocoderReverseGeocode(
-            geocoder_handle.handle,
-            pxcommon.serialize_table(input_table),
-            out_col_definition,
-            err_col_definition,
-            processing_options,
-            ctypes.byref(return_code),
-            message_buffer,
-            ctypes.sizeof(message_buffer)
-        )
+    return _table_operation(
+        PXPOINTSC.GeocoderReverseGeocode,
+        geocoder_handle,
+        input_table,
+        out_col_definition,
+        err_col_definition,
+        processing_options
     )
-    return_code = return_code.value
-    return_message = message_buffer.value.decode(CHAR_SET_NAME).strip()
-    if return_code == 0:
-        output_tableset = deserialize_tableset(output_tableset_handle)
-        output_table = output_tableset.tables["Output"]
-        error_table = output_tableset.tables["Error"]
-    else:
-        output_table = None
-        error_table = None
-
-    return output_table, error_table, return_code, return_message
 
 
 def geocoder_close(geocoder_handle):
@@ -601,18 +846,8 @@ def geospatial_prepare(geospatial_handle, data_catalog, layer_alias_list):
     """
     layer_alias_field_map = {}
     for layer_alias in layer_alias_list:
-            # attach the layer
-            message_buffer = ctypes.create_string_buffer(1024)
-            layer_pathname = data_catalog.spatial_layers[layer_alias]
-            return_code = PXPOINTSC.GeoSpatialAttachLayer(
-                geospatial_handle.handle,
-                layer_pathname.encode(CHAR_SET_NAME),
-                layer_alias.encode(CHAR_SET_NAME),
-                message_buffer,
-                ctypes.sizeof(message_buffer)
-            )
-            return_code = return_code.value
-            return_message = message_buffer.value.decode(CHAR_SET_NAME).strip()
+            return_code, return_message = geospatial_attach_layer(
+                geospatial_handle, data_catalog, layer_alias)
             if return_code != pxcommon.PXP_SUCCESS:
                 raise RuntimeError("Error. Code: {c}. Message: {m}".format(
                     c=return_code, m=return_message))
@@ -622,7 +857,7 @@ def geospatial_prepare(geospatial_handle, data_catalog, layer_alias_list):
                 message_buffer = ctypes.create_string_buffer(1024)
                 output_table_handle = PXPOINTSC.GeoSpatialLayerInfo(
                     geospatial_handle.handle,
-                    layer_alias,
+                    layer_alias.encode(CHAR_SET_NAME),
                     ctypes.byref(return_code),
                     message_buffer,
                     ctypes.sizeof(message_buffer)
@@ -633,7 +868,7 @@ def geospatial_prepare(geospatial_handle, data_catalog, layer_alias_list):
                 if return_code == 0:
                     output_table = deserialize_table(output_table_handle)
                     fields = []
-                    if output_table is not None and output_table.nrows > 0:
+                    if output_table is not None and not output_table.is_empty():
                         name_idx = 0
                         for i in range(output_table.ncols()):
                             if output_table.col_names[i].upper() == "NAME":
@@ -652,6 +887,34 @@ def geospatial_prepare(geospatial_handle, data_catalog, layer_alias_list):
     return layer_alias_field_map 
 
 
+def geospatial_attach_layer(geospatial_handle, data_catalog, layer_alias):
+    """Attaches a layer to a geospatial processor, without asking for its
+    fields.
+
+    Args:
+        geospatial_handle (int): A handle to the spatial processor.
+        data_catalog (DataCatalog): A container for maps of layer aliases to
+            full paths to layers.
+        layer_alias (str): the name of the layer to be attached.
+
+    Returns:
+        return_code (int): A PxPointSC return code.
+        return_message (str): A PxPointSC error message, if the return code is 
+        not 0 (indicating success), or the empty string.
+    """
+    message_buffer = ctypes.create_string_buffer(1024)
+    layer_pathname = data_catalog.spatial_layers[layer_alias]
+    return_code = PXPOINTSC.GeoSpatialAttachLayer(
+        geospatial_handle.handle,
+        layer_pathname.encode(CHAR_SET_NAME),
+        layer_alias.encode(CHAR_SET_NAME),
+        message_buffer,
+        ctypes.sizeof(message_buffer)
+    )
+    return_message = message_buffer.value.decode(CHAR_SET_NAME).strip()
+    return return_code, return_message
+
+
 def geospatial_detach_layer(geospatial_handle, layer_alias):
     """Detaches a layer from a geospatial processor.
     
@@ -706,32 +969,14 @@ def geospatial_query(
         return_message (str): The return message from PxPointSC's 
             GeoSpatialQuery operation (empty = success).
     """
-    return_code = pxcommon.PxpInt32()
-    message_buffer = ctypes.create_string_buffer(1024)
-
-    output_tableset_handle = pxcommon.PxpHandle(
-        PXPOINTSC.GeoSpatialQuery(
-            geospatial_handle.handle,
-            pxcommon.serialize_table(input_table),
-            out_col_definition,
-            err_col_definition,
-            processing_options,
-            ctypes.byref(return_code),
-            message_buffer,
-            ctypes.sizeof(message_buffer)
-        )
+    return _table_operation(
+        PXPOINTSC.GeoSpatialQuery,
+        geospatial_handle,
+        input_table,
+        out_col_definition,
+        err_col_definition,
+        processing_options
     )
-    return_code = return_code.value
-    return_message = message_buffer.value.decode(CHAR_SET_NAME).strip()
-    if return_code == pxcommon.PXP_SUCCESS:
-        output_tableset = deserialize_tableset(output_tableset_handle)
-        output_table = output_tableset.tables["Output"]
-        error_table = output_tableset.tables["Error"]
-    else:
-        output_table = None
-        error_table = None
-
-    return output_table, error_table, return_code, return_message
 
 
 def geospatial_close(geospatial_handle):
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Replays PxPointSC calls captured by slowcalls.SlowCallRecorder.
+
+Each capture is sent to a freshly initialized geocoder or spatial processor,
+once or repeatedly, and its replay timings are printed beside the captured
+ones, with the captured and current data vintages. Geocoder calls made for a
+dataset profile are replayed on a geocoder of the same datasets. Pointing
+--data-catalog at another catalog compares timings across dataset vintages;
+--profile runs the replays under cProfile.
+
+For example:
+    replaycalls.py --repeat 10 --profile captures/
+"""
+
+import argparse
+import cProfile
+import os
+import pstats
+import re
+import sys
+
+import datacatalog
+import pxcommon
+import pxpointsc
+import slowcalls
+
+# Layer aliases in column definitions, as in "[County]NAME"
+_LAYER_ALIAS_PATTERN = re.compile(r"\[([^\]]+)\]")
+
+
+class _Handles:
+    """Initializes the geocoders and the spatial processor on first use."""
+    def __init__(self, data_catalog):
+        self.data_catalog = data_catalog
+        # geocoders, keyed by the tuple of their dataset names, or None for
+        # every dataset
+        self.geocoder_handles = {}
+        self.geospatial_handle = None
+        self.attached_layers = set()
+
+    def get(self, header):
+        """Returns the handle a capture is to be replayed against."""
+        if header["handle_type"] == "geocoder":
+            dataset_names = (header.get("context") or {}).get(
+                "geocoder_datasets")
+            key = None if dataset_names is None else tuple(dataset_names)
+            if key not in self.geocoder_handles:
+                self.geocoder_handles[key] = _check_init(
+                    "geocoder", *pxpointsc.geocoder_init(
+                        self.data_catalog, dataset_names))
+            return self.geocoder_handles[key]
+        if self.geospatial_handle is None:
+            self.geospatial_handle = _check_init(
+                "spatial processor",
+                *pxpointsc.geospatial_init(self.data_catalog))
+        layers = set(_LAYER_ALIAS_PATTERN.findall(
+            header["out_col_definition"])) - self.attached_layers
+        if layers:
+            pxpointsc.geospatial_prepare(
+                self.geospatial_handle, self.data_catalog, sorted(layers))
+            self.attached_layers.update(layers)
+        return self.geospatial_handle
+
+
+def _check_init(name, handle, return_code, return_message):
+    """Returns an initialized handle, or raises RuntimeError."""
+    if return_code != pxcommon.PXP_SUCCESS:
+        raise RuntimeError(
+            "Error initializing {n}. Code: {c}. Message: {m}".format(
+                n=name, c=return_code, m=return_message))
+    return handle
+
+
+def _current_vintages(data_catalog, header):
+    """Returns the current vintages of the data a capture used."""
+    if header["handle_type"] == "geocoder":
+        return {"geocoder": data_catalog.geocoder_vintage()}
+    return dict(
+        (layer, data_catalog.layer_vintage(layer))
+        for layer in set(_LAYER_ALIAS_PATTERN.findall(
+            header["out_col_definition"]))
+        if layer in data_catalog.spatial_layers)
+
+
+def _captured_vintages(header):
+    """Returns the vintages a capture's context recorded."""
+    context = header.get("context") or {}
+    if header["handle_type"] == "geocoder":
+        return {"geocoder": context.get("geocoder_vintage")}
+    layers = set(_LAYER_ALIAS_PATTERN.findall(header["out_col_definition"]))
+    return dict(
+        (layer, vintage)
+        for layer, vintage in (context.get("layer_vintages") or {}).items()
+        if layer in layers)
+
+
+def replay(path, handles, repeat):
+    """Replays a capture, returning its header and a list of the replays'
+    (return_code, timings) tuples."""
+    header, table_bytes = slowcalls.read_capture(path)
+    handle = handles.get(header)
+    replays = []
+    for _ in range(repeat):
+        _, _, return_code, _, timings = pxpointsc.replay_table_operation(
+            header["function"],
+            handle,
+            table_bytes,
+            header["out_col_definition"].encode(pxpointsc.CHAR_SET_NAME),
+            header["err_col_definition"].encode(pxpointsc.CHAR_SET_NAME),
+            header["processing_options"].encode(pxpointsc.CHAR_SET_NAME)
+        )
+        replays.append((return_code, timings))
+    return header, replays
+
+
+def _expand_paths(paths):
+    """Yields capture paths, expanding directories into their captures."""
+    for path in paths:
+        if os.path.isdir(path):
+            for capture_path in slowcalls.list_captures(path):
+                yield capture_path
+        else:
+            yield path
+
+
+def parse_args(argv):
+    """Parses the command line."""
+    parser = argparse.ArgumentParser(
+        description="Replay captured slow PxPointSC calls.")
+    parser.add_argument("captures", nargs="+",
+        help="capture files, or directories of them")
+    parser.add_argument("--repeat", type=int, default=1,
+        help="times to replay each capture (default: 1)")
+    parser.add_argument("--profile", action="store_true",
+        help="run the replays under cProfile and print the hottest functions")
+    parser.add_argument("--profile-sort", default="cumulative",
+        help="pstats sort key for --profile (default: cumulative)")
+    parser.add_argument("--profile-limit", type=int, default=30,
+        help="number of functions --profile prints (default: 30)")
+    parser.add_argument("--data-catalog", default=r"f:\websites\datacatalog.xml",
+        help="data catalog path")
+    parser.add_argument("--shapefile-root", default=r"f:\pxse-data",
+        help="shapefile root directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    data_catalog = datacatalog.DataCatalog(
+        options.data_catalog, options.shapefile_root)
+    handles = _Handles(data_catalog)
+    profiler = cProfile.Profile() if options.profile else None
+    for path in _expand_paths(options.captures):
+        if profiler is not None:
+            profiler.enable()
+        try:
+            header, replays = replay(path, handles, max(1, options.repeat))
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        native_ms = sorted(
+            timings["native"] * 1000 for _, timings in replays)
+        return_codes = sorted(set(return_code for return_code, _ in replays))
+        print "{p}: {f} captured {c:.1f}ms native, return code {r}".format(
+            p=os.path.basename(path), f=header["function"],
+            c=header["timings_ms"].get("native", 0.0),
+            r=header["return_code"])
+        print "    replayed {n}x: min {lo:.1f}ms, median {md:.1f}ms, " \
+            "max {hi:.1f}ms, return codes {r}".format(
+                n=len(replays), lo=native_ms[0],
+                md=native_ms[len(native_ms) // 2], hi=native_ms[-1],
+                r=",".join(str(code) for code in return_codes))
+        captured_vintages = _captured_vintages(header)
+        for name, vintage in sorted(
+                _current_vintages(data_catalog, header).items()):
+            captured = captured_vintages.get(name)
+            print "    {n} vintage {v}{s}".format(
+                n=name, v=vintage,
+                s=" (captured {c})".format(c=captured)
+                    if captured and captured != vintage else "")
+    if profiler is not None:
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats(
+            options.profile_sort).print_stats(options.profile_limit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of replaying captured slow calls."""
+
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+import fakepxpointsc
+fakepxpointsc.install()
+
+import datacatalog
+import geospatial
+import replaycalls
+import slowcalls
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        fakepxpointsc.reset()
+        self.addCleanup(fakepxpointsc.reset)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.data_catalog = fakepxpointsc.write_data_catalog(self.directory)
+        self.capture_dir = os.path.join(self.directory, "captures")
+        geo_spatial = geospatial.GeoSpatial(
+            self.data_catalog, self.directory, {
+                "SLOW_CALL_CAPTURE_DIR": self.capture_dir,
+                "SLOW_CALL_THRESHOLD_MS": 10})
+        self.addCleanup(geo_spatial.close)
+        fakepxpointsc.delay = 0.02
+        geo_spatial.get_location("1", "1 Main St")
+        geo_spatial.query_layer("2", "County", 40.0, -105.0)
+        geo_spatial.close()
+        fakepxpointsc.delay = 0.0
+        self.captures = slowcalls.list_captures(self.capture_dir)
+        del fakepxpointsc.calls[:]
+
+    def test_round_trip(self):
+        self.assertEqual(2, len(self.captures))
+        handles = replaycalls._Handles(datacatalog.DataCatalog(
+            self.data_catalog, self.directory))
+        header, replays = replaycalls.replay(self.captures[0], handles, 2)
+        self.assertEqual("GeocoderGeocode", header["function"])
+        self.assertEqual(
+            [(0, "GeocoderGeocode"), (0, "GeocoderGeocode")],
+            [(return_code, fakepxpointsc.calls[i][0])
+             for i, (return_code, _) in enumerate(replays)])
+        # the same input table, against one geocoder
+        self.assertEqual(
+            set([(handles.geocoder_handles[None], 1)]),
+            set((handle, nrows) for _, handle, nrows in fakepxpointsc.calls))
+        header, replays = replaycalls.replay(self.captures[1], handles, 1)
+        self.assertEqual("GeoSpatialQuery", header["function"])
+        self.assertIn("[County]NAME", header["out_col_definition"])
+        self.assertEqual(set(["County"]), handles.attached_layers)
+        self.assertEqual(
+            ("GeoSpatialQuery", handles.geospatial_handle, 1),
+            fakepxpointsc.calls[-1])
+
+    def test_dataset_profile(self):
+        capture_dir = os.path.join(self.directory, "profile")
+        geo_spatial = geospatial.GeoSpatial(
+            self.data_catalog, self.directory, {
+                "GEOCODER_DATASET_PROFILES": {"parcel": ["Parcel"]},
+                "SLOW_CALL_CAPTURE_DIR": capture_dir,
+                "SLOW_CALL_THRESHOLD_MS": 10,
+                # the call is made on another thread
+                "CALL_DEADLINE_MS": 5000})
+        self.addCleanup(geo_spatial.close)
+        fakepxpointsc.delay = 0.02
+        geo_spatial.get_location("1", "1 Main St", datasets="parcel")
+        geo_spatial.close()
+        fakepxpointsc.delay = 0.0
+        captures = slowcalls.list_captures(capture_dir)
+        self.assertEqual(1, len(captures))
+        header, _ = slowcalls.read_capture(captures[0])
+        self.assertEqual("parcel", header["context"]["dataset_profile"])
+        self.assertEqual(["Parcel"], header["context"]["geocoder_datasets"])
+        del fakepxpointsc.calls[:]
+        handles = replaycalls._Handles(datacatalog.DataCatalog(
+            self.data_catalog, self.directory))
+        replaycalls.replay(captures[0], handles, 1)
+        replaycalls.replay(self.captures[0], handles, 1)
+        self.assertEqual(
+            [["Parcel"], None],
+            [handle.dataset_names for _, handle, _ in fakepxpointsc.calls])
+
+    def test_vintages(self):
+        data_catalog = datacatalog.DataCatalog(
+            self.data_catalog, self.directory)
+        for path in self.captures:
+            header, _ = slowcalls.read_capture(path)
+            self.assertEqual(
+                replaycalls._captured_vintages(header),
+                replaycalls._current_vintages(data_catalog, header))
+        # another vintage of the same data
+        other_directory = os.path.join(self.directory, "other")
+        os.mkdir(other_directory)
+        output = StringIO.StringIO()
+        self.addCleanup(setattr, sys, "stdout", sys.stdout)
+        sys.stdout = output
+        self.assertEqual(0, replaycalls.main([
+            "--repeat", "3",
+            "--data-catalog",
+            fakepxpointsc.write_data_catalog(other_directory),
+            "--shapefile-root", other_directory, self.capture_dir]))
+        lines = output.getvalue().splitlines()
+        self.assertIn("GeocoderGeocode captured", lines[0])
+        self.assertIn("replayed 3x", lines[1])
+        self.assertRegexpMatches(
+            lines[2], r"^    geocoder vintage \w+ \(captured \w+\)$")
+        self.assertRegexpMatches(
+            lines[-1], r"^    County vintage \w+ \(captured \w+\)$")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Persistent, process-shared store of geocode and layer query results.
+
+Results are kept in an SQLite database in WAL mode, so any number of worker
+processes can read it concurrently while one writes, and its contents survive
+restarts and deploys. Each entry holds the serialized output Table of a
+successful request together with the vintage of the data that produced it;
+an entry whose vintage no longer matches the data catalog is treated as a miss
+and deleted.
+
+The store is a cache: every failure to read or write it is swallowed, and the
+caller simply falls through to PxPointSC.
+"""
+
+import sqlite3
+import struct
+import threading
+import time
+
+import table
+
+
+class ResultStore:
+    """An SQLite-backed result store with a size cap and LRU eviction."""
+
+    # Seconds between updates of an entry's last access time; reads of hot
+    # entries would otherwise all turn into writes.
+    ACCESS_RESOLUTION = 60.0
+
+    # Number of puts between checks of the total store size.
+    EVICTION_INTERVAL = 100
+
+    # Fraction of max_bytes that eviction trims the store down to.
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, path, max_bytes):
+        """Opens (creating, if need be) a result store.
+
+        Args:
+            path (str): The path of the SQLite database file.
+            max_bytes (int): The maximum total size of stored values.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__puts = 0
+        connection = self.__connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, "
+            "vintage TEXT NOT NULL, "
+            "value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "hits INTEGER NOT NULL DEFAULT 0, "
+            "accessed REAL NOT NULL)")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        connection.commit()
+
+    def __connection(self):
+        """Returns this thread's connection to the database."""
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1.0)
+            connection.text_factory = str
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local.connection = connection
+        return connection
+
+    def __buffer(self):
+        """Returns this thread's scratch array for serializing tables."""
+        buff = getattr(self.__local, "buff", None)
+        if buff is None:
+            buff = self.__local.buff = bytearray(4 * 1024 * 1024)
+        return buff
+
+    @staticmethod
+    def serialize(output_table, buff=None):
+        """Returns the compact serialized bytes of a table.
+
+        Args:
+            output_table (Table): The table to serialize.
+            buff (bytearray, optional): A scratch array to serialize into,
+                reused across tables; see Table.serialize().
+        """
+        buff, offset = output_table.serialize(buff)
+        return sqlite3.Binary(buff[:offset])
+
+    @staticmethod
+    def deserialize(value):
+        """Returns the table serialized in value."""
+        result_table = table.Table()
+        result_table.deserialize(str(value), 0)
+        return result_table
+
+    def get(self, key, vintage):
+        """Returns the table stored under key, or None.
+
+        Args:
+            key (str): The canonical request key.
+            vintage (str): The vintage of the data the caller would query.
+                Entries of any other vintage are deleted.
+        """
+        try:
+            connection = self.__connection()
+            row = connection.execute(
+                "SELECT vintage, value, accessed FROM results WHERE key = ?",
+                (key, )).fetchone()
+            if row is None:
+                return None
+            stored_vintage, value, accessed = row
+            now = time.time()
+            if stored_vintage != vintage:
+                connection.execute("DELETE FROM results WHERE key = ?", (key, ))
+                connection.commit()
+                return None
+            if now - accessed > ResultStore.ACCESS_RESOLUTION:
+                connection.execute(
+                    "UPDATE results SET accessed = ?, hits = hits + 1 "
+                    "WHERE key = ?", (now, key))
+                connection.commit()
+            return ResultStore.deserialize(value)
+        except (sqlite3.Error, struct.error, ValueError):
+            return None
+
+    def put(self, key, vintage, output_table):
+        """Stores a table under key.
+
+        Args:
+            key (str): The canonical request key.
+            vintage (str): The vintage of the data that produced the table.
+            output_table (Table): The result to store.
+        """
+        self.put_many([(key, vintage, output_table)])
+
+    def put_many(self, entries):
+        """Stores tables in one transaction, as a batch's results are.
+
+        Args:
+            entries (iterable): (key, vintage, output_table) tuples, as for
+                put().
+        """
+        buff = self.__buffer()
+        now = time.time()
+        rows = []
+        for key, vintage, output_table in entries:
+            try:
+                value = ResultStore.serialize(output_table, buff)
+            except Exception:
+                # tables we cannot serialize, such as those with Date
+                # columns, values not of their column's type, or more than
+                # the buffer holds, are not stored
+                continue
+            rows.append((key, vintage, value, len(value), now))
+        if not rows:
+            return
+        try:
+            connection = self.__connection()
+            connection.executemany(
+                "INSERT OR REPLACE INTO results "
+                "(key, vintage, value, size, hits, accessed) "
+                "VALUES (?, ?, ?, ?, 0, ?)", rows)
+            connection.commit()
+        except sqlite3.Error:
+            return
+        with self.__lock:
+            evict = (
+                (self.__puts + len(rows)) // ResultStore.EVICTION_INTERVAL >
+                self.__puts // ResultStore.EVICTION_INTERVAL)
+            self.__puts += len(rows)
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Deletes least recently used entries until the store is under its
+        size cap."""
+        try:
+            connection = self.__connection()
+            (total, ) = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+            target = int(self.max_bytes * ResultStore.EVICTION_TARGET)
+            if total <= self.max_bytes:
+                return
+            cursor = connection.execute(
+                "SELECT key, size FROM results ORDER BY accessed")
+            keys = []
+            for key, size in cursor:
+                if total <= target:
+                    break
+                keys.append((key, ))
+                total -= size
+            cursor.close()
+            connection.executemany("DELETE FROM results WHERE key = ?", keys)
+            connection.commit()
+        except sqlite3.Error:
+            return
+
+    def warm(self, limit, key_prefix=""):
+        """Yields the most used entries, hottest first, for preloading
+        in-memory caches.
+
+        Args:
+            limit (int): The maximum number of entries to yield.
+            key_prefix (str, optional): Only yield keys with this prefix.
+
+        Yields:
+            (key, vintage, table) tuples.
+        """
+        try:
+            rows = self.__connection().execute(
+                "SELECT key, vintage, value FROM results WHERE key LIKE ? "
+                "ORDER BY hits DESC, accessed DESC LIMIT ?",
+                (key_prefix.replace("%", "") + "%", limit)).fetchall()
+        except sqlite3.Error:
+            return
+        for key, vintage, value in rows:
+            try:
+                yield key, vintage, ResultStore.deserialize(value)
+            except (struct.error, ValueError):
+                continue
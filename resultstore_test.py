@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the persistent result store."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import resultstore
+import table
+import variant
+
+
+def make_table(name, lat=40.0):
+    """Returns a one-row output table."""
+    result_table = table.Table()
+    result_table.append_col("Id")
+    result_table.append_col("NAME")
+    result_table.append_col("$Latitude", variant.VarType.Double)
+    result_table.append_row(["1", name, lat])
+    return result_table
+
+
+class ResultStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "results.db")
+        self.store = resultstore.ResultStore(self.path, 1024 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        self.store.put("G:123 MAIN ST", "v1", make_table("Boulder", 40.25))
+        result = self.store.get("G:123 MAIN ST", "v1")
+        self.assertEqual(["Id", "NAME", "$Latitude"], result.col_names)
+        self.assertEqual([["1", "Boulder", 40.25]], result.rows)
+        self.assertEqual(None, self.store.get("G:9 ELM ST", "v1"))
+
+    def test_uses_wal(self):
+        connection = sqlite3.connect(self.path)
+        (mode, ) = connection.execute("PRAGMA journal_mode").fetchone()
+        connection.close()
+        self.assertEqual("wal", mode)
+
+    def test_other_vintage_is_a_miss_and_deleted(self):
+        self.store.put("G:1", "v1", make_table("Boulder"))
+        self.assertEqual(None, self.store.get("G:1", "v2"))
+        self.assertEqual(None, self.store.get("G:1", "v1"))
+
+    def test_put_many_in_one_transaction(self):
+        self.store.put_many(
+            ("P:{n}".format(n=n), "v1", make_table(str(n)))
+            for n in range(50))
+        for n in (0, 49):
+            self.assertEqual(
+                str(n), self.store.get("P:{n}".format(n=n), "v1").rows[0][1])
+
+    def test_unserializable_tables_are_skipped(self):
+        float_name = make_table("Boulder")
+        float_name.rows[0][1] = 1.5
+        date_table = table.Table()
+        date_table.append_col("When", variant.VarType.Date)
+        date_table.append_row([0])
+        self.store.put("G:1", "v1", float_name)
+        self.store.put_many([
+            ("G:2", "v1", date_table), ("G:3", "v1", make_table("Lyons"))])
+        self.assertIsNone(self.store.get("G:1", "v1"))
+        self.assertIsNone(self.store.get("G:2", "v1"))
+        self.assertEqual(u"Lyons", self.store.get("G:3", "v1").rows[0][1])
+
+    def test_shared_across_instances_and_warm_start(self):
+        self.store.put_many([
+            ("G:cold", "v1", make_table("cold")),
+            ("G:hot", "v1", make_table("hot")),
+            ("C:cell", "v1", make_table("cell"))])
+        # make "hot" the most used entry
+        self.addCleanup(
+            setattr, resultstore.ResultStore, "ACCESS_RESOLUTION",
+            resultstore.ResultStore.ACCESS_RESOLUTION)
+        resultstore.ResultStore.ACCESS_RESOLUTION = -1
+        self.store.get("G:hot", "v1")
+        restarted = resultstore.ResultStore(self.path, 1024 * 1024)
+        warmed = list(restarted.warm(10, "G:"))
+        self.assertEqual(
+            ["G:hot", "G:cold"], [key for key, _, _ in warmed])
+        self.assertEqual("hot", warmed[0][2].rows[0][1])
+        self.assertEqual(1, len(list(restarted.warm(1))))
+
+    def test_eviction_keeps_recent_entries(self):
+        value_size = len(resultstore.ResultStore.serialize(make_table("x")))
+        store = resultstore.ResultStore(self.path, value_size * 10)
+        store.put_many(
+            ("P:{n:03d}".format(n=n), "v1", make_table("x"))
+            for n in range(resultstore.ResultStore.EVICTION_INTERVAL))
+        connection = sqlite3.connect(self.path)
+        (count, ) = connection.execute(
+            "SELECT COUNT(*) FROM results").fetchone()
+        connection.close()
+        self.assertTrue(count <= 10, count)
+
+
+if __name__ == "__main__":
+    unittest.main()
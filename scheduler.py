@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Priority scheduling of native calls on a pool of handles.
+
+Interactive lookups and batch jobs share the same PxPointSC handles, and a
+batch chunk holding a handle stalls the lookups queued behind it. A
+PriorityScheduler admits at most a number of calls at once, and when calls
+are waiting, admits them by weighted fair queuing across priority classes:
+each class gets a share of the admissions in proportion to its weight, in
+first come, first served order within the class, and no class starves.
+
+For example:
+    scheduler = PriorityScheduler(2, {"interactive": 10, "bulk": 1})
+    if scheduler.acquire("bulk", deadline):
+        try:
+            ...
+        finally:
+            scheduler.release("bulk")
+"""
+
+import collections
+import threading
+import time
+
+
+class PriorityScheduler:
+    """Admits calls to a number of slots, by weighted fair queuing across
+    priority classes."""
+    def __init__(self, slots, weights):
+        """Initializes the scheduler.
+
+        Args:
+            slots (int): The number of calls admitted at once.
+            weights (dict): Maps the priority class names to their weights.
+        """
+        self.slots = max(1, slots)
+        self.weights = dict(
+            (name, float(weight)) for name, weight in weights.items())
+        self.__running = dict((name, 0) for name in self.weights)
+        self.__waiting = dict(
+            (name, collections.deque()) for name in self.weights)
+        # each class's virtual time, advanced by 1 / weight per admission;
+        # waiting classes are admitted lowest virtual time first
+        self.__pass = dict((name, 0.0) for name in self.weights)
+        self.__virtual_time = 0.0
+        self.__last_admitted = dict((name, None) for name in self.weights)
+        self.__stats = dict(
+            (name, {"admitted": 0, "timed_out": 0, "wait_seconds": 0.0})
+            for name in self.weights)
+        self.__condition = threading.Condition()
+
+    def acquire(self, priority_class, deadline=None):
+        """Waits for a slot for a call of a priority class.
+
+        Args:
+            priority_class (str): The call's priority class.
+            deadline (float, optional): The time.time() after which to stop
+                waiting. None waits as long as it takes.
+
+        Returns:
+            True once the call may go ahead, or False if the deadline passed
+            first.
+
+        Raises:
+            ValueError: if the priority class is unknown.
+        """
+        if priority_class not in self.weights:
+            raise ValueError(
+                "Unknown priority class: {p}".format(p=priority_class))
+        start = time.time()
+        ticket = object()
+        with self.__condition:
+            waiting = self.__waiting[priority_class]
+            if not waiting:
+                # an idle class does not bank the turns it did not take
+                self.__pass[priority_class] = max(
+                    self.__pass[priority_class], self.__virtual_time)
+            waiting.append(ticket)
+            while not (waiting[0] is ticket and
+                    sum(self.__running.values()) < self.slots and
+                    self.__next_class() == priority_class):
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        waiting.remove(ticket)
+                        self.__stats[priority_class]["timed_out"] += 1
+                        self.__condition.notify_all()
+                        return False
+                self.__condition.wait(timeout)
+            waiting.popleft()
+            self.__admit(priority_class, start)
+            return True
+
+    def try_acquire(self, priority_class):
+        """Takes a slot for a call of a priority class if one is free and no
+        call is waiting for it, without waiting.
+
+        Returns:
+            True if the call may go ahead, False otherwise.
+
+        Raises:
+            ValueError: if the priority class is unknown.
+        """
+        if priority_class not in self.weights:
+            raise ValueError(
+                "Unknown priority class: {p}".format(p=priority_class))
+        with self.__condition:
+            if (any(self.__waiting.values()) or
+                    sum(self.__running.values()) >= self.slots):
+                return False
+            self.__pass[priority_class] = max(
+                self.__pass[priority_class], self.__virtual_time)
+            self.__admit(priority_class, time.time())
+            return True
+
+    def release(self, priority_class):
+        """Records the end of an admitted call."""
+        with self.__condition:
+            self.__running[priority_class] -= 1
+            self.__condition.notify_all()
+
+    def is_active(self, priority_class, within_seconds=0):
+        """Returns True if calls of a priority class are running or waiting,
+        or one was admitted in the last within_seconds."""
+        with self.__condition:
+            if self.__running[priority_class] or self.__waiting[priority_class]:
+                return True
+            last_admitted = self.__last_admitted[priority_class]
+            return (last_admitted is not None and
+                time.time() - last_admitted <= within_seconds)
+
+    def waiting(self):
+        """Returns the number of calls waiting, of every priority class."""
+        with self.__condition:
+            return sum(len(waiting) for waiting in self.__waiting.values())
+
+    def stats(self):
+        """Returns a dictionary of counters for each priority class."""
+        with self.__condition:
+            return dict(
+                (name, dict(stats, running=self.__running[name],
+                    waiting=len(self.__waiting[name])))
+                for name, stats in self.__stats.items())
+
+    def __admit(self, priority_class, start):
+        """Records the admission of a call that started waiting at start.
+        Called with the condition held."""
+        self.__running[priority_class] += 1
+        self.__last_admitted[priority_class] = time.time()
+        self.__virtual_time = self.__pass[priority_class]
+        self.__pass[priority_class] += 1.0 / self.weights[priority_class]
+        stats = self.__stats[priority_class]
+        stats["admitted"] += 1
+        stats["wait_seconds"] += time.time() - start
+        self.__condition.notify_all()
+
+    def __next_class(self):
+        """Returns the waiting priority class to admit next. Called with the
+        condition held."""
+        return min(
+            (self.__pass[name], name)
+            for name, waiting in self.__waiting.items() if waiting)[1]
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the priority scheduling of native calls."""
+
+import threading
+import time
+import unittest
+
+import scheduler
+
+
+class PrioritySchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = scheduler.PriorityScheduler(
+            1, {"interactive": 3, "bulk": 1})
+        self.admitted = []
+        self.threads = []
+
+    def wait_in_turn(self, priority_class):
+        """Starts a call of a priority class on another thread, returning
+        once it is waiting."""
+        waiting = self.scheduler.waiting()
+        def call():
+            if self.scheduler.acquire(priority_class, time.time() + 5):
+                self.admitted.append(priority_class)
+                self.scheduler.release(priority_class)
+        thread = threading.Thread(target=call)
+        thread.start()
+        self.threads.append(thread)
+        while self.scheduler.waiting() == waiting:
+            time.sleep(0.001)
+
+    def test_weighted_fair_order(self):
+        self.assertTrue(self.scheduler.acquire("bulk"))
+        for priority_class in ["bulk"] * 4 + ["interactive"] * 4:
+            self.wait_in_turn(priority_class)
+        self.scheduler.release("bulk")
+        for thread in self.threads:
+            thread.join()
+        # interactive calls get three turns to each of bulk's, and bulk
+        # still gets its turns while interactive calls wait
+        self.assertEqual(
+            ["interactive", "interactive", "interactive", "bulk",
+             "interactive", "bulk", "bulk", "bulk"],
+            self.admitted)
+        stats = self.scheduler.stats()
+        self.assertEqual(4, stats["interactive"]["admitted"])
+        self.assertEqual(5, stats["bulk"]["admitted"])
+        self.assertEqual(0, stats["bulk"]["running"])
+
+    def test_deadline(self):
+        self.assertTrue(self.scheduler.acquire("bulk"))
+        start = time.time()
+        self.assertFalse(
+            self.scheduler.acquire("interactive", time.time() + 0.05))
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        self.assertEqual(0, self.scheduler.waiting())
+        stats = self.scheduler.stats()["interactive"]
+        self.assertEqual(1, stats["timed_out"])
+        self.assertEqual(0, stats["admitted"])
+        # a call whose deadline has passed no longer holds up the others
+        self.scheduler.release("bulk")
+        self.assertTrue(self.scheduler.acquire("bulk", time.time() + 5))
+
+    def test_try_acquire(self):
+        self.assertTrue(self.scheduler.try_acquire("interactive"))
+        self.assertFalse(self.scheduler.try_acquire("interactive"))
+        self.wait_in_turn("bulk")
+        self.scheduler.release("interactive")
+        self.threads[0].join()
+        self.assertEqual(["bulk"], self.admitted)
+        self.assertTrue(self.scheduler.try_acquire("bulk"))
+        self.assertTrue(self.scheduler.is_active("bulk"))
+
+    def test_unknown_class(self):
+        self.assertRaises(ValueError, self.scheduler.acquire, "urgent")
+        self.assertRaises(ValueError, self.scheduler.try_acquire, "urgent")
+
+
+if __name__ == "__main__":
+    unittest.main()
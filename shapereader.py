@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""ESRI shapefile (.shp/.dbf) reader.
+
+Only what local layer queries need is supported: point, multipoint, polyline
+and polygon shapes (including their Z and M variants, whose Z and M values are
+ignored) and dBase III attribute tables. Both files are memory mapped, and
+shapes and records are decoded on demand, so opening even a large layer costs
+one pass over the record headers.
+
+See the ESRI Shapefile Technical Description (July 1998).
+"""
+
+import array
+import mmap
+import os.path
+import struct
+import sys
+
+import variant
+
+SHP_FILE_CODE = 9994
+
+# Shape types, by number of coordinates and layout of the XY section.
+NULL_SHAPE = 0
+POINT_SHAPE_TYPES = (1, 11, 21)
+MULTIPOINT_SHAPE_TYPES = (8, 18, 28)
+POLY_SHAPE_TYPES = (3, 5, 13, 15, 23, 25)
+POLYGON_SHAPE_TYPES = (5, 15, 25)
+
+# dBase field types mapped to variant types.
+_DBF_VAR_TYPES = {
+    "C": variant.VarType.String,
+    "D": variant.VarType.String,
+    "F": variant.VarType.Double,
+    "L": variant.VarType.Bool,
+}
+
+
+def _read_doubles(buff, offset, count):
+    """Returns count little-endian doubles from buff[offset] as an array."""
+    values = array.array("d")
+    values.fromstring(buff[offset:offset + 8 * count])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class Shapefile:
+    """A read-only shapefile: shapes from the .shp, records from the .dbf."""
+    def __init__(self, shp_path, encoding=None):
+        """Opens a shapefile.
+
+        Args:
+            shp_path (str): The path of the .shp file. The .dbf file must sit
+                beside it, with the same base name.
+            encoding (str, optional): The encoding of the .dbf's text fields.
+                Defaults to the one named in the .cpg file, if any, or else
+                Latin-1.
+        """
+        base_path = os.path.splitext(shp_path)[0]
+        self.__shp = self.__map(shp_path)
+        self.__dbf = self.__map(base_path + ".dbf")
+        if encoding is None:
+            encoding = "latin_1"
+            if os.path.exists(base_path + ".cpg"):
+                with open(base_path + ".cpg") as cpg_file:
+                    encoding = cpg_file.read().strip() or encoding
+        self.encoding = encoding
+        self.__read_shp_header()
+        self.__read_dbf_header()
+
+    @staticmethod
+    def __map(path):
+        """Memory maps a file for reading."""
+        with open(path, "rb") as mapped_file:
+            return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __read_shp_header(self):
+        """Reads the .shp header, and the offset and box of every shape."""
+        shp = self.__shp
+        (file_code, ) = struct.unpack_from(">i", shp, 0)
+        if file_code != SHP_FILE_CODE:
+            raise ValueError("Invalid shapefile file code: {c}".format(
+                c=file_code))
+        (file_words, ) = struct.unpack_from(">i", shp, 24)
+        (self.shape_type, ) = struct.unpack_from("<i", shp, 32)
+        file_length = min(2 * file_words, len(shp))
+
+        # Offsets of each record's content, and the bounding box of each
+        # shape as (min_x, min_y, max_x, max_y); None for null shapes.
+        self.offsets = []
+        self.boxes = []
+        offset = 100
+        while offset + 8 <= file_length:
+            (content_words, ) = struct.unpack_from(">i", shp, offset + 4)
+            offset += 8
+            (shape_type, ) = struct.unpack_from("<i", shp, offset)
+            if shape_type == NULL_SHAPE:
+                box = None
+            elif shape_type in POINT_SHAPE_TYPES:
+                x, y = struct.unpack_from("<2d", shp, offset + 4)
+                box = (x, y, x, y)
+            else:
+                box = struct.unpack_from("<4d", shp, offset + 4)
+            self.offsets.append(offset)
+            self.boxes.append(box)
+            offset += 2 * content_words
+
+    def __read_dbf_header(self):
+        """Reads the .dbf header and field descriptors."""
+        dbf = self.__dbf
+        (self.__record_count, self.__header_length,
+         self.__record_length) = struct.unpack_from("<IHH", dbf, 4)
+        self.field_names = []
+        self.field_var_types = []
+        # (name, type, offset within record, length, decimal count)
+        self.__fields = []
+        field_offset = 1  # past the deletion flag
+        descriptor = 32
+        while descriptor < self.__header_length and dbf[descriptor] != "\r":
+            name, field_type, length, decimals = struct.unpack_from(
+                "<11sc4xBB", dbf, descriptor)
+            name = name.split("\0")[0].decode(self.encoding)
+            self.__fields.append(
+                (name, field_type, field_offset, length, decimals))
+            self.field_names.append(name)
+            if field_type == "N":
+                self.field_var_types.append(
+                    variant.VarType.Int64 if decimals == 0
+                    else variant.VarType.Double)
+            else:
+                self.field_var_types.append(
+                    _DBF_VAR_TYPES.get(field_type, variant.VarType.String))
+            field_offset += length
+            descriptor += 32
+        # Indexes of the records marked deleted, whose shapes are still in
+        # the .shp; the flag is the first byte of each record.
+        flags = dbf[self.__header_length:
+            self.__header_length + self.__record_count * self.__record_length:
+            self.__record_length]
+        self.deleted = set()
+        index = flags.find("*")
+        while index >= 0:
+            self.deleted.add(index)
+            index = flags.find("*", index + 1)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def shape(self, index):
+        """Returns a shape's coordinates.
+
+        Args:
+            index (int): The zero-based shape index.
+
+        Returns:
+            An (x, y) tuple for a point; a list of parts for any other shape,
+            each part an array of interleaved x and y values (a polygon's
+            parts are its rings); or None for a null shape.
+        """
+        shp = self.__shp
+        offset = self.offsets[index]
+        (shape_type, ) = struct.unpack_from("<i", shp, offset)
+        if shape_type == NULL_SHAPE:
+            return None
+        if shape_type in POINT_SHAPE_TYPES:
+            return struct.unpack_from("<2d", shp, offset + 4)
+        if shape_type in MULTIPOINT_SHAPE_TYPES:
+            (npoints, ) = struct.unpack_from("<i", shp, offset + 36)
+            points = _read_doubles(shp, offset + 40, 2 * npoints)
+            return [points[i:i + 2] for i in range(0, len(points), 2)]
+        if shape_type not in POLY_SHAPE_TYPES:
+            raise NotImplementedError("Shape type {t}".format(t=shape_type))
+        nparts, npoints = struct.unpack_from("<2i", shp, offset + 36)
+        parts = list(struct.unpack_from(
+            "<{n}i".format(n=nparts), shp, offset + 44))
+        parts.append(npoints)
+        points = _read_doubles(shp, offset + 44 + 4 * nparts, 2 * npoints)
+        return [points[2 * parts[i]:2 * parts[i + 1]] for i in range(nparts)]
+
+    def is_deleted(self, index):
+        """Returns True if a record is marked deleted in the .dbf. Its shape
+        is no longer part of the layer."""
+        return index in self.deleted
+
+    def record(self, index):
+        """Returns a record's attribute values, in field order. Deleted
+        records are read like any other; see is_deleted().
+
+        Args:
+            index (int): The zero-based record index.
+        """
+        start = self.__header_length + index * self.__record_length
+        raw = self.__dbf[start:start + self.__record_length]
+        values = []
+        for _, field_type, field_offset, length, decimals in self.__fields:
+            text = raw[field_offset:field_offset + length]
+            if field_type in ("N", "F"):
+                text = text.strip()
+                if not text or text.startswith("*"):
+                    values.append(None)
+                elif field_type == "N" and decimals == 0:
+                    values.append(int(text))
+                else:
+                    values.append(float(text))
+            elif field_type == "L":
+                text = text.strip().upper()
+                values.append(
+                    None if text in ("", "?") else text in ("T", "Y"))
+            else:
+                values.append(text.rstrip(" \0").decode(
+                    self.encoding, "replace"))
+        return values
+
+    def close(self):
+        """Unmaps the shapefile."""
+        self.__shp.close()
+        self.__dbf.close()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the shapefile reader."""
+
+import os.path
+import shutil
+import struct
+import tempfile
+import unittest
+
+import shapereader
+import variant
+
+FIELDS = [
+    ("NAME", "C", 12, 0),
+    ("POP", "N", 8, 0),
+    ("AREA", "F", 10, 2),
+    ("COASTAL", "L", 1, 0),
+]
+
+
+def write_shapefile(base_path, shapes, fields, records, deleted=(),
+                    shape_type=5):
+    """Writes a small shapefile, for tests.
+
+    Args:
+        base_path (str): The path of the files, without extension.
+        shapes (list): One entry per shape: an (x, y) tuple for a point
+            layer, a list of rings of (x, y) tuples for a polygon layer, or
+            None for a null shape.
+        fields (list): (name, type, length, decimal count) tuples.
+        records (list): One list of values per shape, in field order.
+        deleted (iterable, optional): Indexes of records to mark deleted.
+        shape_type (int, optional): The layer's shape type.
+    """
+    body = ""
+    for i, shape in enumerate(shapes):
+        if shape is None:
+            content = struct.pack("<i", shapereader.NULL_SHAPE)
+        elif shape_type in shapereader.POINT_SHAPE_TYPES:
+            content = struct.pack("<i2d", shape_type, shape[0], shape[1])
+        else:
+            points = [point for ring in shape for point in ring]
+            xs = [point[0] for point in points]
+            ys = [point[1] for point in points]
+            parts = [0]
+            for ring in shape[:-1]:
+                parts.append(parts[-1] + len(ring))
+            content = struct.pack(
+                "<i4d2i", shape_type, min(xs), min(ys), max(xs), max(ys),
+                len(parts), len(points))
+            content += struct.pack("<{n}i".format(n=len(parts)), *parts)
+            content += "".join(struct.pack("<2d", *point) for point in points)
+        body += struct.pack(">2i", i + 1, len(content) // 2) + content
+    header = struct.pack(">7i", shapereader.SHP_FILE_CODE, 0, 0, 0, 0, 0,
+                         (100 + len(body)) // 2)
+    header += struct.pack("<2i8d", 1000, shape_type, *([0.0] * 8))
+    with open(base_path + ".shp", "wb") as shp_file:
+        shp_file.write(header + body)
+
+    record_length = 1 + sum(field[2] for field in fields)
+    dbf = struct.pack("<4BIHH20x", 3, 113, 1, 1, len(records),
+                      32 + 32 * len(fields) + 1, record_length)
+    for name, field_type, length, decimals in fields:
+        dbf += struct.pack("<11sc4xBB14x", name, field_type, length, decimals)
+    dbf += "\r"
+    for i, record in enumerate(records):
+        dbf += "*" if i in deleted else " "
+        for value, (_, field_type, length, _) in zip(record, fields):
+            text = str(value)
+            dbf += (text.ljust(length) if field_type in ("C", "L")
+                    else text.rjust(length))[:length]
+    dbf += "\x1a"
+    with open(base_path + ".dbf", "wb") as dbf_file:
+        dbf_file.write(dbf)
+
+
+def square(x, y, size=1.0):
+    """Returns a square polygon's single ring, clockwise from (x, y)."""
+    return [[(x, y), (x, y + size), (x + size, y + size), (x + size, y),
+             (x, y)]]
+
+
+class ShapefileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "layer")
+
+    def open(self, *args, **kwargs):
+        write_shapefile(self.path, *args, **kwargs)
+        shapefile = shapereader.Shapefile(self.path + ".shp")
+        self.addCleanup(shapefile.close)
+        return shapefile
+
+    def test_polygons(self):
+        shapefile = self.open(
+            [square(0, 0), None, square(2, 3, 2)], FIELDS,
+            [["A", 1, 1.5, "T"]] * 3)
+        self.assertEqual(3, len(shapefile))
+        self.assertEqual(5, shapefile.shape_type)
+        self.assertEqual(
+            [(0, 0, 1, 1), None, (2, 3, 4, 5)], shapefile.boxes)
+        self.assertEqual(None, shapefile.shape(1))
+        rings = shapefile.shape(2)
+        self.assertEqual(1, len(rings))
+        self.assertEqual([2, 3, 2, 5, 4, 5, 4, 3, 2, 3], list(rings[0]))
+
+    def test_points(self):
+        shapefile = self.open(
+            [(-105.0, 40.0), (-104.5, 39.5)], FIELDS,
+            [["A", 1, 1.5, "T"]] * 2, shape_type=1)
+        self.assertEqual((-104.5, 39.5), shapefile.shape(1))
+        self.assertEqual((-105.0, 40.0, -105.0, 40.0), shapefile.boxes[0])
+
+    def test_field_types(self):
+        shapefile = self.open([square(0, 0)] * 1, FIELDS, [["A", 1, 1, "T"]])
+        self.assertEqual(["NAME", "POP", "AREA", "COASTAL"],
+                         shapefile.field_names)
+        self.assertEqual(
+            [variant.VarType.String, variant.VarType.Int64,
+             variant.VarType.Double, variant.VarType.Bool],
+            shapefile.field_var_types)
+
+    def test_records(self):
+        shapefile = self.open(
+            [square(0, 0)] * 3, FIELDS,
+            [["Denver", 715522, 401.2, "T"],
+             ["Boulder", "", "********", "N"],
+             ["", -12, 0, "?"]])
+        self.assertEqual([u"Denver", 715522, 401.2, True],
+                         shapefile.record(0))
+        self.assertEqual([u"Boulder", None, None, False],
+                         shapefile.record(1))
+        self.assertEqual([u"", -12, 0.0, None], shapefile.record(2))
+
+    def test_encoding(self):
+        shapefile = self.open(
+            [square(0, 0)], FIELDS, [["Espa\xf1ola", 1, 1, "F"]])
+        self.assertEqual(u"Espa\xf1ola", shapefile.record(0)[0])
+
+    def test_deleted_records(self):
+        shapefile = self.open(
+            [square(0, 0)] * 4, FIELDS, [["A", 1, 1, "T"]] * 4,
+            deleted=(1, 3))
+        self.assertEqual(set([1, 3]), shapefile.deleted)
+        self.assertEqual(
+            [False, True, False, True],
+            [shapefile.is_deleted(i) for i in range(4)])
+
+    def test_bad_file_code(self):
+        write_shapefile(self.path, [square(0, 0)], FIELDS, [["A", 1, 1, "T"]])
+        with open(self.path + ".shp", "r+b") as shp_file:
+            shp_file.write(struct.pack(">i", 1234))
+        self.assertRaises(
+            ValueError, shapereader.Shapefile, self.path + ".shp")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Capture of slow PxPointSC table operations, for replay.
+
+A SlowCallRecorder observes every table operation pxpointsc makes (geocode,
+reverse geocode, spatial query and so on). Calls slower than a threshold are
+saved to a capture directory, one file per call, holding everything needed
+to make the same call again: the function name, the exact serialized input
+table, the output and error column definitions and the processing options.
+The timing breakdown and the data vintages are saved with them. Only the
+newest captures are kept.
+
+A capture file is a line of JSON (the header), followed by the serialized
+input table. replaycalls.py replays them.
+"""
+
+import datetime
+import json
+import os
+import socket
+import threading
+
+import pxpointsc
+
+CAPTURE_EXTENSION = ".capture"
+
+
+def write_capture(path, header, table_bytes):
+    """Writes a capture file atomically.
+
+    Args:
+        path (str): The capture file path.
+        header (dict): The call's description; see SlowCallRecorder.
+        table_bytes (bytearray): The serialized input table.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as capture_file:
+        capture_file.write(json.dumps(header, sort_keys=True) + "\n")
+        capture_file.write(table_bytes)
+    os.rename(temp_path, path)
+
+
+def read_capture(path):
+    """Reads a capture file.
+
+    Returns:
+        The capture's header (a dictionary) and its serialized input table
+        (a bytearray).
+    """
+    with open(path, "rb") as capture_file:
+        header = json.loads(capture_file.readline())
+        return header, bytearray(capture_file.read())
+
+
+def list_captures(directory):
+    """Returns the paths of the captures in a directory, oldest first."""
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if name.endswith(CAPTURE_EXTENSION)]
+
+
+class SlowCallRecorder:
+    """Saves PxPointSC table operations slower than a threshold."""
+    def __init__(
+            self, directory, threshold_seconds, max_captures=100,
+            context=None):
+        """Initializes the recorder. Call install() to start recording.
+
+        Args:
+            directory (str): The capture directory, created if need be.
+            threshold_seconds (float): The total time, serializing the input,
+                in PxPointSC and deserializing the results, above which a
+                call is captured.
+            max_captures (int, optional): The number of captures to keep; the
+                oldest are removed.
+            context (callable, optional): Returns a dictionary saved in the
+                header of each capture, such as the data vintages.
+        """
+        self.directory = directory
+        self.threshold_seconds = threshold_seconds
+        self.max_captures = max(1, max_captures)
+        self.context = context
+        self.captured = 0
+        self.errors = 0
+        self.__sequence = 0
+        self.__lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def install(self):
+        """Starts observing pxpointsc's table operations. Other observers,
+        such as other instances' recorders, are left in place."""
+        pxpointsc.add_table_operation_observer(self.observe)
+
+    def uninstall(self):
+        """Stops observing pxpointsc's table operations."""
+        pxpointsc.remove_table_operation_observer(self.observe)
+
+    def observe(
+            self, function_name, get_table_bytes, out_col_definition,
+            err_col_definition, processing_options, return_code, timings):
+        """Captures a table operation if it was slow. The arguments are those
+        of a pxpointsc table operation observer; the input table is only
+        copied for calls that are captured."""
+        total_seconds = sum(timings.values())
+        if total_seconds < self.threshold_seconds:
+            return
+        now = datetime.datetime.utcnow()
+        header = {
+            "function": function_name,
+            "handle_type": (
+                "geospatial" if function_name.startswith("GeoSpatial")
+                else "geocoder"),
+            "out_col_definition": out_col_definition,
+            "err_col_definition": err_col_definition,
+            "processing_options": processing_options,
+            "return_code": return_code,
+            "timings_ms": dict(
+                (stage, round(seconds * 1000, 3))
+                for stage, seconds in timings.items()),
+            "total_ms": round(total_seconds * 1000, 3),
+            "captured_at": now.isoformat(),
+            "host": socket.gethostname()
+        }
+        # A capture that cannot be written must not fail the call.
+        try:
+            if self.context is not None:
+                header["context"] = self.context()
+            with self.__lock:
+                self.__sequence += 1
+                name = "{t}-{n:06d}-{f}{e}".format(
+                    t=now.strftime("%Y%m%dT%H%M%S%f"), n=self.__sequence,
+                    f=function_name, e=CAPTURE_EXTENSION)
+                write_capture(
+                    os.path.join(self.directory, name), header,
+                    get_table_bytes())
+                self.captured += 1
+                for path in list_captures(self.directory)[:-self.max_captures]:
+                    os.remove(path)
+        except (IOError, OSError, ValueError):
+            self.errors += 1
+
+    def stats(self):
+        """Returns a dictionary of counters describing this recorder."""
+        return {"captured": self.captured, "errors": self.errors}
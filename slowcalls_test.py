@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of slow call capture."""
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import fakepxpointsc
+fakepxpointsc.install()
+
+import geospatial
+import pxpointsc
+import slowcalls
+
+
+class SlowCallRecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.capture_dir = os.path.join(self.directory, "captures")
+        self.recorder = slowcalls.SlowCallRecorder(
+            self.capture_dir, 0.5, 3, lambda: {"vintage": "abc"})
+        self.copies = 0
+
+    def get_table_bytes(self):
+        self.copies += 1
+        return bytearray("table")
+
+    def observe(self, seconds, function_name="GeocoderGeocode"):
+        self.recorder.observe(
+            function_name, self.get_table_bytes, "INPUT.Id;$Latitude",
+            "INPUT.Id;$ErrorCode", "", 0,
+            {"serialize": 0.0, "native": seconds, "deserialize": 0.0})
+
+    def test_fast_calls_are_not_copied(self):
+        self.observe(0.1)
+        self.assertEqual(0, self.copies)
+        self.assertEqual([], slowcalls.list_captures(self.capture_dir))
+
+    def test_slow_calls_are_captured(self):
+        self.observe(0.75, "GeoSpatialQuery")
+        self.assertEqual(1, self.copies)
+        captures = slowcalls.list_captures(self.capture_dir)
+        self.assertEqual(1, len(captures))
+        header, table_bytes = slowcalls.read_capture(captures[0])
+        self.assertEqual(bytearray("table"), table_bytes)
+        self.assertEqual("GeoSpatialQuery", header["function"])
+        self.assertEqual("geospatial", header["handle_type"])
+        self.assertEqual("INPUT.Id;$Latitude", header["out_col_definition"])
+        self.assertEqual(750.0, header["total_ms"])
+        self.assertEqual({"vintage": "abc"}, header["context"])
+        self.assertEqual({"captured": 1, "errors": 0}, self.recorder.stats())
+
+    def test_only_the_newest_captures_are_kept(self):
+        for _ in range(5):
+            self.observe(1.0)
+        self.assertEqual(3, len(slowcalls.list_captures(self.capture_dir)))
+        self.assertEqual(5, self.recorder.stats()["captured"])
+
+    def test_failed_captures_are_counted(self):
+        shutil.rmtree(self.capture_dir)
+        self.observe(1.0)
+        self.assertEqual({"captured": 0, "errors": 1}, self.recorder.stats())
+
+    def test_install(self):
+        self.recorder.install()
+        other = slowcalls.SlowCallRecorder(self.capture_dir, 0.5)
+        other.install()
+        self.assertEqual(
+            [self.recorder.observe, other.observe],
+            pxpointsc._table_operation_observers)
+        self.recorder.uninstall()
+        self.assertEqual(
+            [other.observe], pxpointsc._table_operation_observers)
+        other.uninstall()
+        self.assertEqual([], pxpointsc._table_operation_observers)
+
+
+class GeoSpatialCaptureTest(unittest.TestCase):
+    def setUp(self):
+        fakepxpointsc.reset()
+        self.addCleanup(fakepxpointsc.reset)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.data_catalog = fakepxpointsc.write_data_catalog(self.directory)
+
+    def create(self, capture_dir):
+        return geospatial.GeoSpatial(
+            self.data_catalog, self.directory, {
+                "SLOW_CALL_CAPTURE_DIR": os.path.join(
+                    self.directory, capture_dir),
+                "SLOW_CALL_THRESHOLD_MS": 10})
+
+    def test_capture_until_closed(self):
+        first = self.create("first")
+        second = self.create("second")
+        self.assertEqual(2, len(pxpointsc._table_operation_observers))
+        fakepxpointsc.delay = 0.02
+        first.get_location("1", "1 Main St")
+        self.assertEqual(
+            1, first.get_stats()["slow_calls"]["captured"])
+        header, _ = slowcalls.read_capture(slowcalls.list_captures(
+            os.path.join(self.directory, "first"))[0])
+        self.assertIn("geocoder_vintage", header["context"])
+        first.close()
+        self.assertEqual(1, len(pxpointsc._table_operation_observers))
+        second.get_location("2", "2 Main St")
+        self.assertEqual(
+            1, len(slowcalls.list_captures(
+                os.path.join(self.directory, "first"))))
+        self.assertEqual(
+            2, second.get_stats()["slow_calls"]["captured"])
+        second.close()
+        self.assertEqual([], pxpointsc._table_operation_observers)
+
+
+if __name__ == "__main__":
+    unittest.main()
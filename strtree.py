@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Packed Sort-Tile-Recursive (STR) R-tree of bounding boxes.
+
+The tree is bulk loaded once and never modified. Each level is a flat list of
+(box, payload) entries. At the leaf level the payload is an item index; at
+every other level it is the (start, end) range of the entry's children in the
+level below.
+"""
+
+import math
+
+
+class STRtree:
+    """A static R-tree over (min_x, min_y, max_x, max_y) boxes."""
+    def __init__(self, boxes, node_capacity=16):
+        """Bulk loads the tree.
+
+        Args:
+            boxes (list): One (min_x, min_y, max_x, max_y) tuple per item. The
+                items are identified by their index in this list.
+            node_capacity (int, optional): The maximum number of children of
+                a node.
+        """
+        level = STRtree.__sort_tile(
+            [(tuple(box), i) for i, box in enumerate(boxes)], node_capacity)
+        levels = [level]
+        while len(level) > node_capacity:
+            parents = []
+            for start in range(0, len(level), node_capacity):
+                end = min(start + node_capacity, len(level))
+                parents.append(
+                    (STRtree.__union(level[start:end]), (start, end)))
+            level = STRtree.__sort_tile(parents, node_capacity)
+            levels.append(level)
+        levels.reverse()
+        self.levels = levels
+
+    def __len__(self):
+        return len(self.levels[-1])
+
+    @staticmethod
+    def __union(entries):
+        """Returns the bounding box of a list of entries."""
+        return (
+            min(box[0] for box, _ in entries),
+            min(box[1] for box, _ in entries),
+            max(box[2] for box, _ in entries),
+            max(box[3] for box, _ in entries)
+        )
+
+    @staticmethod
+    def __sort_tile(entries, node_capacity):
+        """Orders entries by the STR algorithm: into vertical slices by center
+        x, each slice sorted by center y."""
+        if not entries:
+            return []
+        node_count = int(math.ceil(len(entries) / float(node_capacity)))
+        slice_size = node_capacity * int(math.ceil(math.sqrt(node_count)))
+        entries = sorted(entries, key=lambda e: e[0][0] + e[0][2])
+        result = []
+        for start in range(0, len(entries), slice_size):
+            result.extend(sorted(
+                entries[start:start + slice_size],
+                key=lambda e: e[0][1] + e[0][3]))
+        return result
+
+    def query_point(self, x, y):
+        """Returns the indexes of the items whose boxes contain (x, y)."""
+        return self.query_box(x, y, x, y)
+
+    def query_box(self, min_x, min_y, max_x, max_y):
+        """Returns the indexes of the items whose boxes intersect a box."""
+        ranges = [(0, len(self.levels[0]))]
+        for level in self.levels:
+            payloads = []
+            for start, end in ranges:
+                for box, payload in level[start:end]:
+                    if (box[0] <= max_x and box[2] >= min_x and
+                            box[1] <= max_y and box[3] >= min_y):
+                        payloads.append(payload)
+            ranges = payloads
+        return ranges
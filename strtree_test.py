@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# $Id$
+#
+
+"""Tests of the STR-tree, against a brute force search."""
+
+import random
+import unittest
+
+import strtree
+
+
+def random_boxes(rng, count):
+    """Returns count random boxes of various sizes in a 100 by 100 square."""
+    boxes = []
+    for _ in range(count):
+        x = rng.uniform(0, 100)
+        y = rng.uniform(0, 100)
+        size = rng.choice((0.0, 0.5, 5.0, 30.0))
+        boxes.append((x, y, x + rng.uniform(0, size), y + rng.uniform(0, size)))
+    return boxes
+
+
+def brute_force(boxes, min_x, min_y, max_x, max_y):
+    """Returns the indexes of the boxes intersecting a box."""
+    return [i for i, box in enumerate(boxes)
+            if box[0] <= max_x and box[2] >= min_x and
+            box[1] <= max_y and box[3] >= min_y]
+
+
+class STRtreeTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1998)
+
+    def test_point_queries(self):
+        for count, capacity in ((1, 16), (15, 4), (1000, 16), (1000, 3)):
+            boxes = random_boxes(self.rng, count)
+            tree = strtree.STRtree(boxes, capacity)
+            self.assertEqual(count, len(tree))
+            for _ in range(200):
+                x = self.rng.uniform(-5, 105)
+                y = self.rng.uniform(-5, 105)
+                self.assertEqual(
+                    brute_force(boxes, x, y, x, y),
+                    sorted(tree.query_point(x, y)))
+
+    def test_box_queries(self):
+        boxes = random_boxes(self.rng, 500)
+        tree = strtree.STRtree(boxes, 8)
+        for _ in range(200):
+            x = self.rng.uniform(-5, 105)
+            y = self.rng.uniform(-5, 105)
+            box = (x, y, x + self.rng.uniform(0, 20),
+                   y + self.rng.uniform(0, 20))
+            self.assertEqual(
+                brute_force(boxes, *box), sorted(tree.query_box(*box)))
+
+    def test_empty_boxes_contain_no_points(self):
+        tree = strtree.STRtree([(-10, -10, 10, 10), (1.0, 1.0, -1.0, -1.0)])
+        for x, y in ((0, 0), (1, 1), (-1, -1), (1, -1)):
+            self.assertEqual([0], tree.query_point(x, y))
+
+    def test_no_boxes(self):
+        tree = strtree.STRtree([])
+        self.assertEqual(0, len(tree))
+        self.assertEqual([], tree.query_point(0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -61,10 +61,15 @@ class Table:
         """
         return self.rows[index]
 
-    def serialize(self):
+    def serialize(self, buff=None):
         """Serializes the table to a bytearray that will be read by
         Table::Deserialize() in geocoder/PxLib/Table.cpp.
         
+        Args:
+            buff (bytearray, optional): The array to serialize into, from
+                its start, so that callers serializing many tables can reuse
+                one. The default is a new 4 MB array.
+
         Returns:
             The byte array containing the serialized table, and the
             offset int indicating the length of the array.
@@ -73,7 +78,8 @@ class Table:
         if ncolumns == 0:
             raise ValueError("Table contains no columns")
 
-        buff = bytearray(4 * 1024 * 1024)
+        if buff is None:
+            buff = bytearray(4 * 1024 * 1024)
         offset = 0
 
         # Table magic number.
@@ -62,6 +62,21 @@ def deserialize_string(buff, offset):
     return (value, offset)
 
 
+def deserialize_bytes(buff, offset):
+    """Deserialize length-prefixed bytes from buffer[offset], returning value
+    and a new offset."""
+
+    # Unpack the length.
+    (length, ) = struct.unpack_from("<i", buff, offset)
+    offset += 4
+
+    # Copy the bytes.
+    value = buff[offset:offset + length]
+    offset += length
+
+    return (value, offset)
+
+
 class Variant:
     """Variable serializer/deserializer."""
     def __init__(self, var_type):
@@ -121,7 +136,8 @@ class Variant:
             elif variant.var_type == VarType.Geometry:
                 # See PxLib/Wks.cpp ExportToWKB
                 # See http://en.wikipedia.org/wiki/Well-known_binary
-                raise NotImplementedError("deserialize VarType.Geometry")
+                # The WKB is left unparsed; see geometry.py.
+                value, offset = deserialize_bytes(buff, offset)
             else:
                 (value, ) = variant.struct_obj.unpack_from(buff, offset)
                 offset += variant.struct_obj.size